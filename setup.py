@@ -46,6 +46,9 @@ setup(
     python_requires=">=3.8",
     install_requires=requirements,
     extras_require={
+        "onnx": [
+            "onnxruntime>=1.16.0",
+        ],
         "dev": [
             "pytest>=7.0.0",
             "pytest-cov>=4.0.0",
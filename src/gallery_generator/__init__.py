@@ -8,8 +8,19 @@ __version__ = "1.0.0"
 __author__ = "Gallery Generate Agent Team"
 __license__ = "MIT"
 
-from .core.image_analyzer import ImageAnalyzer
-from .models.clip_model import CLIPFeatureExtractor
+
+def __getattr__(name):
+    # ImageAnalyzer 会导入 sklearn/scipy，按需加载：解码、构图分析和 PDF 渲染的 spawn 工作进程
+    # 导入本包时不必承担这部分开销
+    if name == "ImageAnalyzer":
+        from .core.image_analyzer import ImageAnalyzer
+        return ImageAnalyzer
+    # CLIPFeatureExtractor 会导入 torch，按需加载以免拖慢 ONNX/桩后端的启动
+    if name == "CLIPFeatureExtractor":
+        from .models.clip_model import CLIPFeatureExtractor
+        return CLIPFeatureExtractor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
     "ImageAnalyzer",
@@ -1,24 +1,320 @@
 """
 Gallery Generate Agent 主入口
 支持作为模块运行: python -m gallery_generator
+
+不带参数时启动图形界面；命令行模式:
+    python -m gallery_generator process <图片文件夹> [-o 输出目录] [--resume] [--streaming]
+    python -m gallery_generator batch <文件夹1> <文件夹2> ... [-o 输出根目录]
+                                  [--url 服务地址 | --socket 套接字路径]
+    python -m gallery_generator serve [--port 端口 | --socket 套接字路径]
+    python -m gallery_generator submit <图片文件夹> [-o 输出目录]
+                                   [--url 服务地址 | --socket 套接字路径]
+    python -m gallery_generator shard <图片文件夹> --job-dir 共享作业目录 [--shard-size 图片数]
+    python -m gallery_generator worker --job-dir 共享作业目录 [--processes 进程数]
+    python -m gallery_generator merge --job-dir 共享作业目录 [-o 输出目录]
 """
 
-from .gui.main_window import MainWindow
-from PyQt5.QtWidgets import QApplication
+import argparse
 import sys
 
 
-def main():
-    """主函数"""
+def run_gui():
+    """启动图形界面"""
+    from PyQt5.QtWidgets import QApplication
+    from .gui.main_window import MainWindow
+
     app = QApplication(sys.argv)
     app.setApplicationName("Gallery Generate Agent")
-    
+
     window = MainWindow()
     window.show()
-    
+
     sys.exit(app.exec_())
 
 
+def run_process(args):
+    """命令行模式处理单个文件夹"""
+    from .core.image_analyzer import ImageAnalyzer
+
+    def progress_callback(current, total, message):
+        print(f"[{current}/{total}] {message}")
+
+    analyzer = ImageAnalyzer(args.config)
+    results = analyzer.process_folder(
+        args.folder,
+        args.output,
+        args.formats,
+        progress_callback,
+        resume=args.resume,
+        run_dir=args.run_dir,
+        streaming=True if args.streaming else None
+    )
+
+    if not results.get("success"):
+        print(f"处理失败: {results.get('message', '未知错误')}")
+        return 1
+
+    print(f"处理完成：{results['image_count']} 张图片，{results['cluster_count']} 个类别")
+    for output_format, path in results.get("gallery_paths", {}).items():
+        print(f"  {output_format}: {path}")
+    return 0
+
+
+def _print_batch_results(results: dict) -> int:
+    """打印批量处理的结果，全部成功时返回 0"""
+    failed = 0
+    for folder, result in results.items():
+        if result.get("success"):
+            print(
+                f"{folder}: {result['image_count']} 张图片，{result['cluster_count']} 个类别 "
+                f"-> {result['output_dir']}"
+            )
+        else:
+            failed += 1
+            print(f"{folder}: 失败 - {result.get('message', '未知错误')}")
+    print(f"完成 {len(results) - failed}/{len(results)} 个文件夹")
+    return 1 if failed else 0
+
+
+def run_batch(args):
+    """批量处理多个文件夹（提供服务地址时提交给常驻服务）"""
+    def progress_callback(current, total, message):
+        print(f"[{current}/{total}] {message}")
+
+    if args.url or args.socket:
+        from .core.service import ServiceClient, ServiceError
+
+        client = ServiceClient(args.url, args.socket)
+        try:
+            job = client.submit_batch(args.folders, args.output, formats=args.formats)
+            print(f"已提交批量任务 #{job['id']}")
+            job = client.wait(job["id"], progress_callback=progress_callback)
+        except ServiceError as e:
+            print(f"提交失败: {e}")
+            return 1
+        if job["status"] != "done":
+            print(f"处理失败: {(job.get('result') or {}).get('message', job['status'])}")
+            return 1
+        return _print_batch_results(job["result"]["folders"])
+
+    from .core.image_analyzer import ImageAnalyzer
+
+    analyzer = ImageAnalyzer(args.config)
+    results = analyzer.process_batch(args.folders, args.output, args.formats, progress_callback,
+                                     workers=args.workers)
+    return _print_batch_results(results)
+
+
+def run_serve(args):
+    """启动常驻的分析服务"""
+    from .core.service import serve
+
+    serve(args.config, args.host, args.port, args.socket, args.workers)
+    return 0
+
+
+def run_submit(args):
+    """向分析服务提交任务，默认等待完成"""
+    from .core.service import ServiceClient, ServiceError
+
+    client = ServiceClient(args.url, args.socket)
+    try:
+        job = client.submit(
+            args.folder,
+            args.output,
+            formats=args.formats,
+            n_clusters=args.n_clusters,
+            streaming=True if args.streaming else None,
+            resume=args.resume
+        )
+        print(f"已提交任务 #{job['id']}")
+        if args.no_wait:
+            return 0
+        job = client.wait(job["id"], progress_callback=lambda current, total, message:
+                          print(f"[{current}/{total}] {message}"))
+    except ServiceError as e:
+        print(f"提交失败: {e}")
+        return 1
+
+    result = job.get("result") or {}
+    if job["status"] != "done":
+        print(f"处理失败: {result.get('message', job['status'])}")
+        return 1
+
+    print(f"处理完成：{result['image_count']} 张图片，{result['cluster_count']} 个类别")
+    for output_format, path in result.get("gallery_paths", {}).items():
+        print(f"  {output_format}: {path}")
+    return 0
+
+
+def _print_shard_status(status: dict):
+    print(
+        f"分片: 完成 {status['done']}/{status['shards']}，失败 {status['failed']}，"
+        f"处理中 {status['running']}，等待 {status['pending']}（共 {status['image_count']} 张图片）"
+    )
+
+
+def run_shard(args):
+    """分布式提取的协调端：切分图片清单"""
+    from .core.image_analyzer import ImageAnalyzer
+
+    analyzer = ImageAnalyzer(args.config)
+    try:
+        shard_queue = analyzer.shard_folder(args.folder, args.job_dir, args.shard_size)
+    except ValueError as e:
+        print(f"创建分片失败: {e}")
+        return 1
+    _print_shard_status(shard_queue.status())
+    return 0
+
+
+def run_shard_worker(args):
+    """分布式提取的工作端：领取分片并提取特征"""
+    import json
+    from .core.distributed import open_queue, run_workers
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    try:
+        ok = run_workers(args.job_dir, args.config, args.processes)
+        status = open_queue(args.job_dir, config).status()
+    except ValueError as e:
+        print(f"工作进程退出: {e}")
+        return 1
+    _print_shard_status(status)
+    return 0 if ok else 1
+
+
+def run_merge(args):
+    """合并分片结果并生成作品集"""
+    from .core.image_analyzer import ImageAnalyzer
+
+    def progress_callback(current, total, message):
+        print(f"[{current}/{total}] {message}")
+
+    analyzer = ImageAnalyzer(args.config)
+    try:
+        results = analyzer.process_shards(
+            args.job_dir, args.output, args.formats, progress_callback, allow_partial=args.partial
+        )
+    except ValueError as e:
+        print(f"合并失败: {e}")
+        return 1
+
+    if not results.get("success"):
+        print(f"处理失败: {results.get('message', '未知错误')}")
+        return 1
+
+    print(f"处理完成：{results['image_count']} 张图片，{results['cluster_count']} 个类别")
+    for output_format, path in results.get("gallery_paths", {}).items():
+        print(f"  {output_format}: {path}")
+    return 0
+
+
+def _cluster_count(value: str):
+    """聚类数量参数：正整数或 auto"""
+    return value if value == "auto" else int(value)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(prog="gallery-generator", description="Gallery Generate Agent")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    subparsers = parser.add_subparsers(dest="command")
+
+    process_parser = subparsers.add_parser("process", help="处理图片文件夹并生成作品集")
+    process_parser.add_argument("folder", help="图片文件夹路径")
+    process_parser.add_argument("-o", "--output", default=None, help="输出目录")
+    process_parser.add_argument("--formats", nargs="+", choices=["html", "pdf", "folder"],
+                                default=None, help="输出格式，默认全部生成")
+    process_parser.add_argument("--resume", action="store_true",
+                                help="从上次中断的批次/阶段继续")
+    process_parser.add_argument("--run-dir", default=None,
+                                help="检查点运行目录，默认位于缓存目录下")
+    process_parser.add_argument("--streaming", action="store_true",
+                                help="流式处理，内存占用不随图片数量增长")
+
+    batch_parser = subparsers.add_parser(
+        "batch", help="批量处理多个文件夹，合并提取特征后分别生成作品集"
+    )
+    batch_parser.add_argument("folders", nargs="+", help="图片文件夹路径")
+    batch_parser.add_argument("-o", "--output", default=None,
+                              help="输出根目录，每个文件夹输出到其下以文件夹名命名的目录")
+    batch_parser.add_argument("--formats", nargs="+", choices=["html", "pdf", "folder"],
+                              default=None, help="输出格式，默认全部生成")
+    batch_parser.add_argument(
+        "--workers", type=int, default=None, help="同时聚类和生成作品集的文件夹数"
+    )
+    batch_parser.add_argument("--url", default=None, help="提交给常驻服务（服务地址）")
+    batch_parser.add_argument("--socket", default=None, help="提交给常驻服务（Unix 套接字）")
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="启动常驻的分析服务，多次处理复用已加载的模型"
+    )
+    serve_parser.add_argument("--host", default=None, help="监听地址，默认 127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=None, help="监听端口，默认 8765")
+    serve_parser.add_argument("--socket", default=None, help="改为监听 Unix 套接字")
+    serve_parser.add_argument("--workers", type=int, default=None, help="同时运行的任务数")
+
+    submit_parser = subparsers.add_parser("submit", help="向分析服务提交处理任务")
+    submit_parser.add_argument("folder", help="图片文件夹路径")
+    submit_parser.add_argument("-o", "--output", default=None, help="输出目录")
+    submit_parser.add_argument("--formats", nargs="+", choices=["html", "pdf", "folder"],
+                               default=None, help="输出格式，默认全部生成")
+    submit_parser.add_argument("--n-clusters", type=_cluster_count, default=None,
+                               help="聚类数量（整数或 auto），默认使用服务的配置")
+    submit_parser.add_argument("--resume", action="store_true", help="从上次中断的批次/阶段继续")
+    submit_parser.add_argument("--streaming", action="store_true", help="流式处理")
+    submit_parser.add_argument("--url", default=None, help="服务地址，默认 http://127.0.0.1:8765")
+    submit_parser.add_argument("--socket", default=None, help="通过 Unix 套接字连接服务")
+    submit_parser.add_argument("--no-wait", action="store_true", help="提交后立即返回，不等待完成")
+
+    shard_parser = subparsers.add_parser(
+        "shard", help="分布式提取：扫描文件夹并切分为分片写入共享目录"
+    )
+    shard_parser.add_argument("folder", help="图片文件夹路径（各工作主机上路径相同）")
+    shard_parser.add_argument("--job-dir", required=True, help="共享作业目录")
+    shard_parser.add_argument("--shard-size", type=int, default=None, help="每个分片的图片数")
+
+    worker_parser = subparsers.add_parser(
+        "worker", help="分布式提取：领取分片并提取特征，直到全部完成"
+    )
+    worker_parser.add_argument("--job-dir", required=True, help="共享作业目录")
+    worker_parser.add_argument("--processes", type=int, default=1, help="本机启动的工作进程数")
+
+    merge_parser = subparsers.add_parser("merge", help="分布式提取：合并分片结果并生成作品集")
+    merge_parser.add_argument("--job-dir", required=True, help="共享作业目录")
+    merge_parser.add_argument("-o", "--output", default=None, help="输出目录")
+    merge_parser.add_argument("--formats", nargs="+", choices=["html", "pdf", "folder"],
+                              default=None, help="输出格式，默认全部生成")
+    merge_parser.add_argument(
+        "--partial", action="store_true", help="还有分片未完成时只合并已完成的部分"
+    )
+
+    return parser
+
+
+def main():
+    """主函数"""
+    args = build_parser().parse_args()
+
+    if args.command == "process":
+        sys.exit(run_process(args))
+    if args.command == "batch":
+        sys.exit(run_batch(args))
+    if args.command == "serve":
+        sys.exit(run_serve(args))
+    if args.command == "submit":
+        sys.exit(run_submit(args))
+    if args.command == "shard":
+        sys.exit(run_shard(args))
+    if args.command == "worker":
+        sys.exit(run_shard_worker(args))
+    if args.command == "merge":
+        sys.exit(run_merge(args))
+
+    run_gui()
+
+
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,177 @@
+"""
+自适应批大小模块
+根据吞吐量自动调整特征提取的批大小，遇到内存不足时回退，并按设备/模型持久化调优结果
+"""
+
+import json
+import os
+import sys
+from typing import Dict, Optional
+
+
+def is_memory_error(error: Exception) -> bool:
+    """
+    判断异常是否由内存/显存不足引起
+
+    Args:
+        error: 捕获到的异常
+
+    Returns:
+        是否为内存不足错误
+    """
+    if isinstance(error, MemoryError):
+        return True
+
+    message = str(error).lower()
+    return any(keyword in message for keyword in (
+        "out of memory", "failed to allocate", "bad_alloc", "cannot allocate memory"
+    ))
+
+
+def release_device_memory():
+    """释放 PyTorch 缓存的显存（仅在 torch 已导入时）"""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def available_memory_mb() -> Optional[float]:
+    """
+    获取系统可用内存（MB），无法获取时返回 None
+    """
+    try:
+        pages = os.sysconf("SC_AVPHYS_PAGES")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+    return pages * page_size / (1024 * 1024)
+
+
+class AdaptiveBatchSizer:
+    """
+    自适应批大小控制器
+
+    吞吐量持续提升时批大小翻倍；吞吐量不再提升时固定在最佳值；
+    出现内存错误时减半并记住上限，之后不会再超过该上限。
+    """
+
+    def __init__(self, initial_size: int = 32, min_size: int = 1, max_size: int = 512,
+                 adaptive: bool = True, cache_path: Optional[str] = None,
+                 cache_key: Optional[str] = None, min_free_memory_mb: float = 1024):
+        """
+        初始化批大小控制器
+
+        Args:
+            initial_size: 初始批大小（有持久化结果时以持久化结果为准）
+            min_size: 最小批大小
+            max_size: 最大批大小
+            adaptive: 是否根据吞吐量自动增大批大小；为 False 时只在内存不足时回退
+            cache_path: 调优结果保存文件
+            cache_key: 调优结果的键（通常由后端、模型、设备和精度组成）
+            min_free_memory_mb: 系统可用内存低于该值时不再增大批大小
+        """
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.adaptive = adaptive
+        self.cache_path = cache_path
+        self.cache_key = cache_key
+        self.min_free_memory_mb = min_free_memory_mb
+
+        self.ceiling = self.max_size
+        self.batch_size = self._clamp(initial_size)
+
+        cached = self._load_cached()
+        if cached:
+            self.ceiling = self._clamp(cached.get("ceiling", self.max_size))
+            self.batch_size = self._clamp(cached.get("batch_size", self.batch_size))
+
+        self.best_size = self.batch_size
+        self.best_throughput = 0.0
+        self._ramping = adaptive
+
+    def _clamp(self, size: int) -> int:
+        return max(self.min_size, min(int(size), self.max_size))
+
+    def _load_cached(self) -> Dict:
+        """读取持久化的调优结果"""
+        if not self.cache_path or not self.cache_key or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get(self.cache_key, {})
+        except (OSError, ValueError) as e:
+            print(f"读取批大小缓存失败 {self.cache_path}: {e}")
+            return {}
+
+    def record(self, batch_len: int, elapsed: float):
+        """
+        记录一个成功批次的耗时，并据此调整下一批的大小
+
+        Args:
+            batch_len: 批次中的图片数量
+            elapsed: 批次耗时（秒）
+        """
+        # 末尾不满的批次不具代表性
+        if batch_len < self.batch_size or elapsed <= 0:
+            return
+
+        throughput = batch_len / elapsed
+        if throughput > self.best_throughput * 1.05:
+            self.best_throughput = throughput
+            self.best_size = self.batch_size
+            if self._ramping and self._can_grow():
+                self.batch_size = self._clamp(min(self.batch_size * 2, self.ceiling))
+                return
+        elif self._ramping:
+            # 吞吐量不再提升，固定在最佳值
+            self._ramping = False
+            self.batch_size = self.best_size
+            return
+
+        self._ramping = False
+
+    def _can_grow(self) -> bool:
+        if self.batch_size >= self.ceiling:
+            return False
+        free_mb = available_memory_mb()
+        return free_mb is None or free_mb >= self.min_free_memory_mb
+
+    def on_memory_error(self) -> bool:
+        """
+        处理内存不足：减半批大小并记录上限
+
+        Returns:
+            是否还能以更小的批大小重试
+        """
+        release_device_memory()
+        if self.batch_size <= self.min_size:
+            return False
+
+        self.ceiling = max(self.min_size, self.batch_size - 1)
+        self.batch_size = self._clamp(self.batch_size // 2)
+        self.best_size = min(self.best_size, self.batch_size)
+        self._ramping = False
+        print(f"内存不足，批大小回退到 {self.batch_size}")
+        return True
+
+    def save(self):
+        """持久化当前设备/模型的最佳批大小"""
+        if not self.cache_path or not self.cache_key:
+            return
+
+        data = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+
+        data[self.cache_key] = {"batch_size": self.best_size, "ceiling": self.ceiling}
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"保存批大小缓存失败 {self.cache_path}: {e}")
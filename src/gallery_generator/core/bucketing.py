@@ -0,0 +1,120 @@
+"""
+预分桶模块
+按文件夹、相机和拍摄时间把图片划分为事件/拍摄场次，
+聚类可以在各个桶内独立进行，计算量随图片数量近似线性增长
+"""
+
+import os
+from typing import Sequence
+
+import numpy as np
+
+from .metadata_store import MetadataStore
+
+
+def _compact(codes: np.ndarray) -> np.ndarray:
+    """把任意整数编号压缩为 0..n-1"""
+    _, compact = np.unique(codes, return_inverse=True)
+    return compact.astype(np.int64)
+
+
+def compute_buckets(metadata: MetadataStore, by: Sequence[str] = ("time", "camera", "folder"),
+                    gap_hours: float = 6.0, min_bucket_size: int = 50) -> np.ndarray:
+    """
+    计算每张图片所属的桶
+
+    先按文件夹和相机分组，组内按拍摄时间排序，相邻两张间隔超过 gap_hours 即开始新的场次；
+    没有时间信息的图片在组内单独成桶。小于 min_bucket_size 的场次并入组内相邻的场次，
+    合并后仍然过小的组统一放入一个公共桶。
+
+    Args:
+        metadata: 列式元数据，行与特征一一对应
+        by: 分桶依据，time（拍摄时间）/ camera（相机型号）/ folder（所在文件夹）的任意组合
+        gap_hours: 同一场次内相邻照片的最大时间间隔（小时）
+        min_bucket_size: 桶的最小图片数量
+
+    Returns:
+        桶编号数组（0..n_buckets-1）
+    """
+    n = len(metadata)
+    group = np.zeros(n, dtype=np.int64)
+
+    if "folder" in by:
+        folders = np.asarray([os.path.dirname(path) for path in metadata.paths()])
+        group = _compact(folders)
+    if "camera" in by:
+        make = metadata.columns["make"].astype(np.int64) + 1
+        model = metadata.columns["model"].astype(np.int64) + 1
+        camera = _compact(make * (len(metadata.categories["model"]) + 1) + model)
+        group = _compact(group * (int(camera.max()) + 1) + camera)
+
+    if "time" in by and n:
+        timestamps = metadata.timestamps
+        # 组内按时间排序（没有时间的排在组末尾）
+        order = np.lexsort((timestamps, group))
+        sorted_group = group[order]
+        sorted_time = timestamps[order]
+        missing = np.isnan(sorted_time)
+
+        starts = np.ones(n, dtype=bool)
+        starts[1:] = ((sorted_group[1:] != sorted_group[:-1])
+                      | (missing[1:] != missing[:-1])
+                      | (np.diff(sorted_time) > gap_hours * 3600))
+        sessions = np.cumsum(starts) - 1
+    else:
+        order = np.argsort(group, kind="stable")
+        sorted_group = group[order]
+        starts = np.ones(n, dtype=bool)
+        starts[1:] = sorted_group[1:] != sorted_group[:-1]
+        sessions = np.cumsum(starts) - 1
+
+    sorted_buckets = _merge_small_sessions(sessions, sorted_group, min_bucket_size)
+    buckets = np.empty(n, dtype=np.int64)
+    buckets[order] = sorted_buckets
+    return _compact(buckets)
+
+
+def _merge_small_sessions(sessions: np.ndarray, groups: np.ndarray, min_size: int) -> np.ndarray:
+    """
+    合并过小的场次（输入已按组和时间排序）
+
+    同组内相邻的场次依次累积，直到桶内至少有 min_size 张；组末尾剩余的小桶并入前一个桶。
+    整组都不足 min_size 张时放入一个公共桶。
+    """
+    if not len(sessions):
+        return sessions
+
+    bounds = np.flatnonzero(np.diff(sessions)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(sessions)]])
+
+    result = np.empty(len(sessions), dtype=np.int64)
+    common = -1
+    next_id = 0
+    index = 0
+    while index < len(starts):
+        # 一个组内的所有场次
+        group = groups[starts[index]]
+        group_end = index
+        while group_end < len(starts) and groups[starts[group_end]] == group:
+            group_end += 1
+
+        buckets = []          # [起始位置, 结束位置]
+        for start, end in zip(starts[index:group_end], ends[index:group_end]):
+            if buckets and buckets[-1][1] - buckets[-1][0] < min_size:
+                buckets[-1][1] = end
+            else:
+                buckets.append([start, end])
+        if len(buckets) > 1 and buckets[-1][1] - buckets[-1][0] < min_size:
+            last = buckets.pop()
+            buckets[-1][1] = last[1]
+
+        for start, end in buckets:
+            if end - start < min_size:
+                result[start:end] = common
+            else:
+                result[start:end] = next_id
+                next_id += 1
+        index = group_end
+
+    return result
@@ -0,0 +1,469 @@
+"""
+图库目录模块
+用本地 SQLite 数据库（WAL 模式）记录图片、元数据、特征向量位置、聚类分配和运行历史，
+未变化的图片在后续运行中直接复用特征，历史结果可以直接打开而无需重新处理
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .checkpoint import cluster_results_from_json, cluster_results_to_json
+from .metadata_store import MetadataStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path_hash TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_images_hash_mtime ON images(path_hash, mtime);
+CREATE TABLE IF NOT EXISTS embeddings (
+    image_id INTEGER NOT NULL,
+    model_key TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    dim INTEGER NOT NULL,
+    PRIMARY KEY (image_id, model_key)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    output_dir TEXT,
+    formats TEXT,
+    run_dir TEXT,
+    started TEXT NOT NULL,
+    finished TEXT,
+    status TEXT NOT NULL,
+    image_count INTEGER DEFAULT 0,
+    cluster_count INTEGER DEFAULT 0,
+    cluster_info TEXT,
+    parents TEXT,
+    gallery_paths TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_folder ON runs(folder, started);
+CREATE TABLE IF NOT EXISTS assignments (
+    run_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    image_id INTEGER NOT NULL,
+    cluster_id INTEGER NOT NULL,
+    PRIMARY KEY (run_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_assignments_cluster ON assignments(run_id, cluster_id);
+"""
+
+
+def path_hash(image_path: str) -> str:
+    """图片绝对路径的哈希，作为目录中的主键"""
+    return hashlib.sha1(os.path.abspath(image_path).encode("utf-8")).hexdigest()
+
+
+def _chunks(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def merge_cached_features(image_paths: List[str], cached, features: np.ndarray,
+                          valid_paths: List[str], metadata: MetadataStore):
+    """
+    按扫描顺序合并复用的特征和新提取的特征
+
+    Args:
+        image_paths: 扫描顺序的图片路径
+        cached: LibraryCatalog.lookup_features 的返回值
+        features: 新提取的特征，与 valid_paths 按行对应
+        valid_paths: 新提取成功的图片路径
+        metadata: 新提取的列式元数据
+
+    Returns:
+        (特征数组, 有效路径列表, 列式元数据, 是否为新提取的布尔数组)
+    """
+    cached_positions, cached_features, cached_metadata = cached
+    new_positions = {path: len(cached_positions) + row for row, path in enumerate(valid_paths)}
+
+    order = []
+    merged_paths = []
+    for path in image_paths:
+        row = cached_positions.get(path, new_positions.get(path))
+        if row is not None:
+            order.append(row)
+            merged_paths.append(path)
+
+    all_features = np.concatenate([cached_features, features]) if valid_paths else cached_features
+    all_metadata = MetadataStore.concat([cached_metadata, metadata])
+    order = np.asarray(order, dtype=np.int64)
+    return (
+        all_features[order],
+        merged_paths,
+        all_metadata.subset(order),
+        order >= len(cached_positions),
+    )
+
+
+class LibraryCatalog:
+    """
+    图库目录
+
+    特征向量按模型分别追加保存在 <目录>/embeddings/<模型>.f32 中，数据库只记录行号；
+    图片以路径哈希为键，大小和修改时间不变即视为未变化。
+    """
+
+    def __init__(self, catalog_dir: str, batch_size: int = 500):
+        """
+        初始化图库目录
+
+        Args:
+            catalog_dir: 目录文件夹（包含 catalog.db 和特征文件）
+            batch_size: 批量查询/插入的行数
+        """
+        self.catalog_dir = catalog_dir
+        self.embeddings_dir = os.path.join(catalog_dir, "embeddings")
+        self.db_path = os.path.join(catalog_dir, "catalog.db")
+        self.batch_size = batch_size
+        os.makedirs(self.embeddings_dir, exist_ok=True)
+
+        # GUI 线程和处理线程共用一个连接，由锁串行化
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def _embeddings_path(self, model_key: str) -> str:
+        safe_key = hashlib.sha1(model_key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.embeddings_dir, f"{safe_key}.f32")
+
+    # ---- 图片和特征 ----
+
+    def _find_images(self, hashes: List[str], model_key: str) -> Dict[str, Tuple]:
+        """按路径哈希批量查询 (图片ID, 大小, 修改时间, 元数据, 特征行号, 维度)"""
+        found = {}
+        for chunk in _chunks(hashes, self.batch_size):
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT i.path_hash, i.id, i.size, i.mtime, i.metadata, e.row, e.dim "
+                f"FROM images i LEFT JOIN embeddings e ON e.image_id = i.id AND e.model_key = ? "
+                f"WHERE i.path_hash IN ({placeholders})",
+                [model_key, *chunk]
+            ).fetchall()
+            for row in rows:
+                found[row[0]] = row[1:]
+        return found
+
+    def lookup_features(self, image_paths: List[str],
+                        model_key: str) -> Tuple[Dict[str, int], np.ndarray, MetadataStore]:
+        """
+        查找未变化且已有特征的图片
+
+        Args:
+            image_paths: 图片路径列表
+            model_key: 模型标识（后端、模型和精度），不同模型的特征不能混用
+
+        Returns:
+            ({图片路径: 行号}, 特征数组, 列式元数据)，特征和元数据按行号对应
+        """
+        hashes = [path_hash(path) for path in image_paths]
+        with self._lock:
+            found = self._find_images(hashes, model_key)
+
+        vectors_path = self._embeddings_path(model_key)
+        stored_rows = 0
+        dim = None
+        cached_paths = []
+        rows = []
+        records = []
+        for image_path, digest in zip(image_paths, hashes):
+            entry = found.get(digest)
+            if entry is None or entry[4] is None:
+                continue
+            _, size, mtime, metadata, row, entry_dim = entry
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                continue
+            if stat.st_size != size or stat.st_mtime != mtime:
+                continue
+            if dim is None:
+                dim = entry_dim
+                if os.path.exists(vectors_path):
+                    stored_rows = os.path.getsize(vectors_path) // (4 * dim)
+            # 特征文件在崩溃时可能没写完，超出文件的行视为缺失
+            if entry_dim != dim or row >= stored_rows:
+                continue
+            cached_paths.append(image_path)
+            rows.append(row)
+            record = json.loads(metadata) if metadata else {}
+            record["path"] = image_path
+            records.append(record)
+
+        if not rows:
+            return {}, np.zeros((0, 0), dtype=np.float32), MetadataStore()
+
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(stored_rows, dim))
+        features = np.asarray(vectors[np.asarray(rows)], dtype=np.float32)
+        del vectors
+        positions = {image_path: position for position, image_path in enumerate(cached_paths)}
+        return positions, features, MetadataStore.from_records(records)
+
+    def record_features(self, valid_paths: List[str], features: np.ndarray,
+                        metadata: MetadataStore, model_key: str):
+        """
+        记录图片、元数据和特征（已存在的图片会被更新）
+
+        Args:
+            valid_paths: 有效图片路径
+            features: 特征数组，与 valid_paths 按行对应
+            metadata: 列式元数据，与 valid_paths 按行对应
+            model_key: 模型标识
+        """
+        if not valid_paths:
+            return
+
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        dim = features.shape[1]
+        vectors_path = self._embeddings_path(model_key)
+
+        with self._lock:
+            # 先写特征文件并落盘，再提交数据库，保证数据库中的行号都有效
+            with open(vectors_path, 'ab') as f:
+                # 丢弃上次崩溃时写了一半的行
+                start_row = f.tell() // (4 * dim)
+                f.truncate(start_row * 4 * dim)
+                f.seek(start_row * 4 * dim)
+                features.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            for start in range(0, len(valid_paths), self.batch_size):
+                image_rows = []
+                for index in range(start, min(start + self.batch_size, len(valid_paths))):
+                    image_path = valid_paths[index]
+                    try:
+                        stat = os.stat(image_path)
+                    except OSError:
+                        continue
+                    image_rows.append(
+                        (
+                            path_hash(image_path),
+                            os.path.abspath(image_path),
+                            stat.st_size,
+                            stat.st_mtime,
+                            json.dumps(metadata[index], ensure_ascii=False),
+                            start_row + index,
+                        )
+                    )
+
+                self._conn.executemany(
+                    "INSERT INTO images (path_hash, path, size, mtime, metadata) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(path_hash) DO UPDATE SET path = excluded.path, "
+                    "size = excluded.size, mtime = excluded.mtime, metadata = excluded.metadata",
+                    [row[:5] for row in image_rows],
+                )
+                ids = self._image_ids([row[0] for row in image_rows])
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (image_id, model_key, row, dim) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(ids[row[0]], model_key, row[5], dim) for row in image_rows],
+                )
+            self._conn.commit()
+
+    def _image_ids(self, hashes: List[str]) -> Dict[str, int]:
+        ids = {}
+        for chunk in _chunks(hashes, self.batch_size):
+            placeholders = ",".join("?" * len(chunk))
+            ids.update(self._conn.execute(
+                f"SELECT path_hash, id FROM images WHERE path_hash IN ({placeholders})", chunk
+            ).fetchall())
+        return ids
+
+    # ---- 运行历史 ----
+
+    def start_run(self, folder_path: str, output_dir: str = None,
+                  formats: List[str] = None, run_dir: str = None) -> int:
+        """
+        记录一次运行开始
+
+        Returns:
+            运行ID
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (folder, output_dir, formats, run_dir, started, status) "
+                "VALUES (?, ?, ?, ?, ?, 'running')",
+                (os.path.abspath(folder_path), output_dir, json.dumps(formats or []),
+                 run_dir, datetime.now().isoformat())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def finish_run(self, run_id: int, cluster_results: Dict, image_count: int,
+                   gallery_paths: Dict = None, run_dir: str = None):
+        """
+        记录运行结果和聚类分配
+
+        Args:
+            run_id: 运行ID
+            cluster_results: 聚类结果字典
+            image_count: 扫描到的图片数量
+            gallery_paths: 生成的作品集路径
+            run_dir: 实际使用的运行目录
+        """
+        clusters = cluster_results.get("clusters", {})
+        paths = [path for image_paths in clusters.values() for path in image_paths]
+        cluster_of = [
+            cluster_id for cluster_id, image_paths in clusters.items() for _ in image_paths
+        ]
+
+        with self._lock:
+            ids = self._image_ids([path_hash(path) for path in paths])
+            assignments = [
+                (run_id, position, ids[path_hash(path)], int(cluster_id))
+                for position, (path, cluster_id) in enumerate(zip(paths, cluster_of))
+                if path_hash(path) in ids
+            ]
+            self._conn.execute("DELETE FROM assignments WHERE run_id = ?", (run_id,))
+            for chunk in _chunks(assignments, self.batch_size):
+                self._conn.executemany(
+                    "INSERT INTO assignments (run_id, position, image_id, cluster_id) "
+                    "VALUES (?, ?, ?, ?)",
+                    chunk,
+                )
+            self._conn.execute(
+                "UPDATE runs SET finished = ?, status = 'done', image_count = ?, "
+                "cluster_count = ?, cluster_info = ?, parents = ?, gallery_paths = ?, "
+                "run_dir = COALESCE(?, run_dir) "
+                "WHERE id = ?",
+                (
+                    datetime.now().isoformat(),
+                    image_count,
+                    cluster_results.get("n_clusters", 0),
+                    json.dumps(
+                        cluster_results_to_json(cluster_results.get("cluster_info", {})),
+                        ensure_ascii=False,
+                    ),
+                    json.dumps(
+                        cluster_results_to_json(cluster_results.get("parents") or {}),
+                        ensure_ascii=False,
+                    ),
+                    json.dumps(gallery_paths or {}, ensure_ascii=False),
+                    run_dir,
+                    run_id,
+                ),
+            )
+            self._conn.commit()
+
+    def fail_run(self, run_id: int, message: str = ""):
+        """记录运行失败或被取消"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET finished = ?, status = ? WHERE id = ?",
+                (datetime.now().isoformat(), f"failed: {message}" if message else "failed", run_id)
+            )
+            self._conn.commit()
+
+    def list_runs(self, folder_path: str = None, limit: int = 20) -> List[Dict]:
+        """
+        列出已完成的运行（最新的在前）
+
+        Args:
+            folder_path: 只列出该文件夹的运行
+            limit: 最多返回数量
+
+        Returns:
+            [{"id", "folder", "output_dir", "started", "finished", "image_count", "cluster_count"}]
+        """
+        query = ("SELECT id, folder, output_dir, started, finished, image_count, cluster_count "
+                 "FROM runs WHERE status = 'done'")
+        params = []
+        if folder_path is not None:
+            query += " AND folder = ?"
+            params.append(os.path.abspath(folder_path))
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        keys = ("id", "folder", "output_dir", "started", "finished", "image_count", "cluster_count")
+        with self._lock:
+            return [dict(zip(keys, row)) for row in self._conn.execute(query, params).fetchall()]
+
+    def load_run(self, run_id: int) -> Optional[Dict]:
+        """
+        读取一次运行的完整结果（与 ImageAnalyzer.process_folder 的返回格式相同）
+
+        Args:
+            run_id: 运行ID
+
+        Returns:
+            处理结果字典，运行不存在或未完成时返回 None
+        """
+        with self._lock:
+            run = self._conn.execute(
+                "SELECT folder, output_dir, run_dir, image_count, cluster_count, cluster_info, "
+                "parents, gallery_paths FROM runs WHERE id = ? AND status = 'done'",
+                (run_id,)
+            ).fetchone()
+            if run is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT a.cluster_id, i.path, i.metadata FROM assignments a "
+                "JOIN images i ON i.id = a.image_id WHERE a.run_id = ? ORDER BY a.position",
+                (run_id,)
+            ).fetchall()
+
+        (
+            folder,
+            output_dir,
+            run_dir,
+            image_count,
+            cluster_count,
+            cluster_info,
+            parents,
+            gallery_paths,
+        ) = run
+        keyed = cluster_results_from_json({
+            "cluster_info": json.loads(cluster_info or "{}"),
+            "parents": json.loads(parents or "{}"),
+        })
+        clusters = {}
+        records = []
+        for cluster_id, image_path, metadata in rows:
+            clusters.setdefault(cluster_id, []).append(image_path)
+            record = json.loads(metadata) if metadata else {}
+            record["path"] = image_path
+            records.append(record)
+
+        cluster_results = {
+            "labels": np.asarray([row[0] for row in rows]),
+            "clusters": clusters,
+            "cluster_info": keyed["cluster_info"],
+            "n_clusters": cluster_count,
+            "metadata": MetadataStore.from_records(records),
+        }
+        if keyed["parents"]:
+            cluster_results["parents"] = keyed["parents"]
+
+        return {
+            "success": True,
+            "image_count": image_count,
+            "cluster_count": cluster_count,
+            "cluster_results": cluster_results,
+            "gallery_paths": json.loads(gallery_paths) if gallery_paths else {},
+            "output_dir": output_dir,
+            "run_dir": run_dir,
+            "run_id": run_id,
+            "folder": folder,
+        }
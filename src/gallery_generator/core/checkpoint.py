@@ -0,0 +1,404 @@
+"""
+运行检查点模块
+将特征提取进度、聚类结果和各格式的生成状态保存到运行目录，支持中断后断点续跑
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .metadata_store import MetadataStore
+
+
+def default_run_dir(cache_dir: str, folder_path: str) -> str:
+    """
+    根据输入文件夹生成默认的运行目录
+
+    Args:
+        cache_dir: 缓存根目录
+        folder_path: 输入文件夹路径
+
+    Returns:
+        运行目录路径
+    """
+    digest = hashlib.sha1(os.path.abspath(folder_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, "runs", digest)
+
+
+def _write_json(path: str, data):
+    """先写临时文件再替换，保证中途崩溃不会留下半个文件"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cluster_results_to_json(cluster_results: Dict) -> Dict:
+    """将聚类结果转换为可 JSON 序列化的字典（numpy 类型、整数键）"""
+    def convert(value):
+        if isinstance(value, dict):
+            return {str(k): convert(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [convert(v) for v in value]
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    return convert(cluster_results)
+
+
+def cluster_digest(cluster_results: Dict) -> str:
+    """
+    聚类分配的摘要（各类别的 ID、名称和图片），用于判断已生成的输出是否对应同一结果
+
+    Args:
+        cluster_results: 聚类结果字典
+
+    Returns:
+        十六进制摘要
+    """
+    cluster_info = cluster_results.get("cluster_info", {})
+    assignment = [
+        [int(cluster_id), cluster_info.get(cluster_id, {}).get("name"), list(image_paths)]
+        for cluster_id, image_paths in sorted(cluster_results.get("clusters", {}).items())
+    ]
+    return hashlib.sha1(json.dumps(assignment, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def cluster_results_from_json(data: Dict) -> Dict:
+    """cluster_results_to_json 的逆操作，恢复类别 ID 的整数键"""
+    results = dict(data)
+    for key in ("clusters", "cluster_info", "parents"):
+        if key in results:
+            results[key] = {int(k): v for k, v in results[key].items()}
+    if "centroids" in results:
+        results["centroids"] = {
+            int(k): np.asarray(v, dtype=np.float32) for k, v in results["centroids"].items()
+        }
+    return results
+
+
+class RunCheckpoint:
+    """运行检查点"""
+
+    def __init__(self, run_dir: str):
+        """
+        初始化检查点
+
+        Args:
+            run_dir: 运行目录
+        """
+        self.run_dir = run_dir
+        self.batches_dir = os.path.join(run_dir, "batches")
+        self.state_path = os.path.join(run_dir, "state.json")
+        self.manifest_path = os.path.join(run_dir, "manifest.json")
+        self.stream_manifest_path = os.path.join(run_dir, "manifest.txt")
+        self.clusters_path = os.path.join(run_dir, "clusters.json")
+        self.metadata_path = os.path.join(run_dir, "metadata.npz")
+        os.makedirs(self.batches_dir, exist_ok=True)
+        self.state = _read_json(self.state_path) if os.path.exists(self.state_path) else {}
+        self.next_batch_index = 0
+
+    def reset(self):
+        """清空之前的检查点，开始新的运行"""
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.batches_dir, exist_ok=True)
+        self.state = {}
+        self.next_batch_index = 0
+
+    def _save_state(self):
+        self.state["updated"] = datetime.now().isoformat()
+        _write_json(self.state_path, self.state)
+
+    # ---- 图片清单 ----
+
+    def save_manifest(self, folder_path: str, image_paths: List[str]):
+        """保存扫描得到的图片清单，续跑时按相同顺序处理"""
+        _write_json(self.manifest_path, image_paths)
+        self.state.update({
+            "folder": os.path.abspath(folder_path),
+            "image_count": len(image_paths),
+            "created": datetime.now().isoformat(),
+        })
+        self._save_state()
+
+    def load_manifest(self) -> Optional[List[str]]:
+        """读取图片清单，不存在时返回 None"""
+        if not os.path.exists(self.manifest_path):
+            return None
+        return _read_json(self.manifest_path)
+
+    def clear_stream_manifest(self):
+        """流式模式：删除未完成的图片清单，准备重新扫描"""
+        if os.path.exists(self.stream_manifest_path):
+            os.remove(self.stream_manifest_path)
+
+    def iter_processed_paths(self):
+        """按顺序产生已完成批次的输入路径"""
+        for batch, _ in self._iter_batch_files():
+            yield from batch["input_paths"]
+
+    def append_manifest(self, image_paths: List[str]):
+        """流式模式：边扫描边追加图片清单（每行一个路径）"""
+        with open(self.stream_manifest_path, 'a', encoding='utf-8') as f:
+            f.writelines(path + "\n" for path in image_paths)
+
+    def finish_manifest(self, folder_path: str, image_count: int):
+        """流式模式：记录扫描完成"""
+        self.state.update({
+            "folder": os.path.abspath(folder_path),
+            "image_count": image_count,
+            "scan_done": True,
+            "created": datetime.now().isoformat(),
+        })
+        self._save_state()
+
+    def iter_manifest(self):
+        """流式模式：逐行读取已完成扫描的图片清单"""
+        with open(self.stream_manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    # ---- 特征提取 ----
+
+    def save_batch(self, index: int, input_paths: List[str], features: np.ndarray,
+                   valid_paths: List[str], metadata):
+        """
+        保存一个已完成的特征提取批次
+
+        Args:
+            index: 批次序号
+            input_paths: 该批次的输入路径（含读取失败的图片）
+            features: 特征向量数组
+            valid_paths: 有效路径列表
+            metadata: 元数据（MetadataStore 或字典列表），以列式格式保存
+        """
+        if not isinstance(metadata, MetadataStore):
+            metadata = MetadataStore.from_records(metadata)
+
+        prefix = os.path.join(self.batches_dir, f"batch_{index:06d}")
+        np.save(prefix + ".npy", np.asarray(features, dtype=np.float32))
+        metadata.save(prefix + ".meta.npz")
+        # JSON 最后写入，存在即表示该批次完整
+        _write_json(prefix + ".json", {
+            "input_paths": input_paths,
+            "valid_paths": valid_paths,
+        })
+
+    def _iter_batch_files(self):
+        """按顺序遍历完整的批次文件，遇到第一个不完整或损坏的批次即停止"""
+        index = 0
+        while True:
+            prefix = os.path.join(self.batches_dir, f"batch_{index:06d}")
+            if not (os.path.exists(prefix + ".json") and os.path.exists(prefix + ".npy")):
+                break
+            try:
+                batch = _read_json(prefix + ".json")
+                batch_features = np.load(prefix + ".npy", mmap_mode="r")
+            except (OSError, ValueError) as e:
+                print(f"检查点批次损坏，从该批次重新开始 {prefix}: {e}")
+                break
+            batch["prefix"] = prefix
+            yield batch, batch_features
+            index += 1
+
+    def count_batches(self) -> Tuple[int, int]:
+        """
+        统计已完成的批次
+
+        Returns:
+            (批次数量, 已处理的输入图片数量)
+        """
+        count = 0
+        consumed = 0
+        for batch, _ in self._iter_batch_files():
+            count += 1
+            consumed += len(batch["input_paths"])
+        return count, consumed
+
+    def load_feature_matrix(self) -> Tuple[np.ndarray, List[str], int]:
+        """
+        读取所有批次的特征到一个预先分配的数组中（不读取元数据）
+
+        Returns:
+            (特征矩阵, 有效路径列表, 已处理的输入图片数量)
+        """
+        rows = 0
+        dim = 0
+        for batch, batch_features in self._iter_batch_files():
+            if batch["valid_paths"]:
+                rows += batch_features.shape[0]
+                dim = batch_features.shape[1]
+
+        features = np.empty((rows, dim), dtype=np.float32)
+        valid_paths = []
+        consumed = 0
+        row = 0
+        for batch, batch_features in self._iter_batch_files():
+            if batch["valid_paths"]:
+                features[row:row + batch_features.shape[0]] = batch_features
+                row += batch_features.shape[0]
+            valid_paths.extend(batch["valid_paths"])
+            consumed += len(batch["input_paths"])
+
+        return features, valid_paths, consumed
+
+    def load_metadata(self) -> MetadataStore:
+        """读取所有批次的列式元数据（与 load_feature_matrix 的有效路径按行对应）"""
+        return MetadataStore.concat([
+            MetadataStore.load(batch["prefix"] + ".meta.npz")
+            for batch, _ in self._iter_batch_files() if batch["valid_paths"]
+        ])
+
+    def load_batches(self) -> Tuple[List[np.ndarray], List[str], MetadataStore, int]:
+        """
+        读取所有已完成的批次（遇到第一个不完整的批次即停止）
+
+        Returns:
+            (特征数组列表, 有效路径列表, 元数据, 已处理的输入图片数量)
+        """
+        features = []
+        valid_paths = []
+        metadata = []
+        consumed = 0
+
+        index = 0
+        for batch, batch_features in self._iter_batch_files():
+            if batch["valid_paths"]:
+                features.append(np.asarray(batch_features))
+                metadata.append(MetadataStore.load(batch["prefix"] + ".meta.npz"))
+            valid_paths.extend(batch["valid_paths"])
+            consumed += len(batch["input_paths"])
+            index += 1
+
+        self.next_batch_index = index
+        return features, valid_paths, MetadataStore.concat(metadata), consumed
+
+    # ---- 聚类 ----
+
+    def save_clusters(self, cluster_results: Dict):
+        """保存聚类结果（元数据单独以列式格式保存）"""
+        metadata = cluster_results.get("metadata")
+        if metadata is not None:
+            if not isinstance(metadata, MetadataStore):
+                metadata = MetadataStore.from_records(metadata)
+            metadata.save(self.metadata_path)
+        _write_json(self.clusters_path, cluster_results_to_json(
+            {key: value for key, value in cluster_results.items() if key != "metadata"}
+        ))
+        self.state["clustering_done"] = True
+        self._save_state()
+
+    def load_clusters(self) -> Optional[Dict]:
+        """读取聚类结果，不存在时返回 None"""
+        if not self.state.get("clustering_done") or not os.path.exists(self.clusters_path):
+            return None
+        cluster_results = cluster_results_from_json(_read_json(self.clusters_path))
+        if os.path.exists(self.metadata_path):
+            cluster_results["metadata"] = MetadataStore.load(self.metadata_path)
+        return cluster_results
+
+    # ---- 作品集生成 ----
+
+    def mark_format_done(self, output_format: str, output_dir: str, result_path: str,
+                         cluster_results: Dict = None):
+        """
+        记录某种输出格式已生成完毕
+
+        Args:
+            output_format: 输出格式
+            output_dir: 输出目录
+            result_path: 生成结果路径
+            cluster_results: 生成所用的聚类结果，记录其摘要
+        """
+        generated = self.state.setdefault("generated", {})
+        generated[output_format] = {
+            "output_dir": os.path.abspath(output_dir),
+            "path": result_path,
+            "clusters_digest": (
+                cluster_digest(cluster_results) if cluster_results is not None else None
+            ),
+        }
+        self._save_state()
+
+    def get_generated(self, output_format: str, output_dir: str,
+                      cluster_results: Dict = None) -> Optional[str]:
+        """
+        查询某种格式是否已按同一聚类结果生成到同一输出目录
+
+        Args:
+            output_format: 输出格式
+            output_dir: 输出目录
+            cluster_results: 当前的聚类结果，提供时与生成时记录的摘要比较
+
+        Returns:
+            已生成的结果路径，未生成或聚类结果已变化时返回 None
+        """
+        entry = self.state.get("generated", {}).get(output_format)
+        if not entry or entry.get("output_dir") != os.path.abspath(output_dir):
+            return None
+        if cluster_results is not None and entry.get("clusters_digest") != cluster_digest(
+            cluster_results
+        ):
+            return None
+        if not os.path.exists(entry.get("path", "")):
+            return None
+        return entry["path"]
+
+
+class ClusterResultsHandle:
+    """
+    聚类结果的轻量句柄（流式模式返回）
+
+    只在内存中保留各类别的名称和数量，完整结果保存在运行目录，需要时才读取。
+    支持 get/[] 访问，与聚类结果字典的用法兼容。
+    """
+
+    def __init__(self, checkpoint: RunCheckpoint, cluster_results: Dict):
+        """
+        初始化句柄
+
+        Args:
+            checkpoint: 保存了聚类结果的运行检查点
+            cluster_results: 聚类结果，只保留其中的摘要信息
+        """
+        self.checkpoint = checkpoint
+        self.n_clusters = cluster_results.get("n_clusters", 0)
+        self.cluster_info = {
+            cluster_id: {key: info.get(key) for key in ("name", "count", "description", "parent")}
+            for cluster_id, info in cluster_results.get("cluster_info", {}).items()
+        }
+        self._summary = {"n_clusters": self.n_clusters, "cluster_info": self.cluster_info}
+
+    def load(self) -> Dict:
+        """读取完整的聚类结果"""
+        return self.checkpoint.load_clusters() or {}
+
+    def cluster_paths(self, cluster_id: int) -> List[str]:
+        """读取某个类别的图片路径"""
+        return self.load().get("clusters", {}).get(cluster_id, [])
+
+    def get(self, key: str, default=None):
+        if key in self._summary:
+            return self._summary[key]
+        return self.load().get(key, default)
+
+    def __getitem__(self, key: str):
+        if key in self._summary:
+            return self._summary[key]
+        return self.load()[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._summary or key in self.load()
@@ -4,24 +4,59 @@
 """
 
 import json
+import os
 import numpy as np
-from sklearn.cluster import KMeans, DBSCAN
+from scipy import sparse
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN
 from sklearn.metrics import silhouette_score
-from typing import List, Dict, Tuple
-from collections import defaultdict
+from typing import List, Dict, Optional, Tuple
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from gallery_generator.models.clip_model import CLIPFeatureExtractor
+from gallery_generator.core.bucketing import compute_buckets
+from gallery_generator.core.embedding_backends import create_backend
+from gallery_generator.core.metadata_store import MetadataStore
+
+
+def cluster_centroids(features: np.ndarray, labels) -> Dict[int, np.ndarray]:
+    """
+    计算各类别的中心（一次稀疏矩阵乘法，不复制特征矩阵）
+    
+    Args:
+        features: 特征向量数组
+        labels: 聚类标签
+        
+    Returns:
+        {类别ID: 中心向量}，不包含 DBSCAN 的噪声类别 -1
+    """
+    labels = np.asarray(labels)
+    ids, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    membership = sparse.csr_matrix(
+        (np.ones(len(labels), dtype=np.float32), (inverse, np.arange(len(labels)))),
+        shape=(len(ids), len(labels))
+    )
+    centroids = np.asarray(membership @ features) / counts[:, None]
+    return {int(cluster_id): centroids[row].astype(np.float32)
+            for row, cluster_id in enumerate(ids) if cluster_id != -1}
 
 
 class ImageClassifier:
     """图像分类器"""
     
-    def __init__(self, config_path: str = "config.json"):
+    # 生成类别名称时与类别中心比较的关键词
+    CATEGORY_KEYWORDS = [
+        "废墟", "建筑", "城市", "自然", "山", "海", "水", "森林", "天空",
+        "人物", "肖像", "人文", "生活", "文化", "艺术", "抽象", "风景",
+        "夜景", "日出", "日落", "动物", "植物", "花卉", "静物", "美食"
+    ]
+    
+    def __init__(self, config_path: str = "config.json", backend=None):
         """
         初始化分类器
         
         Args:
             config_path: 配置文件路径
+            backend: 已创建的嵌入后端（例如与特征提取器共用），None 时按配置创建
         """
         with open(config_path, 'r', encoding='utf-8') as f:
             self.config = json.load(f)
@@ -32,23 +67,48 @@ class ImageClassifier:
         self.auto_method = clustering_config.get("auto_cluster_method", "elbow")
         self.min_samples = clustering_config.get("min_samples", 5)
         
-        # 初始化CLIP用于生成类别标签
-        model_config = self.config.get("model", {})
-        self.clip_extractor = CLIPFeatureExtractor(
-            model_name=model_config.get("clip_model_name", "openai/clip-vit-base-patch32"),
-            device=model_config.get("device", "auto")
+        # 分层聚类：先粗分大类，再在每个大类内并行细分
+        self.hierarchical = clustering_config.get("hierarchical", "auto")
+        self.hierarchical_threshold = clustering_config.get("hierarchical_threshold", 2000)
+        self.max_sub_clusters = clustering_config.get("max_sub_clusters", 10)
+        self.min_sub_cluster_size = clustering_config.get("min_sub_cluster_size", 20)
+        self.k_selection_sample = clustering_config.get("k_selection_sample", 2000)
+        self.parallel_workers = clustering_config.get("parallel_workers", 0) or os.cpu_count() or 1
+        
+        # 预分桶：按拍摄时间、相机和文件夹划分场次，桶内独立聚类后再合并
+        self.bucketing = clustering_config.get("bucketing", False)
+        self.bucketing_threshold = clustering_config.get("bucketing_threshold", 5000)
+        self.bucket_by = clustering_config.get("bucket_by", ["time", "camera", "folder"])
+        self.bucket_gap_hours = clustering_config.get("bucket_gap_hours", 6)
+        self.min_bucket_size = clustering_config.get("min_bucket_size", 50)
+        self.max_bucket_clusters = clustering_config.get("max_bucket_clusters", 10)
+        
+        # 类别描述中列出的在线 API 标签数
+        self.summary_tags = self.config.get("api", {}).get("summary_tags", 5)
+        
+        # 初始化嵌入后端用于生成类别标签（传入时与特征提取器共用同一个模型）
+        self.backend = (
+            backend if backend is not None else create_backend(self.config.get("model", {}))
         )
+        # 类别关键词的文本特征（首次生成类别名称时计算）
+        self._keyword_features = None
     
-    def cluster_images(self, features: np.ndarray, image_paths: List[str]) -> Dict:
+    def cluster_images(self, features: np.ndarray, image_paths: List[str], metadata=None,
+                       init_centroids=None) -> Dict:
         """
         对图像进行聚类
         
         Args:
             features: 特征向量数组
             image_paths: 图片路径列表
+            metadata: 与图片按行对应的元数据（MetadataStore 或字典列表），启用预分桶时使用
+            init_centroids: 上一次聚类的类别中心（聚类结果中的 centroids），
+                提供时 KMeans 从这些中心开始迭代（热启动），调整聚类数后重新聚类只需很少的迭代；
+                分桶和分层聚类保持原有结构，
+                热启动用于合并局部类别或划分大类的那一层
             
         Returns:
-            聚类结果字典，包含类别标签、类别信息等
+            聚类结果字典，包含类别标签、类别信息、各类别中心（centroids）等
         """
         if len(features) < 2:
             return {
@@ -57,10 +117,43 @@ class ImageClassifier:
                 "cluster_info": {0: {"name": "所有图片", "count": len(image_paths)}}
             }
         
-        # 确定聚类数量
+        warm_start = init_centroids is not None and self.algorithm == "kmeans"
+        
+        if self._use_bucketing(len(features), metadata):
+            if not isinstance(metadata, MetadataStore):
+                metadata = MetadataStore.from_records(metadata)
+            buckets = compute_buckets(
+                metadata, self.bucket_by, self.bucket_gap_hours, self.min_bucket_size
+            )
+            if buckets.max() > 0:
+                return self._summarize_tags(
+                    self._bucketed_cluster(
+                        features, image_paths, buckets, init_centroids if warm_start else None
+                    ),
+                    image_paths,
+                    metadata,
+                )
+        
+        if self._use_hierarchical(len(features)):
+            return self._summarize_tags(
+                self._hierarchical_cluster(
+                    features, image_paths, init_centroids if warm_start else None
+                ),
+                image_paths,
+                metadata,
+            )
+        
+        # 确定聚类数量（在不超过 k_selection_sample 的样本上确定）
         if self.algorithm == "kmeans":
-            n_clusters = self._determine_clusters(features) if self.n_clusters == "auto" else self.n_clusters
-            labels = self._kmeans_cluster(features, n_clusters)
+            if self.n_clusters == "auto":
+                n_clusters = self._determine_clusters(self._selection_sample(features))
+            else:
+                n_clusters = self.n_clusters
+            n_clusters = max(1, min(int(n_clusters), len(features)))
+            init = (
+                self._warm_start_init(features, init_centroids, n_clusters) if warm_start else None
+            )
+            labels = self._kmeans_cluster(features, n_clusters, init)
         else:
             labels = self._dbscan_cluster(features)
             n_clusters = len(set(labels)) - (1 if -1 in labels else 0)
@@ -68,16 +161,301 @@ class ImageClassifier:
         # 组织聚类结果
         clusters = defaultdict(list)
         for idx, label in enumerate(labels):
-            clusters[label].append(image_paths[idx])
+            clusters[int(label)].append(image_paths[idx])
         
         # 生成类别名称和描述
-        cluster_info = self._generate_cluster_names(clusters, features, labels)
+        centroids = cluster_centroids(features, labels)
+        cluster_info = self._generate_cluster_names(clusters, features, labels, centroids)
         
-        return {
+        return self._summarize_tags({
             "labels": labels.tolist() if isinstance(labels, np.ndarray) else labels,
             "clusters": dict(clusters),
             "cluster_info": cluster_info,
-            "n_clusters": n_clusters
+            "n_clusters": n_clusters,
+            "centroids": centroids
+        }, image_paths, metadata)
+    
+    def _summarize_tags(self, results: Dict, image_paths: List[str], metadata) -> Dict:
+        """元数据中有在线 API 标签时，为每个类别记录出现最多的标签并写入描述"""
+        if (
+            not isinstance(metadata, MetadataStore)
+            or not metadata.has_tags
+            or len(metadata) != len(image_paths)
+        ):
+            return results
+        row_of = {path: row for row, path in enumerate(image_paths)}
+        for cluster_id, paths in results["clusters"].items():
+            info = results["cluster_info"].get(cluster_id)
+            if info is None:
+                continue
+            counts = Counter(tag for path in paths for tag in metadata.tags(row_of[path]))
+            top_tags = [tag for tag, _ in counts.most_common(self.summary_tags)]
+            if top_tags:
+                info["tags"] = top_tags
+                info["description"] = (
+                    f"{info.get('description', '')}，常见标签：{'、'.join(top_tags)}"
+                )
+        return results
+    
+    def _warm_start_init(self, features: np.ndarray, init_centroids, n_clusters: int):
+        """
+        由上一次的类别中心构造 n_clusters 个初始中心
+        
+        数量多于 n_clusters 时把相近的中心合并（在中心上做 KMeans），
+        少于时依次加入离现有中心最远的样本。维度与特征不一致时返回 None（冷启动）。
+        """
+        if isinstance(init_centroids, dict):
+            init_centroids = [init_centroids[key] for key in sorted(init_centroids)]
+        init = np.asarray(init_centroids, dtype=features.dtype)
+        if init.ndim != 2 or not len(init) or init.shape[1] != features.shape[1]:
+            return None
+        
+        if len(init) > n_clusters:
+            return (
+                KMeans(n_clusters=n_clusters, random_state=42, n_init=3).fit(init).cluster_centers_
+            )
+        
+        if len(init) < n_clusters:
+            # 新中心只从不超过 k_selection_sample 的样本中挑选
+            sample = self._selection_sample(features)
+            # 到最近中心的平方距离，||x||² - 2x·c + ||c||²
+            squared_norms = np.einsum("ij,ij->i", sample, sample)
+            distances = (squared_norms[:, None] - 2 * sample @ init.T
+                         + np.einsum("ij,ij->i", init, init)[None, :]).min(axis=1)
+            extra = []
+            for _ in range(n_clusters - len(init)):
+                point = sample[int(np.argmax(distances))]
+                extra.append(point)
+                distances = np.minimum(
+                    distances, squared_norms - 2 * sample @ point + point @ point
+                )
+            init = np.vstack([init, np.asarray(extra)])
+        return init
+    
+    def _use_bucketing(self, n_images: int, metadata) -> bool:
+        """是否使用预分桶（需要与特征按行对应的元数据，仅支持 KMeans）"""
+        if self.algorithm != "kmeans" or metadata is None or len(metadata) != n_images:
+            return False
+        if self.bucketing == "auto":
+            return n_images >= self.bucketing_threshold
+        return bool(self.bucketing)
+    
+    def _bucketed_cluster(self, features: np.ndarray, image_paths: List[str],
+                          buckets: np.ndarray, init_centroids=None) -> Dict:
+        """
+        分桶聚类：各桶内并行聚类得到局部类别，再按局部类别中心（以图片数加权）聚类合并
+        
+        每个桶的计算量有上限，总计算量随图片数量近似线性增长；
+        合并后同一类别可以包含不同场次中相似的图片。
+        
+        Args:
+            features: 特征向量数组
+            image_paths: 图片路径列表
+            buckets: 每张图片的桶编号
+            init_centroids: 上一次的类别中心，提供时合并局部类别的 KMeans 从这些中心开始迭代
+            
+        Returns:
+            聚类结果字典，n_buckets 为桶的数量
+        """
+        bucket_ids = sorted(set(buckets.tolist()))
+        members = {bid: np.flatnonzero(buckets == bid) for bid in bucket_ids}
+        
+        def fit(bucket_id):
+            # 局部类别只是合并前的中间结果，直接取上限数量，省去逐个桶选择聚类数
+            indices = members[bucket_id]
+            k = min(self.max_bucket_clusters, len(indices) // self.min_sub_cluster_size)
+            if k < 2:
+                return bucket_id, np.zeros(len(indices), dtype=int)
+            return bucket_id, self._fit_level(features[indices], n_clusters=k)
+        
+        # 各桶互不依赖，并行计算
+        with ThreadPoolExecutor(max_workers=self.parallel_workers) as executor:
+            local_results = dict(executor.map(fit, bucket_ids))
+        
+        # 局部类别中心
+        local_of = np.empty(len(features), dtype=int)
+        centroids = []
+        weights = []
+        for bucket_id in bucket_ids:
+            indices = members[bucket_id]
+            local_labels = local_results[bucket_id]
+            for local_id in sorted(set(local_labels.tolist())):
+                local_indices = indices[local_labels == local_id]
+                local_of[local_indices] = len(centroids)
+                centroids.append(features[local_indices].mean(axis=0))
+                weights.append(len(local_indices))
+        centroids = np.asarray(centroids)
+        weights = np.asarray(weights, dtype=np.float64)
+        
+        # 合并局部类别
+        if self.n_clusters == "auto":
+            n_clusters = self._determine_clusters(centroids)
+        else:
+            n_clusters = self.n_clusters
+        n_clusters = max(1, min(n_clusters, len(centroids)))
+        init = (
+            self._warm_start_init(centroids, init_centroids, n_clusters)
+            if init_centroids is not None
+            else None
+        )
+        if n_clusters == len(centroids):
+            merged = np.arange(len(centroids))
+        elif init is not None:
+            kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42)
+            merged = kmeans.fit_predict(centroids, sample_weight=weights)
+        else:
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+            merged = kmeans.fit_predict(centroids, sample_weight=weights)
+        _, labels = np.unique(merged[local_of], return_inverse=True)
+        
+        clusters = defaultdict(list)
+        for idx, label in enumerate(labels):
+            clusters[int(label)].append(image_paths[idx])
+        
+        centroids = cluster_centroids(features, labels)
+        cluster_info = self._generate_cluster_names(clusters, features, labels, centroids)
+        
+        return {
+            "labels": labels.tolist(),
+            "clusters": dict(clusters),
+            "cluster_info": cluster_info,
+            "n_clusters": len(clusters),
+            "n_buckets": len(bucket_ids),
+            "centroids": centroids
+        }
+    
+    def _use_hierarchical(self, n_images: int) -> bool:
+        """是否使用分层聚类（auto 时按图片数量决定，仅支持 KMeans）"""
+        if self.algorithm != "kmeans":
+            return False
+        if self.hierarchical == "auto":
+            return n_images >= self.hierarchical_threshold
+        return bool(self.hierarchical)
+    
+    def _selection_sample(self, features: np.ndarray) -> np.ndarray:
+        """确定聚类数时使用的样本（不超过 k_selection_sample 张）"""
+        if len(features) <= self.k_selection_sample:
+            return features
+        rng = np.random.default_rng(42)
+        return features[rng.choice(len(features), self.k_selection_sample, replace=False)]
+    
+    def _fit_level(self, features: np.ndarray, max_k: int = None,
+                   n_clusters: int = None, init_centroids=None) -> np.ndarray:
+        """
+        对一层数据做 KMeans，聚类数在不超过 k_selection_sample 的样本上确定，
+        数据量大时使用 MiniBatchKMeans，保证每层的计算量有上限
+        
+        Args:
+            features: 特征向量数组
+            max_k: 自动确定聚类数时的上限
+            n_clusters: 指定聚类数，None 时自动确定
+            init_centroids: 上一次的类别中心，提供时从这些中心开始迭代（热启动）
+            
+        Returns:
+            聚类标签数组
+        """
+        if n_clusters is None:
+            n_clusters = self._determine_clusters(self._selection_sample(features))
+            if max_k is not None:
+                n_clusters = min(n_clusters, max_k)
+        
+        n_clusters = max(1, min(n_clusters, len(features)))
+        if n_clusters == 1:
+            return np.zeros(len(features), dtype=int)
+        
+        if init_centroids is not None:
+            init = self._warm_start_init(features, init_centroids, n_clusters)
+            if init is not None:
+                return self._kmeans_cluster(features, n_clusters, init)
+        
+        if len(features) > 10000:
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3,
+                                     batch_size=4096)
+            return kmeans.fit_predict(features)
+        return self._kmeans_cluster(features, n_clusters)
+    
+    def _hierarchical_cluster(self, features: np.ndarray, image_paths: List[str],
+                              init_centroids=None) -> Dict:
+        """
+        两级聚类：先粗分大类，再在每个大类内并行细分子类
+        
+        Args:
+            features: 特征向量数组
+            image_paths: 图片路径列表
+            init_centroids: 上一次的类别中心，提供时划分大类的 KMeans 从这些中心开始迭代
+            
+        Returns:
+            聚类结果字典。clusters/cluster_info/labels 为叶子子类，
+            parents 记录大类及其包含的子类
+        """
+        top_k = None if self.n_clusters == "auto" else self.n_clusters
+        parent_labels = self._fit_level(features, n_clusters=top_k, init_centroids=init_centroids)
+        parent_ids = sorted(set(parent_labels.tolist()))
+        members = {pid: np.flatnonzero(parent_labels == pid) for pid in parent_ids}
+        
+        def split(parent_id):
+            indices = members[parent_id]
+            max_k = min(self.max_sub_clusters, len(indices) // self.min_sub_cluster_size)
+            if max_k < 2:
+                return parent_id, np.zeros(len(indices), dtype=int)
+            return parent_id, self._fit_level(features[indices], max_k=max_k)
+        
+        # 各大类的细分互不依赖，并行计算
+        with ThreadPoolExecutor(max_workers=self.parallel_workers) as executor:
+            sub_results = dict(executor.map(split, parent_ids))
+        
+        labels = np.empty(len(features), dtype=int)
+        children = {}
+        next_id = 0
+        for parent_id in parent_ids:
+            indices = members[parent_id]
+            sub_labels = sub_results[parent_id]
+            children[parent_id] = []
+            for sub_id in sorted(set(sub_labels.tolist())):
+                labels[indices[sub_labels == sub_id]] = next_id
+                children[parent_id].append(next_id)
+                next_id += 1
+        
+        clusters = defaultdict(list)
+        for idx, label in enumerate(labels):
+            clusters[int(label)].append(image_paths[idx])
+        
+        centroids = cluster_centroids(features, labels)
+        cluster_info = self._generate_cluster_names(clusters, features, labels, centroids)
+        
+        # 大类名称
+        parent_clusters = {pid: [image_paths[i] for i in members[pid]] for pid in parent_ids}
+        parent_info = self._generate_cluster_names(parent_clusters, features, parent_labels)
+        parents = {}
+        for parent_id in parent_ids:
+            info = parent_info[parent_id]
+            child_names = set()
+            for child_id in children[parent_id]:
+                child = cluster_info[child_id]
+                child["parent"] = parent_id
+                # 同一大类下的子类重名时加序号区分
+                name = child["name"]
+                suffix = 2
+                while name in child_names:
+                    name = f"{child['name']} {suffix}"
+                    suffix += 1
+                child["name"] = name
+                child_names.add(name)
+            parents[parent_id] = {
+                "name": info["name"],
+                "count": info["count"],
+                "description": info["description"],
+                "children": children[parent_id]
+            }
+        
+        return {
+            "labels": labels.tolist(),
+            "clusters": dict(clusters),
+            "cluster_info": cluster_info,
+            "n_clusters": next_id,
+            "parents": parents,
+            "n_parents": len(parents),
+            "centroids": centroids
         }
     
     def _determine_clusters(self, features: np.ndarray) -> int:
@@ -141,9 +519,24 @@ class ImageClassifier:
         best_k, _ = max(scores, key=lambda x: x[1])
         return best_k
     
-    def _kmeans_cluster(self, features: np.ndarray, n_clusters: int) -> np.ndarray:
-        """KMeans聚类"""
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    def _kmeans_cluster(
+        self, features: np.ndarray, n_clusters: int, init: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        KMeans聚类
+        
+        Args:
+            features: 特征向量数组
+            n_clusters: 聚类数量
+            init: 初始中心（热启动），提供时只运行一次，数据量大时使用 MiniBatchKMeans
+        """
+        if init is None:
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+        elif len(features) > 10000:
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42,
+                                     batch_size=4096)
+        else:
+            kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42)
         labels = kmeans.fit_predict(features)
         return labels
     
@@ -162,7 +555,22 @@ class ImageClassifier:
         labels = dbscan.fit_predict(features)
         return labels
     
-    def _generate_cluster_names(self, clusters: Dict, features: np.ndarray, labels: List) -> Dict:
+    def keyword_features(self) -> Optional[np.ndarray]:
+        """
+        类别关键词的文本特征（只计算一次，重新聚类时直接复用）
+        
+        Returns:
+            特征数组，后端不支持文本特征时返回 None
+        """
+        if self._keyword_features is None:
+            try:
+                self._keyword_features = self.backend.get_text_features(self.CATEGORY_KEYWORDS)
+            except Exception:
+                self._keyword_features = False
+        return self._keyword_features if self._keyword_features is not False else None
+    
+    def _generate_cluster_names(self, clusters: Dict, features: np.ndarray, labels: List,
+                                centroids: Dict = None) -> Dict:
         """
         为每个聚类生成名称和描述
         
@@ -170,18 +578,17 @@ class ImageClassifier:
             clusters: 聚类结果字典
             features: 特征向量数组
             labels: 聚类标签列表
+            centroids: 已计算的类别中心，None 时逐类计算
             
         Returns:
             聚类信息字典
         """
         cluster_info = {}
         
-        # 预定义的类别关键词
-        category_keywords = [
-            "废墟", "建筑", "城市", "自然", "山", "海", "水", "森林", "天空",
-            "人物", "肖像", "人文", "生活", "文化", "艺术", "抽象", "风景",
-            "夜景", "日出", "日落", "动物", "植物", "花卉", "静物", "美食"
-        ]
+        category_keywords = self.CATEGORY_KEYWORDS
+        text_features = self.keyword_features()
+        
+        labels = np.asarray(labels)
         
         for cluster_id, image_paths in clusters.items():
             if cluster_id == -1:  # DBSCAN的噪声点
@@ -193,20 +600,20 @@ class ImageClassifier:
                 continue
             
             # 计算该聚类的中心特征
-            cluster_indices = [i for i, label in enumerate(labels) if label == cluster_id]
-            if not cluster_indices:
-                continue
-            
-            cluster_features = features[cluster_indices]
-            centroid = np.mean(cluster_features, axis=0)
+            if centroids is not None and cluster_id in centroids:
+                centroid = centroids[cluster_id]
+            else:
+                cluster_mask = labels == cluster_id
+                if not cluster_mask.any():
+                    continue
+                centroid = np.mean(features[cluster_mask], axis=0)
             
             # 使用CLIP匹配最相关的类别关键词
-            try:
-                text_features = self.clip_extractor.get_text_features(category_keywords)
+            if text_features is not None:
                 similarities = np.dot(centroid, text_features.T)
                 best_match_idx = np.argmax(similarities)
                 category_name = category_keywords[best_match_idx]
-            except:
+            else:
                 category_name = f"类别 {cluster_id + 1}"
             
             cluster_info[cluster_id] = {
@@ -0,0 +1,167 @@
+"""
+聚类结果差异模块
+将新的聚类结果与上一次输出时的结果对齐类别 ID，并计算新增、删除、移动的图片和改名的类别，
+供作品集生成器只更新受影响的文件
+"""
+
+import copy
+from typing import Dict, List
+
+import numpy as np
+
+
+def match_clusters(previous: Dict, current: Dict) -> Dict[int, int]:
+    """
+    按图片重合数量将当前类别与上一次的类别一一对应
+
+    Args:
+        previous: 上一次的聚类结果
+        current: 当前聚类结果
+
+    Returns:
+        {当前类别ID: 上一次类别ID}，没有重合图片的类别不在其中
+    """
+    previous_cluster_of = {}
+    for cluster_id, image_paths in previous['clusters'].items():
+        for path in image_paths:
+            previous_cluster_of[path] = cluster_id
+
+    overlaps = {}
+    for cluster_id, image_paths in current['clusters'].items():
+        for path in image_paths:
+            previous_id = previous_cluster_of.get(path)
+            if previous_id is not None:
+                key = (cluster_id, previous_id)
+                overlaps[key] = overlaps.get(key, 0) + 1
+
+    # 重合最多的配对优先；重合数相同时按与编号无关的顺序选择，对齐后的结果再次对齐时不会变化
+    first_path = {
+        cluster_id: min(image_paths)
+        for cluster_id, image_paths in current['clusters'].items()
+        if image_paths
+    }
+    mapping = {}
+    used = set()
+    for (cluster_id, previous_id), _ in sorted(
+            overlaps.items(), key=lambda item: (-item[1], item[0][1], first_path[item[0][0]])):
+        if cluster_id in mapping or previous_id in used:
+            continue
+        mapping[cluster_id] = previous_id
+        used.add(previous_id)
+
+    return mapping
+
+
+def align_cluster_ids(previous: Dict, current: Dict) -> Dict:
+    """
+    重新编号当前聚类结果，使与上一次对应的类别沿用原来的ID
+
+    聚类算法每次给出的类别编号可能不同，对齐后未变化的类别才能复用已生成的文件。
+    没有对应类别的新类别保留原编号（与上一次的编号冲突时使用新编号），因此对齐是幂等的。
+
+    Args:
+        previous: 上一次的聚类结果
+        current: 当前聚类结果
+
+    Returns:
+        重新编号后的聚类结果（新字典，不修改输入）
+    """
+    mapping = match_clusters(previous, current)
+
+    next_id = max(list(previous['clusters'].keys()) + list(current['clusters'].keys()) + [-1]) + 1
+    used = set(previous['clusters']) | set(mapping.values())
+    for cluster_id in current['clusters']:
+        if cluster_id not in mapping:
+            if cluster_id in used:
+                mapping[cluster_id] = next_id
+                next_id += 1
+            else:
+                mapping[cluster_id] = cluster_id
+            used.add(mapping[cluster_id])
+
+    aligned = dict(current)
+    aligned['clusters'] = {mapping[cid]: paths for cid, paths in current['clusters'].items()}
+    aligned['cluster_info'] = {
+        mapping[cid]: info for cid, info in current.get('cluster_info', {}).items()
+    }
+
+    if current.get('centroids') is not None:
+        aligned['centroids'] = {
+            mapping.get(cid, cid): centroid for cid, centroid in current['centroids'].items()
+        }
+
+    if 'labels' in current:
+        labels = [mapping.get(int(label), int(label)) for label in np.asarray(current['labels'])]
+        aligned['labels'] = (
+            np.array(labels) if isinstance(current['labels'], np.ndarray) else labels
+        )
+
+    if current.get('parents'):
+        aligned['parents'] = copy.deepcopy(current['parents'])
+        for parent in aligned['parents'].values():
+            parent['children'] = [mapping.get(cid, cid) for cid in parent.get('children', [])]
+
+    return aligned
+
+
+def compute_cluster_diff(previous: Dict, current: Dict) -> Dict:
+    """
+    计算两次聚类结果（类别ID已对齐）之间的差异
+
+    Args:
+        previous: 上一次的聚类结果
+        current: 当前聚类结果
+
+    Returns:
+        差异字典：
+            added: 新增的图片路径
+            removed: 删除的图片路径
+            moved: [(图片路径, 原类别ID, 新类别ID)]
+            renamed: {类别ID: (原名称, 新名称)}
+            changed_clusters: 内容或信息有变化的类别ID（含新类别）
+            removed_clusters: 已不存在的类别ID
+            unchanged: 是否完全没有变化
+    """
+    previous_cluster_of = {
+        path: cid for cid, paths in previous['clusters'].items() for path in paths
+    }
+    current_cluster_of = {path: cid for cid, paths in current['clusters'].items() for path in paths}
+
+    added = [path for path in current_cluster_of if path not in previous_cluster_of]
+    removed = [path for path in previous_cluster_of if path not in current_cluster_of]
+    moved = [
+        (path, previous_cluster_of[path], cid)
+        for path, cid in current_cluster_of.items()
+        if path in previous_cluster_of and previous_cluster_of[path] != cid
+    ]
+
+    renamed = {}
+    changed_clusters: List[int] = []
+    for cluster_id, image_paths in current['clusters'].items():
+        if cluster_id not in previous['clusters']:
+            changed_clusters.append(cluster_id)
+            continue
+
+        old_info = previous.get('cluster_info', {}).get(cluster_id, {})
+        new_info = current.get('cluster_info', {}).get(cluster_id, {})
+        if old_info.get("name") != new_info.get("name"):
+            renamed[cluster_id] = (old_info.get("name"), new_info.get("name"))
+
+        if (image_paths != previous['clusters'][cluster_id]
+                or old_info.get("name") != new_info.get("name")
+                or old_info.get("description") != new_info.get("description")
+                or old_info.get("parent") != new_info.get("parent")):
+            changed_clusters.append(cluster_id)
+
+    removed_clusters = [cid for cid in previous['clusters'] if cid not in current['clusters']]
+
+    return {
+        "added": added,
+        "removed": removed,
+        "moved": moved,
+        "renamed": renamed,
+        "changed_clusters": changed_clusters,
+        "removed_clusters": removed_clusters,
+        "unchanged": not (changed_clusters or removed_clusters)
+                     and (previous.get('parents') or {}) == (current.get('parents') or {}),
+    }
@@ -0,0 +1,214 @@
+"""
+构图分析模块
+在小尺寸灰度缩略图（优先读取缩略图缓存）上用积分图计算构图特征，支持批量并行处理，
+结果为紧凑的特征数组，可用于整个图库的聚类或排序
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from .thumbnail_cache import ThumbnailCache
+
+# 特征数组的列
+COMPOSITION_FEATURES = (
+    "aspect_ratio",       # 宽高比
+    "symmetry",           # 左右对称程度 0-1
+    "center_ratio",       # 中心区域与边缘区域的亮度比
+    "thirds_strength",    # 三分线附近的边缘强度与平均值之比
+    "brightness",         # 平均亮度 0-1
+    "contrast",           # 亮度标准差 0-1
+)
+
+# 由特征得到布尔构图标签的阈值
+SYMMETRY_THRESHOLD = 0.7
+CENTER_THRESHOLD = 1.2
+THIRDS_THRESHOLD = 1.2
+
+
+def load_gray_thumbnail(
+    image_path: str, size: int = 128, thumbnails: Optional[Dict] = None
+) -> np.ndarray:
+    """
+    读取灰度缩略图（最长边为 size）
+
+    Args:
+        image_path: 图片路径
+        size: 缩略图最长边
+        thumbnails: 缩略图缓存配置（ThumbnailCache.spec），提供时从缓存读取（未命中时生成并写入）
+
+    Returns:
+        uint8 灰度数组
+    """
+    cached = (
+        ThumbnailCache.from_spec(thumbnails).get_or_create(image_path, size) if thumbnails else None
+    )
+    if cached is not None:
+        gray = cached.convert("L")
+    else:
+        # JPEG 在解码阶段直接降采样
+        with Image.open(image_path) as img:
+            img.draft("L", (size, size))
+            gray = img.convert("L")
+    gray.thumbnail((size, size), Image.BILINEAR)
+    return np.asarray(gray, dtype=np.uint8)
+
+
+def _integral(values: np.ndarray) -> np.ndarray:
+    """积分图（首行首列补零），任意矩形区域之和为 O(1)"""
+    integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0, dtype=np.float64), axis=1, out=integral[1:, 1:])
+    return integral
+
+
+def _region_sum(integral: np.ndarray, y0: int, y1: int, x0: int, x1: int) -> float:
+    return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+
+def composition_features(gray: np.ndarray) -> np.ndarray:
+    """
+    计算一张灰度缩略图的构图特征
+
+    Args:
+        gray: uint8 灰度数组
+
+    Returns:
+        float32 数组，各列见 COMPOSITION_FEATURES
+    """
+    height, width = gray.shape
+    features = np.full(len(COMPOSITION_FEATURES), np.nan, dtype=np.float32)
+    if height < 2 or width < 2:
+        return features
+
+    pixels = gray.astype(np.float32)
+    integral = _integral(pixels)
+    total = integral[-1, -1]
+    area = height * width
+
+    # 对称性：左半部分与水平翻转后的右半部分（均为视图，不复制）
+    half = width // 2
+    diff = np.abs(pixels[:, :half] - pixels[:, ::-1][:, :half])
+    symmetry = 1 - diff.mean() / 255.0
+
+    # 中心构图：中心 20% 区域与外围 30% 边框的亮度比
+    cy0, cy1 = int(height * 0.4), max(int(height * 0.6), int(height * 0.4) + 1)
+    cx0, cx1 = int(width * 0.4), max(int(width * 0.6), int(width * 0.4) + 1)
+    center_mean = _region_sum(integral, cy0, cy1, cx0, cx1) / ((cy1 - cy0) * (cx1 - cx0))
+    iy0, iy1, ix0, ix1 = int(height * 0.3), int(height * 0.7), int(width * 0.3), int(width * 0.7)
+    inner_area = (iy1 - iy0) * (ix1 - ix0)
+    edge_mean = (total - _region_sum(integral, iy0, iy1, ix0, ix1)) / max(area - inner_area, 1)
+    center_ratio = (center_mean + 1) / (edge_mean + 1)
+
+    # 三分法：边缘强度在三分线附近的带状区域中的占比
+    gradient = np.zeros_like(pixels)
+    gradient[:, 1:] += np.abs(pixels[:, 1:] - pixels[:, :-1])
+    gradient[1:, :] += np.abs(pixels[1:, :] - pixels[:-1, :])
+    energy = _integral(gradient)
+    mean_energy = energy[-1, -1] / area
+    band_x = max(width // 12, 1)
+    band_y = max(height // 12, 1)
+    band_energy = 0.0
+    band_area = 0
+    for x in (width // 3, width * 2 // 3):
+        x0, x1 = max(x - band_x, 0), min(x + band_x, width)
+        band_energy += _region_sum(energy, 0, height, x0, x1)
+        band_area += height * (x1 - x0)
+    for y in (height // 3, height * 2 // 3):
+        y0, y1 = max(y - band_y, 0), min(y + band_y, height)
+        band_energy += _region_sum(energy, y0, y1, 0, width)
+        band_area += width * (y1 - y0)
+    thirds_strength = (band_energy / band_area) / mean_energy if mean_energy > 0 else 0.0
+
+    features[:] = (
+        width / height,
+        symmetry,
+        center_ratio,
+        thirds_strength,
+        total / area / 255.0,
+        pixels.std() / 255.0,
+    )
+    return features
+
+
+def _analyze_one(args) -> np.ndarray:
+    """进程池任务：读取缩略图并计算特征，失败时返回 NaN"""
+    image_path, size, thumbnails = args
+    try:
+        return composition_features(load_gray_thumbnail(image_path, size, thumbnails))
+    except Exception as e:
+        print(f"构图分析失败 {image_path}: {e}")
+        return np.full(len(COMPOSITION_FEATURES), np.nan, dtype=np.float32)
+
+
+def analyze_composition_batch(
+    image_paths: List[str],
+    size: int = 128,
+    thumbnails: Optional[Dict] = None,
+    workers: int = 0,
+    chunksize: int = 64,
+) -> np.ndarray:
+    """
+    批量计算构图特征
+
+    Args:
+        image_paths: 图片路径列表
+        size: 缩略图最长边
+        thumbnails: 缩略图缓存配置（ThumbnailCache.spec）
+        workers: 进程数，0 表示 CPU 核心数，1 表示在当前进程中计算
+        chunksize: 每次分发给进程的图片数
+
+    Returns:
+        (N, len(COMPOSITION_FEATURES)) 的 float32 数组，失败的图片为 NaN
+    """
+    result = np.full((len(image_paths), len(COMPOSITION_FEATURES)), np.nan, dtype=np.float32)
+    tasks = [(path, size, thumbnails) for path in image_paths]
+
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks) // chunksize, 1))
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                for row, features in enumerate(
+                    executor.map(_analyze_one, tasks, chunksize=chunksize)
+                ):
+                    result[row] = features
+            return result
+        except Exception as e:
+            # 进程池不可用（例如受限环境）时退回逐个计算
+            print(f"并行构图分析失败，改为逐个计算: {e}")
+
+    for row, task in enumerate(tasks):
+        result[row] = _analyze_one(task)
+    return result
+
+
+def composition_to_dict(features: np.ndarray) -> Dict:
+    """
+    将一行构图特征转换为构图特征字典
+
+    Args:
+        features: composition_features 的结果
+
+    Returns:
+        {"rule_of_thirds", "center_composition", "symmetry", "aspect_ratio", "scores"}
+    """
+    if np.isnan(features).any():
+        return {
+            "rule_of_thirds": False,
+            "center_composition": False,
+            "symmetry": False,
+            "aspect_ratio": 1.0
+        }
+
+    values = dict(zip(COMPOSITION_FEATURES, features.tolist()))
+    return {
+        "rule_of_thirds": values["thirds_strength"] > THIRDS_THRESHOLD,
+        "center_composition": values["center_ratio"] > CENTER_THRESHOLD,
+        "symmetry": values["symmetry"] > SYMMETRY_THRESHOLD,
+        "aspect_ratio": values["aspect_ratio"],
+        "scores": values,
+    }
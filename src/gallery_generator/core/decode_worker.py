@@ -0,0 +1,40 @@
+"""
+解码工作进程入口
+spawn 启动的工作进程只导入本模块和解码所需的 PIL/numpy，不加载聚类、模型等重量级依赖
+"""
+
+from typing import Callable, Dict, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+
+def is_io_error(error: BaseException) -> bool:
+    """
+    是否为读取文件时的 I/O 错误（文件不存在、无权限、网络存储暂时不可用等）
+
+    这类错误与文件内容无关，不应加入隔离名单。PIL 的解码错误同样是 OSError，
+    但没有 errno（无法识别的格式为 UnidentifiedImageError）。
+    """
+    return (isinstance(error, OSError) and not isinstance(error, UnidentifiedImageError)
+            and error.errno is not None)
+
+
+def worker_main(conn, max_pixels: int, max_side: int, thumbnails: Optional[Dict] = None,
+                decode_func: Optional[Callable] = None):
+    """解码工作进程主循环"""
+    if decode_func is None:
+        from .image_decoder import decode_image as decode_func
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    conn.send(("ready", None))
+    while True:
+        try:
+            image_path = conn.recv()
+        except EOFError:
+            break
+        if image_path is None:
+            break
+        try:
+            conn.send(("ok", decode_func(image_path, max_pixels, max_side, thumbnails)))
+        except Exception as e:
+            status = "io_error" if is_io_error(e) else "error"
+            conn.send((status, f"{type(e).__name__}: {e}"))
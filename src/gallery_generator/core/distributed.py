@@ -0,0 +1,490 @@
+"""
+分布式特征提取模块
+协调端把扫描得到的图片清单切分为分片，写入共享目录（如 NFS）作为工作队列；
+各主机上的工作进程领取分片、提取特征并写入分片结果文件，全部完成后由合并步骤
+按清单顺序拼接为统一的特征数组供聚类使用。
+
+共享目录结构:
+    manifest.json        作业信息（分片数、图片数、模型标识）
+    shards/<编号>.txt     每个分片的图片路径
+    leases/<编号>.json    领取租约，处理期间定期刷新修改时间作为心跳
+    attempts/<编号>.json  尝试次数（出错和心跳超时被接管都计入）和最近一次错误
+    out/<编号>.*          分片结果（特征、有效路径、列式元数据）
+    done/<编号>           完成标记（结果文件全部写入后才创建）
+    failed/<编号>.json    超过重试次数、不再领取的分片
+
+租约用 O_EXCL 创建保证同一分片只被一个进程领取；心跳超时的租约会被空闲进程
+原子地改名后接管（工作窃取），处理出错的分片释放后由其他进程重试。每次出错或被接管
+都计为一次尝试，反复导致工作进程崩溃的分片达到最大次数后标记为失败。
+"""
+
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from gallery_generator.core.feature_extractor import ImageFeatureExtractor
+from gallery_generator.core.metadata_store import MetadataStore
+
+DEFAULT_SHARD_SIZE = 1000
+DEFAULT_LEASE_TIMEOUT = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 5
+
+_SUBDIRS = ("shards", "leases", "attempts", "out", "done", "failed")
+
+
+def _tmp_path(path: str, suffix: str = ".tmp") -> str:
+    """共享目录中的临时文件名，包含主机名和进程号，不同主机上的进程不会冲突"""
+    return f"{path}.{default_worker_id()}{suffix}"
+
+
+def _write_json(path: str, data):
+    """先写临时文件再替换，共享目录中的读者不会看到半个文件"""
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def default_worker_id() -> str:
+    """工作进程标识：主机名-进程号"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardQueue:
+    """共享目录中的分片工作队列"""
+
+    def __init__(self, job_dir: str, lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        """
+        打开已创建的分片作业
+
+        Args:
+            job_dir: 共享作业目录
+            lease_timeout: 租约心跳超时（秒），超时的分片可被其他进程接管
+            max_attempts: 每个分片最多尝试的次数
+        """
+        self.job_dir = job_dir
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max(1, max_attempts)
+        self._manifest = None
+
+    @classmethod
+    def create(cls, job_dir: str, image_paths: List[str], shard_size: int, model_key: str,
+               folder_path: str = None, **kwargs) -> "ShardQueue":
+        """
+        切分图片清单并创建分片作业
+
+        Args:
+            job_dir: 共享作业目录（不能已包含作业）
+            image_paths: 图片路径列表（工作进程所在主机上必须可以按同一路径访问）
+            shard_size: 每个分片的图片数
+            model_key: 嵌入模型标识，工作进程的模型配置必须一致
+            folder_path: 图片所在的文件夹（合并后记录运行历史时使用）
+            **kwargs: 传给构造函数的参数
+
+        Returns:
+            分片队列
+        """
+        if os.path.exists(os.path.join(job_dir, "manifest.json")):
+            raise ValueError(f"作业目录中已有分片作业: {job_dir}")
+        for name in _SUBDIRS:
+            os.makedirs(os.path.join(job_dir, name), exist_ok=True)
+
+        shard_size = max(1, int(shard_size))
+        shard_count = (len(image_paths) + shard_size - 1) // shard_size
+        for shard_id in range(shard_count):
+            with open(
+                os.path.join(job_dir, "shards", f"{shard_id:06d}.txt"), 'w', encoding='utf-8'
+            ) as f:
+                f.write("\n".join(image_paths[shard_id * shard_size:(shard_id + 1) * shard_size]))
+
+        # 清单最后写入，出现 manifest.json 表示分片已全部就绪
+        _write_json(os.path.join(job_dir, "manifest.json"), {
+            "folder": folder_path,
+            "image_count": len(image_paths),
+            "shard_size": shard_size,
+            "shard_count": shard_count,
+            "model_key": model_key,
+            "created_at": datetime.now().isoformat(),
+        })
+        return cls(job_dir, **kwargs)
+
+    @property
+    def manifest(self) -> Dict:
+        """作业信息"""
+        if self._manifest is None:
+            path = os.path.join(self.job_dir, "manifest.json")
+            if not os.path.exists(path):
+                raise ValueError(f"作业目录中没有分片作业: {self.job_dir}")
+            self._manifest = _read_json(path)
+        return self._manifest
+
+    @property
+    def shard_count(self) -> int:
+        return self.manifest["shard_count"]
+
+    def _path(self, kind: str, shard_id: int, suffix: str = "") -> str:
+        return os.path.join(self.job_dir, kind, f"{shard_id:06d}{suffix}")
+
+    def shard_paths(self, shard_id: int) -> List[str]:
+        """分片中的图片路径"""
+        with open(self._path("shards", shard_id, ".txt"), 'r', encoding='utf-8') as f:
+            return [line for line in f.read().split("\n") if line]
+
+    def is_done(self, shard_id: int) -> bool:
+        return os.path.exists(self._path("done", shard_id))
+
+    def is_failed(self, shard_id: int) -> bool:
+        return os.path.exists(self._path("failed", shard_id, ".json"))
+
+    def claim(self, worker_id: str) -> Optional[int]:
+        """
+        领取一个分片：优先领取未被领取的分片，其次接管心跳超时的分片
+
+        Args:
+            worker_id: 工作进程标识
+
+        Returns:
+            分片编号，当前没有可领取的分片时返回 None
+        """
+        count = self.shard_count
+        if not count:
+            return None
+        # 各进程从不同位置开始查找，减少争抢同一个分片
+        start = hash(worker_id) % count
+        for offset in range(count):
+            shard_id = (start + offset) % count
+            if self.is_done(shard_id) or self.is_failed(shard_id):
+                continue
+            if self._acquire(shard_id, worker_id):
+                return shard_id
+        return None
+
+    def _acquire(self, shard_id: int, worker_id: str) -> bool:
+        """创建租约，已有租约且心跳超时时先将其改名作废"""
+        lease_path = self._path("leases", shard_id, ".json")
+        if self._create_lease(lease_path, worker_id):
+            return True
+
+        try:
+            age = time.time() - os.path.getmtime(lease_path)
+        except FileNotFoundError:
+            return self._create_lease(lease_path, worker_id)
+        if age < self.lease_timeout:
+            return False
+
+        # 改名是原子操作，多个进程同时接管时只有一个能成功
+        stale_path = f"{lease_path}.{worker_id}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return False
+        try:
+            previous = _read_json(stale_path).get("worker", "?")
+        except (OSError, ValueError):
+            previous = "?"
+        os.remove(stale_path)
+
+        # 原工作进程可能是被该分片中的图片弄崩溃的，接管同样计为一次尝试
+        error = f"工作进程 {previous} 心跳超时（{age:.0f} 秒无响应）"
+        if not self._record_attempt(shard_id, error):
+            print(f"[{worker_id}] 分片 {shard_id} 已达到最大尝试次数，标记为失败: {error}")
+            return False
+        print(
+            f"[{worker_id}] 接管心跳超时的分片 {shard_id}"
+            f"（原工作进程 {previous}，{age:.0f} 秒无响应）"
+        )
+        return self._create_lease(lease_path, worker_id)
+
+    @staticmethod
+    def _create_lease(lease_path: str, worker_id: str) -> bool:
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"worker": worker_id, "claimed_at": datetime.now().isoformat()}, f)
+        return True
+
+    def _owns_lease(self, shard_id: int, worker_id: str) -> bool:
+        """租约是否属于该工作进程（心跳超时后可能已被其他进程接管）"""
+        try:
+            return _read_json(self._path("leases", shard_id, ".json")).get("worker") == worker_id
+        except (OSError, ValueError):
+            return False
+
+    def heartbeat(self, shard_id: int, worker_id: str) -> bool:
+        """
+        刷新租约的修改时间
+
+        Returns:
+            租约是否仍属于该工作进程
+        """
+        if not self._owns_lease(shard_id, worker_id):
+            return False
+        try:
+            os.utime(self._path("leases", shard_id, ".json"))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, shard_id: int, worker_id: str):
+        """删除租约（已被其他进程接管的租约保持不变）"""
+        if not self._owns_lease(shard_id, worker_id):
+            return
+        try:
+            os.remove(self._path("leases", shard_id, ".json"))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, shard_id: int, worker_id: str, features: np.ndarray, valid_paths: List[str],
+                 metadata: MetadataStore):
+        """
+        保存分片结果并标记完成
+
+        Args:
+            shard_id: 分片编号
+            worker_id: 工作进程标识
+            features: 特征数组
+            valid_paths: 成功读取的图片路径
+            metadata: 列式元数据
+        """
+        prefix = self._path("out", shard_id)
+        # 被接管的分片原进程也可能写入同样的结果，各自的临时文件名不同，替换后内容一致
+        tmp_path = _tmp_path(prefix, ".tmp.npy")
+        np.save(tmp_path, np.asarray(features, dtype=np.float32))
+        os.replace(tmp_path, prefix + ".features.npy")
+        _write_json(prefix + ".paths.json", valid_paths)
+        tmp_path = _tmp_path(prefix, ".tmp.metadata.npz")
+        metadata.save(tmp_path)
+        os.replace(tmp_path, prefix + ".metadata.npz")
+
+        with open(self._path("done", shard_id), 'w', encoding='utf-8') as f:
+            f.write(str(len(valid_paths)))
+        self.release(shard_id, worker_id)
+
+    def _record_attempt(self, shard_id: int, error: str) -> bool:
+        """
+        记录一次尝试，达到最大尝试次数时将分片标记为失败
+
+        Returns:
+            是否还可以重试
+        """
+        attempts_path = self._path("attempts", shard_id, ".json")
+        attempts = (
+            _read_json(attempts_path).get("attempts", 0) if os.path.exists(attempts_path) else 0
+        )
+        attempts += 1
+        _write_json(attempts_path, {"attempts": attempts, "error": error})
+
+        retry = attempts < self.max_attempts
+        if not retry:
+            _write_json(
+                self._path("failed", shard_id, ".json"), {"attempts": attempts, "error": error}
+            )
+        return retry
+
+    def fail(self, shard_id: int, worker_id: str, error: str) -> bool:
+        """
+        记录一次失败并释放分片
+
+        Args:
+            shard_id: 分片编号
+            worker_id: 工作进程标识
+            error: 错误信息
+
+        Returns:
+            是否还会重试（达到最大尝试次数时分片标记为失败）
+        """
+        if not self._owns_lease(shard_id, worker_id):
+            # 租约已被接管，接管时已经计入一次尝试
+            return True
+        retry = self._record_attempt(shard_id, error)
+        self.release(shard_id, worker_id)
+        return retry
+
+    def status(self) -> Dict:
+        """
+        作业进度
+
+        Returns:
+            {"shards", "done", "failed", "running", "pending", "image_count", "finished"}
+        """
+        count = self.shard_count
+        done = sum(1 for shard_id in range(count) if self.is_done(shard_id))
+        failed = sum(1 for shard_id in range(count)
+                     if self.is_failed(shard_id) and not self.is_done(shard_id))
+        running = sum(1 for shard_id in range(count)
+                      if not self.is_done(shard_id) and not self.is_failed(shard_id)
+                      and os.path.exists(self._path("leases", shard_id, ".json")))
+        return {
+            "shards": count,
+            "done": done,
+            "failed": failed,
+            "running": running,
+            "pending": count - done - failed - running,
+            "image_count": self.manifest["image_count"],
+            "finished": done + failed == count,
+        }
+
+    def failures(self) -> Dict[int, str]:
+        """失败的分片及其最近一次错误"""
+        return {
+            shard_id: _read_json(self._path("failed", shard_id, ".json")).get("error", "")
+            for shard_id in range(self.shard_count)
+            if self.is_failed(shard_id) and not self.is_done(shard_id)
+        }
+
+    def merge(self) -> Tuple[np.ndarray, List[str], MetadataStore]:
+        """
+        按分片顺序（即扫描顺序）拼接所有已完成分片的结果
+
+        Returns:
+            (特征数组, 有效路径列表, 列式元数据)
+        """
+        all_features = []
+        valid_paths = []
+        metadata_stores = []
+        for shard_id in range(self.shard_count):
+            if not self.is_done(shard_id):
+                continue
+            prefix = self._path("out", shard_id)
+            shard_paths = _read_json(prefix + ".paths.json")
+            if not shard_paths:
+                continue
+            all_features.append(np.load(prefix + ".features.npy"))
+            valid_paths.extend(shard_paths)
+            metadata_stores.append(MetadataStore.load(prefix + ".metadata.npz"))
+
+        if not all_features:
+            return np.zeros((0, 0), dtype=np.float32), [], MetadataStore()
+        return (
+            np.concatenate(all_features, axis=0),
+            valid_paths,
+            MetadataStore.concat(metadata_stores),
+        )
+
+
+def open_queue(job_dir: str, config: Dict) -> ShardQueue:
+    """按配置 distributed 中的超时和重试次数打开分片作业"""
+    dist_config = config.get("distributed", {})
+    return ShardQueue(
+        job_dir,
+        lease_timeout=dist_config.get("lease_timeout", DEFAULT_LEASE_TIMEOUT),
+        max_attempts=dist_config.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+    )
+
+
+def run_worker(job_dir: str, config_path: str = "config.json", worker_id: str = None) -> int:
+    """
+    工作进程主循环：领取分片并提取特征，直到所有分片完成或失败
+
+    暂时没有可领取的分片（其余分片正由其他进程处理）时等待一段时间再查找，
+    以便接管心跳超时的分片。
+
+    Args:
+        job_dir: 共享作业目录
+        config_path: 配置文件路径（模型配置需与协调端一致）
+        worker_id: 工作进程标识，默认为 主机名-进程号
+
+    Returns:
+        本进程完成的分片数
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    poll_interval = config.get("distributed", {}).get("poll_interval", DEFAULT_POLL_INTERVAL)
+    worker_id = worker_id or default_worker_id()
+
+    shard_queue = open_queue(job_dir, config)
+    extractor = ImageFeatureExtractor(config_path)
+    if extractor.embedding_key != shard_queue.manifest["model_key"]:
+        raise ValueError(
+            f"模型配置与分片作业不一致: {extractor.embedding_key} "
+            f"!= {shard_queue.manifest['model_key']}"
+        )
+
+    completed = 0
+    while True:
+        shard_id = shard_queue.claim(worker_id)
+        if shard_id is None:
+            if shard_queue.status()["finished"]:
+                extractor.close()
+                return completed
+            time.sleep(poll_interval)
+            continue
+
+        # 后台线程定期刷新租约，单个分片耗时超过超时时间也不会被接管
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(max(shard_queue.lease_timeout / 3, 0.1)):
+                if not shard_queue.heartbeat(shard_id, worker_id):
+                    print(f"[{worker_id}] 分片 {shard_id} 的租约已被其他进程接管")
+                    return
+
+        heartbeat_thread = threading.Thread(target=beat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            paths = shard_queue.shard_paths(shard_id)
+            features, valid_paths, metadata = extractor.extract_image_features(paths)
+            shard_queue.complete(shard_id, worker_id, features, valid_paths, metadata)
+            completed += 1
+            print(f"[{worker_id}] 分片 {shard_id} 完成：{len(valid_paths)}/{len(paths)} 张图片")
+        except Exception as e:
+            print(f"[{worker_id}] 分片 {shard_id} 处理出错:\n{traceback.format_exc()}")
+            retry = shard_queue.fail(shard_id, worker_id, str(e) or type(e).__name__)
+            if not retry:
+                print(f"[{worker_id}] 分片 {shard_id} 已达到最大尝试次数，标记为失败")
+        finally:
+            stop.set()
+            heartbeat_thread.join()
+
+
+def _worker_process(job_dir: str, config_path: str, worker_id: str):
+    """子进程入口"""
+    run_worker(job_dir, config_path, worker_id)
+
+
+def run_workers(job_dir: str, config_path: str = "config.json", processes: int = 1) -> bool:
+    """
+    在本机启动多个工作进程（每个进程加载自己的模型）
+
+    Args:
+        job_dir: 共享作业目录
+        config_path: 配置文件路径
+        processes: 工作进程数
+
+    Returns:
+        所有工作进程是否正常退出
+    """
+    if processes <= 1:
+        run_worker(job_dir, config_path)
+        return True
+
+    context = multiprocessing.get_context("spawn")
+    host = socket.gethostname()
+    workers = [
+        context.Process(
+            target=_worker_process, args=(job_dir, config_path, f"{host}-{os.getpid()}-{index}")
+        )
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return all(worker.exitcode == 0 for worker in workers)
@@ -0,0 +1,502 @@
+"""
+图像嵌入后端模块
+为特征提取提供可插拔的推理后端：CLIP (PyTorch)、ONNX Runtime 和测试用的轻量桩实现
+"""
+
+import hashlib
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from gallery_generator.core.precision import apply_precision, autocast_context, resolve_precision
+
+
+# CLIP 预处理使用的归一化参数
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+
+def _l2_normalize(features: np.ndarray) -> np.ndarray:
+    """按行做L2归一化"""
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=-1, keepdims=True)
+    return features / np.maximum(norms, 1e-12)
+
+
+class EmbeddingBackend:
+    """嵌入后端基类，所有后端都需要实现 embed_images 和 get_text_features"""
+
+    name = "base"
+
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        """
+        提取一批图片的特征向量
+
+        Args:
+            images: RGB 模式的 PIL 图片列表
+
+        Returns:
+            特征向量数组 (N, D)
+        """
+        raise NotImplementedError
+
+    def get_text_features(self, texts: List[str]) -> np.ndarray:
+        """
+        提取文本特征向量
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            特征向量数组 (N, D)
+        """
+        raise NotImplementedError
+
+    def warm_up(self, batch_size: int = 1, image_size: int = 224) -> float:
+        """
+        用一批空白图片和一条文本各推理一次
+
+        首次推理的一次性开销（CUDA 上下文、显存分配器、cuDNN 算法选择、ONNX Runtime 图优化等）
+        在这里付出，之后的第一批真实图片不再变慢。
+
+        Args:
+            batch_size: 预热批大小，与实际批大小相同时显存分配器可以直接复用
+            image_size: 空白图片边长
+
+        Returns:
+            预热耗时（秒）
+        """
+        start = time.perf_counter()
+        images = [Image.new("RGB", (image_size, image_size), (127, 127, 127))] * max(1, batch_size)
+        self.embed_images(images)
+        self.get_text_features(["warm up"])
+        return time.perf_counter() - start
+
+    def extract_features_from_paths(self, image_paths: List[str],
+                                    batch_size: int = 32) -> Tuple[np.ndarray, List[str]]:
+        """
+        从图片路径分批提取特征，无法读取的图片会被跳过
+
+        Args:
+            image_paths: 图片路径列表
+            batch_size: 批处理大小
+
+        Returns:
+            (特征向量数组, 有效路径列表)
+        """
+        all_features = []
+        valid_paths = []
+
+        for start in range(0, len(image_paths), batch_size):
+            images = []
+            batch_paths = []
+            for path in image_paths[start:start + batch_size]:
+                try:
+                    with Image.open(path) as img:
+                        images.append(img.convert("RGB"))
+                    batch_paths.append(path)
+                except Exception as e:
+                    print(f"读取图片失败 {path}: {e}")
+
+            if not images:
+                continue
+
+            all_features.append(self.embed_images(images))
+            valid_paths.extend(batch_paths)
+
+        if not all_features:
+            return np.zeros((0, 0), dtype=np.float32), []
+
+        return np.concatenate(all_features, axis=0), valid_paths
+
+
+class CLIPBackend(EmbeddingBackend):
+    """基于 PyTorch 的 CLIP 后端（默认）"""
+
+    name = "clip"
+
+    def __init__(self, model_name: str = "openai/clip-vit-base-patch32", device: str = "auto",
+                 precision: str = "fp32"):
+        """
+        初始化 CLIP 后端
+
+        Args:
+            model_name: CLIP 模型名称
+            device: 运行设备
+            precision: 推理精度 fp32 / bf16 / fp16 / int8
+        """
+        # 延迟导入，避免其他后端也要付出 torch 的导入开销
+        from gallery_generator.models.clip_model import CLIPFeatureExtractor
+
+        self.extractor = CLIPFeatureExtractor(model_name=model_name, device=device)
+
+        # 模型加载完成后应用精度设置
+        self.device = str(getattr(self.extractor, "device", "cpu"))
+        self.precision = resolve_precision(precision, self.device)
+        apply_precision(self.extractor.model, self.precision)
+
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        with autocast_context(self.precision, self.device):
+            features = self.extractor.extract_features(images)
+        return np.asarray(features, dtype=np.float32)
+
+    def get_text_features(self, texts: List[str]) -> np.ndarray:
+        with autocast_context(self.precision, self.device):
+            features = self.extractor.get_text_features(texts)
+        return np.asarray(features, dtype=np.float32)
+
+    def extract_features_from_paths(self, image_paths: List[str],
+                                    batch_size: int = 32) -> Tuple[np.ndarray, List[str]]:
+        with autocast_context(self.precision, self.device):
+            features, valid_paths = self.extractor.extract_features_from_paths(
+                image_paths, batch_size
+            )
+        return np.asarray(features, dtype=np.float32), valid_paths
+
+
+class ONNXBackend(EmbeddingBackend):
+    """基于 ONNX Runtime 的 CPU 推理后端"""
+
+    name = "onnx"
+
+    def __init__(self, model_name: str = "openai/clip-vit-base-patch32",
+                 vision_model_path: str = "models/onnx/clip_vision.onnx",
+                 text_model_path: str = "models/onnx/clip_text.onnx",
+                 intra_op_num_threads: int = 0, inter_op_num_threads: int = 1,
+                 image_size: int = 224):
+        """
+        初始化 ONNX 后端
+
+        Args:
+            model_name: 对应的 CLIP 模型名称（用于加载分词器）
+            vision_model_path: 图像编码器 ONNX 文件路径
+            text_model_path: 文本编码器 ONNX 文件路径
+            intra_op_num_threads: 单个算子内部的线程数，0 表示使用全部物理核心
+            inter_op_num_threads: 算子之间的并行线程数
+            image_size: 模型输入分辨率
+        """
+        import onnxruntime as ort
+
+        if not os.path.exists(vision_model_path):
+            raise FileNotFoundError(
+                f"未找到ONNX模型 {vision_model_path}，请先运行 export_clip_onnx() 导出模型"
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_num_threads
+        options.inter_op_num_threads = inter_op_num_threads
+
+        providers = ["CPUExecutionProvider"]
+        self.vision_session = ort.InferenceSession(vision_model_path, options, providers=providers)
+        self.vision_input = self.vision_session.get_inputs()[0].name
+
+        self.text_session = None
+        if os.path.exists(text_model_path):
+            self.text_session = ort.InferenceSession(text_model_path, options, providers=providers)
+
+        self.model_name = model_name
+        self.image_size = image_size
+        self._tokenizer = None
+
+    def _preprocess(self, image: Image.Image) -> np.ndarray:
+        """与 CLIPProcessor 等价的预处理：短边缩放、中心裁剪、归一化"""
+        size = self.image_size
+        width, height = image.size
+        scale = size / min(width, height)
+        resized = image.resize(
+            (max(size, round(width * scale)), max(size, round(height * scale))),
+            Image.BICUBIC
+        )
+        left = (resized.width - size) // 2
+        top = (resized.height - size) // 2
+        cropped = resized.crop((left, top, left + size, top + size))
+
+        pixels = np.asarray(cropped, dtype=np.float32) / 255.0
+        pixels = (pixels - CLIP_MEAN) / CLIP_STD
+        return pixels.transpose(2, 0, 1)
+
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        pixel_values = np.stack([self._preprocess(img) for img in images])
+        outputs = self.vision_session.run(None, {self.vision_input: pixel_values})
+        return _l2_normalize(outputs[0])
+
+    def get_text_features(self, texts: List[str]) -> np.ndarray:
+        if self.text_session is None:
+            raise RuntimeError("未加载ONNX文本编码器，无法提取文本特征")
+
+        if self._tokenizer is None:
+            from transformers import CLIPTokenizerFast
+            self._tokenizer = CLIPTokenizerFast.from_pretrained(self.model_name)
+
+        tokens = self._tokenizer(texts, padding="max_length", truncation=True,
+                                 max_length=77, return_tensors="np")
+        feed = {
+            "input_ids": tokens["input_ids"].astype(np.int64),
+            "attention_mask": tokens["attention_mask"].astype(np.int64),
+        }
+        outputs = self.text_session.run(None, feed)
+        return _l2_normalize(outputs[0])
+
+
+class StubBackend(EmbeddingBackend):
+    """
+    轻量桩后端，不依赖任何模型
+
+    图像特征由缩略图像素经固定随机投影得到，内容相近的图片特征也相近；
+    文本特征由文本哈希生成。适用于测试和流程调试。
+    """
+
+    name = "stub"
+
+    def __init__(self, embedding_dim: int = 512, seed: int = 42):
+        self.embedding_dim = embedding_dim
+        rng = np.random.default_rng(seed)
+        # 16x16 RGB 缩略图 -> embedding_dim
+        self._projection = rng.standard_normal((16 * 16 * 3, embedding_dim)).astype(np.float32)
+
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        thumbs = np.stack([
+            np.asarray(img.convert("RGB").resize((16, 16), Image.BILINEAR),
+                       dtype=np.float32).ravel() / 255.0
+            for img in images
+        ])
+        return _l2_normalize((thumbs - 0.5) @ self._projection)
+
+    def get_text_features(self, texts: List[str]) -> np.ndarray:
+        features = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "little")
+            features.append(np.random.default_rng(seed).standard_normal(self.embedding_dim))
+        return _l2_normalize(np.array(features))
+
+
+class BatchingBackend(EmbeddingBackend):
+    """
+    跨调用方合并推理批次的包装后端
+
+    多个线程（例如服务模式中同时运行的多个任务）调用 embed_images 时，请求先进入队列，
+    由一个推理线程把等待时间窗口内到达的请求拼成一个批次推理，再按请求拆分结果。
+    许多小文件夹同时处理时，每次模型推理的批次仍然足够大。
+    """
+
+    # 停止推理线程的队列标记
+    _STOP = object()
+
+    def __init__(
+        self, backend: EmbeddingBackend, max_batch_size: int = 256, max_wait: float = 0.01
+    ):
+        """
+        初始化包装后端
+
+        Args:
+            backend: 实际执行推理的后端
+            max_batch_size: 合并后的批次上限（单个请求超过上限时单独推理）
+            max_wait: 收到第一个请求后等待其他请求的最长时间（秒）
+        """
+        self.backend = backend
+        self.name = backend.name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+
+        self._queue = queue.Queue()
+        self._held = None
+        # 推理线程与文本特征请求共用，保证同一时间只有一个推理在执行
+        self._infer_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "images": 0}
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        # device、precision 等属性沿用实际后端
+        if name == "backend":
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        request = {"images": images, "done": threading.Event(), "result": None, "error": None}
+        self._queue.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def get_text_features(self, texts: List[str]) -> np.ndarray:
+        with self._infer_lock:
+            return self.backend.get_text_features(texts)
+
+    def close(self):
+        """停止推理线程（已在队列中的请求仍会完成）"""
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _next_batch(self) -> Optional[List[Dict]]:
+        """取出一个批次的请求：第一个请求到达后在 max_wait 内继续收集，直到达到批次上限"""
+        first = self._held if self._held is not None else self._queue.get()
+        self._held = None
+        if first is self._STOP:
+            return None
+
+        batch = [first]
+        count = len(first["images"])
+        deadline = time.perf_counter() + self.max_wait
+        while count < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if request is self._STOP or count + len(request["images"]) > self.max_batch_size:
+                # 放不下的请求（或停止标记）留到下一批
+                self._held = request
+                break
+            batch.append(request)
+            count += len(request["images"])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            images = [image for request in batch for image in request["images"]]
+            try:
+                with self._infer_lock:
+                    features = self.backend.embed_images(images)
+                offset = 0
+                for request in batch:
+                    request["result"] = features[offset:offset + len(request["images"])]
+                    offset += len(request["images"])
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+            finally:
+                self.stats["requests"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["images"] += len(images)
+                for request in batch:
+                    request["done"].set()
+
+
+BACKENDS = {
+    CLIPBackend.name: CLIPBackend,
+    ONNXBackend.name: ONNXBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def create_backend(model_config: Dict) -> EmbeddingBackend:
+    """
+    根据 config.json 的 model 配置创建嵌入后端
+
+    Args:
+        model_config: 配置中的 model 段
+
+    Returns:
+        嵌入后端实例
+
+    Raises:
+        ValueError: 未知的后端名称
+    """
+    backend_name = model_config.get("backend", "clip")
+    model_name = model_config.get("clip_model_name", "openai/clip-vit-base-patch32")
+
+    if backend_name == "clip":
+        return CLIPBackend(
+            model_name=model_name,
+            device=model_config.get("device", "auto"),
+            precision=model_config.get("precision", "fp32"),
+        )
+
+    if backend_name == "onnx":
+        onnx_config = model_config.get("onnx", {})
+        return ONNXBackend(
+            model_name=model_name,
+            vision_model_path=onnx_config.get("vision_model_path", "models/onnx/clip_vision.onnx"),
+            text_model_path=onnx_config.get("text_model_path", "models/onnx/clip_text.onnx"),
+            intra_op_num_threads=onnx_config.get("intra_op_num_threads", 0),
+            inter_op_num_threads=onnx_config.get("inter_op_num_threads", 1),
+        )
+
+    if backend_name == "stub":
+        return StubBackend(embedding_dim=model_config.get("stub", {}).get("embedding_dim", 512))
+
+    raise ValueError(f"未知的嵌入后端: {backend_name}，可选: {', '.join(BACKENDS)}")
+
+
+def export_clip_onnx(model_name: str = "openai/clip-vit-base-patch32",
+                     output_dir: str = "models/onnx", opset: int = 14) -> Tuple[str, str]:
+    """
+    将 CLIP 模型的图像和文本编码器导出为 ONNX 文件（需要 torch 和 transformers）
+
+    Args:
+        model_name: CLIP 模型名称
+        output_dir: 输出目录
+        opset: ONNX opset 版本
+
+    Returns:
+        (图像编码器路径, 文本编码器路径)
+    """
+    import torch
+    from transformers import CLIPModel
+
+    class _VisionEncoder(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            return self.clip.get_image_features(pixel_values=pixel_values)
+
+    class _TextEncoder(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, input_ids, attention_mask):
+            return self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = CLIPModel.from_pretrained(model_name).eval()
+    image_size = model.config.vision_config.image_size
+
+    vision_path = os.path.join(output_dir, "clip_vision.onnx")
+    text_path = os.path.join(output_dir, "clip_text.onnx")
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _VisionEncoder(model),
+            (torch.randn(1, 3, image_size, image_size),),
+            vision_path,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=opset,
+        )
+        dummy_ids = torch.ones(1, 77, dtype=torch.long)
+        torch.onnx.export(
+            _TextEncoder(model),
+            (dummy_ids, torch.ones_like(dummy_ids)),
+            text_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["text_embeds"],
+            dynamic_axes={
+                "input_ids": {0: "batch"},
+                "attention_mask": {0: "batch"},
+                "text_embeds": {0: "batch"},
+            },
+            opset_version=opset,
+        )
+
+    return vision_path, text_path
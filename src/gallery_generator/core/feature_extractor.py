@@ -3,128 +3,360 @@
 结合本地CLIP模型和在线API提取图像特征
 """
 
+import itertools
 import json
 import os
-from typing import List, Dict, Tuple, Optional
+import queue
+import threading
+import time
+from typing import Callable, List, Dict, Iterable, Tuple, Optional
 import numpy as np
 from PIL import Image
-import cv2
-from datetime import datetime
 
-from gallery_generator.models.clip_model import CLIPFeatureExtractor
+from gallery_generator.core.batch_tuner import AdaptiveBatchSizer, is_memory_error
+from gallery_generator.core.catalog import merge_cached_features
+from gallery_generator.core.composition import (
+    analyze_composition_batch, composition_features, composition_to_dict, load_gray_thumbnail
+)
+from gallery_generator.core.embedding_backends import create_backend
+from gallery_generator.core.image_decoder import SafeDecoder, extract_metadata, parse_exif
+from gallery_generator.core.metadata_store import MetadataStore
+from gallery_generator.core.online_api import create_online_tagger
+from gallery_generator.core.quality import is_blurry
+from gallery_generator.core.thumbnail_cache import create_thumbnail_cache
 
 
 class ImageFeatureExtractor:
     """图像特征提取器"""
     
-    def __init__(self, config_path: str = "config.json"):
+    def __init__(self, config_path: str = "config.json", backend=None):
         """
         初始化特征提取器
         
         Args:
             config_path: 配置文件路径
+            backend: 已创建的嵌入后端（例如服务模式中各任务共用的后端），None 时按配置创建
         """
         with open(config_path, 'r', encoding='utf-8') as f:
             self.config = json.load(f)
         
-        # 初始化CLIP模型
+        # 初始化嵌入后端（clip / onnx / stub）
         model_config = self.config.get("model", {})
-        self.clip_extractor = CLIPFeatureExtractor(
-            model_name=model_config.get("clip_model_name", "openai/clip-vit-base-patch32"),
-            device=model_config.get("device", "auto")
-        )
+        self.backend = backend if backend is not None else create_backend(model_config)
         
         self.batch_size = model_config.get("batch_size", 32)
+        self.adaptive_batch_size = model_config.get("adaptive_batch_size", True)
+        self.max_batch_size = model_config.get("max_batch_size", 256)
+        self.cache_dir = self.config.get("cache", {}).get("dir", ".gallery_cache")
+        self.batch_size_cache_key = "|".join([
+            self.backend.name,
+            model_config.get("clip_model_name", "openai/clip-vit-base-patch32"),
+            str(getattr(self.backend, "device", "cpu")),
+            str(getattr(self.backend, "precision", "fp32")),
+        ])
+        # 特征可复用的范围：同一后端、模型和精度
+        self.embedding_key = "|".join([
+            self.backend.name,
+            model_config.get("clip_model_name", "openai/clip-vit-base-patch32"),
+            str(getattr(self.backend, "precision", "fp32")),
+        ])
         self.use_online_api = self.config.get("api", {}).get("use_online_api", False)
+        
+        # 缩略图缓存：解码阶段生成，构图分析、作品集输出和界面预览共用
+        self.thumbnail_cache = create_thumbnail_cache(self.config)
+        
+        # 在线 API 标签客户端（未启用或未配置密钥时为 None）
+        self.online_tagger = create_online_tagger(self.config, self.thumbnail_cache)
+        thumbnail_spec = self.thumbnail_cache.spec if self.thumbnail_cache is not None else None
+        
+        # 构图分析使用小尺寸灰度缩略图
+        composition_config = self.config.get("composition", {})
+        self.composition_size = composition_config.get("thumbnail_size", 128)
+        self.composition_workers = composition_config.get("workers", 0)
+        self.composition_thumbnails = (
+            thumbnail_spec if composition_config.get("cache", True) else None
+        )
+        
+        # 解码阶段计算质量指标，可选在计算嵌入前剔除模糊的图片
+        quality_config = self.config.get("quality", {})
+        self.reject_blurry = quality_config.get("reject_blurry", False)
+        self.blur_threshold = quality_config.get("blur_threshold", 30.0)
+        
+        # 图片解码在隔离进程中进行，坏文件会被加入隔离名单
+        decoding_config = self.config.get("decoding", {})
+        self.decoder = SafeDecoder(
+            workers=decoding_config.get("workers", 0),
+            timeout=decoding_config.get("timeout", 30),
+            max_pixels=decoding_config.get("max_pixels", 100_000_000),
+            max_side=decoding_config.get("max_side", 512),
+            quarantine_path=os.path.join(
+                self.cache_dir, decoding_config.get("quarantine_file", "quarantine.json")
+            ),
+            isolated=decoding_config.get("isolated", True),
+            thumbnails=thumbnail_spec
+        )
     
-    def extract_image_features(self, image_paths: List[str]) -> Tuple[np.ndarray, List[str], List[Dict]]:
+    def extract_image_features(
+        self,
+        image_paths: List[str],
+        checkpoint=None,
+        progress_callback=None,
+        cached_lookup: Optional[Callable] = None,
+    ) -> Tuple[np.ndarray, List[str], MetadataStore]:
         """
         提取图像特征
         
         Args:
             image_paths: 图片路径列表
+            checkpoint: 运行检查点（RunCheckpoint），提供时会跳过已完成的批次并保存新批次
+            progress_callback: 进度回调函数 (current, total, message)
+            cached_lookup: 按批查询可复用的特征（见 iter_feature_batches）
             
         Returns:
-            (特征向量数组, 有效路径列表, 元数据列表)
+            (特征向量数组, 有效路径列表, 列式元数据)
         """
-        # 提取CLIP特征
-        features, valid_paths = self.clip_extractor.extract_features_from_paths(
-            image_paths, self.batch_size
+        # 分批提取图像特征和元数据
+        features, valid_paths, metadata_list = self._extract_in_batches(
+            image_paths, checkpoint, progress_callback, cached_lookup
         )
         
-        # 提取元数据
-        metadata_list = []
-        for path in valid_paths:
-            metadata = self._extract_metadata(path)
-            metadata_list.append(metadata)
-        
-        # 如果启用在线API，可以在这里添加补充特征
-        if self.use_online_api:
-            # TODO: 集成在线API特征提取
-            pass
+        # 在线 API 的补充标签写入元数据（已缓存的图片不再请求）
+        if self.online_tagger is not None and valid_paths:
+            metadata_list.set_tags(self.online_tagger.tag_images(valid_paths, progress_callback))
         
         return features, valid_paths, metadata_list
     
-    def _extract_metadata(self, image_path: str) -> Dict:
+    def _extract_in_batches(
+        self,
+        image_paths: List[str],
+        checkpoint=None,
+        progress_callback=None,
+        cached_lookup: Optional[Callable] = None,
+    ) -> Tuple[np.ndarray, List[str], MetadataStore]:
         """
-        提取图像元数据
+        分批提取特征和元数据，批大小根据吞吐量自动调整，内存不足时减小批大小重试失败的批次
+        
+        检查点中的批次位置对应完整的 image_paths，可复用的特征也写入批次，
+        续跑时不受图库目录状态变化的影响。
         
         Args:
-            image_path: 图片路径
+            image_paths: 图片路径列表
+            checkpoint: 运行检查点
+            progress_callback: 进度回调函数
+            cached_lookup: 按批查询可复用的特征
             
         Returns:
-            元数据字典
+            (特征向量数组, 有效路径列表, 列式元数据)
         """
-        metadata = {
-            "path": image_path,
-            "filename": os.path.basename(image_path),
-            "size": 0,
-            "format": "",
-            "width": 0,
-            "height": 0,
-            "modification_time": None
-        }
+        all_features = []
+        valid_paths = []
+        metadata_stores = []
+        position = 0
+        batch_index = 0
         
-        try:
-            # 获取文件信息
-            stat = os.stat(image_path)
-            metadata["size"] = stat.st_size
-            metadata["modification_time"] = datetime.fromtimestamp(stat.st_mtime).isoformat()
+        # 从检查点恢复已完成的批次
+        if checkpoint is not None:
+            all_features, valid_paths, restored_metadata, position = checkpoint.load_batches()
+            metadata_stores.append(restored_metadata)
+            batch_index = checkpoint.next_batch_index
+            if position:
+                print(f"从检查点恢复 {position} 张图片的特征")
+        
+        total = len(image_paths)
+        for batch, features, batch_valid, batch_metadata, _ in self.iter_feature_batches(
+                image_paths[position:], checkpoint, batch_index, cached_lookup=cached_lookup):
+            position += len(batch)
+            
+            if batch_valid:
+                all_features.append(features)
+                valid_paths.extend(batch_valid)
+                metadata_stores.append(batch_metadata)
             
-            # 获取图片信息
-            with Image.open(image_path) as img:
-                metadata["format"] = img.format
-                metadata["width"], metadata["height"] = img.size
+            if progress_callback:
+                progress_callback(position, total, f"正在提取图像特征 ({position}/{total})...")
+        
+        if not all_features:
+            return np.zeros((0, 0), dtype=np.float32), [], MetadataStore()
+        
+        return (
+            np.concatenate(all_features, axis=0),
+            valid_paths,
+            MetadataStore.concat(metadata_stores),
+        )
+    
+    def iter_feature_batches(self, image_paths: Iterable[str], checkpoint=None,
+                             batch_index: int = 0, queue_size: int = 2,
+                             cached_lookup: Optional[Callable] = None):
+        """
+        流式提取特征：后台线程按批读取路径并解码，当前线程计算嵌入，
+        两者之间的队列长度有上限，内存占用与图片总数无关
+        
+        Args:
+            image_paths: 图片路径（可以是生成器）
+            checkpoint: 运行检查点，提供时每批结果写入检查点
+            batch_index: 第一个批次的序号（续跑时接在已有批次之后）
+            queue_size: 预先解码的批次数上限
+            cached_lookup: 按批查询可复用的特征（返回值同 LibraryCatalog.lookup_features），
+                命中的图片不再解码和计算嵌入
+            
+        Yields:
+            (该批输入路径, 特征数组, 有效路径列表, 列式元数据, 各行是否为新提取的布尔数组)
+        """
+        sizer = self._batch_sizer()
+        
+        decoded_queue = queue.Queue(maxsize=max(1, queue_size))
+        stop = threading.Event()
+        
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    decoded_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def decode_ahead():
+            try:
+                path_iter = iter(image_paths)
+                while not stop.is_set():
+                    # 批大小在读取时确定，随吞吐量调整
+                    batch = list(itertools.islice(path_iter, sizer.batch_size))
+                    if not batch:
+                        break
+                    cached = cached_lookup(batch) if cached_lookup is not None else None
+                    pending = [path for path in batch if path not in cached[0]] if cached else batch
+                    if not put(("batch", batch, (self.decoder.decode_batch(pending), cached))):
+                        return
+                put(("done", None, None))
+            except Exception as e:
+                put(("error", e, None))
+        
+        reader = threading.Thread(target=decode_ahead, daemon=True)
+        reader.start()
+        
+        try:
+            while True:
+                kind, batch, payload = decoded_queue.get()
+                if kind == "done":
+                    break
+                if kind == "error":
+                    raise batch
+                decoded, cached = payload
+                
+                if self.reject_blurry:
+                    decoded = self._reject_blurry(decoded)
+                
+                start = time.perf_counter()
+                features = self._embed_decoded(decoded, sizer)
+                # 按实际计算嵌入的图片数统计吞吐量（不含读取失败、模糊和复用特征的图片）
+                sizer.record(len(decoded), time.perf_counter() - start)
+                
+                batch_valid = [item["path"] for item in decoded]
+                batch_metadata = MetadataStore.from_records(item["metadata"] for item in decoded)
+                embedded = np.ones(len(batch_valid), dtype=bool)
+                if cached and cached[0]:
+                    features, batch_valid, batch_metadata, embedded = merge_cached_features(
+                        batch, cached, features, batch_valid, batch_metadata
+                    )
+                if checkpoint is not None:
+                    checkpoint.save_batch(batch_index, batch, features, batch_valid, batch_metadata)
+                batch_index += 1
                 
-                # 提取EXIF信息（如果有）
-                if hasattr(img, '_getexif') and img._getexif() is not None:
-                    exif = img._getexif()
-                    if exif:
-                        metadata["exif"] = self._parse_exif(exif)
+                yield batch, features, batch_valid, batch_metadata, embedded
+        finally:
+            stop.set()
+            reader.join()
+            sizer.save()
+    
+    def close(self):
+        """关闭解码工作进程（工作进程在多次提取之间保持运行，避免重复启动）"""
+        self.decoder.close()
+    
+    def _batch_sizer(self) -> AdaptiveBatchSizer:
+        """批大小控制器（沿用该设备/模型上次调优的结果）"""
+        return AdaptiveBatchSizer(
+            initial_size=self.batch_size,
+            max_size=self.max_batch_size,
+            adaptive=self.adaptive_batch_size,
+            cache_path=os.path.join(self.cache_dir, "batch_sizes.json"),
+            cache_key=self.batch_size_cache_key
+        )
+    
+    def warm_up(self, max_batch_size: int = 0) -> float:
+        """
+        预热嵌入后端：按第一批实际会使用的批大小推理一次空白图片
         
+        Args:
+            max_batch_size: 预热批大小上限，0 表示不限制
+            
+        Returns:
+            预热耗时（秒）
+        """
+        batch_size = self._batch_sizer().batch_size
+        if max_batch_size:
+            batch_size = min(batch_size, max_batch_size)
+        try:
+            return self.backend.warm_up(batch_size)
         except Exception as e:
-            print(f"提取元数据失败 {image_path}: {e}")
+            if not is_memory_error(e):
+                raise
+            # 显存不足不影响正式处理，批大小由正式处理时的自适应逻辑调整
+            print(f"预热时内存不足，跳过: {e}")
+            return 0.0
+    
+    def _reject_blurry(self, decoded: List[Dict]) -> List[Dict]:
+        """剔除清晰度低于 blur_threshold 的图片，不再为其计算嵌入"""
+        kept = [item for item in decoded
+                if not is_blurry(item["metadata"].get("quality"), self.blur_threshold)]
+        if len(kept) < len(decoded):
+            print(f"跳过 {len(decoded) - len(kept)} 张模糊图片（清晰度低于 {self.blur_threshold}）")
+        return kept
+    
+    def _embed_decoded(self, decoded: List[Dict], sizer: AdaptiveBatchSizer) -> np.ndarray:
+        """
+        计算一批已解码图片的嵌入，内存不足时按更小的批大小分块重试
         
-        return metadata
+        Args:
+            decoded: 解码结果列表
+            sizer: 批大小控制器
+            
+        Returns:
+            特征向量数组
+        """
+        if not decoded:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        while True:
+            chunk_size = min(len(decoded), sizer.batch_size)
+            try:
+                chunks = [
+                    self.backend.embed_images(
+                        [Image.fromarray(item["image"]) for item in decoded[i:i + chunk_size]]
+                    )
+                    for i in range(0, len(decoded), chunk_size)
+                ]
+                return np.concatenate(chunks, axis=0)
+            except Exception as e:
+                if is_memory_error(e) and sizer.on_memory_error():
+                    continue
+                raise
+    
+    def _extract_metadata(self, image_path: str) -> Dict:
+        """
+        提取图像元数据
+        
+        Args:
+            image_path: 图片路径
+            
+        Returns:
+            元数据字典
+        """
+        return extract_metadata(image_path)
     
     def _parse_exif(self, exif: Dict) -> Dict:
         """解析EXIF数据"""
-        exif_data = {}
-        # EXIF标签映射
-        exif_tags = {
-            271: "make",
-            272: "model",
-            306: "datetime",
-            33434: "exposure_time",
-            33437: "f_number",
-            34855: "iso",
-        }
-        
-        for tag_id, tag_name in exif_tags.items():
-            if tag_id in exif:
-                exif_data[tag_name] = str(exif[tag_id])
-        
-        return exif_data
+        return parse_exif(exif)
     
     def analyze_composition(self, image_path: str) -> Dict:
         """
@@ -136,56 +368,28 @@ class ImageFeatureExtractor:
         Returns:
             构图特征字典
         """
-        composition = {
-            "rule_of_thirds": False,
-            "center_composition": False,
-            "symmetry": False,
-            "aspect_ratio": 1.0
-        }
-        
         try:
-            img = cv2.imread(image_path)
-            if img is None:
-                return composition
-            
-            height, width = img.shape[:2]
-            composition["aspect_ratio"] = width / height if height > 0 else 1.0
-            
-            # 转换为灰度图进行构图分析
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
-            # 检测对称性（简化版）
-            left_half = gray[:, :width//2]
-            right_half = cv2.flip(gray[:, width//2:], 1)
-            right_half = right_half[:, :left_half.shape[1]]
-            
-            if left_half.shape == right_half.shape:
-                diff = cv2.absdiff(left_half, right_half)
-                symmetry_score = 1 - (np.mean(diff) / 255.0)
-                composition["symmetry"] = symmetry_score > 0.7
-            
-            # 中心构图检测（简化版）
-            center_region = gray[int(height*0.4):int(height*0.6), int(width*0.4):int(width*0.6)]
-            edge_region = np.concatenate([
-                gray[:int(height*0.3), :].flatten(),
-                gray[int(height*0.7):, :].flatten(),
-                gray[:, :int(width*0.3)].flatten(),
-                gray[:, int(width*0.7):].flatten()
-            ])
-            
-            if len(edge_region) > 0 and len(center_region) > 0:
-                center_brightness = np.mean(center_region)
-                edge_brightness = np.mean(edge_region)
-                composition["center_composition"] = center_brightness > edge_brightness * 1.2
-            
-            # 三分法检测（简化版）
-            # 检查是否有明显的主体在三分线附近
-            third_points = [width//3, width*2//3, height//3, height*2//3]
-            composition["rule_of_thirds"] = True  # 简化实现
-        
+            features = composition_features(load_gray_thumbnail(
+                image_path, self.composition_size, self.composition_thumbnails
+            ))
         except Exception as e:
             print(f"构图分析失败 {image_path}: {e}")
+            features = np.full(1, np.nan, dtype=np.float32)
+        return composition_to_dict(features)
+    
+    def analyze_composition_batch(self, image_paths: List[str]) -> np.ndarray:
+        """
+        批量分析构图特征（缩略图缓存 + 进程池）
         
-        return composition
+        Args:
+            image_paths: 图片路径列表
+            
+        Returns:
+            (N, 6) 的构图特征数组，列见 composition.COMPOSITION_FEATURES，失败的图片为 NaN
+        """
+        return analyze_composition_batch(
+            image_paths, self.composition_size, self.composition_thumbnails,
+            workers=self.composition_workers
+        )
 
 
@@ -3,18 +3,25 @@
 生成HTML、PDF和文件夹结构三种格式的作品集
 """
 
+import hashlib
 import json
+import multiprocessing
 import os
 import shutil
-from typing import List, Dict
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple
 from pathlib import Path
-from jinja2 import Template
+from jinja2 import Environment
 from datetime import datetime
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
+from pypdf import PdfReader, PdfWriter
+
+from .checkpoint import cluster_results_to_json, cluster_results_from_json
+from .cluster_diff import align_cluster_ids, compute_cluster_diff
+from .file_copier import CopyEngine
+from .metadata_store import MetadataStore
+from .pdf_worker import render_pdf_cover, render_pdf_section
+from .thumbnail_cache import create_thumbnail_cache
 
 
 class GalleryGenerator:
@@ -34,16 +41,45 @@ class GalleryGenerator:
         self.default_output_dir = output_config.get("default_output_dir", "outputs/gallery")
         self.html_template_path = output_config.get("html_template", "outputs/html_template.html")
         self.styles_path = output_config.get("styles", "outputs/styles.css")
+        self.html_page_size = output_config.get("html_page_size", 200)
+        self.html_preview_count = output_config.get("html_preview_count", 20)
+        self.pdf_workers = output_config.get("pdf_workers", 0)
+        self.copy_workers = output_config.get("copy_workers", 16)
+        self.copy_buffer_mb = output_config.get("copy_buffer_mb", 8)
+        self.html_thumbnail_size = output_config.get("html_thumbnail_size", 512)
+        self.pdf_thumbnail_size = output_config.get("pdf_thumbnail_size", 1024)
+        # 同时生成的作品集数量（批量模式并行处理多个文件夹时由调用方设置），
+        # PDF 渲染进程和复制线程按此数量均分，总数不随文件夹并行数成倍增长
+        self.concurrent_outputs = 1
+        
+        # 每个类别按质量得分排序，可只输出得分最高的若干张
+        quality_config = self.config.get("quality", {})
+        self.rank_by_quality = quality_config.get("rank", True)
+        self.max_images_per_cluster = quality_config.get("max_images_per_cluster", 0)
+        
+        # HTML 缩略图和 PDF 插图直接取自缩略图缓存
+        self.thumbnail_cache = create_thumbnail_cache(self.config)
+        
+        # 模板环境和编译结果在多次生成之间复用
+        self._jinja_env = Environment()
+        self._template_cache = {}
     
     def generate_all(self, cluster_results: Dict, output_dir: str = None, 
-                     formats: List[str] = None) -> Dict:
+                     formats: List[str] = None, checkpoint=None) -> Dict:
         """
         生成所有格式的作品集
         
+        输出目录中保存了上一次的聚类结果时，会先将类别 ID 与上次对齐
+        （不修改传入的 cluster_results，需要保存对齐后编号的调用方应先调用 align_with_output），
+        再根据差异只更新受影响的文件、分页和章节。
+        各类别的图片按质量得分从高到低输出（预览图和 PDF 取每类排在最前的图片），
+        配置了 max_images_per_cluster 时只输出得分最高的若干张。
+        
         Args:
             cluster_results: 聚类结果字典
             output_dir: 输出目录
             formats: 要生成的格式列表 ['html', 'pdf', 'folder']
+            checkpoint: 运行检查点（RunCheckpoint），已生成的格式会被跳过
             
         Returns:
             生成结果字典
@@ -56,74 +92,309 @@ class GalleryGenerator:
         
         os.makedirs(output_dir, exist_ok=True)
         
-        results = {}
+        # 读取上一次输出时的聚类结果，对齐类别ID并计算差异
+        state = self._load_output_state(output_dir)
+        previous = None
+        if state:
+            previous = state["cluster_results"]
+            cluster_results = align_cluster_ids(previous, cluster_results)
         
-        if 'html' in formats:
-            html_path = self.generate_html(cluster_results, output_dir)
-            results['html'] = html_path
+        # 排序和筛选只影响输出，调用方的聚类结果保持完整
+        cluster_results = self._select_by_quality(cluster_results)
+        if state:
+            diff = compute_cluster_diff(previous, cluster_results)
+            print(f"聚类差异: 新增 {len(diff['added'])} 张，删除 {len(diff['removed'])} 张，"
+                  f"移动 {len(diff['moved'])} 张，改名 {len(diff['renamed'])} 个类别")
         
-        if 'pdf' in formats:
-            pdf_path = self.generate_pdf(cluster_results, output_dir)
-            results['pdf'] = pdf_path
+        generators = {
+            'html': self.generate_html,
+            'pdf': self.generate_pdf,
+            'folder': self.generate_folder_structure,
+        }
         
-        if 'folder' in formats:
-            folder_path = self.generate_folder_structure(cluster_results, output_dir)
-            results['folder'] = folder_path
+        results = {}
+        for output_format, generate in generators.items():
+            if output_format not in formats:
+                continue
+            
+            if checkpoint is not None:
+                done_path = checkpoint.get_generated(output_format, output_dir, cluster_results)
+                if done_path:
+                    results[output_format] = done_path
+                    continue
+            
+            # 只有上次也生成过的格式才能增量更新
+            format_previous = previous if state and output_format in state["formats"] else None
+            results[output_format] = generate(cluster_results, output_dir, previous=format_previous)
+            
+            if checkpoint is not None:
+                checkpoint.mark_format_done(
+                    output_format, output_dir, results[output_format], cluster_results
+                )
         
+        self._save_output_state(output_dir, cluster_results, list(results.keys()))
         return results
     
-    def generate_html(self, cluster_results: Dict, output_dir: str) -> str:
+    def _select_by_quality(self, cluster_results: Dict) -> Dict:
+        """
+        按质量得分对各类别的图片排序（得分高的在前），并按 max_images_per_cluster 截取
+        
+        Args:
+            cluster_results: 聚类结果字典（metadata 中带有质量列时才排序）
+            
+        Returns:
+            新的聚类结果字典（浅拷贝），没有质量信息且不截取时原样返回
+        """
+        metadata = cluster_results.get("metadata")
+        scores = None
+        if self.rank_by_quality and isinstance(metadata, MetadataStore) and len(metadata):
+            column = metadata.columns["quality_score"]
+            if not np.isnan(column).all():
+                scores = dict(zip(metadata.paths(), np.nan_to_num(column, nan=-1.0).tolist()))
+        limit = int(self.max_images_per_cluster or 0)
+        if scores is None and limit <= 0:
+            return cluster_results
+        
+        clusters = {}
+        cluster_info = {}
+        for cluster_id, image_paths in cluster_results['clusters'].items():
+            paths = list(image_paths)
+            if scores is not None:
+                paths.sort(key=lambda path: -scores.get(path, -1.0))
+            info = cluster_results['cluster_info'].get(cluster_id, {})
+            if 0 < limit < len(paths):
+                paths = paths[:limit]
+                info = dict(info, count=len(paths))
+            clusters[cluster_id] = paths
+            cluster_info[cluster_id] = info
+        
+        return dict(cluster_results, clusters=clusters, cluster_info=cluster_info)
+    
+    def align_with_output(self, cluster_results: Dict, output_dir: str = None) -> Dict:
+        """
+        将聚类结果的类别 ID 与输出目录中上一次的结果对齐
+        
+        在保存检查点和运行记录之前调用，使保存的编号与生成的作品集一致。
+        
+        Args:
+            cluster_results: 聚类结果字典
+            output_dir: 输出目录
+            
+        Returns:
+            对齐后的聚类结果（新字典），输出目录中没有上一次的结果时原样返回
+        """
+        state = self._load_output_state(output_dir or self.default_output_dir)
+        if not state:
+            return cluster_results
+        return align_cluster_ids(state["cluster_results"], cluster_results)
+    
+    def _output_state_path(self, output_dir: str) -> str:
+        return os.path.join(output_dir, ".gallery_state.json")
+    
+    def _load_output_state(self, output_dir: str) -> Dict:
+        """
+        读取输出目录中保存的上一次聚类结果
+        
+        Returns:
+            {"cluster_results": 聚类结果, "formats": 与之同步的格式列表}，不存在或损坏时返回空字典
+        """
+        state_path = self._output_state_path(output_dir)
+        if not os.path.exists(state_path):
+            return {}
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return {
+                "cluster_results": cluster_results_from_json(state["cluster_results"]),
+                "formats": state.get("formats", []),
+            }
+        except (OSError, ValueError, KeyError) as e:
+            print(f"读取输出状态失败 {state_path}: {e}")
+            return {}
+    
+    def _save_output_state(self, output_dir: str, cluster_results: Dict, formats: List[str]):
+        """保存本次输出对应的聚类结果，未重新生成的格式视为已过期"""
+        state_path = self._output_state_path(output_dir)
+        state = {
+            "cluster_results": cluster_results_to_json({
+                key: cluster_results[key]
+                for key in ("clusters", "cluster_info", "parents")
+                if key in cluster_results
+            }),
+            "formats": formats,
+            "updated": datetime.now().isoformat(),
+        }
+        try:
+            tmp_path = state_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, state_path)
+        except OSError as e:
+            print(f"保存输出状态失败 {state_path}: {e}")
+    
+    def generate_html(self, cluster_results: Dict, output_dir: str, previous: Dict = None) -> str:
         """
         生成HTML格式的作品集
         
+        首页 gallery.html 只展示每类的预览图，完整图片按类别分页写入 pages/ 目录，
+        同时生成 manifest.json 供页面脚本按需加载。增量运行时内容未变化的分页不会重新渲染。
+        启用缩略图缓存时，页面中显示 thumbs/ 目录下的缩略图，点击后打开原图。
+        
         Args:
             cluster_results: 聚类结果字典
             output_dir: 输出目录
+            previous: 上一次生成时的聚类结果，提供时删除已移除的图片（其余图片只在有变化时复制）
             
         Returns:
             HTML文件路径
         """
-        # 创建图片目录
+        # 创建图片目录、缩略图目录和分页目录
         images_dir = os.path.join(output_dir, "images")
+        thumbs_dir = os.path.join(output_dir, "thumbs")
+        pages_dir = os.path.join(output_dir, "pages")
         os.makedirs(images_dir, exist_ok=True)
+        os.makedirs(pages_dir, exist_ok=True)
+        if self.thumbnail_cache is not None:
+            os.makedirs(thumbs_dir, exist_ok=True)
+        
+        manifest_path = os.path.join(output_dir, "manifest.json")
+        previous_hashes = self._load_json_state(manifest_path, "HTML清单").get("page_hashes", {})
+        
+        # 图片文件名与类别无关，已复制过的图片按大小和修改时间判断是否需要更新（原图可能被就地修改）
+        if previous is not None:
+            copied_paths = {path for paths in previous['clusters'].values() for path in paths}
+            current_paths = {
+                path for paths in cluster_results['clusters'].values() for path in paths
+            }
+            for path in copied_paths - current_paths:
+                self._remove_file(os.path.join(images_dir, self._html_image_name(path)))
+                self._remove_file(os.path.join(thumbs_dir, self._html_thumb_name(path)))
+        
+        copier = self._create_copy_engine()
+        page_template, page_source = self._get_template("page", self._get_default_page_template())
+
+        template_digest = hashlib.sha1(page_source.encode("utf-8")).hexdigest()
         
         # 准备数据
         clusters_data = []
+        manifest_clusters = []
+        page_hashes = {}
+        rendered_count = 0
         for cluster_id, image_paths in cluster_results['clusters'].items():
             cluster_info = cluster_results['cluster_info'].get(cluster_id, {})
+            cluster_name = cluster_info.get("name", f"类别 {cluster_id}")
             
-            # 复制图片到输出目录
+            # 复制图片到输出目录（后台并发复制）
             cluster_images = []
-            for img_path in image_paths[:20]:  # 限制每类最多20张
+            for img_path in image_paths:
                 img_name = os.path.basename(img_path)
-                dest_path = os.path.join(images_dir, f"cluster_{cluster_id}_{img_name}")
-                try:
-                    shutil.copy2(img_path, dest_path)
-                    cluster_images.append({
-                        "src": f"images/cluster_{cluster_id}_{img_name}",
-                        "alt": img_name
-                    })
-                except Exception as e:
-                    print(f"复制图片失败 {img_path}: {e}")
+                dest_name = self._html_image_name(img_path)
+                copier.submit(img_path, os.path.join(images_dir, dest_name))
+                
+                # 缩略图从缓存复制，缓存中没有且无法生成时直接显示原图
+                thumb_src = f"images/{dest_name}"
+                if self.thumbnail_cache is not None:
+                    cached_path = self.thumbnail_cache.get_or_create_path(
+                        img_path, self.html_thumbnail_size
+                    )
+                    if cached_path is not None:
+                        thumb_name = self._html_thumb_name(img_path)
+                        copier.submit(cached_path, os.path.join(thumbs_dir, thumb_name))
+                        thumb_src = f"thumbs/{thumb_name}"
+                
+                cluster_images.append({
+                    "src": f"images/{dest_name}",
+                    "thumb": thumb_src,
+                    "alt": img_name
+                })
+            
+            # 按页渲染该类别的全部图片
+            pages = self._paginate(cluster_images)
+            page_files = [
+                self._page_filename(cluster_id, number) for number in range(1, len(pages) + 1)
+            ]
+            for number, page_images in enumerate(pages, 1):
+                context = {
+                    "title": cluster_name,
+                    "description": cluster_info.get("description", ""),
+                    "count": cluster_info.get("count", len(image_paths)),
+                    "images": [
+                        {
+                            "src": "../" + image["src"],
+                            "thumb": "../" + image["thumb"],
+                            "alt": image["alt"],
+                        }
+                        for image in page_images
+                    ],
+                    "page_number": number,
+                    "page_count": len(pages),
+                    "prev_page": page_files[number - 2] if number > 1 else None,
+                    "next_page": page_files[number] if number < len(pages) else None,
+                }
+                page_file = page_files[number - 1]
+                digest = hashlib.sha1(
+                    (
+                        template_digest + json.dumps(context, ensure_ascii=False, sort_keys=True)
+                    ).encode("utf-8")
+                ).hexdigest()
+                page_hashes[page_file] = digest
+                
+                page_path = os.path.join(pages_dir, page_file)
+                if previous_hashes.get(page_file) == digest and os.path.exists(page_path):
+                    continue
+                with open(page_path, 'w', encoding='utf-8') as f:
+                    f.write(page_template.render(**context))
+                rendered_count += 1
             
             clusters_data.append({
                 "id": cluster_id,
-                "name": cluster_info.get("name", f"类别 {cluster_id}"),
+                "name": cluster_name,
                 "description": cluster_info.get("description", ""),
                 "count": cluster_info.get("count", len(image_paths)),
-                "images": cluster_images
+                "images": cluster_images[:self.html_preview_count],
+                "page": f"pages/{page_files[0]}"
+            })
+            manifest_clusters.append({
+                "id": cluster_id,
+                "name": cluster_name,
+                "count": cluster_info.get("count", len(image_paths)),
+                "parent": cluster_info.get("parent"),
+                "cover": cluster_images[0]["thumb"] if cluster_images else None,
+                "pages": [f"pages/{page_file}" for page_file in page_files]
+            })
+        
+        self._report_copy_stats(copier.wait())
+        
+        # 删除已不存在的类别或多余页码留下的旧分页
+        for page_file in previous_hashes:
+            if page_file not in page_hashes:
+                self._remove_file(os.path.join(pages_dir, page_file))
+        
+        # 分层聚类结果按大类分组
+        clusters_by_id = {cluster["id"]: cluster for cluster in clusters_data}
+        parents_data = []
+        for parent_id, parent, child_ids in self._group_clusters(cluster_results):
+            if parent is None:
+                continue
+            parents_data.append({
+                "id": parent_id,
+                "name": parent.get("name", f"大类 {parent_id}"),
+                "description": parent.get("description", ""),
+                "count": parent.get("count", 0),
+                "clusters": [clusters_by_id[cid] for cid in child_ids if cid in clusters_by_id]
             })
         
-        # 读取模板
+        # 读取模板（首页内容很小，每次都重新渲染）
         if os.path.exists(self.html_template_path):
             with open(self.html_template_path, 'r', encoding='utf-8') as f:
                 template_content = f.read()
         else:
             template_content = self._get_default_html_template()
         
-        template = Template(template_content)
+        template, _ = self._get_template("index", template_content)
         html_content = template.render(
             clusters=clusters_data,
+            parents=parents_data,
             title="图片作品集",
             generated_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         )
@@ -133,7 +404,25 @@ class GalleryGenerator:
         with open(html_path, 'w', encoding='utf-8') as f:
             f.write(html_content)
         
-        # 保存CSS文件
+        # 保存清单文件
+        manifest = {
+            "title": "图片作品集",
+            "generated_time": datetime.now().isoformat(),
+            "page_size": self.html_page_size,
+            "clusters": manifest_clusters,
+            "parents": [
+                {"id": parent["id"], "name": parent["name"], "count": parent["count"],
+                 "children": [cluster["id"] for cluster in parent["clusters"]]}
+                for parent in parents_data
+            ],
+            "page_hashes": page_hashes
+        }
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, manifest_path)
+        
+        # 保存CSS和脚本文件
         css_path = os.path.join(output_dir, "styles.css")
         if os.path.exists(self.styles_path):
             shutil.copy2(self.styles_path, css_path)
@@ -141,109 +430,216 @@ class GalleryGenerator:
             with open(css_path, 'w', encoding='utf-8') as f:
                 f.write(self._get_default_css())
         
+        with open(os.path.join(output_dir, "gallery.js"), 'w', encoding='utf-8') as f:
+            f.write(self._get_default_script())
+        
+        print(f"HTML 分页: 重新渲染 {rendered_count}/{len(page_hashes)} 页")
         return html_path
     
-    def generate_pdf(self, cluster_results: Dict, output_dir: str) -> str:
+    def _get_template(self, name: str, source: str) -> Tuple:
+        """
+        获取编译后的模板，同一模板内容只编译一次
+        
+        Args:
+            name: 模板名称
+            source: 模板源码
+            
+        Returns:
+            (模板对象, 模板源码)
+        """
+        cached = self._template_cache.get(name)
+        if cached is None or cached[1] != source:
+            cached = (self._jinja_env.from_string(source), source)
+            self._template_cache[name] = cached
+        return cached
+    
+    def _load_json_state(self, state_path: str, description: str) -> Dict:
+        """读取上一次生成时保存的 JSON 状态（HTML清单、PDF分段状态等），不存在或损坏时返回空字典"""
+        if not os.path.exists(state_path):
+            return {}
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取{description}失败 {state_path}: {e}")
+            return {}
+    
+    def _paginate(self, images: List[Dict]) -> List[List[Dict]]:
+        """按 html_page_size 分页，至少返回一页"""
+        size = max(1, int(self.html_page_size))
+        return [images[i:i + size] for i in range(0, len(images), size)] or [[]]
+    
+    def _page_filename(self, cluster_id, page_number: int) -> str:
+        """类别分页的文件名"""
+        return f"cluster_{cluster_id}_{page_number}.html"
+    
+    def _html_image_name(self, img_path: str) -> str:
+        """
+        HTML图片目录中的文件名
+        
+        以源路径的哈希作前缀，不同文件夹中的同名图片不会冲突，图片换类别后也无需重新复制
+        """
+        digest = hashlib.sha1(os.path.abspath(img_path).encode("utf-8")).hexdigest()[:10]
+        return f"{digest}_{os.path.basename(img_path)}"
+    
+    def _html_thumb_name(self, img_path: str) -> str:
+        """HTML缩略图目录中的文件名（缩略图均为JPEG）"""
+        return os.path.splitext(self._html_image_name(img_path))[0] + ".jpg"
+    
+    def generate_pdf(self, cluster_results: Dict, output_dir: str, previous: Dict = None) -> str:
         """
         生成PDF格式的作品集
         
+        每个类别的章节在进程池中渲染为单独的PDF分段（保存在 .pdf_parts/），
+        最后与封面目录合并为 gallery.pdf 并添加书签。内容未变化的分段会直接复用。
+        
         Args:
             cluster_results: 聚类结果字典
             output_dir: 输出目录
+            previous: 上一次生成时的聚类结果（与其他格式接口一致；是否重新渲染由分段的内容哈希决定，
+                      其中包含图片的大小和修改时间，就地修改过的图片也会更新）
             
         Returns:
             PDF文件路径
         """
         pdf_path = os.path.join(output_dir, "gallery.pdf")
-        doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-        story = []
-        
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#333333'),
-            spaceAfter=30,
-            alignment=1  # 居中
-        )
         
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=18,
-            textColor=colors.HexColor('#555555'),
-            spaceAfter=20
-        )
+        parts_dir = os.path.join(output_dir, ".pdf_parts")
+        os.makedirs(parts_dir, exist_ok=True)
+        parts_state_path = os.path.join(parts_dir, "parts.json")
+        parts_state = self._load_json_state(parts_state_path, "PDF分段状态")
         
-        # 标题
-        story.append(Paragraph("图片作品集", title_style))
-        story.append(Spacer(1, 0.2*inch))
-        story.append(Paragraph(
-            f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            styles['Normal']
-        ))
-        story.append(Spacer(1, 0.3*inch))
+        # 每个类别一个分段（分层结果的大类标题放在其第一个子类的分段开头）
+        sections = []
+        tasks = []
+        new_state = {}
+        for parent_id, parent, child_ids in self._group_clusters(cluster_results):
+            for position, cluster_id in enumerate(child_ids):
+                cluster_info = cluster_results['cluster_info'].get(cluster_id, {})
+                task = {
+                    "path": os.path.join(parts_dir, f"cluster_{cluster_id}.pdf"),
+                    "name": cluster_info.get("name", f"类别 {cluster_id}"),
+                    "description": cluster_info.get("description", ""),
+                    "image_paths": list(cluster_results['clusters'][cluster_id][:6]),  # 每类最多6张
+                    "parent_name": None,
+                    "parent_description": "",
+                }
+                if self.thumbnail_cache is not None:
+                    task["thumbnails"] = self.thumbnail_cache.spec
+                    task["thumbnail_size"] = self.pdf_thumbnail_size
+                if parent is not None and position == 0:
+                    task["parent_name"] = parent.get("name", f"大类 {parent_id}")
+                    task["parent_description"] = parent.get("description", "")
+                sections.append((parent_id, parent, task))
+                
+                digest = self._pdf_section_digest(task)
+                new_state[str(cluster_id)] = digest
+                if parts_state.get(str(cluster_id)) != digest or not os.path.exists(task["path"]):
+                    tasks.append(task)
         
-        # 每个聚类
-        for cluster_id, image_paths in cluster_results['clusters'].items():
-            cluster_info = cluster_results['cluster_info'].get(cluster_id, {})
-            
-            # 类别标题
-            story.append(PageBreak())
-            story.append(Paragraph(
-                cluster_info.get("name", f"类别 {cluster_id}"),
-                heading_style
-            ))
-            story.append(Paragraph(
-                cluster_info.get("description", ""),
-                styles['Normal']
-            ))
-            story.append(Spacer(1, 0.2*inch))
-            
-            # 添加图片（限制数量）
-            for img_path in image_paths[:6]:  # 每类最多6张
-                try:
-                    # 先用PIL获取原始尺寸，保持宽高比
-                    from PIL import Image as PILImage
-                    pil_img = PILImage.open(img_path)
-                    img_width, img_height = pil_img.size
-                    pil_img.close()
-                    
-                    # 计算缩放比例，保持宽高比
-                    max_width = 5 * inch
-                    max_height = 4 * inch
-                    
-                    width_ratio = max_width / img_width
-                    height_ratio = max_height / img_height
-                    ratio = min(width_ratio, height_ratio)
-                    
-                    new_width = img_width * ratio
-                    new_height = img_height * ratio
-                    
-                    # 创建RLImage时使用计算后的尺寸
-                    img = RLImage(img_path, width=new_width, height=new_height)
-                    story.append(img)
-                    story.append(Spacer(1, 0.1*inch))
-                except Exception as e:
-                    print(f"添加PDF图片失败 {img_path}: {e}")
-                    # 添加错误提示
-                    story.append(Paragraph(
-                        f"图片加载失败: {os.path.basename(img_path)}",
-                        styles['Normal']
-                    ))
-                    story.append(Spacer(1, 0.1*inch))
-        
-        doc.build(story)
+        # 所有分段及其顺序都没有变化时直接复用上一次合并的PDF
+        if (
+            not tasks
+            and list(new_state.items()) == list(parts_state.items())
+            and os.path.exists(pdf_path)
+        ):
+            return pdf_path
+        
+        self._render_pdf_parts(tasks)
+        
+        for cluster_key in parts_state:
+            if cluster_key not in new_state:
+                self._remove_file(os.path.join(parts_dir, f"cluster_{cluster_key}.pdf"))
+        
+        # 封面和目录：页码取决于封面本身的页数，页数变化时重新排版一次
+        part_pages = [len(PdfReader(task["path"]).pages) for _, _, task in sections]
+        cover_path = os.path.join(parts_dir, "cover.pdf")
+        generated_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cover_pages = 1
+        for _ in range(2):
+            toc_entries = []
+            page = cover_pages + 1
+            for (_, parent, task), pages in zip(sections, part_pages):
+                if task["parent_name"] is not None:
+                    toc_entries.append((0, task["parent_name"], page))
+                toc_entries.append((1 if parent is not None else 0, task["name"], page))
+                page += pages
+            render_pdf_cover(cover_path, generated_time, toc_entries)
+            actual_pages = len(PdfReader(cover_path).pages)
+            if actual_pages == cover_pages:
+                break
+            cover_pages = actual_pages
+        
+        # 合并并添加书签
+        writer = PdfWriter()
+        writer.append(cover_path, import_outline=False)
+        parent_bookmark = None
+        for _, parent, task in sections:
+            start_page = len(writer.pages)
+            writer.append(task["path"], import_outline=False)
+            if task["parent_name"] is not None:
+                parent_bookmark = writer.add_outline_item(task["parent_name"], start_page)
+            writer.add_outline_item(
+                task["name"], start_page,
+                parent=parent_bookmark if parent is not None else None
+            )
+        
+        tmp_path = pdf_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            writer.write(f)
+        os.replace(tmp_path, pdf_path)
+        
+        with open(parts_state_path, 'w', encoding='utf-8') as f:
+            json.dump(new_state, f)
+        
+        print(f"PDF 分段: 重新渲染 {len(tasks)}/{len(sections)} 个类别")
         return pdf_path
     
-    def generate_folder_structure(self, cluster_results: Dict, output_dir: str) -> str:
+    def _pdf_section_digest(self, task: Dict) -> str:
+        """PDF分段内容的哈希，包含图片的大小和修改时间"""
+        signatures = []
+        for img_path in task["image_paths"]:
+            try:
+                stat = os.stat(img_path)
+                signatures.append([img_path, stat.st_size, int(stat.st_mtime)])
+            except OSError:
+                signatures.append([img_path, None, None])
+        content = dict(task, image_paths=signatures)
+        return hashlib.sha1(
+            json.dumps(content, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+    
+    def _render_pdf_parts(self, tasks: List[Dict]):
+        """
+        渲染PDF分段，多个分段时使用进程池并行
+        
+        Args:
+            tasks: 分段任务列表
+        """
+        workers = min(self._worker_share(self.pdf_workers or os.cpu_count() or 1), len(tasks))
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+                ) as executor:
+                    list(executor.map(render_pdf_section, tasks))
+                return
+            except Exception as e:
+                # 进程池不可用（例如受限环境）时退回逐个渲染
+                print(f"并行生成PDF失败，改为逐个生成: {e}")
+        
+        for task in tasks:
+            render_pdf_section(task)
+    
+    def generate_folder_structure(self, cluster_results: Dict, output_dir: str,
+                                  previous: Dict = None) -> str:
         """
         生成文件夹结构
         
         Args:
             cluster_results: 聚类结果字典
             output_dir: 输出目录
+            previous: 上一次生成时的聚类结果，提供时只移动/复制/删除有变化的图片
             
         Returns:
             文件夹路径
@@ -251,26 +647,180 @@ class GalleryGenerator:
         folders_dir = os.path.join(output_dir, "folders")
         os.makedirs(folders_dir, exist_ok=True)
         
+        if previous is not None and os.path.isdir(folders_dir):
+            self._update_folder_structure(previous, cluster_results, folders_dir)
+            return folders_dir
+        
+        copier = self._create_copy_engine()
+        folder_names = self._cluster_folder_names(cluster_results)
         for cluster_id, image_paths in cluster_results['clusters'].items():
-            cluster_info = cluster_results['cluster_info'].get(cluster_id, {})
-            cluster_name = cluster_info.get("name", f"类别_{cluster_id}")
-            
-            # 清理文件夹名称（移除非法字符）
-            safe_name = "".join(c for c in cluster_name if c.isalnum() or c in (' ', '-', '_')).strip()
-            cluster_folder = os.path.join(folders_dir, safe_name)
+            cluster_folder = os.path.join(folders_dir, folder_names[cluster_id])
             os.makedirs(cluster_folder, exist_ok=True)
             
             # 复制图片
             for img_path in image_paths:
                 img_name = os.path.basename(img_path)
-                dest_path = os.path.join(cluster_folder, img_name)
-                try:
-                    shutil.copy2(img_path, dest_path)
-                except Exception as e:
-                    print(f"复制图片失败 {img_path}: {e}")
+                copier.submit(img_path, os.path.join(cluster_folder, img_name))
         
+        self._report_copy_stats(copier.wait())
         return folders_dir
     
+    def _update_folder_structure(self, previous: Dict, cluster_results: Dict, folders_dir: str):
+        """
+        根据与上一次聚类结果的差异增量更新文件夹结构
+        
+        Args:
+            previous: 上一次的聚类结果（类别ID已对齐）
+            cluster_results: 当前聚类结果
+            folders_dir: 文件夹输出根目录
+        """
+        old_names = self._cluster_folder_names(previous)
+        new_names = self._cluster_folder_names(cluster_results)
+        
+        # 删除已不存在的类别
+        for cluster_id in previous['clusters']:
+            if cluster_id not in cluster_results['clusters']:
+                shutil.rmtree(os.path.join(folders_dir, old_names[cluster_id]), ignore_errors=True)
+        
+        # 改名的类别整体移动文件夹，先移到临时名称避免互相交换名称时冲突
+        renames = []
+        for cluster_id in cluster_results['clusters']:
+            if cluster_id not in previous['clusters']:
+                continue
+            old_folder = os.path.join(folders_dir, old_names[cluster_id])
+            new_folder = os.path.join(folders_dir, new_names[cluster_id])
+            if old_folder != new_folder and os.path.isdir(old_folder):
+                tmp_folder = os.path.join(folders_dir, f".renaming_{cluster_id}")
+                os.rename(old_folder, tmp_folder)
+                renames.append((tmp_folder, new_folder))
+        
+        for tmp_folder, new_folder in renames:
+            if os.path.exists(new_folder):
+                # 同名文件夹已存在（例如名称重复的类别），合并内容
+                for entry in os.listdir(tmp_folder):
+                    os.replace(os.path.join(tmp_folder, entry), os.path.join(new_folder, entry))
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+                continue
+            os.makedirs(os.path.dirname(new_folder), exist_ok=True)
+            os.rename(tmp_folder, new_folder)
+        
+        # 类别内部只处理移出和移入的图片
+        copier = self._create_copy_engine()
+        for cluster_id, image_paths in cluster_results['clusters'].items():
+            cluster_folder = os.path.join(folders_dir, new_names[cluster_id])
+            os.makedirs(cluster_folder, exist_ok=True)
+            
+            old_paths = set(previous['clusters'].get(cluster_id, []))
+            new_paths = set(image_paths)
+            
+            kept_names = {os.path.basename(path) for path in new_paths}
+            for img_path in old_paths - new_paths:
+                img_name = os.path.basename(img_path)
+                if img_name not in kept_names:
+                    self._remove_file(os.path.join(cluster_folder, img_name))
+            
+            for img_path in image_paths:
+                copier.submit(img_path, os.path.join(cluster_folder, os.path.basename(img_path)))
+        
+        self._report_copy_stats(copier.wait())
+        
+        # 清理改名或删除后留下的空文件夹
+        for root, _, _ in os.walk(folders_dir, topdown=False):
+            if root != folders_dir and not os.listdir(root):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+    
+    def _group_clusters(self, cluster_results: Dict) -> List[Tuple]:
+        """
+        按大类分组聚类结果
+        
+        Args:
+            cluster_results: 聚类结果字典
+            
+        Returns:
+            [(大类ID, 大类信息, 子类ID列表)]；非分层结果返回一个大类信息为 None 的分组
+        """
+        parents = cluster_results.get('parents')
+        if not parents:
+            return [(None, None, list(cluster_results['clusters'].keys()))]
+        
+        return [(parent_id, parent, parent.get("children", []))
+                for parent_id, parent in parents.items()]
+    
+    def _cluster_folder_names(self, cluster_results: Dict) -> Dict:
+        """
+        各聚类对应的文件夹相对路径，分层结果为 大类/子类，重名时加序号区分
+        
+        Args:
+            cluster_results: 聚类结果字典
+            
+        Returns:
+            {聚类ID: 文件夹相对路径}
+        """
+        def safe(name: str) -> str:
+            # 清理文件夹名称（移除非法字符）
+            return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip()
+        
+        def unique(name: str, used: set) -> str:
+            result = name
+            suffix = 2
+            while result in used:
+                result = f"{name} {suffix}"
+                suffix += 1
+            used.add(result)
+            return result
+        
+        used_parents = set()
+        parent_folders = {}
+        for parent_id in sorted(cluster_results.get('parents') or {}):
+            parent = cluster_results['parents'][parent_id]
+            parent_folders[parent_id] = unique(
+                safe(parent.get("name", f"大类_{parent_id}")), used_parents
+            )
+        
+        used = set()
+        folder_names = {}
+        for cluster_id in sorted(cluster_results['clusters']):
+            cluster_info = cluster_results['cluster_info'].get(cluster_id, {})
+            folder_name = safe(cluster_info.get("name", f"类别_{cluster_id}"))
+            
+            parent_id = cluster_info.get("parent")
+            if parent_id in parent_folders:
+                folder_name = os.path.join(parent_folders[parent_id], folder_name)
+            
+            folder_names[cluster_id] = unique(folder_name, used)
+        
+        return folder_names
+    
+    def _remove_file(self, path: str):
+        """删除文件，文件不存在时忽略"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _worker_share(self, total: int) -> int:
+        """同时生成多个作品集时每个作品集分到的进程/线程数"""
+        return max(1, total // max(1, self.concurrent_outputs))
+    
+    def _create_copy_engine(self) -> CopyEngine:
+        """按配置创建并发复制引擎"""
+        return CopyEngine(
+            workers=self._worker_share(self.copy_workers),
+            buffer_size=int(self.copy_buffer_mb * 1024 * 1024)
+        )
+    
+    def _report_copy_stats(self, stats: Dict):
+        """输出复制统计"""
+        if stats["copied"] or stats["failed"]:
+            print(
+                f"复制图片: 复制 {stats['copied']} 个，跳过 {stats['skipped']} 个，"
+                f"失败 {stats['failed']} 个，{stats['bytes'] / (1024 * 1024):.1f} MB，"
+                f"{stats['throughput_mb_s']:.1f} MB/s"
+            )
+    
     def _get_default_html_template(self) -> str:
         """获取默认HTML模板"""
         return """<!DOCTYPE html>
@@ -286,8 +836,53 @@ class GalleryGenerator:
         <header>
             <h1>{{ title }}</h1>
             <p class="subtitle">生成时间: {{ generated_time }}</p>
+            <input type="search" id="gallery-search" class="gallery-search"
+                   placeholder="搜索类别...">
         </header>
         
+        <ul id="search-results" class="search-results"></ul>
+        
+        {% if parents %}
+        <nav class="categories">
+            {% for parent in parents %}
+            <div class="category-group">
+                <a href="#parent-{{ parent.id }}"
+                   class="category-link parent-link">{{ parent.name }} ({{ parent.count }})</a>
+                {% for cluster in parent.clusters %}
+                <a href="#cluster-{{ cluster.id }}"
+                   class="category-link sub-link">{{ cluster.name }} ({{ cluster.count }})</a>
+                {% endfor %}
+            </div>
+            {% endfor %}
+        </nav>
+        
+        <main>
+            {% for parent in parents %}
+            <section id="parent-{{ parent.id }}" class="parent-section">
+                <h2>{{ parent.name }}</h2>
+                <p class="cluster-description">{{ parent.description }}</p>
+                {% for cluster in parent.clusters %}
+                <section id="cluster-{{ cluster.id }}" class="cluster-section sub-section">
+                    <h3>{{ cluster.name }}</h3>
+                    <p class="cluster-description">{{ cluster.description }}</p>
+                    <div class="image-grid">
+                        {% for image in cluster.images %}
+                        <div class="image-item">
+                            <a href="{{ image.src }}"><img src="{{ image.thumb or image.src }}"
+                                alt="{{ image.alt }}" loading="lazy"></a>
+                        </div>
+                        {% endfor %}
+                    </div>
+                    {% if cluster.page %}
+                    <a href="{{ cluster.page }}"
+                       class="view-all">查看全部 {{ cluster.count }} 张</a>
+                    {% endif %}
+                </section>
+                {% endfor %}
+            </section>
+            {% endfor %}
+        </main>
+        {% else %}
         <nav class="categories">
             {% for cluster in clusters %}
             <a href="#cluster-{{ cluster.id }}" class="category-link">{{ cluster.name }} ({{ cluster.count }})</a>
@@ -302,21 +897,137 @@ class GalleryGenerator:
                 <div class="image-grid">
                     {% for image in cluster.images %}
                     <div class="image-item">
-                        <img src="{{ image.src }}" alt="{{ image.alt }}" loading="lazy">
+                        <a href="{{ image.src }}"><img src="{{ image.thumb or image.src }}"
+                            alt="{{ image.alt }}" loading="lazy"></a>
                     </div>
                     {% endfor %}
                 </div>
+                {% if cluster.page %}
+                <a href="{{ cluster.page }}" class="view-all">查看全部 {{ cluster.count }} 张</a>
+                {% endif %}
             </section>
             {% endfor %}
         </main>
+        {% endif %}
         
         <footer>
             <p>Gallery Generate Agent</p>
         </footer>
     </div>
+    <script src="gallery.js" defer></script>
 </body>
 </html>"""
     
+    def _get_default_page_template(self) -> str:
+        """获取默认的类别分页模板"""
+        return """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ title }} - 第 {{ page_number }} 页</title>
+    <link rel="stylesheet" href="../styles.css">
+</head>
+<body>
+    <div class="container">
+        <header>
+            <h1>{{ title }}</h1>
+            <p class="subtitle">{{ description }}（共 {{ count }} 张）</p>
+        </header>
+        
+        <nav class="pagination">
+            <a href="../gallery.html" class="category-link">返回首页</a>
+            {% if prev_page %}<a href="{{ prev_page }}" class="category-link">上一页</a>{% endif %}
+            <span class="page-number">{{ page_number }} / {{ page_count }}</span>
+            {% if next_page %}<a href="{{ next_page }}" class="category-link">下一页</a>{% endif %}
+        </nav>
+        
+        <main>
+            <section class="cluster-section">
+                <div class="image-grid">
+                    {% for image in images %}
+                    <div class="image-item">
+                        <a href="{{ image.src }}"><img src="{{ image.thumb or image.src }}"
+                            alt="{{ image.alt }}" loading="lazy"></a>
+                    </div>
+                    {% endfor %}
+                </div>
+            </section>
+        </main>
+        
+        <nav class="pagination">
+            {% if prev_page %}<a href="{{ prev_page }}" class="category-link">上一页</a>{% endif %}
+            <span class="page-number">{{ page_number }} / {{ page_count }}</span>
+            {% if next_page %}<a href="{{ next_page }}" class="category-link">下一页</a>{% endif %}
+        </nav>
+    </div>
+</body>
+</html>"""
+    
+    def _get_default_script(self) -> str:
+        """获取首页使用的脚本：首次搜索时才加载 manifest.json"""
+        return """(function () {
+    var input = document.getElementById('gallery-search');
+    var results = document.getElementById('search-results');
+    if (!input || !results) {
+        return;
+    }
+
+    var manifest = null;
+    var loading = null;
+
+    function loadManifest() {
+        if (!loading) {
+            loading = fetch('manifest.json')
+                .then(function (response) { return response.json(); })
+                .then(function (data) { manifest = data; })
+                .catch(function () { manifest = { clusters: [] }; });
+        }
+        return loading;
+    }
+
+    function render(query) {
+        results.innerHTML = '';
+        if (!query) {
+            return;
+        }
+        var clusters = manifest.clusters.length ? manifest.clusters : domClusters();
+        clusters.forEach(function (cluster) {
+            if (cluster.name.toLowerCase().indexOf(query) === -1) {
+                return;
+            }
+            var item = document.createElement('li');
+            var link = document.createElement('a');
+            link.href = cluster.pages && cluster.pages.length
+                ? cluster.pages[0] : '#cluster-' + cluster.id;
+            link.textContent = cluster.name + ' (' + cluster.count + ')';
+            item.appendChild(link);
+            results.appendChild(item);
+        });
+    }
+
+    // 本地 file:// 打开时浏览器可能禁止 fetch，退回到页面中的类别列表
+    function domClusters() {
+        var sections = document.querySelectorAll('.cluster-section');
+        return Array.prototype.map.call(sections, function (section) {
+            var heading = section.querySelector('h2, h3');
+            var viewAll = section.querySelector('.view-all');
+            return {
+                id: section.id.replace('cluster-', ''),
+                name: heading ? heading.textContent : '',
+                count: section.querySelectorAll('.image-item').length,
+                pages: viewAll ? [viewAll.getAttribute('href')] : []
+            };
+        });
+    }
+
+    input.addEventListener('focus', loadManifest);
+    input.addEventListener('input', function () {
+        var query = input.value.trim().toLowerCase();
+        loadManifest().then(function () { render(query); });
+    });
+})();"""
+    
     def _get_default_css(self) -> str:
         """获取默认CSS样式"""
         return """* {
@@ -430,6 +1141,80 @@ header h1 {
     opacity: 0.9;
 }
 
+.category-group {
+    display: flex;
+    flex-wrap: wrap;
+    align-items: center;
+    gap: 8px;
+    width: 100%;
+}
+
+.sub-link {
+    padding: 4px 12px;
+    font-size: 0.9em;
+    background: #a3b1f5;
+}
+
+.parent-section {
+    margin-bottom: 60px;
+}
+
+.parent-section > h2 {
+    color: #764ba2;
+    font-size: 2.2em;
+    margin-bottom: 10px;
+}
+
+.sub-section {
+    margin-bottom: 30px;
+}
+
+.sub-section h3 {
+    color: #667eea;
+    margin-bottom: 10px;
+    font-size: 1.6em;
+}
+
+.gallery-search {
+    margin-top: 15px;
+    padding: 8px 16px;
+    width: 60%;
+    max-width: 400px;
+    border: none;
+    border-radius: 20px;
+    font-size: 1em;
+}
+
+.search-results {
+    list-style: none;
+    margin-bottom: 20px;
+}
+
+.search-results a {
+    color: #667eea;
+    text-decoration: none;
+}
+
+.view-all {
+    display: inline-block;
+    margin-top: 15px;
+    color: #667eea;
+    text-decoration: none;
+    font-weight: bold;
+}
+
+.pagination {
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    gap: 10px;
+    margin: 20px 0;
+}
+
+.page-number {
+    color: #666;
+}
+
 footer {
     text-align: center;
     padding: 20px;
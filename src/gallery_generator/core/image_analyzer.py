@@ -5,37 +5,126 @@
 
 import os
 import json
-from typing import List, Dict, Optional
+import itertools
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from typing import List, Dict, Iterator, Optional
 from pathlib import Path
 
+from PIL import Image
+
+from gallery_generator.core.catalog import LibraryCatalog
 from gallery_generator.core.feature_extractor import ImageFeatureExtractor
-from gallery_generator.core.classifier import ImageClassifier
+from gallery_generator.core.checkpoint import ClusterResultsHandle, RunCheckpoint, default_run_dir
+from gallery_generator.core.classifier import ImageClassifier, cluster_centroids
+from gallery_generator.core.distributed import DEFAULT_SHARD_SIZE, ShardQueue, open_queue
 from gallery_generator.core.gallery_generator import GalleryGenerator
+from gallery_generator.core.image_decoder import decode_image
+from gallery_generator.core.precision import check_precision_accuracy
+from gallery_generator.core.vector_index import VectorIndex
+
+
+# 批量模式默认同时处理的文件夹数（每个文件夹的聚类和PDF渲染本身已经是多线程/多进程）
+DEFAULT_BATCH_WORKERS = 4
 
 
 class ImageAnalyzer:
     """图像分析器主类"""
     
-    def __init__(self, config_path: str = "config.json"):
+    def __init__(self, config_path: str = "config.json", backend=None):
         """
         初始化图像分析器
         
         Args:
             config_path: 配置文件路径
+            backend: 已创建的嵌入后端（服务模式中多个分析器共用），None 时按配置创建
         """
         self.config_path = config_path
         with open(config_path, 'r', encoding='utf-8') as f:
             self.config = json.load(f)
         
-        # 初始化各个模块
-        self.feature_extractor = ImageFeatureExtractor(config_path)
-        self.classifier = ImageClassifier(config_path)
+        # 初始化各个模块（分类器与特征提取器共用同一个嵌入模型，只加载一次）
+        self.feature_extractor = ImageFeatureExtractor(config_path, backend=backend)
+        self.classifier = ImageClassifier(config_path, backend=self.feature_extractor.backend)
         self.gallery_generator = GalleryGenerator(config_path)
         
         # 支持的图片格式
         self.supported_formats = set(
             self.config.get("supported_formats", [".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"])
         )
+        
+        # 相似图片检索索引（首次使用时加载）
+        self.index_config = self.config.get("index", {})
+        self._vector_index = None
+        
+        # 流式处理（内存占用不随图片数量增长）
+        self.streaming_config = self.config.get("streaming", {})
+        
+        # 图库目录（跨运行复用特征，记录运行历史，首次使用时打开）
+        self.catalog_config = self.config.get("catalog", {})
+        self._catalog = None
+        
+        # 最近一次聚类的特征来源和结果，用于交互式重新聚类（recluster）
+        self._session = None
+    
+    def warm_up(self) -> float:
+        """
+        预热模型：推理一批空白图片并预先计算类别关键词的文本特征
+        
+        使第一批真实图片不再承担首次推理的一次性开销，适合在界面启动时于后台线程调用。
+        配置 model.warmup 为 false 时跳过。
+        
+        Returns:
+            预热耗时（秒）
+        """
+        model_config = self.config.get("model", {})
+        if not model_config.get("warmup", True):
+            return 0.0
+        start = time.perf_counter()
+        self.feature_extractor.warm_up(model_config.get("warmup_batch_size", 0))
+        self.classifier.keyword_features()
+        return time.perf_counter() - start
+    
+    def share_resources(self, other: "ImageAnalyzer"):
+        """
+        与另一个分析器共用图库目录和检索索引（服务模式中各工作线程的分析器）
+        
+        Args:
+            other: 提供资源的分析器
+        """
+        self._catalog = other.catalog
+        if self.index_config.get("enabled", True):
+            self._vector_index = other.vector_index
+    
+    @property
+    def catalog(self) -> Optional[LibraryCatalog]:
+        """图库目录，未启用时为 None"""
+        if not self.catalog_config.get("enabled", True):
+            return None
+        if self._catalog is None:
+            cache_dir = self.config.get("cache", {}).get("dir", ".gallery_cache")
+            self._catalog = LibraryCatalog(
+                self.catalog_config.get("dir", os.path.join(cache_dir, "catalog")),
+                batch_size=self.catalog_config.get("batch_size", 500)
+            )
+        return self._catalog
+    
+    @property
+    def vector_index(self) -> VectorIndex:
+        """相似度检索索引"""
+        if self._vector_index is None:
+            cache_dir = self.config.get("cache", {}).get("dir", ".gallery_cache")
+            self._vector_index = VectorIndex(
+                self.index_config.get("dir", os.path.join(cache_dir, "index")),
+                kind=self.index_config.get("kind", "ivf"),
+                nprobe=self.index_config.get("nprobe", 16),
+                embedding_key=self.feature_extractor.embedding_key
+            )
+        return self._vector_index
     
     def scan_images(self, folder_path: str) -> List[str]:
         """
@@ -47,10 +136,20 @@ class ImageAnalyzer:
         Returns:
             图片路径列表
         """
-        image_paths = []
+        return list(self.iter_images(folder_path))
+    
+    def iter_images(self, folder_path: str) -> Iterator[str]:
+        """
+        逐个产生文件夹中的图片路径，不在内存中保存完整列表
         
+        Args:
+            folder_path: 文件夹路径
+            
+        Yields:
+            图片路径
+        """
         if not os.path.isdir(folder_path):
-            return image_paths
+            return
         
         for root, dirs, files in os.walk(folder_path):
             for file in files:
@@ -58,18 +157,36 @@ class ImageAnalyzer:
                 file_ext = os.path.splitext(file)[1].lower()
                 
                 if file_ext in self.supported_formats:
-                    image_paths.append(file_path)
-        
-        return image_paths
+                    yield file_path
+    
+    def check_precision(self, folder_path: str, precision: str, sample_size: int = 200) -> Dict:
+        """
+        在文件夹的样本图片上比较指定精度与 fp32 的聚类一致性
+
+        Args:
+            folder_path: 样本图片所在文件夹
+            precision: 待检查的精度 bf16 / fp16 / int8
+            sample_size: 抽样数量
+
+        Returns:
+            检查结果字典（adjusted_rand_index 越接近 1 表示聚类分配越一致）
+        """
+        image_paths = self.scan_images(folder_path)
+        return check_precision_accuracy(
+            image_paths, self.config.get("model", {}), precision, sample_size
+        )
     
     def analyze_and_cluster(self, image_paths: List[str], 
-                          progress_callback=None) -> Dict:
+                          progress_callback=None, checkpoint: RunCheckpoint = None,
+                          output_dir: str = None) -> Dict:
         """
         分析图片并进行聚类
         
         Args:
             image_paths: 图片路径列表
             progress_callback: 进度回调函数 (current, total, message)
+            checkpoint: 运行检查点，提供时从中恢复已完成的批次和聚类结果
+            output_dir: 将要生成作品集的输出目录，提供时类别 ID 在保存之前与上一次的输出对齐
             
         Returns:
             聚类结果字典
@@ -82,30 +199,162 @@ class ImageAnalyzer:
                 "n_clusters": 0
             }
         
-        # 提取特征
-        if progress_callback:
-            progress_callback(0, len(image_paths), "正在提取图像特征...")
+        # 检查点中已有聚类结果时直接使用
+        if checkpoint is not None:
+            cluster_results = checkpoint.load_clusters()
+            if cluster_results is not None:
+                self._session = {"cluster_results": cluster_results, "checkpoint": checkpoint}
+                if progress_callback:
+                    progress_callback(len(image_paths), len(image_paths), "已从检查点恢复聚类结果")
+                return cluster_results
         
-        features, valid_paths, metadata_list = self.feature_extractor.extract_image_features(
-            image_paths
+        features, valid_paths, metadata = self._extract_features(
+            image_paths, progress_callback, checkpoint
         )
         
-        if progress_callback:
-            progress_callback(len(image_paths), len(image_paths), "特征提取完成，正在进行聚类...")
+        if not valid_paths:
+            return {
+                "labels": [],
+                "clusters": {},
+                "cluster_info": {},
+                "n_clusters": 0
+            }
         
         # 聚类
-        cluster_results = self.classifier.cluster_images(features, valid_paths)
+        cluster_results = self.classifier.cluster_images(features, valid_paths, metadata)
+        
+        # 添加元数据（列式存储，与 valid_paths 按行对应）
+        cluster_results['metadata'] = metadata
+        if output_dir is not None:
+            cluster_results = self.gallery_generator.align_with_output(cluster_results, output_dir)
         
-        # 添加元数据
-        cluster_results['metadata'] = metadata_list
+        # 保留特征矩阵，调整聚类参数时无需重新提取
+        self._session = {"cluster_results": cluster_results, "features": features,
+                         "paths": valid_paths, "metadata": metadata}
+        
+        if checkpoint is not None:
+            checkpoint.save_clusters(cluster_results)
         
         if progress_callback:
             progress_callback(len(image_paths), len(image_paths), "分析完成！")
         
         return cluster_results
     
+    def _extract_features(self, image_paths: List[str], progress_callback=None,
+                          checkpoint: RunCheckpoint = None):
+        """
+        提取特征：图库目录中未变化的图片直接复用，其余图片分批提取后写入检索索引和图库目录
+        
+        Returns:
+            (特征数组, 有效路径列表, 列式元数据)，按 image_paths 的顺序排列
+        """
+        catalog = self.catalog
+        model_key = self.feature_extractor.embedding_key
+        cached = catalog.lookup_features(image_paths, model_key) if catalog is not None else None
+        cached_positions = cached[0] if cached else {}
+        cached_lookup = None
+        if cached_positions:
+            print(f"图库目录中 {len(cached_positions)} 张图片未变化，复用已有特征")
+            
+            def cached_lookup(paths):
+                # 从本次开始时查到的特征中取出该批命中的部分
+                hits = [path for path in paths if path in cached_positions]
+                rows = np.asarray([cached_positions[path] for path in hits], dtype=np.int64)
+                return (
+                    {path: i for i, path in enumerate(hits)},
+                    cached[1][rows],
+                    cached[2].subset(rows),
+                )
+        
+        if progress_callback:
+            progress_callback(0, len(image_paths), "正在提取图像特征...")
+        
+        # 复用的特征在各批次内按扫描顺序合并，检查点的批次位置对应完整的 image_paths
+        features, valid_paths, metadata = self.feature_extractor.extract_image_features(
+            image_paths, checkpoint, progress_callback, cached_lookup
+        )
+        
+        if progress_callback:
+            progress_callback(len(image_paths), len(image_paths), "特征提取完成，正在进行聚类...")
+        
+        # 新提取的特征增量写入检索索引和图库目录
+        rows = np.asarray(
+            [row for row, path in enumerate(valid_paths) if path not in cached_positions],
+            dtype=np.int64,
+        )
+        if len(rows):
+            new_paths = [valid_paths[row] for row in rows]
+            if self.index_config.get("enabled", True):
+                self.vector_index.add(features[rows], new_paths)
+            if catalog is not None:
+                catalog.record_features(new_paths, features[rows], metadata.subset(rows), model_key)
+        return features, valid_paths, metadata
+    
+    def search_similar(self, image_path: str, k: int = 10) -> List[Dict]:
+        """
+        以图搜图：查找与给定图片最相似的已索引图片
+        
+        Args:
+            image_path: 查询图片路径（不要求已在索引中）
+            k: 返回数量
+            
+        Returns:
+            [{"path": 图片路径, "score": 余弦相似度}]，按相似度降序
+        """
+        query = self.vector_index.get_vector(image_path)
+        if query is None:
+            thumbnail_cache = self.feature_extractor.thumbnail_cache
+            decoded = decode_image(
+                image_path, thumbnails=thumbnail_cache.spec if thumbnail_cache is not None else None
+            )
+            query = self.feature_extractor.backend.embed_images(
+                [Image.fromarray(decoded["image"])]
+            )[0]
+        
+        return [{"path": path, "score": score}
+                for path, score in self.vector_index.search(query, k)]
+    
+    def get_thumbnail(self, image_path: str, size: int = 128) -> Optional[Image.Image]:
+        """
+        读取用于预览的缩略图（优先读取缩略图缓存）
+        
+        Args:
+            image_path: 图片路径
+            size: 最长边
+            
+        Returns:
+            PIL 图片，读取失败时返回 None
+        """
+        thumbnail_cache = self.feature_extractor.thumbnail_cache
+        if thumbnail_cache is not None:
+            return thumbnail_cache.get_or_create(image_path, size)
+        try:
+            with Image.open(image_path) as img:
+                img.draft("RGB", (size, size))
+                thumbnail = img.convert("RGB")
+            thumbnail.thumbnail((size, size))
+            return thumbnail
+        except Exception as e:
+            print(f"读取缩略图失败 {image_path}: {e}")
+            return None
+    
+    def search_text(self, query: str, k: int = 10) -> List[Dict]:
+        """
+        以文搜图：查找与文本描述最匹配的已索引图片，例如 "sunset over sea"
+        
+        Args:
+            query: 文本描述
+            k: 返回数量
+            
+        Returns:
+            [{"path": 图片路径, "score": 余弦相似度}]，按相似度降序
+        """
+        text_features = self.feature_extractor.backend.get_text_features([query])
+        return [{"path": path, "score": score}
+                for path, score in self.vector_index.search(text_features[0], k)]
+    
     def generate_gallery(self, cluster_results: Dict, output_dir: str = None,
-                        formats: List[str] = None) -> Dict:
+                        formats: List[str] = None, checkpoint: RunCheckpoint = None) -> Dict:
         """
         生成作品集
         
@@ -113,6 +362,7 @@ class ImageAnalyzer:
             cluster_results: 聚类结果字典
             output_dir: 输出目录
             formats: 输出格式列表 ['html', 'pdf', 'folder']
+            checkpoint: 运行检查点，已生成的格式会被跳过
             
         Returns:
             生成结果字典
@@ -120,27 +370,88 @@ class ImageAnalyzer:
         if formats is None:
             formats = ['html', 'pdf', 'folder']
         
-        return self.gallery_generator.generate_all(cluster_results, output_dir, formats)
+        return self.gallery_generator.generate_all(cluster_results, output_dir, formats, checkpoint)
     
     def process_folder(self, folder_path: str, output_dir: str = None,
-                      formats: List[str] = None, progress_callback=None) -> Dict:
+                      formats: List[str] = None, progress_callback=None,
+                      resume: bool = False, run_dir: str = None,
+                      streaming: bool = None) -> Dict:
         """
         处理整个文件夹的完整流程
         
+        特征提取进度、聚类结果和各格式的生成状态会保存到运行目录。
+        resume 为 True 时从上次中断的批次/阶段继续，并沿用上次扫描得到的图片清单。
+        
         Args:
             folder_path: 输入文件夹路径
             output_dir: 输出目录
             formats: 输出格式列表
             progress_callback: 进度回调函数
+            resume: 是否从检查点继续
+            run_dir: 运行目录，默认为 <cache.dir>/runs/<文件夹哈希>
+            streaming: 是否使用流式模式，默认读取配置 streaming.enabled
             
         Returns:
             处理结果字典
         """
-        # 扫描图片
+        if output_dir is None:
+            output_dir = self.config.get("output", {}).get("default_output_dir", "outputs/gallery")
+        
+        if formats is None:
+            formats = ['html', 'pdf', 'folder']
+        
+        if streaming is None:
+            streaming = self.streaming_config.get("enabled", False)
+        
+        # 在图库目录中记录运行历史
+        catalog = self.catalog
+        run_id = (
+            catalog.start_run(folder_path, output_dir, formats, run_dir)
+            if catalog is not None
+            else None
+        )
+        try:
+            if streaming:
+                results = self._process_folder_streaming(
+                    folder_path, output_dir, formats, progress_callback, resume, run_dir, run_id
+                )
+            else:
+                results = self._process_folder_batch(
+                    folder_path, output_dir, formats, progress_callback, resume, run_dir, run_id
+                )
+        except BaseException as e:
+            if run_id is not None:
+                catalog.fail_run(run_id, str(e) or type(e).__name__)
+            raise
+        
+        if run_id is not None:
+            results["run_id"] = run_id
+            if not results.get("success"):
+                catalog.fail_run(run_id, results.get("message", ""))
+        return results
+    
+    def _process_folder_batch(self, folder_path: str, output_dir: str, formats: List[str],
+                              progress_callback=None, resume: bool = False,
+                              run_dir: str = None, run_id: int = None) -> Dict:
+        """非流式处理文件夹：扫描完整的图片清单后分批提取特征并聚类"""
+        checkpoint = None
+        if self.config.get("checkpoint", {}).get("enabled", True):
+            if run_dir is None:
+                cache_dir = self.config.get("cache", {}).get("dir", ".gallery_cache")
+                run_dir = default_run_dir(cache_dir, folder_path)
+            checkpoint = RunCheckpoint(run_dir)
+            if not resume:
+                checkpoint.reset()
+        
+        # 扫描图片（续跑时沿用检查点中的清单，保证批次顺序一致）
         if progress_callback:
             progress_callback(0, 100, "正在扫描图片...")
         
-        image_paths = self.scan_images(folder_path)
+        image_paths = checkpoint.load_manifest() if checkpoint is not None and resume else None
+        if image_paths is None:
+            image_paths = self.scan_images(folder_path)
+            if checkpoint is not None:
+                checkpoint.save_manifest(folder_path, image_paths)
         
         if not image_paths:
             return {
@@ -150,27 +461,583 @@ class ImageAnalyzer:
             }
         
         # 分析和聚类
-        cluster_results = self.analyze_and_cluster(image_paths, progress_callback)
+        cluster_results = self.analyze_and_cluster(
+            image_paths, progress_callback, checkpoint, output_dir
+        )
         
         # 生成作品集
         if progress_callback:
             progress_callback(100, 100, "正在生成作品集...")
         
+        gallery_results = self.generate_gallery(cluster_results, output_dir, formats, checkpoint)
+        if run_id is not None:
+            self.catalog.finish_run(
+                run_id, cluster_results, len(image_paths), gallery_results, run_dir
+            )
+        
+        return {
+            "success": True,
+            "image_count": len(image_paths),
+            "cluster_count": cluster_results.get("n_clusters", 0),
+            "cluster_results": cluster_results,
+            "gallery_paths": gallery_results,
+            "output_dir": output_dir,
+            "run_dir": run_dir
+        }
+    
+    def process_batch(self, folder_paths: List[str], output_root: str = None,
+                      formats: List[str] = None, progress_callback=None,
+                      workers: int = None) -> Dict[str, Dict]:
+        """
+        批量处理多个文件夹
+        
+        所有文件夹的图片合并为一个特征提取流（只有最后一批可能不满，图库目录和检索索引共用），
+        提取完成后按文件夹并行聚类和生成作品集，
+        每个文件夹输出到 output_root 下以文件夹名命名的目录。
+        批量模式不使用检查点；中断后重新运行时，已提取过的图片会从图库目录直接复用特征。
+        
+        Args:
+            folder_paths: 输入文件夹路径列表
+            output_root: 输出根目录，默认为 output.default_output_dir
+            formats: 输出格式列表
+            progress_callback: 进度回调函数，总数固定为 100
+                （特征提取占前 80，各文件夹的聚类和生成占后 20）；
+                回调抛出 InterruptedError 时取消尚未开始的文件夹并向上抛出
+            workers: 同时聚类和生成作品集的文件夹数，默认读取配置 batch.workers
+                （0 为 DEFAULT_BATCH_WORKERS 与 CPU 核心数中较小者）；PDF 进程数和复制线程数按此均分
+            
+        Returns:
+            {文件夹路径: 处理结果字典（与 process_folder 的返回格式相同）}
+        """
+        if output_root is None:
+            output_root = self.config.get("output", {}).get("default_output_dir", "outputs/gallery")
+        if formats is None:
+            formats = ['html', 'pdf', 'folder']
+        if workers is None:
+            workers = self.config.get("batch", {}).get("workers", 0)
+        workers = workers or min(DEFAULT_BATCH_WORKERS, os.cpu_count() or 1)
+        folder_paths = list(dict.fromkeys(folder_paths))
+        
+        if progress_callback:
+            progress_callback(0, 100, "正在扫描图片...")
+        
+        output_dirs = self._batch_output_dirs(folder_paths, output_root)
+        folder_images = {folder: self.scan_images(folder) for folder in folder_paths}
+        results = {
+            folder: {"success": False, "message": "未找到支持的图片文件", "image_count": 0}
+            for folder, image_paths in folder_images.items() if not image_paths
+        }
+        
+        # 所有文件夹的图片（去除重复路径）一起提取特征
+        all_paths = list(
+            dict.fromkeys(path for image_paths in folder_images.values() for path in image_paths)
+        )
+        if not all_paths:
+            return results
+        extract_callback = None
+        if progress_callback:
+            def extract_callback(current, total, message):
+                progress_callback(current * 80 // max(total, 1), 100, message)
+        features, valid_paths, metadata = self._extract_features(all_paths, extract_callback)
+        row_of = {path: row for row, path in enumerate(valid_paths)}
+        
+        catalog = self.catalog
+        pending = [folder for folder in folder_paths if folder not in results]
+        progress_lock = threading.Lock()
+        completed = [0]
+        
+        def report(message: str = None):
+            # 在锁内更新计数并回调，多个线程汇报的进度不会倒退；不提供 message 表示完成一个文件夹
+            with progress_lock:
+                if message is None:
+                    completed[0] += 1
+                    message = f"已完成 {completed[0]}/{len(pending)} 个文件夹"
+                if progress_callback:
+                    progress_callback(80 + completed[0] * 20 // len(pending), 100, message)
+        
+        def process_one(folder: str) -> Dict:
+            image_paths = folder_images[folder]
+            output_dir = output_dirs[folder]
+            report(f"正在处理文件夹 {folder}...")
+            run_id = catalog.start_run(folder, output_dir, formats) if catalog is not None else None
+            try:
+                rows = np.asarray(
+                    [row_of[path] for path in image_paths if path in row_of], dtype=np.int64
+                )
+                if not len(rows):
+                    result = {
+                        "success": False,
+                        "message": "没有可以读取的图片",
+                        "image_count": len(image_paths),
+                    }
+                else:
+                    folder_metadata = metadata.subset(rows)
+                    cluster_results = self.classifier.cluster_images(
+                        features[rows], [valid_paths[row] for row in rows], folder_metadata
+                    )
+                    cluster_results['metadata'] = folder_metadata
+                    cluster_results = self.gallery_generator.align_with_output(
+                        cluster_results, output_dir
+                    )
+                    gallery_results = self.generate_gallery(cluster_results, output_dir, formats)
+                    if run_id is not None:
+                        catalog.finish_run(
+                            run_id, cluster_results, len(image_paths), gallery_results
+                        )
+                    result = {
+                        "success": True,
+                        "image_count": len(image_paths),
+                        "cluster_count": cluster_results.get("n_clusters", 0),
+                        "cluster_results": cluster_results,
+                        "gallery_paths": gallery_results,
+                        "output_dir": output_dir,
+                        "run_id": run_id
+                    }
+            except InterruptedError:
+                if run_id is not None:
+                    catalog.fail_run(run_id, "任务已取消")
+                raise
+            except Exception as e:
+                print(f"处理文件夹失败 {folder}:\n{traceback.format_exc()}")
+                result = {
+                    "success": False,
+                    "message": f"处理出错: {str(e)}",
+                    "image_count": len(image_paths),
+                }
+            if run_id is not None and not result.get("success"):
+                catalog.fail_run(run_id, result.get("message", ""))
+            report()
+            return result
+        
+        workers = max(1, min(workers, len(pending) or 1))
+        self.gallery_generator.concurrent_outputs = workers
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(process_one, folder) for folder in pending]
+                try:
+                    for folder, future in zip(pending, futures):
+                        results[folder] = future.result()
+                except BaseException:
+                    # 取消尚未开始的文件夹，正在处理的文件夹在退出线程池时等待其结束
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            self.gallery_generator.concurrent_outputs = 1
+        
+        return {folder: results[folder] for folder in folder_paths}
+    
+    def shard_folder(self, folder_path: str, job_dir: str, shard_size: int = None) -> ShardQueue:
+        """
+        分布式提取的协调端：扫描文件夹并把图片清单切分为分片，写入共享作业目录
+        
+        Args:
+            folder_path: 输入文件夹路径（各工作主机上必须可以按同一路径访问）
+            job_dir: 共享作业目录
+            shard_size: 每个分片的图片数，默认读取配置 distributed.shard_size
+            
+        Returns:
+            分片队列
+        """
+        if shard_size is None:
+            shard_size = self.config.get("distributed", {}).get("shard_size", DEFAULT_SHARD_SIZE)
+        image_paths = self.scan_images(folder_path)
+        ShardQueue.create(
+            job_dir, image_paths, shard_size, self.feature_extractor.embedding_key, folder_path
+        )
+        return open_queue(job_dir, self.config)
+    
+    def process_shards(self, job_dir: str, output_dir: str = None, formats: List[str] = None,
+                       progress_callback=None, allow_partial: bool = False) -> Dict:
+        """
+        合并分布式提取的分片结果，写入检索索引和图库目录后聚类并生成作品集
+        
+        Args:
+            job_dir: 共享作业目录
+            output_dir: 输出目录
+            formats: 输出格式列表
+            progress_callback: 进度回调函数
+            allow_partial: 还有分片未完成时是否只合并已完成的部分
+            
+        Returns:
+            处理结果字典（与 process_folder 的返回格式相同）
+        """
         if output_dir is None:
             output_dir = self.config.get("output", {}).get("default_output_dir", "outputs/gallery")
-        
         if formats is None:
             formats = ['html', 'pdf', 'folder']
         
-        gallery_results = self.generate_gallery(cluster_results, output_dir, formats)
+        shard_queue = open_queue(job_dir, self.config)
+        manifest = shard_queue.manifest
+        if manifest["model_key"] != self.feature_extractor.embedding_key:
+            return {"success": False, "message": "模型配置与分片作业不一致", "image_count": 0}
+        status = shard_queue.status()
+        if not status["finished"] and not allow_partial:
+            return {
+                "success": False,
+                "message": f"还有 {status['running'] + status['pending']} 个分片未完成",
+                "image_count": manifest["image_count"]
+            }
+        for shard_id, error in shard_queue.failures().items():
+            print(f"分片 {shard_id} 失败，合并时跳过: {error}")
+        
+        if progress_callback:
+            progress_callback(0, 100, "正在合并分片...")
+        features, valid_paths, metadata = shard_queue.merge()
+        if not valid_paths:
+            return {
+                "success": False,
+                "message": "没有已完成的分片",
+                "image_count": manifest["image_count"],
+            }
+        
+        catalog = self.catalog
+        folder_path = manifest.get("folder") or job_dir
+        run_id = (
+            catalog.start_run(folder_path, output_dir, formats) if catalog is not None else None
+        )
+        try:
+            # 合并结果写入检索索引和图库目录，之后在本机处理该文件夹时可直接复用特征
+            if self.index_config.get("enabled", True):
+                self.vector_index.add(features, valid_paths)
+            if catalog is not None:
+                catalog.record_features(
+                    valid_paths, features, metadata, self.feature_extractor.embedding_key
+                )
+            
+            if progress_callback:
+                progress_callback(50, 100, "分片合并完成，正在进行聚类...")
+            cluster_results = self.classifier.cluster_images(features, valid_paths, metadata)
+            cluster_results['metadata'] = metadata
+            cluster_results = self.gallery_generator.align_with_output(cluster_results, output_dir)
+            self._session = {"cluster_results": cluster_results, "features": features,
+                             "paths": valid_paths, "metadata": metadata}
+            
+            if progress_callback:
+                progress_callback(100, 100, "正在生成作品集...")
+            gallery_results = self.generate_gallery(cluster_results, output_dir, formats)
+        except BaseException as e:
+            if run_id is not None:
+                catalog.fail_run(run_id, str(e) or type(e).__name__)
+            raise
         
+        if run_id is not None:
+            catalog.finish_run(run_id, cluster_results, manifest["image_count"], gallery_results)
         return {
             "success": True,
-            "image_count": len(image_paths),
+            "image_count": manifest["image_count"],
             "cluster_count": cluster_results.get("n_clusters", 0),
             "cluster_results": cluster_results,
             "gallery_paths": gallery_results,
-            "output_dir": output_dir
+            "output_dir": output_dir,
+            "run_id": run_id
         }
-
-
+    
+    @staticmethod
+    def _batch_output_dirs(folder_paths: List[str], output_root: str) -> Dict[str, str]:
+        """批量处理时每个文件夹的输出目录（文件夹名重复时追加序号）"""
+        output_dirs = {}
+        used = set()
+        for folder in folder_paths:
+            name = os.path.basename(os.path.normpath(folder)) or "gallery"
+            candidate = name
+            suffix = 2
+            while candidate in used:
+                candidate = f"{name}_{suffix}"
+                suffix += 1
+            used.add(candidate)
+            output_dirs[folder] = os.path.join(output_root, candidate)
+        return output_dirs
+    
+    def list_runs(self, folder_path: str = None, limit: int = 20) -> List[Dict]:
+        """
+        列出图库目录中已完成的历史运行
+        
+        Args:
+            folder_path: 只列出该文件夹的运行
+            limit: 最多返回数量
+            
+        Returns:
+            运行摘要列表（最新的在前），未启用图库目录时为空
+        """
+        catalog = self.catalog
+        return catalog.list_runs(folder_path, limit) if catalog is not None else []
+    
+    def open_run(self, run_id: int) -> Dict:
+        """
+        直接打开一次历史运行的结果，不重新处理
+        
+        Args:
+            run_id: 运行ID
+            
+        Returns:
+            处理结果字典（与 process_folder 的返回格式相同）
+        """
+        catalog = self.catalog
+        results = catalog.load_run(run_id) if catalog is not None else None
+        if results is None:
+            return {
+                "success": False,
+                "message": f"未找到历史运行 {run_id}",
+                "image_count": 0
+            }
+        # 重新聚类时从图库目录读取特征
+        self._session = {"cluster_results": results["cluster_results"]}
+        return results
+    
+    def recluster(self, n_clusters=None, algorithm: str = None) -> Dict:
+        """
+        用上一次的特征重新聚类（不重新扫描、解码和提取特征，也不生成作品集）
+        
+        KMeans 以上一次的类别中心热启动；作品集需要时再调用 generate_gallery 生成。
+        
+        Args:
+            n_clusters: 聚类数量（"auto" 为自动确定），None 时沿用当前设置
+            algorithm: 聚类算法 kmeans/dbscan，None 时沿用当前设置
+            
+        Returns:
+            处理结果字典（不含 gallery_paths），elapsed 为聚类耗时（秒）
+        """
+        if self._session is None:
+            return {
+                "success": False,
+                "message": "没有可以重新聚类的结果，请先处理文件夹",
+                "image_count": 0
+            }
+        
+        loaded = self._session_features()
+        if loaded is None:
+            return {
+                "success": False,
+                "message": "无法读取上一次的图像特征，请重新处理文件夹",
+                "image_count": 0
+            }
+        features, valid_paths, metadata = loaded
+        
+        if n_clusters is not None:
+            self.classifier.n_clusters = n_clusters
+        if algorithm is not None:
+            self.classifier.algorithm = algorithm
+        
+        start = time.perf_counter()
+        previous = self._session["cluster_results"]
+        init_centroids = previous.get("centroids")
+        if init_centroids is None:
+            # 历史结果没有保存类别中心时按上一次的分配计算
+            labels_by_path = {
+                path: cluster_id
+                for cluster_id, paths in previous.get("clusters", {}).items()
+                for path in paths
+            }
+            labels = np.asarray([labels_by_path.get(path, -1) for path in valid_paths])
+            init_centroids = cluster_centroids(features, labels) or None
+        cluster_results = self.classifier.cluster_images(
+            features, valid_paths, metadata, init_centroids=init_centroids
+        )
+        cluster_results['metadata'] = metadata
+        elapsed = time.perf_counter() - start
+        self._session["cluster_results"] = cluster_results
+        
+        return {
+            "success": True,
+            "image_count": len(valid_paths),
+            "cluster_count": cluster_results.get("n_clusters", 0),
+            "cluster_results": cluster_results,
+            "elapsed": elapsed
+        }
+    
+    def _session_features(self):
+        """
+        读取最近一次聚类使用的特征（首次读取后保留在内存中）
+        
+        Returns:
+            (特征数组, 有效路径列表, 列式元数据)，无法读取时返回 None
+        """
+        session = self._session
+        if session.get("features") is None:
+            checkpoint = session.get("checkpoint")
+            if checkpoint is not None:
+                features, valid_paths, _ = checkpoint.load_feature_matrix()
+                metadata = checkpoint.load_metadata()
+            else:
+                # 历史结果：按类别中的图片从图库目录读取特征
+                catalog = self.catalog
+                cluster_results = session["cluster_results"]
+                image_paths = [
+                    path for paths in cluster_results.get("clusters", {}).values() for path in paths
+                ]
+                if catalog is None or not image_paths:
+                    return None
+                positions, cached_features, cached_metadata = catalog.lookup_features(
+                    image_paths, self.feature_extractor.embedding_key
+                )
+                valid_paths = [path for path in image_paths if path in positions]
+                rows = np.asarray([positions[path] for path in valid_paths], dtype=np.int64)
+                features = cached_features[rows] if len(rows) else cached_features
+                metadata = cached_metadata.subset(rows)
+            if not valid_paths or len(features) != len(valid_paths):
+                return None
+            session.update(features=features, paths=valid_paths, metadata=metadata)
+        return session["features"], session["paths"], session["metadata"]
+    
+    def _process_folder_streaming(self, folder_path: str, output_dir: str, formats: List[str],
+                                  progress_callback=None, resume: bool = False,
+                                  run_dir: str = None, run_id: int = None) -> Dict:
+        """
+        流式处理文件夹
+        
+        扫描 → 解码 → 嵌入 → 写入运行目录组成生成器流水线，各阶段之间的队列长度有上限；
+        聚类时只在内存中保留紧凑的特征矩阵，返回的聚类结果为轻量句柄，元数据保留在运行目录中。
+        
+        Args:
+            folder_path: 输入文件夹路径
+            output_dir: 输出目录
+            formats: 输出格式列表
+            progress_callback: 进度回调函数（扫描未完成时总数为 0）
+            resume: 是否从检查点继续
+            run_dir: 运行目录
+            run_id: 图库目录中的运行ID
+            
+        Returns:
+            处理结果字典，cluster_results 为 ClusterResultsHandle
+        """
+        # 流式模式依赖运行目录暂存每批特征，总是使用检查点
+        if run_dir is None:
+            cache_dir = self.config.get("cache", {}).get("dir", ".gallery_cache")
+            run_dir = default_run_dir(cache_dir, folder_path)
+        checkpoint = RunCheckpoint(run_dir)
+        
+        if not resume:
+            checkpoint.reset()
+        
+        cluster_results = checkpoint.load_clusters()
+        if cluster_results is None:
+            cluster_results = self._stream_and_cluster(
+                folder_path, checkpoint, progress_callback, output_dir
+            )
+        
+        if not cluster_results or not cluster_results.get("clusters"):
+            return {
+                "success": False,
+                "message": "未找到支持的图片文件",
+                "image_count": 0
+            }
+        
+        if progress_callback:
+            progress_callback(100, 100, "正在生成作品集...")
+        
+        gallery_results = self.generate_gallery(cluster_results, output_dir, formats, checkpoint)
+        if run_id is not None:
+            self.catalog.finish_run(
+                run_id,
+                cluster_results,
+                checkpoint.state.get("image_count", 0),
+                gallery_results,
+                run_dir,
+            )
+        handle = ClusterResultsHandle(checkpoint, cluster_results)
+        del cluster_results
+        self._session = {"cluster_results": handle, "checkpoint": checkpoint}
+        
+        return {
+            "success": True,
+            "image_count": checkpoint.state.get("image_count", 0),
+            "cluster_count": handle.n_clusters,
+            "cluster_results": handle,
+            "gallery_paths": gallery_results,
+            "output_dir": output_dir,
+            "run_dir": run_dir
+        }
+    
+    def _stream_and_cluster(self, folder_path: str, checkpoint: RunCheckpoint,
+                            progress_callback=None, output_dir: str = None) -> Optional[Dict]:
+        """
+        流式提取特征（逐批写入检查点和检索索引），完成后读取紧凑的特征矩阵进行聚类，
+        类别 ID 与 output_dir 中上一次的输出对齐后再保存
+        """
+        batch_count, position = checkpoint.count_batches()
+        
+        if checkpoint.state.get("scan_done"):
+            image_paths = itertools.islice(checkpoint.iter_manifest(), position, None)
+            total = checkpoint.state.get("image_count", 0)
+        else:
+            # 扫描在上次中断时尚未完成：重新扫描，并核对已处理的部分与新的扫描顺序一致
+            checkpoint.clear_stream_manifest()
+            image_paths = self._scan_to_manifest(folder_path, checkpoint)
+            total = 0
+            processed = checkpoint.iter_processed_paths()
+            if position and any(path != next(image_paths, None) for path in processed):
+                print("文件夹内容已变化，从头开始处理")
+                checkpoint.reset()
+                batch_count, position = 0, 0
+                image_paths = self._scan_to_manifest(folder_path, checkpoint)
+        
+        if position:
+            print(f"从检查点恢复 {position} 张图片的特征")
+        
+        index_enabled = self.index_config.get("enabled", True)
+        catalog = self.catalog
+        model_key = self.feature_extractor.embedding_key
+        # 与非流式模式一样，图库目录中未变化的图片逐批复用已有特征
+        cached_lookup = (
+            (lambda paths: catalog.lookup_features(paths, model_key))
+            if catalog is not None
+            else None
+        )
+        reused = 0
+        batches = self.feature_extractor.iter_feature_batches(
+            image_paths, checkpoint, batch_count,
+            queue_size=self.streaming_config.get("decode_queue_size", 2),
+            cached_lookup=cached_lookup,
+        )
+        for batch, features, batch_valid, batch_metadata, embedded in batches:
+            position += len(batch)
+            # 只有新提取的特征写入检索索引和图库目录，复用的行已经存在
+            rows = np.flatnonzero(embedded)
+            reused += len(batch_valid) - len(rows)
+            if len(rows):
+                new_paths = [batch_valid[row] for row in rows]
+                if index_enabled:
+                    self.vector_index.add(features[rows], new_paths)
+                if catalog is not None:
+                    catalog.record_features(
+                        new_paths, features[rows], batch_metadata.subset(rows), model_key
+                    )
+            if progress_callback:
+                progress_callback(position, total, f"正在提取图像特征 ({position})...")
+        
+        if reused:
+            print(f"图库目录中 {reused} 张图片未变化，复用已有特征")
+        
+        features, valid_paths, _ = checkpoint.load_feature_matrix()
+        if not valid_paths:
+            return None
+        
+        if progress_callback:
+            progress_callback(position, position, "特征提取完成，正在进行聚类...")
+        
+        # 列式元数据占用很小，可以随聚类结果一起保存
+        metadata = checkpoint.load_metadata()
+        cluster_results = self.classifier.cluster_images(features, valid_paths, metadata)
+        del features
+        cluster_results['metadata'] = metadata
+        if output_dir is not None:
+            cluster_results = self.gallery_generator.align_with_output(cluster_results, output_dir)
+        checkpoint.save_clusters(cluster_results)
+        return cluster_results
+    
+    def _scan_to_manifest(self, folder_path: str, checkpoint: RunCheckpoint) -> Iterator[str]:
+        """边扫描边把图片清单追加写入检查点"""
+        chunk = []
+        count = 0
+        for image_path in self.iter_images(folder_path):
+            chunk.append(image_path)
+            count += 1
+            if len(chunk) >= 1000:
+                checkpoint.append_manifest(chunk)
+                chunk = []
+            yield image_path
+        
+        if chunk:
+            checkpoint.append_manifest(chunk)
+        checkpoint.finish_manifest(folder_path, count)
@@ -0,0 +1,434 @@
+"""
+图片解码模块
+在隔离的工作进程中解码图片并提取元数据，支持单文件超时、像素数限制和持久化的隔离名单
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from .decode_worker import is_io_error, worker_main
+from .quality import image_quality
+from .thumbnail_cache import ThumbnailCache
+
+
+# EXIF标签映射
+EXIF_TAGS = {
+    271: "make",
+    272: "model",
+    306: "datetime",
+    33434: "exposure_time",
+    33437: "f_number",
+    34855: "iso",
+}
+
+
+class DecodeRejected(Exception):
+    """图片被拒绝解码（例如像素数超过限制）"""
+
+
+def parse_exif(exif: Dict) -> Dict:
+    """解析EXIF数据"""
+    exif_data = {}
+    for tag_id, tag_name in EXIF_TAGS.items():
+        if tag_id in exif:
+            exif_data[tag_name] = str(exif[tag_id])
+    return exif_data
+
+
+def extract_metadata(image_path: str, img: Optional[Image.Image] = None) -> Dict:
+    """
+    提取图像元数据
+
+    Args:
+        image_path: 图片路径
+        img: 已打开的图片（尚未缩放），为 None 时重新打开
+
+    Returns:
+        元数据字典
+    """
+    metadata = {
+        "path": image_path,
+        "filename": os.path.basename(image_path),
+        "size": 0,
+        "format": "",
+        "width": 0,
+        "height": 0,
+        "modification_time": None
+    }
+
+    try:
+        # 获取文件信息
+        stat = os.stat(image_path)
+        metadata["size"] = stat.st_size
+        metadata["modification_time"] = datetime.fromtimestamp(stat.st_mtime).isoformat()
+
+        if img is None:
+            with Image.open(image_path) as opened:
+                _fill_image_metadata(metadata, opened)
+        else:
+            _fill_image_metadata(metadata, img)
+
+    except Exception as e:
+        print(f"提取元数据失败 {image_path}: {e}")
+
+    return metadata
+
+
+def _fill_image_metadata(metadata: Dict, img: Image.Image):
+    """从图片对象中读取格式、尺寸和EXIF"""
+    metadata["format"] = img.format
+    metadata["width"], metadata["height"] = img.size
+
+    # 提取EXIF信息（如果有）
+    if hasattr(img, '_getexif'):
+        exif = img._getexif()
+        if exif:
+            metadata["exif"] = parse_exif(exif)
+
+
+def decode_image(image_path: str, max_pixels: int = 100_000_000, max_side: int = 512,
+                 thumbnails: Optional[Dict] = None) -> Dict:
+    """
+    解码单张图片：检查像素数、按需降采样解码并提取元数据
+
+    Args:
+        image_path: 图片路径
+        max_pixels: 允许的最大像素数，超过则拒绝解码
+        max_side: 解码结果的最长边
+        thumbnails: 缩略图缓存配置（ThumbnailCache.spec），提供时优先读取缓存，
+            未命中时把解码结果写入缓存
+
+    Returns:
+        {"path": 路径, "image": RGB uint8 数组, "metadata": 元数据字典（含 quality 质量指标）}
+
+    Raises:
+        DecodeRejected: 像素数超过限制
+    """
+    cache = ThumbnailCache.from_spec(thumbnails) if thumbnails else None
+    cached = None
+    if cache is not None:
+        try:
+            cached = cache.get(image_path, max_side)
+        except Exception as e:
+            # 缓存不可用时照常解码原图
+            print(f"读取缩略图缓存失败 {image_path}: {e}")
+        if cached is not None:
+            # 缓存命中时只读取原图的文件头获取元数据，不解码像素
+            rgb = cached.convert("RGB")
+            rgb.thumbnail((max_side, max_side), Image.BICUBIC)
+            pixels = np.asarray(rgb, dtype=np.uint8)
+            metadata = extract_metadata(image_path)
+            metadata["quality"] = image_quality(
+                pixels, metadata.get("width", 0), metadata.get("height", 0)
+            )
+            return {"path": image_path, "image": pixels, "metadata": metadata}
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+        if width * height > max_pixels:
+            raise DecodeRejected(f"像素数 {width}x{height} 超过限制 {max_pixels}")
+
+        metadata = extract_metadata(image_path, img)
+
+        # JPEG 可在解码阶段直接降采样，避免解码全分辨率
+        img.draft("RGB", (max_side, max_side))
+        rgb = img.convert("RGB")
+        rgb.thumbnail((max_side, max_side), Image.BICUBIC)
+        pixels = np.asarray(rgb, dtype=np.uint8)
+    metadata["quality"] = image_quality(pixels, width, height)
+
+    if cache is not None:
+        try:
+            cache.put(image_path, rgb, complete=max(width, height) <= max_side)
+        except Exception as e:
+            print(f"写入缩略图缓存失败 {image_path}: {e}")
+
+    return {"path": image_path, "image": pixels, "metadata": metadata}
+
+
+class Quarantine:
+    """解码失败图片的隔离名单，按文件大小和修改时间识别同一文件"""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化隔离名单
+
+        Args:
+            path: 名单保存路径，为 None 时不持久化
+        """
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取隔离名单失败 {path}: {e}")
+
+    @staticmethod
+    def _signature(image_path: str) -> Optional[List]:
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def contains(self, image_path: str) -> bool:
+        """文件是否在隔离名单中（文件被修改后会重新尝试）"""
+        entry = self.entries.get(image_path)
+        if entry is None:
+            return False
+        return entry.get("signature") == self._signature(image_path)
+
+    def add(self, image_path: str, reason: str):
+        """加入隔离名单（文件已无法访问时不加入，否则恢复访问后也会一直被跳过）"""
+        signature = self._signature(image_path)
+        if signature is None:
+            print(f"解码失败 {image_path}: {reason}")
+            return
+        self.entries[image_path] = {
+            "signature": signature,
+            "reason": reason,
+            "time": datetime.now().isoformat(),
+        }
+        print(f"图片已隔离 {image_path}: {reason}")
+
+    def save(self):
+        """保存隔离名单"""
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"保存隔离名单失败 {self.path}: {e}")
+
+
+class _Worker:
+    """一个解码工作进程及其管道（启动后异步等待就绪消息）"""
+
+    def __init__(self, context, max_pixels: int, max_side: int, thumbnails: Optional[Dict] = None,
+                 decode_func: Optional[Callable] = None):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(child_conn, max_pixels, max_side, thumbnails, decode_func),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.task = None
+        self.started = time.monotonic()
+
+    def submit(self, index: int, image_path: str):
+        self.task = (index, image_path)
+        self.started = time.monotonic()
+        self.conn.send(image_path)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class SafeDecoder:
+    """
+    隔离解码器
+
+    每个文件在独立工作进程中解码，超时或导致进程崩溃的文件会被终止并加入隔离名单，
+    之后的运行中直接跳过。工作进程在多次调用之间保持运行，被终止的进程在后台重新启动。
+    """
+
+    def __init__(self, workers: int = 0, timeout: float = 30.0, max_pixels: int = 100_000_000,
+                 max_side: int = 512, quarantine_path: Optional[str] = None,
+                 isolated: bool = True, thumbnails: Optional[Dict] = None,
+                 decode_func: Optional[Callable] = None):
+        """
+        初始化解码器
+
+        Args:
+            workers: 工作进程数，0 表示使用 CPU 核心数
+            timeout: 单个文件的解码超时（秒）
+            max_pixels: 允许的最大像素数
+            max_side: 解码结果的最长边
+            quarantine_path: 隔离名单保存路径
+            isolated: 是否使用隔离进程；为 False 时在当前进程内解码（无超时保护）
+            thumbnails: 缩略图缓存配置（ThumbnailCache.spec），为 None 时不使用缓存
+            decode_func: 替换 decode_image 的模块级函数（需可在工作进程中导入，测试使用）
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_pixels = max_pixels
+        self.max_side = max_side
+        self.isolated = isolated
+        self.thumbnails = thumbnails
+        self.decode_func = decode_func
+        self.quarantine = Quarantine(quarantine_path)
+        self.startup_timeout = 60.0
+        self._context = multiprocessing.get_context("spawn")
+        self._pool: List[_Worker] = []
+
+    def _start_worker(self) -> _Worker:
+        """启动一个工作进程（不等待就绪）"""
+        worker = _Worker(
+            self._context, self.max_pixels, self.max_side, self.thumbnails, self.decode_func
+        )
+        self._pool.append(worker)
+        return worker
+
+    def _drop_worker(self, worker: _Worker):
+        worker.kill()
+        self._pool.remove(worker)
+
+    def decode_batch(self, image_paths: List[str]) -> List[Dict]:
+        """
+        解码一批图片
+
+        Args:
+            image_paths: 图片路径列表
+
+        Returns:
+            成功解码的结果列表（保持输入顺序），失败的图片会被跳过
+        """
+        pending = [(i, path) for i, path in enumerate(image_paths)
+                   if not self.quarantine.contains(path)]
+        if not pending:
+            return []
+
+        results = {}
+        if self.isolated:
+            try:
+                self._decode_isolated(pending, results)
+            except RuntimeError as e:
+                # 工作进程不可用时不能把所有文件都当成坏文件，退回进程内解码；
+                # 已完成和已被隔离的文件（包括刚刚导致进程崩溃或超时的文件）不再在当前进程中解码
+                print(f"{e}，改为在当前进程内解码")
+                self.close()
+                self.isolated = False
+                pending = [(index, path) for index, path in pending
+                           if index not in results and not self.quarantine.contains(path)]
+
+        if not self.isolated:
+            decode = self.decode_func or decode_image
+            for index, path in pending:
+                try:
+                    results[index] = decode(path, self.max_pixels, self.max_side, self.thumbnails)
+                except Exception as e:
+                    if is_io_error(e):
+                        print(f"读取图片失败 {path}: {e}")
+                    else:
+                        self.quarantine.add(path, f"{type(e).__name__}: {e}")
+
+        self.quarantine.save()
+        return [results[index] for index in sorted(results)]
+
+    def _decode_isolated(self, pending: List, results: Dict[int, Dict]):
+        """
+        在工作进程中解码，结果写入 results（{输入序号: 结果}）
+
+        Raises:
+            RuntimeError: 没有可用的工作进程（results 中保留已完成的部分）
+        """
+        for _ in range(min(self.workers, len(pending)) - len(self._pool)):
+            self._start_worker()
+
+        queue = list(reversed(pending))
+        busy: List[_Worker] = []
+
+        while queue or busy:
+            idle = [worker for worker in self._pool if worker.ready and worker.task is None]
+            while queue and idle:
+                worker = idle.pop()
+                task = queue.pop()
+                try:
+                    worker.submit(*task)
+                except OSError:
+                    # 空闲时已退出的进程：任务放回队列，由其他进程处理
+                    worker.task = None
+                    queue.append(task)
+                    self._drop_worker(worker)
+                    self._start_worker()
+                    continue
+                busy.append(worker)
+
+            starting = [worker for worker in self._pool if not worker.ready]
+            if not busy and not starting and not idle:
+                raise RuntimeError("无法启动解码工作进程")
+
+            ready = wait([worker.conn for worker in busy + starting], timeout=0.1)
+            now = time.monotonic()
+
+            for worker in starting:
+                if worker.conn in ready:
+                    try:
+                        worker.ready = worker.conn.recv()[0] == "ready"
+                    except (EOFError, OSError):
+                        worker.ready = False
+                    if not worker.ready:
+                        self._drop_worker(worker)
+                elif now - worker.started > self.startup_timeout or not worker.process.is_alive():
+                    self._drop_worker(worker)
+            if not self._pool:
+                raise RuntimeError("无法启动解码工作进程")
+
+            for worker in list(busy):
+                index, path = worker.task
+                if worker.conn in ready:
+                    try:
+                        status, payload = worker.conn.recv()
+                    except (EOFError, OSError):
+                        status, payload = "crash", "解码进程异常退出"
+                elif now - worker.started > self.timeout:
+                    status, payload = "timeout", f"解码超时（>{self.timeout}秒）"
+                elif not worker.process.is_alive():
+                    status, payload = "crash", "解码进程异常退出"
+                else:
+                    continue
+
+                busy.remove(worker)
+                worker.task = None
+                if status == "ok":
+                    results[index] = payload
+                elif status == "io_error":
+                    # 文件暂时无法读取（不存在、无权限、网络存储故障），下次运行照常重试
+                    print(f"读取图片失败 {path}: {payload}")
+                else:
+                    self.quarantine.add(path, payload)
+                    if status != "error":
+                        # 超时或崩溃的进程直接终止，替换进程在后台启动，就绪后再分配任务
+                        self._drop_worker(worker)
+                        self._start_worker()
+
+    def close(self):
+        """关闭所有工作进程"""
+        for worker in self._pool:
+            worker.stop()
+        self._pool = []
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
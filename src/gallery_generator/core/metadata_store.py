@@ -0,0 +1,470 @@
+"""
+列式元数据存储模块
+用类型化的 numpy 数组保存图片元数据（每个字段一列），代替每张图片一个字典，
+按日期/相机/大小的筛选和排序都是向量化操作，并可保存为 .npz 文件
+"""
+
+import os
+from datetime import datetime
+from fractions import Fraction
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+# 数值列及其类型，缺失值为 NaN（整数列为 0）
+NUMERIC_COLUMNS = {
+    "size": np.int64,
+    "width": np.int32,
+    "height": np.int32,
+    "mtime": np.float64,          # 文件修改时间（Unix 时间戳）
+    "taken": np.float64,          # EXIF 拍摄时间（Unix 时间戳）
+    "exposure_time": np.float32,
+    "f_number": np.float32,
+    "iso": np.float32,
+    # 解码阶段计算的质量指标（见 quality.py）
+    "quality_sharpness": np.float32,
+    "quality_exposure": np.float32,
+    "quality_noise": np.float32,
+    "quality_resolution": np.float32,
+    "quality_score": np.float32,
+}
+
+# 取值较少的字符串列，保存为类别编号（-1 表示缺失）
+CATEGORY_COLUMNS = ("format", "make", "model")
+
+EXIF_NUMERIC = ("exposure_time", "f_number", "iso")
+
+QUALITY_NUMERIC = ("sharpness", "exposure", "noise", "resolution", "score")
+
+# 在线 API 标签在字符串列中的分隔符
+TAG_SEPARATOR = "\x1f"
+
+
+def _encode_strings(values: List[str]):
+    """将字符串列表编码为 UTF-8 字节数组和偏移量数组"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(item) for item in encoded])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).copy()
+    return data, offsets
+
+
+def _decode_string(data: np.ndarray, offsets: np.ndarray, index: int) -> str:
+    return data[offsets[index]:offsets[index + 1]].tobytes().decode("utf-8")
+
+
+def _decode_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    raw = data.tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def _subset_strings(data: np.ndarray, offsets: np.ndarray, indices: np.ndarray):
+    """按行号取编码字符串列的子集"""
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(lengths)
+    new_data = np.concatenate([data[s:s + n] for s, n in zip(starts, lengths)]) \
+        if len(indices) else np.zeros(0, dtype=np.uint8)
+    return new_data, new_offsets
+
+
+def _concat_strings(parts):
+    """按顺序拼接多个编码字符串列"""
+    offsets = [parts[0][1]]
+    base = parts[0][1][-1]
+    for _, part_offsets in parts[1:]:
+        offsets.append(part_offsets[1:] + base)
+        base += part_offsets[-1]
+    return np.concatenate([data for data, _ in parts]), np.concatenate(offsets)
+
+
+def _to_float(value) -> float:
+    """解析 EXIF 数值（可能是 "1/125"、"0.008" 等形式）"""
+    if value is None:
+        return np.nan
+    try:
+        return float(Fraction(str(value).strip()))
+    except (ValueError, ZeroDivisionError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+
+def _to_timestamp(value: Optional[str], exif_format: bool = False) -> float:
+    """解析时间字符串为 Unix 时间戳，无法解析时返回 NaN"""
+    if not value:
+        return np.nan
+    try:
+        if exif_format:
+            return datetime.strptime(value.strip()[:19], "%Y:%m:%d %H:%M:%S").timestamp()
+        return datetime.fromisoformat(value).timestamp()
+    except (ValueError, OverflowError, OSError):
+        return np.nan
+
+
+def _to_datetime_value(timestamp: float):
+    if np.isnan(timestamp):
+        return None
+    return datetime.fromtimestamp(float(timestamp))
+
+
+class MetadataStore:
+    """
+    列式元数据存储
+
+    行与有效图片路径一一对应。支持 len/下标/迭代访问（返回与原来相同格式的字典），
+    便于与按字典处理元数据的旧代码兼容。
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray] = None,
+                 categories: Dict[str, List[str]] = None,
+                 path_data: np.ndarray = None, path_offsets: np.ndarray = None,
+                 tag_data: np.ndarray = None, tag_offsets: np.ndarray = None):
+        """
+        初始化元数据存储（通常使用 from_records / load 创建）
+
+        Args:
+            columns: 数值列和类别编号列
+            categories: 类别列的取值表
+            path_data: 路径的 UTF-8 字节
+            path_offsets: 路径偏移量
+            tag_data: 在线 API 标签的 UTF-8 字节（每行的标签以 TAG_SEPARATOR 连接）
+            tag_offsets: 标签偏移量，None 时每行都没有标签
+        """
+        self.columns = columns or {
+            **{name: np.zeros(0, dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()},
+            **{name: np.zeros(0, dtype=np.int32) for name in CATEGORY_COLUMNS},
+        }
+        self.categories = categories or {name: [] for name in CATEGORY_COLUMNS}
+        self.path_data = path_data if path_data is not None else np.zeros(0, dtype=np.uint8)
+        self.path_offsets = (
+            path_offsets if path_offsets is not None else np.zeros(1, dtype=np.int64)
+        )
+        if tag_offsets is None:
+            tag_data = np.zeros(0, dtype=np.uint8)
+            tag_offsets = np.zeros(len(self.path_offsets), dtype=np.int64)
+        self.tag_data = tag_data
+        self.tag_offsets = tag_offsets
+
+    # ---- 构建 ----
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "MetadataStore":
+        """
+        由元数据字典列表构建
+
+        Args:
+            records: extract_metadata 返回的字典
+
+        Returns:
+            元数据存储
+        """
+        records = list(records)
+        numeric = {name: [] for name in NUMERIC_COLUMNS}
+        category_values = {name: [] for name in CATEGORY_COLUMNS}
+        paths = []
+        tags = []
+
+        for record in records:
+            exif = record.get("exif") or {}
+            paths.append(record.get("path", ""))
+            tags.append(TAG_SEPARATOR.join(record.get("tags") or []))
+            numeric["size"].append(record.get("size") or 0)
+            numeric["width"].append(record.get("width") or 0)
+            numeric["height"].append(record.get("height") or 0)
+            numeric["mtime"].append(_to_timestamp(record.get("modification_time")))
+            numeric["taken"].append(_to_timestamp(exif.get("datetime"), exif_format=True))
+            for name in EXIF_NUMERIC:
+                numeric[name].append(_to_float(exif.get(name)))
+            quality = record.get("quality") or {}
+            for name in QUALITY_NUMERIC:
+                numeric[f"quality_{name}"].append(_to_float(quality.get(name)))
+            category_values["format"].append(record.get("format") or None)
+            category_values["make"].append(exif.get("make"))
+            category_values["model"].append(exif.get("model"))
+
+        columns = {
+            name: np.asarray(values, dtype=NUMERIC_COLUMNS[name])
+            for name, values in numeric.items()
+        }
+        categories = {}
+        for name, values in category_values.items():
+            table = sorted({value for value in values if value is not None})
+            lookup = {value: code for code, value in enumerate(table)}
+            columns[name] = np.asarray([lookup.get(value, -1) for value in values], dtype=np.int32)
+            categories[name] = table
+
+        path_data, path_offsets = _encode_strings(paths)
+        return cls(columns, categories, path_data, path_offsets, *_encode_strings(tags))
+
+    @classmethod
+    def concat(cls, stores: List["MetadataStore"]) -> "MetadataStore":
+        """
+        按顺序拼接多个元数据存储（类别编号会重新映射）
+
+        Args:
+            stores: 元数据存储列表
+
+        Returns:
+            拼接后的元数据存储
+        """
+        stores = [store for store in stores if len(store)]
+        if not stores:
+            return cls()
+        if len(stores) == 1:
+            return stores[0]
+
+        columns = {
+            name: np.concatenate([store.columns[name] for store in stores])
+            for name in NUMERIC_COLUMNS
+        }
+        categories = {}
+        for name in CATEGORY_COLUMNS:
+            table = sorted({value for store in stores for value in store.categories[name]})
+            lookup = {value: code for code, value in enumerate(table)}
+            parts = []
+            for store in stores:
+                # 旧编号 → 新编号，末尾的 -1 对应缺失值
+                remap = np.asarray(
+                    [lookup[value] for value in store.categories[name]] + [-1], dtype=np.int32
+                )
+                parts.append(remap[store.columns[name]])
+            columns[name] = np.concatenate(parts)
+            categories[name] = table
+
+        return cls(
+            columns, categories,
+            *_concat_strings([(store.path_data, store.path_offsets) for store in stores]),
+            *_concat_strings([(store.tag_data, store.tag_offsets) for store in stores])
+        )
+
+    # ---- 持久化 ----
+
+    def save(self, path: str):
+        """保存为 .npz 文件（先写临时文件再替换）"""
+        arrays = {f"col_{name}": values for name, values in self.columns.items()}
+        for name, table in self.categories.items():
+            arrays[f"cat_{name}_data"], arrays[f"cat_{name}_offsets"] = _encode_strings(table)
+        arrays["path_data"] = self.path_data
+        arrays["path_offsets"] = self.path_offsets
+        arrays["tag_data"] = self.tag_data
+        arrays["tag_offsets"] = self.tag_offsets
+
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataStore":
+        """读取 save 保存的文件"""
+        with np.load(path) as data:
+            columns = {
+                name: data[f"col_{name}"] for name in list(CATEGORY_COLUMNS) + list(NUMERIC_COLUMNS)
+            }
+            categories = {
+                name: _decode_strings(data[f"cat_{name}_data"], data[f"cat_{name}_offsets"])
+                for name in CATEGORY_COLUMNS
+            }
+            return cls(columns, categories, data["path_data"], data["path_offsets"],
+                       data["tag_data"], data["tag_offsets"])
+
+    # ---- 访问 ----
+
+    def __len__(self) -> int:
+        return len(self.path_offsets) - 1
+
+    def __getitem__(self, index: int) -> Dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.record(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def path(self, index: int) -> str:
+        """第 index 行的图片路径"""
+        return _decode_string(self.path_data, self.path_offsets, index)
+
+    def paths(self) -> List[str]:
+        """全部图片路径"""
+        return _decode_strings(self.path_data, self.path_offsets)
+
+    def tags(self, index: int) -> List[str]:
+        """第 index 行的在线 API 标签"""
+        value = _decode_string(self.tag_data, self.tag_offsets, index)
+        return value.split(TAG_SEPARATOR) if value else []
+
+    def set_tags(self, tags: List[Optional[List[str]]]):
+        """
+        替换所有行的标签
+
+        Args:
+            tags: 与行对应的标签列表（None 或空列表表示没有标签）
+        """
+        if len(tags) != len(self):
+            raise ValueError(f"标签数量 {len(tags)} 与行数 {len(self)} 不一致")
+        self.tag_data, self.tag_offsets = _encode_strings(
+            [TAG_SEPARATOR.join(row or []) for row in tags]
+        )
+
+    @property
+    def has_tags(self) -> bool:
+        """是否有任意一行带有标签"""
+        return len(self.tag_data) > 0
+
+    def category(self, name: str, index: int) -> Optional[str]:
+        """类别列第 index 行的取值"""
+        code = int(self.columns[name][index])
+        return self.categories[name][code] if code >= 0 else None
+
+    def record(self, index: int) -> Dict:
+        """
+        还原为 extract_metadata 格式的字典
+
+        Args:
+            index: 行号
+
+        Returns:
+            元数据字典
+        """
+        path = self.path(index)
+        mtime = _to_datetime_value(self.columns["mtime"][index])
+        record = {
+            "path": path,
+            "filename": os.path.basename(path),
+            "size": int(self.columns["size"][index]),
+            "format": self.category("format", index) or "",
+            "width": int(self.columns["width"][index]),
+            "height": int(self.columns["height"][index]),
+            "modification_time": mtime.isoformat() if mtime else None,
+        }
+
+        exif = {}
+        for name in ("make", "model"):
+            value = self.category(name, index)
+            if value is not None:
+                exif[name] = value
+        taken = _to_datetime_value(self.columns["taken"][index])
+        if taken:
+            exif["datetime"] = taken.strftime("%Y:%m:%d %H:%M:%S")
+        for name in EXIF_NUMERIC:
+            value = self.columns[name][index]
+            if not np.isnan(value):
+                exif[name] = f"{float(value):g}"
+        if exif:
+            record["exif"] = exif
+
+        quality = {}
+        for name in QUALITY_NUMERIC:
+            value = self.columns[f"quality_{name}"][index]
+            if not np.isnan(value):
+                quality[name] = float(value)
+        if quality:
+            record["quality"] = quality
+
+        tags = self.tags(index)
+        if tags:
+            record["tags"] = tags
+
+        return record
+
+    def subset(self, indices) -> "MetadataStore":
+        """
+        按行号或布尔掩码取子集
+
+        Args:
+            indices: 行号数组或布尔掩码
+
+        Returns:
+            新的元数据存储
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+
+        columns = {name: values[indices] for name, values in self.columns.items()}
+        return MetadataStore(
+            columns, dict(self.categories),
+            *_subset_strings(self.path_data, self.path_offsets, indices),
+            *_subset_strings(self.tag_data, self.tag_offsets, indices)
+        )
+
+    # ---- 向量化筛选和排序 ----
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """拍摄时间，没有 EXIF 时间时使用文件修改时间"""
+        taken = self.columns["taken"]
+        return np.where(np.isnan(taken), self.columns["mtime"], taken)
+
+    def category_mask(self, name: str, values) -> np.ndarray:
+        """类别列取值属于 values 的行"""
+        if isinstance(values, str):
+            values = [values]
+        codes = [code for code, value in enumerate(self.categories[name]) if value in set(values)]
+        return np.isin(self.columns[name], codes)
+
+    def filter_mask(self, date_from: datetime = None, date_to: datetime = None,
+                    camera: str = None, formats: List[str] = None,
+                    min_size: int = None, max_size: int = None) -> np.ndarray:
+        """
+        按条件筛选
+
+        Args:
+            date_from: 拍摄时间下限
+            date_to: 拍摄时间上限
+            camera: 相机型号（make 或 model 匹配即可）
+            formats: 图片格式列表，例如 ["JPEG", "PNG"]
+            min_size: 文件大小下限（字节）
+            max_size: 文件大小上限（字节）
+
+        Returns:
+            布尔掩码
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if date_from is not None or date_to is not None:
+            timestamps = self.timestamps
+            if date_from is not None:
+                mask &= timestamps >= date_from.timestamp()
+            if date_to is not None:
+                mask &= timestamps <= date_to.timestamp()
+        if camera is not None:
+            mask &= self.category_mask("make", camera) | self.category_mask("model", camera)
+        if formats is not None:
+            mask &= self.category_mask("format", formats)
+        if min_size is not None:
+            mask &= self.columns["size"] >= min_size
+        if max_size is not None:
+            mask &= self.columns["size"] <= max_size
+        return mask
+
+    def argsort(self, key: str = "date", descending: bool = False) -> np.ndarray:
+        """
+        排序后的行号
+
+        Args:
+            key: date（拍摄时间）、类别列名或数值列名
+            descending: 是否降序
+
+        Returns:
+            行号数组（缺失值排在最后）
+        """
+        if key == "date":
+            values = self.timestamps
+        elif key in CATEGORY_COLUMNS:
+            # 按取值字母序排序
+            codes = self.columns[key]
+            values = np.where(codes >= 0, codes, np.nan)
+        else:
+            values = self.columns[key].astype(np.float64)
+
+        order = np.argsort(-values if descending else values, kind="stable")
+        missing = np.isnan(values[order])
+        return np.concatenate([order[~missing], order[missing]])
@@ -0,0 +1,511 @@
+"""
+在线 API 标签模块
+调用 Google Vision / OpenAI 为图片生成补充标签：asyncio 调度请求，连接池复用长连接，
+同时进行的请求数有上限，遇到限流（429）或服务端错误时按 Retry-After 或指数退避重试，
+多张图片合并为一个请求；响应按图片内容哈希保存在本地缓存中，重复运行不再请求
+"""
+
+import asyncio
+import base64
+import http.client
+import io
+import json
+import os
+import queue
+import random
+import sqlite3
+import ssl
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from PIL import Image, ImageOps
+
+from .thumbnail_cache import content_digest
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    request_key TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (request_key, digest)
+);
+"""
+
+
+class OnlineAPIError(Exception):
+    """在线 API 请求失败（不可重试的错误或重试次数用尽）"""
+
+
+class ResponseCache:
+    """按 (请求配置, 图片内容哈希) 保存的 API 响应缓存"""
+
+    def __init__(self, path: str):
+        """
+        打开缓存数据库
+
+        Args:
+            path: SQLite 文件路径
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def get_many(self, request_key: str, digests: List[str]) -> Dict[str, List[Dict]]:
+        """查询已缓存的响应，返回 {内容哈希: 标签列表}"""
+        found = {}
+        unique = list(dict.fromkeys(digests))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT digest, labels FROM responses WHERE request_key = ? "
+                    f"AND digest IN ({', '.join('?' * len(chunk))})",
+                    [request_key, *chunk]
+                ).fetchall()
+                found.update((digest, json.loads(labels)) for digest, labels in rows)
+        return found
+
+    def put_many(self, request_key: str, items: Dict[str, List[Dict]]):
+        """保存响应"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO responses (request_key, digest, labels, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (request_key, digest, json.dumps(labels, ensure_ascii=False), now)
+                    for digest, labels in items.items()
+                ],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _ConnectionPool:
+    """同一主机的 HTTP(S) 长连接池（多个线程共用）"""
+
+    def __init__(self, base_url: str, size: int, timeout: float):
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max(1, size))
+        self._ssl_context = ssl.create_default_context() if self.https else None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                               context=self._ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: bytes, headers: Dict):
+        """
+        发送请求（阻塞，在线程池中调用）
+
+        Returns:
+            (状态码, 响应头, 响应体)
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        return response.status, response.headers, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class GoogleVisionProvider:
+    """Google Cloud Vision 标签检测（images:annotate 每个请求最多 16 张图片）"""
+
+    name = "google_vision"
+    base_url = "https://vision.googleapis.com"
+    max_batch_size = 16
+
+    def __init__(self, api_key: str, max_tags: int = 10, **_):
+        self.api_key = api_key
+        self.max_tags = max_tags
+
+    @property
+    def request_key(self) -> str:
+        return f"{self.name}|labels|{self.max_tags}"
+
+    def build(self, images: List[str]):
+        """构造请求：(路径, 请求头, JSON 请求体)"""
+        body = {"requests": [
+            {"image": {"content": image},
+             "features": [{"type": "LABEL_DETECTION", "maxResults": self.max_tags}]}
+            for image in images
+        ]}
+        return f"/v1/images:annotate?key={self.api_key}", {}, body
+
+    def parse(self, data: Dict, count: int) -> List[Optional[List[Dict]]]:
+        """解析响应，单张图片出错时对应位置为 None"""
+        responses = data.get("responses", [])
+        results = []
+        for index in range(count):
+            item = (
+                responses[index] if index < len(responses) else {"error": {"message": "响应缺失"}}
+            )
+            if "error" in item:
+                print(f"Google Vision 无法处理图片: {item['error'].get('message', '')}")
+                results.append(None)
+                continue
+            results.append(
+                [
+                    {
+                        "label": annotation.get("description", ""),
+                        "score": float(annotation.get("score", 0.0)),
+                    }
+                    for annotation in item.get("labelAnnotations", [])
+                ]
+            )
+        return results
+
+
+class OpenAIProvider:
+    """OpenAI 多模态对话接口：一次请求中发送多张图片，要求按顺序返回每张图片的标签"""
+
+    name = "openai"
+    base_url = "https://api.openai.com"
+    max_batch_size = 8
+
+    def __init__(self, api_key: str, max_tags: int = 10, model: str = "gpt-4o-mini", **_):
+        self.api_key = api_key
+        self.max_tags = max_tags
+        self.model = model
+
+    @property
+    def request_key(self) -> str:
+        return f"{self.name}|{self.model}|{self.max_tags}"
+
+    def build(self, images: List[str]):
+        prompt = (
+            f"为以下 {len(images)} 张图片分别给出最多 {self.max_tags} 个描述内容的英文标签，"
+            '按图片顺序以 JSON 返回：{"tags": [["标签", ...], ...]}'
+        )
+        content = [{"type": "text", "text": prompt}] + [
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{image}", "detail": "low"},
+            }
+            for image in images
+        ]
+        body = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": content}],
+            "response_format": {"type": "json_object"},
+        }
+        return "/v1/chat/completions", {"Authorization": f"Bearer {self.api_key}"}, body
+
+    def parse(self, data: Dict, count: int) -> List[Optional[List[Dict]]]:
+        try:
+            tags = json.loads(data["choices"][0]["message"]["content"])["tags"]
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            raise OnlineAPIError(f"无法解析 OpenAI 响应: {e}")
+        results = []
+        for index in range(count):
+            labels = tags[index] if index < len(tags) and isinstance(tags[index], list) else None
+            # 对话接口没有置信度，返回的标签都视为可信（不受 min_score 过滤），按返回顺序排列
+            results.append(None if labels is None else [
+                {"label": str(label), "score": 1.0} for label in labels[:self.max_tags]
+            ])
+        return results
+
+
+PROVIDERS = {
+    GoogleVisionProvider.name: GoogleVisionProvider,
+    OpenAIProvider.name: OpenAIProvider,
+}
+
+
+def _retry_after(headers) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期）"""
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_image(image_path: str, max_side: int = 640, quality: int = 85) -> str:
+    """缩小并编码为 base64 JPEG（减少上传流量）"""
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((max_side, max_side))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class OnlineTagger:
+    """在线 API 标签客户端"""
+
+    def __init__(self, provider, cache: Optional[ResponseCache] = None, base_url: str = None,
+                 max_concurrency: int = 4, batch_size: int = 0, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0, timeout: float = 30.0,
+                 image_max_side: int = 640, min_score: float = 0.5, thumbnail_cache=None):
+        """
+        初始化客户端
+
+        Args:
+            provider: GoogleVisionProvider / OpenAIProvider
+            cache: 响应缓存，None 时不缓存
+            base_url: 覆盖服务地址（代理或本地模拟服务）
+            max_concurrency: 同时进行的请求数上限（也是连接池大小）
+            batch_size: 每个请求的图片数，0 为服务允许的最大值
+            max_retries: 限流、服务端错误或网络错误时的最大重试次数
+            backoff_base: 指数退避的初始等待（秒）
+            backoff_max: 单次等待的上限（秒）
+            timeout: 单个请求的超时（秒）
+            image_max_side: 上传前缩小到的最长边
+            min_score: 保留的标签的最低置信度
+            thumbnail_cache: 缩略图缓存，提供时复用其中按文件大小和修改时间缓存的内容哈希
+        """
+        self.provider = provider
+        self.cache = cache
+        self.max_concurrency = max(1, max_concurrency)
+        self.batch_size = min(batch_size or provider.max_batch_size, provider.max_batch_size)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.image_max_side = image_max_side
+        self.min_score = min_score
+        self.thumbnail_cache = thumbnail_cache
+        self._pool = _ConnectionPool(base_url or provider.base_url, self.max_concurrency, timeout)
+        # 收到 429 后所有请求暂停到该时间（单调时钟）
+        self._paused_until = 0.0
+        self.stats = {"requests": 0, "retries": 0, "cached": 0, "tagged": 0, "failed": 0}
+
+    def close(self):
+        self._pool.close()
+
+    def _digest(self, image_path: str) -> Optional[str]:
+        if self.thumbnail_cache is not None:
+            return self.thumbnail_cache.digest(image_path)
+        try:
+            return content_digest(image_path)
+        except OSError:
+            return None
+
+    def tag_images(self, image_paths: List[str], progress_callback=None) -> List[List[str]]:
+        """
+        为图片生成标签（已缓存的图片不再请求）
+
+        Args:
+            image_paths: 图片路径列表
+            progress_callback: 进度回调函数 (current, total, message)
+
+        Returns:
+            与 image_paths 对应的标签列表，请求失败的图片为空列表
+        """
+        digests = [self._digest(path) for path in image_paths]
+        request_key = self.provider.request_key
+        labels = (
+            self.cache.get_many(request_key, [d for d in digests if d])
+            if self.cache is not None
+            else {}
+        )
+        self.stats["cached"] += sum(1 for digest in digests if digest in labels)
+
+        # 内容相同的图片只请求一次
+        pending = {}
+        for path, digest in zip(image_paths, digests):
+            if digest and digest not in labels and digest not in pending:
+                pending[digest] = path
+        if pending:
+            labels.update(asyncio.run(self._tag_pending(list(pending.items()), progress_callback)))
+
+        return [
+            [item["label"] for item in labels.get(digest) or [] if item["score"] >= self.min_score]
+            for digest in digests
+        ]
+
+    async def _tag_pending(self, items: List, progress_callback=None) -> Dict[str, List[Dict]]:
+        """并发请求所有待处理的图片，返回 {内容哈希: 标签列表}"""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = [
+            items[start : start + self.batch_size]
+            for start in range(0, len(items), self.batch_size)
+        ]
+        results = {}
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            async def run_batch(batch):
+                nonlocal done
+                async with semaphore:
+                    try:
+                        batch_labels = await self._request_batch(loop, executor, batch)
+                    except Exception as e:
+                        print(f"在线 API 请求失败（{len(batch)} 张图片）: {e}")
+                        batch_labels = [None] * len(batch)
+                found = {
+                    digest: value
+                    for (digest, _), value in zip(batch, batch_labels)
+                    if value is not None
+                }
+                self.stats["tagged"] += len(found)
+                self.stats["failed"] += len(batch) - len(found)
+                # 每批完成后立即写入缓存，中断后重新运行只请求剩余的图片
+                if found and self.cache is not None:
+                    self.cache.put_many(self.provider.request_key, found)
+                results.update(found)
+                done += len(batch)
+                if progress_callback:
+                    progress_callback(
+                        done, len(items), f"正在获取在线标签 ({done}/{len(items)})..."
+                    )
+
+            await asyncio.gather(*(run_batch(batch) for batch in batches))
+        return results
+
+    async def _request_batch(self, loop, executor, batch: List) -> List[Optional[List[Dict]]]:
+        """编码一批图片并发送请求，可重试的错误按退避策略重试"""
+        encoded = await asyncio.gather(*(
+            loop.run_in_executor(executor, self._encode, path) for _, path in batch
+        ))
+        positions = [index for index, image in enumerate(encoded) if image is not None]
+        results = [None] * len(batch)
+        if not positions:
+            return results
+
+        path, headers, body = self.provider.build([encoded[index] for index in positions])
+        payload = json.dumps(body).encode("utf-8")
+        headers = {**headers, "Content-Type": "application/json"}
+
+        for attempt in range(self.max_retries + 1):
+            wait = self._paused_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            delay = min(self.backoff_max, self.backoff_base * 2**attempt) * (
+                0.5 + random.random() / 2
+            )
+            self.stats["requests"] += 1
+            try:
+                status, response_headers, data = await loop.run_in_executor(
+                    executor, self._pool.request, "POST", path, payload, headers
+                )
+            except (OSError, http.client.HTTPException) as e:
+                error = f"网络错误: {e}"
+            else:
+                if status == 200:
+                    for index, labels in zip(
+                        positions, self.provider.parse(json.loads(data), len(positions))
+                    ):
+                        results[index] = labels
+                    return results
+                error = f"HTTP {status}: {data[:200].decode('utf-8', 'replace')}"
+                if status != 429 and status < 500:
+                    raise OnlineAPIError(error)
+                retry_after = _retry_after(response_headers)
+                if retry_after is not None:
+                    delay = retry_after
+                if status == 429:
+                    # 限流时所有请求一起暂停，避免其余并发请求继续触发限流
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+            if attempt == self.max_retries:
+                raise OnlineAPIError(f"重试 {self.max_retries} 次后仍然失败，{error}")
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def _encode(self, image_path: str) -> Optional[str]:
+        try:
+            return encode_image(image_path, self.image_max_side)
+        except Exception:
+            print(f"无法编码图片 {image_path}:\n{traceback.format_exc()}")
+            return None
+
+
+def create_online_tagger(config: Dict, thumbnail_cache=None) -> Optional[OnlineTagger]:
+    """
+    按配置 api 创建在线标签客户端
+
+    Args:
+        config: 完整配置字典（读取 api 和 cache.dir）
+        thumbnail_cache: 缩略图缓存（复用内容哈希）
+
+    Returns:
+        客户端，未启用或未配置 API 密钥时返回 None
+    """
+    api_config = config.get("api", {})
+    if not api_config.get("use_online_api", False):
+        return None
+
+    provider_name = api_config.get("provider", GoogleVisionProvider.name)
+    if provider_name not in PROVIDERS:
+        print(f"未知的在线 API: {provider_name}，可选: {', '.join(PROVIDERS)}")
+        return None
+    api_key = api_config.get("google_vision_api_key" if provider_name == GoogleVisionProvider.name
+                             else "openai_api_key", "")
+    if not api_key:
+        print(f"已启用在线 API 但未配置 {provider_name} 的 API 密钥，跳过在线标签")
+        return None
+    provider = PROVIDERS[provider_name](
+        api_key,
+        max_tags=api_config.get("max_tags", 10),
+        model=api_config.get("openai_model", "gpt-4o-mini"),
+    )
+
+    cache = None
+    if api_config.get("cache", True):
+        cache_dir = config.get("cache", {}).get("dir", ".gallery_cache")
+        cache = ResponseCache(
+            api_config.get("cache_path") or os.path.join(cache_dir, "online_api.db")
+        )
+
+    return OnlineTagger(
+        provider,
+        cache,
+        base_url=api_config.get("base_url"),
+        max_concurrency=api_config.get("max_concurrency", 4),
+        batch_size=api_config.get("batch_size", 0),
+        max_retries=api_config.get("max_retries", 5),
+        backoff_base=api_config.get("backoff_base", 1.0),
+        backoff_max=api_config.get("backoff_max", 60.0),
+        timeout=api_config.get("timeout", 30),
+        image_max_side=api_config.get("image_max_side", 640),
+        min_score=api_config.get("min_score", 0.5),
+        thumbnail_cache=thumbnail_cache
+    )
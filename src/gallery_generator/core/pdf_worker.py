@@ -0,0 +1,156 @@
+"""
+PDF 分段渲染模块
+进程池中 spawn 启动的工作进程只导入本模块和 reportlab/PIL，不加载聚类、模型等重量级依赖
+"""
+
+import os
+from typing import Dict, List, Tuple
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import (
+    Image as RLImage,
+    Paragraph,
+    SimpleDocTemplate,
+    Spacer,
+    Table,
+    TableStyle,
+)
+
+from .thumbnail_cache import ThumbnailCache
+
+
+def _pdf_styles() -> Dict:
+    """PDF使用的段落样式"""
+    styles = getSampleStyleSheet()
+    return {
+        "normal": styles['Normal'],
+        "title": ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor('#333333'),
+            spaceAfter=30,
+            alignment=1  # 居中
+        ),
+        "heading": ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=18,
+            textColor=colors.HexColor('#555555'),
+            spaceAfter=20
+        ),
+        "parent": ParagraphStyle(
+            'CustomParentHeading',
+            parent=styles['Heading1'],
+            fontSize=22,
+            textColor=colors.HexColor('#667eea'),
+            spaceAfter=20
+        ),
+    }
+
+
+def render_pdf_section(task: Dict) -> str:
+    """
+    将一个类别渲染为单独的PDF（在工作进程中运行）
+    
+    Args:
+        task: 分段任务，包含 path/name/description/image_paths/parent_name/parent_description，
+              以及可选的 thumbnails（缩略图缓存配置）和 thumbnail_size
+        
+    Returns:
+        生成的PDF路径
+    """
+    styles = _pdf_styles()
+    story = []
+    
+    # 分层结果中大类的第一个子类带上大类标题
+    if task.get("parent_name") is not None:
+        story.append(Paragraph(task["parent_name"], styles["parent"]))
+        story.append(Paragraph(task.get("parent_description", ""), styles["normal"]))
+        story.append(Spacer(1, 0.3*inch))
+    
+    # 类别标题
+    story.append(Paragraph(task["name"], styles["heading"]))
+    story.append(Paragraph(task["description"], styles["normal"]))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # 有缩略图缓存时嵌入缓存中的缩略图，避免在PDF中写入原图
+    thumbnails = ThumbnailCache.from_spec(task["thumbnails"]) if task.get("thumbnails") else None
+    
+    # 添加图片
+    for img_path in task["image_paths"]:
+        try:
+            source_path = img_path
+            if thumbnails is not None:
+                source_path = (
+                    thumbnails.get_or_create_path(img_path, task["thumbnail_size"]) or img_path
+                )
+            
+            # 先用PIL获取原始尺寸，保持宽高比
+            from PIL import Image as PILImage
+            pil_img = PILImage.open(source_path)
+            img_width, img_height = pil_img.size
+            pil_img.close()
+            
+            # 计算缩放比例，保持宽高比
+            max_width = 5 * inch
+            max_height = 4 * inch
+            
+            width_ratio = max_width / img_width
+            height_ratio = max_height / img_height
+            ratio = min(width_ratio, height_ratio)
+            
+            new_width = img_width * ratio
+            new_height = img_height * ratio
+            
+            # 创建RLImage时使用计算后的尺寸
+            img = RLImage(source_path, width=new_width, height=new_height)
+            story.append(img)
+            story.append(Spacer(1, 0.1*inch))
+        except Exception as e:
+            print(f"添加PDF图片失败 {img_path}: {e}")
+            # 添加错误提示
+            story.append(Paragraph(
+                f"图片加载失败: {os.path.basename(img_path)}",
+                styles["normal"]
+            ))
+            story.append(Spacer(1, 0.1*inch))
+    
+    tmp_path = task["path"] + ".tmp"
+    SimpleDocTemplate(tmp_path, pagesize=A4).build(story)
+    os.replace(tmp_path, task["path"])
+    return task["path"]
+
+
+def render_pdf_cover(path: str, generated_time: str, toc_entries: List[Tuple]):
+    """
+    渲染封面和目录
+    
+    Args:
+        path: 输出路径
+        generated_time: 生成时间
+        toc_entries: [(层级, 标题, 页码)]
+    """
+    styles = _pdf_styles()
+    story = [
+        Paragraph("图片作品集", styles["title"]),
+        Spacer(1, 0.2*inch),
+        Paragraph(f"生成时间: {generated_time}", styles["normal"]),
+        Spacer(1, 0.3*inch),
+    ]
+    
+    if toc_entries:
+        story.append(Paragraph("目录", styles["heading"]))
+        rows = [["    " * level + title, str(page)] for level, title, page in toc_entries]
+        table = Table(rows, colWidths=[5.5*inch, 0.8*inch])
+        table.setStyle(TableStyle([
+            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#333333')),
+            ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.HexColor('#dddddd')),
+        ]))
+        story.append(table)
+    
+    SimpleDocTemplate(path, pagesize=A4).build(story)
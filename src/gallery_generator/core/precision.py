@@ -0,0 +1,176 @@
+"""
+推理精度模块
+为 CLIP 模型提供 fp32 / bf16 / fp16 / int8 动态量化推理，并校验低精度对聚类结果的影响
+"""
+
+import contextlib
+import random
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+SUPPORTED_PRECISIONS = ("fp32", "bf16", "fp16", "int8")
+
+
+def resolve_precision(precision: str, device: str) -> str:
+    """
+    根据设备检查精度设置，不支持的组合回退到 fp32
+
+    Args:
+        precision: 配置的精度
+        device: 模型所在设备（cpu / cuda / mps）
+
+    Returns:
+        实际使用的精度
+
+    Raises:
+        ValueError: 未知的精度名称
+    """
+    if precision not in SUPPORTED_PRECISIONS:
+        raise ValueError(f"未知的推理精度: {precision}，可选: {', '.join(SUPPORTED_PRECISIONS)}")
+
+    device_type = str(device).split(":")[0]
+    if precision == "int8" and device_type != "cpu":
+        print(f"int8 动态量化仅支持 CPU，当前设备为 {device}，回退到 fp32")
+        return "fp32"
+    if precision == "fp16" and device_type == "cpu":
+        print("CPU 上不支持 fp16 推理，改用 bf16")
+        return "bf16"
+    return precision
+
+
+def apply_precision(model, precision: str):
+    """
+    对已加载的模型应用权重级别的精度转换
+
+    bf16/fp16 通过 autocast 在推理时生效（见 autocast_context），这里只处理 int8：
+    将所有 Linear 层替换为动态量化版本（原地修改）。
+
+    Args:
+        model: torch 模型
+        precision: 已通过 resolve_precision 校验的精度
+
+    Returns:
+        处理后的模型
+    """
+    if precision != "int8":
+        return model
+
+    import torch
+
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def autocast_context(precision: str, device: str):
+    """
+    返回推理时使用的 autocast 上下文
+
+    Args:
+        precision: 已通过 resolve_precision 校验的精度
+        device: 模型所在设备
+
+    Returns:
+        上下文管理器
+    """
+    if precision not in ("bf16", "fp16"):
+        return contextlib.nullcontext()
+
+    import torch
+
+    dtype = torch.bfloat16 if precision == "bf16" else torch.float16
+    return torch.autocast(device_type=str(device).split(":")[0], dtype=dtype)
+
+
+def check_precision_accuracy(image_paths: List[str], model_config: Dict, precision: str,
+                             sample_size: int = 200, n_clusters: Optional[int] = None,
+                             seed: int = 42) -> Dict:
+    """
+    在样本上比较低精度与 fp32 的特征和聚类分配
+
+    Args:
+        image_paths: 候选图片路径
+        model_config: 配置中的 model 段
+        precision: 待检查的精度
+        sample_size: 抽样数量
+        n_clusters: 聚类数量，None 时按样本量估计
+        seed: 抽样和聚类的随机种子
+
+    Returns:
+        检查结果字典，包含调整兰德指数、平均余弦相似度、近邻召回率和耗时对比
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import adjusted_rand_score
+
+    from gallery_generator.core.embedding_backends import create_backend
+
+    sample = list(image_paths)
+    if len(sample) > sample_size:
+        sample = random.Random(seed).sample(sample, sample_size)
+
+    batch_size = model_config.get("batch_size", 32)
+    if not isinstance(batch_size, int):
+        batch_size = 32
+
+    def _extract(target_precision):
+        backend = create_backend({**model_config, "precision": target_precision})
+        start = time.perf_counter()
+        features, valid_paths = backend.extract_features_from_paths(sample, batch_size)
+        elapsed = time.perf_counter() - start
+        del backend
+        return dict(zip(valid_paths, features)), elapsed
+
+    reference, reference_time = _extract("fp32")
+    candidate, candidate_time = _extract(precision)
+
+    common = [path for path in sample if path in reference and path in candidate]
+    if len(common) < 2:
+        return {"precision": precision, "sample_size": len(common), "error": "有效样本不足"}
+
+    ref_features = np.stack([reference[path] for path in common]).astype(np.float32)
+    test_features = np.stack([candidate[path] for path in common]).astype(np.float32)
+
+    ref_norm = ref_features / np.maximum(np.linalg.norm(ref_features, axis=1, keepdims=True), 1e-12)
+    test_norm = test_features / np.maximum(
+        np.linalg.norm(test_features, axis=1, keepdims=True), 1e-12
+    )
+    cosine = np.sum(ref_norm * test_norm, axis=1)
+
+    # 近邻召回率：fp32 下每张图片的 k 个最近邻在低精度特征中仍属于 k 个最近邻的比例
+    k = min(10, len(common) - 1)
+    ref_similarity = ref_norm @ ref_norm.T
+    test_similarity = test_norm @ test_norm.T
+    np.fill_diagonal(ref_similarity, -np.inf)
+    np.fill_diagonal(test_similarity, -np.inf)
+    ref_neighbors = np.argsort(-ref_similarity, axis=1)[:, :k]
+    test_neighbors = np.argsort(-test_similarity, axis=1)[:, :k]
+    recall = np.mean(
+        [len(set(a) & set(b)) / k for a, b in zip(ref_neighbors.tolist(), test_neighbors.tolist())]
+    )
+
+    if n_clusters is None:
+        n_clusters = max(2, min(10, len(common) // 10))
+    n_clusters = min(n_clusters, len(common))
+
+    ref_labels = KMeans(n_clusters=n_clusters, random_state=seed, n_init=10).fit_predict(
+        ref_features
+    )
+    test_labels = KMeans(n_clusters=n_clusters, random_state=seed, n_init=10).fit_predict(
+        test_features
+    )
+
+    return {
+        "precision": precision,
+        "sample_size": len(common),
+        "n_clusters": n_clusters,
+        "adjusted_rand_index": float(adjusted_rand_score(ref_labels, test_labels)),
+        "mean_cosine_similarity": float(np.mean(cosine)),
+        "min_cosine_similarity": float(np.min(cosine)),
+        "neighbor_recall": float(recall),
+        "fp32_seconds": reference_time,
+        "seconds": candidate_time,
+        "speedup": reference_time / candidate_time if candidate_time > 0 else 0.0,
+    }
@@ -0,0 +1,686 @@
+"""
+分析服务模块
+常驻进程中保留已加载的模型，通过本机 HTTP 或 Unix 套接字接收处理任务；
+任务排队后由若干工作线程执行，同时运行的任务的嵌入推理合并成批次
+"""
+
+import http.client
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from gallery_generator.core.embedding_backends import BatchingBackend, create_backend
+from gallery_generator.core.image_analyzer import ImageAnalyzer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# 任务状态
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+OUTPUT_FORMATS = ("html", "pdf", "folder")
+
+
+class ServiceError(Exception):
+    """服务请求失败（任务参数无效、任务不存在或服务不可用）"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _summarize(results: Dict) -> Dict:
+    """把 process_folder 的结果转换为可以 JSON 序列化的摘要（不含特征和元数据）"""
+    summary = {
+        "success": bool(results.get("success")),
+        "image_count": int(results.get("image_count", 0) or 0),
+    }
+    if not summary["success"]:
+        summary["message"] = results.get("message", "处理失败")
+        return summary
+
+    cluster_info = results["cluster_results"].get("cluster_info", {})
+    summary.update({
+        "cluster_count": int(results.get("cluster_count", 0) or 0),
+        "clusters": [
+            {"id": int(cluster_id), "name": info.get("name"), "count": int(info.get("count", 0))}
+            for cluster_id, info in cluster_info.items()
+        ],
+        "gallery_paths": results.get("gallery_paths", {}),
+        "output_dir": results.get("output_dir"),
+    })
+    return summary
+
+
+class AnalysisService:
+    """
+    常驻的分析服务
+
+    模型只加载和预热一次；每个工作线程持有一个共用嵌入后端、图库目录和检索索引的 ImageAnalyzer，
+    各自的解码进程池和缩略图缓存在任务之间复用，每个任务只付出扫描和处理本身的时间。
+    """
+
+    def __init__(self, config_path: str = "config.json", workers: int = None):
+        """
+        初始化服务（加载并预热模型，启动工作线程）
+
+        Args:
+            config_path: 配置文件路径
+            workers: 同时运行的任务数，None 时读取配置 service.workers
+        """
+        with open(config_path, 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+
+        service_config = self.config.get("service", {})
+        model_config = self.config.get("model", {})
+        self.workers = max(1, workers or service_config.get("workers", 2))
+        self.keep_jobs = service_config.get("keep_jobs", 200)
+
+        # 所有任务共用一个模型，同时到达的推理请求合并成批次
+        self.backend = BatchingBackend(
+            create_backend(model_config),
+            max_batch_size=service_config.get("max_batch_size", 0)
+            or model_config.get("max_batch_size", 256),
+            max_wait=service_config.get("batch_wait_ms", 10) / 1000.0,
+        )
+        self._analyzers = [
+            ImageAnalyzer(config_path, backend=self.backend) for _ in range(self.workers)
+        ]
+        for analyzer in self._analyzers[1:]:
+            analyzer.share_resources(self._analyzers[0])
+        self._analyzers[0].warm_up()
+
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()      # 任务ID -> 任务字典
+        self._cancel = {}               # 未结束任务的取消标记
+        self._next_id = 1
+        self._queue = queue.Queue()
+        self.started = _now()
+
+        self._threads = [
+            threading.Thread(
+                target=self._worker, args=(analyzer,), name=f"job-worker-{i}", daemon=True
+            )
+            for i, analyzer in enumerate(self._analyzers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, folder: str, output_dir: str = None, formats: List[str] = None,
+               n_clusters=None, algorithm: str = None, streaming: bool = None,
+               resume: bool = False) -> Dict:
+        """
+        提交处理任务
+
+        Args:
+            folder: 图片文件夹路径
+            output_dir: 输出目录
+            formats: 输出格式列表
+            n_clusters: 聚类数量（"auto" 为自动确定），None 时使用配置
+            algorithm: 聚类算法 kmeans/dbscan，None 时使用配置
+            streaming: 是否使用流式模式，None 时读取配置
+            resume: 是否从检查点继续
+
+        Returns:
+            任务字典
+
+        Raises:
+            ServiceError: 参数无效，或该文件夹已有未结束的任务
+        """
+        self._validate([folder], formats, algorithm, n_clusters)
+        return self._enqueue({
+            "kind": "folder",
+            "folder": os.path.abspath(folder),
+            "options": {
+                "output_dir": os.path.abspath(output_dir) if output_dir else None,
+                "formats": formats,
+                "n_clusters": n_clusters,
+                "algorithm": algorithm,
+                "streaming": streaming,
+                "resume": bool(resume),
+            },
+        })
+
+    def submit_batch(self, folders: List[str], output_root: str = None, formats: List[str] = None,
+                     n_clusters=None, algorithm: str = None) -> Dict:
+        """
+        提交批量任务：多个文件夹合并提取特征，再分别聚类和生成作品集（ImageAnalyzer.process_batch）
+
+        Args:
+            folders: 图片文件夹路径列表
+            output_root: 输出根目录，每个文件夹输出到其下以文件夹名命名的目录
+            formats: 输出格式列表
+            n_clusters: 聚类数量，None 时使用配置
+            algorithm: 聚类算法，None 时使用配置
+
+        Returns:
+            任务字典
+
+        Raises:
+            ServiceError: 参数无效，或其中的文件夹已有未结束的任务
+        """
+        if not folders or isinstance(folders, str):
+            raise ServiceError("folders 必须是非空的文件夹路径列表")
+        self._validate(folders, formats, algorithm, n_clusters)
+        return self._enqueue({
+            "kind": "batch",
+            "folders": [os.path.abspath(folder) for folder in folders],
+            "options": {
+                "output_root": os.path.abspath(output_root) if output_root else None,
+                "formats": formats,
+                "n_clusters": n_clusters,
+                "algorithm": algorithm,
+            },
+        })
+
+    @staticmethod
+    def _validate(folders: List[str], formats: Optional[List[str]], algorithm: Optional[str],
+                  n_clusters=None):
+        """检查任务参数"""
+        for folder in folders:
+            if not folder or not os.path.isdir(folder):
+                raise ServiceError(f"文件夹不存在: {folder}")
+        if formats is not None and (
+            not formats or any(item not in OUTPUT_FORMATS for item in formats)
+        ):
+            raise ServiceError(f"无效的输出格式: {formats}，可选: {', '.join(OUTPUT_FORMATS)}")
+        if algorithm is not None and algorithm not in ("kmeans", "dbscan"):
+            raise ServiceError(f"未知的聚类算法: {algorithm}")
+        # HTTP 客户端可能提交字符串或小数，分类器只接受正整数或 "auto"
+        if n_clusters is not None and n_clusters != "auto" and (
+                isinstance(n_clusters, bool) or not isinstance(n_clusters, int) or n_clusters < 1):
+            raise ServiceError(f"无效的聚类数量: {n_clusters!r}，应为正整数或 \"auto\"")
+
+    @staticmethod
+    def _job_folders(job: Dict) -> List[str]:
+        return job["folders"] if job["kind"] == "batch" else [job["folder"]]
+
+    def _enqueue(self, job: Dict) -> Dict:
+        """加入任务队列"""
+        with self._lock:
+            # 同一文件夹的检查点和输出状态不能被两个任务同时修改
+            busy = {
+                folder: item["id"] for item in self._jobs.values()
+                if item["status"] not in FINISHED_STATES for folder in self._job_folders(item)
+            }
+            for folder in self._job_folders(job):
+                if folder in busy:
+                    raise ServiceError(f"文件夹 {folder} 已有未结束的任务 #{busy[folder]}")
+
+            job = dict(
+                {"id": self._next_id},
+                **job,
+                status="queued",
+                progress={"current": 0, "total": 0, "message": "排队中"},
+                submitted=_now(),
+                started=None,
+                finished=None,
+                result=None,
+            )
+            self._next_id += 1
+            self._jobs[job["id"]] = job
+            self._cancel[job["id"]] = threading.Event()
+            snapshot = self._snapshot(job)
+
+        self._queue.put(job["id"])
+        return snapshot
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """任务状态，任务不存在时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job is not None else None
+
+    def list_jobs(self) -> List[Dict]:
+        """全部任务（最早提交的在前）"""
+        with self._lock:
+            return [self._snapshot(job) for job in self._jobs.values()]
+
+    def cancel(self, job_id: int) -> Optional[Dict]:
+        """
+        取消任务：排队中的任务直接取消，运行中的任务在下一次进度回调时停止
+
+        Returns:
+            任务字典，任务不存在时返回 None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                self._finish(job, "cancelled", {"success": False, "message": "任务已取消"})
+            elif job["status"] == "running":
+                self._cancel[job_id].set()
+            return self._snapshot(job)
+
+    def status(self) -> Dict:
+        """服务状态：任务数量、模型和批次合并统计"""
+        with self._lock:
+            counts = {state: 0 for state in JOB_STATES}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+        stats = dict(self.backend.stats)
+        stats["images_per_batch"] = (
+            round(stats["images"] / stats["batches"], 2) if stats["batches"] else 0
+        )
+        return {
+            "status": "ok",
+            "started": self.started,
+            "workers": self.workers,
+            "jobs": counts,
+            "backend": self.backend.name,
+            "device": str(getattr(self.backend, "device", "cpu")),
+            "batching": stats,
+        }
+
+    def close(self):
+        """停止服务：取消未结束的任务，等待工作线程退出"""
+        with self._lock:
+            for job in list(self._jobs.values()):
+                if job["status"] == "queued":
+                    self._finish(job, "cancelled", {"success": False, "message": "服务已停止"})
+                elif job["status"] == "running":
+                    self._cancel[job["id"]].set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.backend.close()
+
+    def _worker(self, analyzer: ImageAnalyzer):
+        """工作线程：依次执行队列中的任务"""
+        default_n_clusters = analyzer.classifier.n_clusters
+        default_algorithm = analyzer.classifier.algorithm
+
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                analyzer.feature_extractor.close()
+                return
+
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                job["status"] = "running"
+                job["started"] = _now()
+                cancel = self._cancel[job_id]
+                options = dict(job["options"])
+
+            analyzer.classifier.n_clusters = options["n_clusters"] or default_n_clusters
+            analyzer.classifier.algorithm = options["algorithm"] or default_algorithm
+
+            def progress_callback(current, total, message):
+                if cancel.is_set():
+                    raise InterruptedError("任务已取消")
+                with self._lock:
+                    job["progress"] = {"current": current, "total": total, "message": message}
+
+            try:
+                if job["kind"] == "batch":
+                    batch_results = analyzer.process_batch(
+                        job["folders"],
+                        options["output_root"],
+                        options["formats"],
+                        progress_callback,
+                    )
+                    folder_summaries = {
+                        folder: _summarize(results) for folder, results in batch_results.items()
+                    }
+                    state = "done"
+                    summary = {
+                        "success": True,
+                        "image_count": sum(
+                            item["image_count"] for item in folder_summaries.values()
+                        ),
+                        "folders": folder_summaries,
+                    }
+                else:
+                    results = analyzer.process_folder(
+                        job["folder"],
+                        options["output_dir"],
+                        options["formats"],
+                        progress_callback,
+                        resume=options["resume"],
+                        streaming=options["streaming"]
+                    )
+                    state = "done" if results.get("success") else "failed"
+                    summary = _summarize(results)
+            except InterruptedError:
+                state, summary = "cancelled", {"success": False, "message": "任务已取消"}
+            except Exception as e:
+                print(f"任务 #{job_id} 处理错误详情:\n{traceback.format_exc()}")
+                state, summary = "failed", {"success": False, "message": f"处理出错: {str(e)}"}
+
+            with self._lock:
+                self._finish(job, state, summary)
+
+    def _finish(self, job: Dict, state: str, summary: Dict):
+        """结束任务并清理过多的历史任务（调用方持有锁）"""
+        job["status"] = state
+        job["result"] = summary
+        job["finished"] = _now()
+        self._cancel.pop(job["id"], None)
+
+        finished = [
+            job_id for job_id, item in self._jobs.items() if item["status"] in FINISHED_STATES
+        ]
+        for job_id in finished[:max(0, len(finished) - self.keep_jobs)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _snapshot(job: Dict) -> Dict:
+        """任务字典的副本（不与工作线程共享可变的字段）"""
+        return dict(job, options=dict(job["options"]), progress=dict(job["progress"]))
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON 接口
+
+        GET    /health             服务状态
+        GET    /jobs               全部任务
+        POST   /jobs               提交任务 {"folder", "output_dir", "formats", "n_clusters", ...}
+                                   或批量任务 {"folders", "output_root", "formats", ...}
+        GET    /jobs/<id>          任务状态和结果
+        DELETE /jobs/<id>          取消任务
+    """
+
+    server_version = "GalleryGenerator/1.0"
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self._path_parts()
+        if parts == ["health"]:
+            self._send_json(200, service.status())
+        elif parts == ["jobs"]:
+            self._send_json(200, {"jobs": service.list_jobs()})
+        elif len(parts) == 2 and parts[0] == "jobs":
+            self._send_job(service.get_job(self._job_id(parts[1])))
+        else:
+            self._send_json(404, {"error": "未知的接口"})
+
+    def do_POST(self):
+        if self._path_parts() != ["jobs"]:
+            self._send_json(404, {"error": "未知的接口"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("请求体必须是 JSON 对象")
+            service = self.server.service
+            if "folders" in payload:
+                options = {
+                    key: payload[key]
+                    for key in ("output_root", "formats", "n_clusters", "algorithm")
+                    if key in payload
+                }
+                job = service.submit_batch(payload["folders"], **options)
+            else:
+                options = {
+                    key: payload[key]
+                    for key in (
+                        "output_dir",
+                        "formats",
+                        "n_clusters",
+                        "algorithm",
+                        "streaming",
+                        "resume",
+                    )
+                    if key in payload
+                }
+                job = service.submit(payload.get("folder"), **options)
+        except (ValueError, ServiceError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(201, job)
+
+    def do_DELETE(self):
+        parts = self._path_parts()
+        if len(parts) == 2 and parts[0] == "jobs":
+            self._send_job(self.server.service.cancel(self._job_id(parts[1])))
+        else:
+            self._send_json(404, {"error": "未知的接口"})
+
+    def _path_parts(self) -> List[str]:
+        return [part for part in self.path.split("?", 1)[0].split("/") if part]
+
+    @staticmethod
+    def _job_id(text: str) -> int:
+        return int(text) if text.isdigit() else -1
+
+    def _send_job(self, job: Optional[Dict]):
+        if job is None:
+            self._send_json(404, {"error": "任务不存在"})
+        else:
+            self._send_json(200, job)
+
+    def _send_json(self, code: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix 套接字的客户端没有地址
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format, *args):
+        # 客户端会频繁轮询任务状态，不逐条打印请求
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听 Unix 套接字的 HTTP 服务器"""
+
+    daemon_threads = True
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过 Unix 套接字连接的 HTTP 客户端连接"""
+
+    def __init__(self, socket_path: str, timeout: float = 30):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def create_server(service: AnalysisService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                  socket_path: str = None):
+    """
+    创建服务的 HTTP 服务器（调用 serve_forever 开始处理请求）
+
+    Args:
+        service: 分析服务
+        host: 监听地址（默认只接受本机连接）
+        port: 监听端口
+        socket_path: Unix 套接字路径，提供时不监听 TCP 端口
+
+    Returns:
+        服务器实例
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            # 上次未正常退出留下的套接字文件
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, _RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), _RequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(config_path: str = "config.json", host: str = None, port: int = None,
+          socket_path: str = None, workers: int = None):
+    """
+    启动服务并一直运行，直到按 Ctrl+C 或收到 SIGTERM
+
+    Args:
+        config_path: 配置文件路径
+        host: 监听地址，None 时读取配置 service.host
+        port: 监听端口，None 时读取配置 service.port
+        socket_path: Unix 套接字路径，None 时读取配置 service.socket（未配置则监听 TCP）
+        workers: 同时运行的任务数
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        service_config = json.load(f).get("service", {})
+    host = host or service_config.get("host", DEFAULT_HOST)
+    port = port or service_config.get("port", DEFAULT_PORT)
+    socket_path = socket_path or service_config.get("socket")
+
+    print("正在加载模型...")
+    start = time.perf_counter()
+    service = AnalysisService(config_path, workers)
+    server = create_server(service, host, port, socket_path)
+    address = (
+        f"unix://{socket_path}" if socket_path else f"http://{host}:{server.server_address[1]}"
+    )
+    print(f"分析服务已启动: {address}（{service.workers} 个工作线程，"
+          f"模型加载 {time.perf_counter() - start:.1f} 秒）")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("正在停止服务...")
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class ServiceClient:
+    """分析服务的客户端"""
+
+    def __init__(self, url: str = None, socket_path: str = None, timeout: float = 30):
+        """
+        初始化客户端
+
+        Args:
+            url: 服务地址，例如 http://127.0.0.1:8765
+            socket_path: Unix 套接字路径（提供时忽略 url）
+            timeout: 单个请求的超时时间（秒）
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        address = (url or f"http://{DEFAULT_HOST}:{DEFAULT_PORT}").split("://", 1)[-1].rstrip("/")
+        host, _, port = address.partition(":")
+        self.host = host
+        self.port = int(port) if port else DEFAULT_PORT
+
+    def _request(self, method: str, path: str, payload: Dict = None) -> Dict:
+        if self.socket_path:
+            connection = _UnixHTTPConnection(self.socket_path, self.timeout)
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = json.loads(response.read() or b"{}")
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            raise ServiceError(f"无法连接分析服务: {e}")
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise ServiceError(data.get("error", f"HTTP {response.status}"))
+        return data
+
+    def health(self) -> Dict:
+        """服务状态"""
+        return self._request("GET", "/health")
+
+    def submit(self, folder: str, output_dir: str = None, **options) -> Dict:
+        """
+        提交任务（路径转换为绝对路径，服务进程的工作目录可能不同）
+
+        Args:
+            folder: 图片文件夹路径
+            output_dir: 输出目录
+            options: formats / n_clusters / algorithm / streaming / resume
+
+        Returns:
+            任务字典
+        """
+        payload = {"folder": os.path.abspath(folder)}
+        if output_dir:
+            payload["output_dir"] = os.path.abspath(output_dir)
+        payload.update({key: value for key, value in options.items() if value is not None})
+        return self._request("POST", "/jobs", payload)
+
+    def submit_batch(self, folders: List[str], output_root: str = None, **options) -> Dict:
+        """
+        提交批量任务
+
+        Args:
+            folders: 图片文件夹路径列表
+            output_root: 输出根目录
+            options: formats / n_clusters / algorithm
+
+        Returns:
+            任务字典
+        """
+        payload = {"folders": [os.path.abspath(folder) for folder in folders]}
+        if output_root:
+            payload["output_root"] = os.path.abspath(output_root)
+        payload.update({key: value for key, value in options.items() if value is not None})
+        return self._request("POST", "/jobs", payload)
+
+    def job(self, job_id: int) -> Dict:
+        """任务状态和结果"""
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def jobs(self) -> List[Dict]:
+        """全部任务"""
+        return self._request("GET", "/jobs")["jobs"]
+
+    def cancel(self, job_id: int) -> Dict:
+        """取消任务"""
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    def wait(self, job_id: int, poll_interval: float = 0.5, progress_callback=None) -> Dict:
+        """
+        等待任务结束
+
+        Args:
+            job_id: 任务ID
+            poll_interval: 轮询间隔（秒）
+            progress_callback: 进度变化时调用 (current, total, message)
+
+        Returns:
+            结束时的任务字典
+        """
+        last = None
+        while True:
+            job = self.job(job_id)
+            progress = job["progress"]
+            if progress_callback and progress != last:
+                progress_callback(progress["current"], progress["total"], progress["message"])
+                last = progress
+            if job["status"] in FINISHED_STATES:
+                return job
+            time.sleep(poll_interval)
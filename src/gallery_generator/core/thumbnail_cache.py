@@ -0,0 +1,338 @@
+"""
+缩略图缓存模块
+按图片内容哈希保存多个尺寸档位的缩略图，在解码阶段一次生成，
+之后的特征提取、构图分析、PDF/HTML 输出和界面预览都直接读取，磁盘占用超出预算时按 LRU 淘汰
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    digest TEXT NOT NULL,
+    tier INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (digest, tier)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access);
+"""
+
+# 每个进程按配置复用一个缓存实例（工作进程中使用）
+_instances: Dict[tuple, "ThumbnailCache"] = {}
+
+
+def content_digest(image_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的 SHA1"""
+    sha1 = hashlib.sha1()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def create_thumbnail_cache(config: Dict) -> Optional["ThumbnailCache"]:
+    """
+    按配置创建缩略图缓存
+
+    Args:
+        config: 完整配置字典（读取 thumbnails 和 cache.dir）
+
+    Returns:
+        缩略图缓存，未启用时返回 None
+    """
+    thumbnails_config = config.get("thumbnails", {})
+    if not thumbnails_config.get("enabled", True):
+        return None
+    cache_dir = config.get("cache", {}).get("dir", ".gallery_cache")
+    return ThumbnailCache.from_spec({
+        "dir": thumbnails_config.get("dir", os.path.join(cache_dir, "thumbnails")),
+        "sizes": thumbnails_config.get("sizes", [128, 512, 1024]),
+        "budget_mb": thumbnails_config.get("budget_mb", 2048),
+        "quality": thumbnails_config.get("quality", 85),
+    })
+
+
+class ThumbnailCache:
+    """
+    缩略图缓存
+
+    文件按 <目录>/<档位>/<哈希前两位>/<内容哈希>.jpg 保存，索引数据库记录路径到内容哈希的映射
+    （大小和修改时间不变时不重新计算哈希）以及各缩略图的大小和最近访问时间。
+    多个进程可以同时使用同一个缓存目录。
+    """
+
+    def __init__(self, cache_dir: str, sizes: List[int] = (128, 512, 1024),
+                 budget_mb: float = 2048, quality: int = 85):
+        """
+        初始化缩略图缓存
+
+        Args:
+            cache_dir: 缓存目录
+            sizes: 尺寸档位（最长边像素）
+            budget_mb: 磁盘占用上限（MB）
+            quality: JPEG 质量
+        """
+        self.cache_dir = cache_dir
+        self.sizes = sorted(int(size) for size in sizes)
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.quality = quality
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"),
+                                     timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._pending_touches: Dict[tuple, float] = {}
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM entries"
+        ).fetchone()[0]
+
+    @classmethod
+    def from_spec(cls, spec: Dict) -> "ThumbnailCache":
+        """按配置字典获取缓存实例（同一进程内复用）"""
+        key = (os.getpid(), spec["dir"], tuple(spec["sizes"]), spec["budget_mb"], spec["quality"])
+        if key not in _instances:
+            _instances[key] = cls(spec["dir"], spec["sizes"], spec["budget_mb"], spec["quality"])
+        return _instances[key]
+
+    @property
+    def spec(self) -> Dict:
+        """可在进程间传递的配置字典"""
+        return {
+            "dir": self.cache_dir,
+            "sizes": list(self.sizes),
+            "budget_mb": self.budget_bytes / (1024 * 1024),
+            "quality": self.quality,
+        }
+
+    def close(self):
+        """保存未写入的访问记录并关闭索引"""
+        with self._lock:
+            self._flush_touches()
+            self._conn.close()
+
+    # ---- 查找 ----
+
+    def digest(self, image_path: str) -> Optional[str]:
+        """图片的内容哈希（文件未变化时直接读取索引），文件不存在时返回 None"""
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        path = os.path.abspath(image_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, digest FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = content_digest(image_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, digest)
+            )
+            self._conn.commit()
+        return digest
+
+    def tier_for(self, size: int) -> int:
+        """不小于 size 的最小档位（超过最大档位时为最大档位）"""
+        for tier in self.sizes:
+            if tier >= size:
+                return tier
+        return self.sizes[-1]
+
+    def _file_path(self, digest: str, tier: int) -> str:
+        return os.path.join(self.cache_dir, str(tier), digest[:2], digest + ".jpg")
+
+    def get_path(self, image_path: str, size: int) -> Optional[str]:
+        """
+        查找缩略图文件
+
+        Args:
+            image_path: 原图路径
+            size: 需要的最长边
+
+        Returns:
+            缩略图文件路径，不存在时返回 None
+        """
+        digest = self.digest(image_path)
+        if digest is None:
+            return None
+        tier = self.tier_for(size)
+        path = self._file_path(digest, tier)
+        if not os.path.exists(path):
+            return None
+        self._touch(digest, tier)
+        return path
+
+    def get(self, image_path: str, size: int) -> Optional[Image.Image]:
+        """
+        读取缩略图
+
+        Args:
+            image_path: 原图路径
+            size: 需要的最长边
+
+        Returns:
+            已加载的 PIL 图片（最长边为档位大小，原图更小时为原图大小），不存在时返回 None
+        """
+        path = self.get_path(image_path, size)
+        if path is None:
+            return None
+        try:
+            with Image.open(path) as img:
+                img.load()
+                return img
+        except OSError:
+            return None
+
+    def get_or_create_path(self, image_path: str, size: int) -> Optional[str]:
+        """
+        查找缩略图文件，不存在时解码原图生成
+
+        Returns:
+            缩略图文件路径，原图无法读取时返回 None
+        """
+        path = self.get_path(image_path, size)
+        if path is not None:
+            return path
+
+        tier = self.tier_for(size)
+        try:
+            with Image.open(image_path) as img:
+                complete = max(img.size) <= tier
+                img.draft("RGB", (tier, tier))
+                rgb = img.convert("RGB")
+        except Exception as e:
+            print(f"生成缩略图失败 {image_path}: {e}")
+            return None
+        self.put(image_path, rgb, complete=complete)
+        return self.get_path(image_path, size)
+
+    def get_or_create(self, image_path: str, size: int) -> Optional[Image.Image]:
+        """读取缩略图，不存在时解码原图生成"""
+        path = self.get_or_create_path(image_path, size)
+        if path is None:
+            return None
+        with Image.open(path) as img:
+            img.load()
+            return img
+
+    # ---- 写入和淘汰 ----
+
+    def put(self, image_path: str, image: Image.Image, complete: bool = False):
+        """
+        由已解码的图片生成各档位缩略图
+
+        只生成不超过该图片尺寸的档位；complete 为 True（图片即原图大小）时，
+        更大的档位直接保存原图大小的图片。
+
+        Args:
+            image_path: 原图路径
+            image: 已解码的图片（可以是降采样后的）
+            complete: image 是否为原图的完整分辨率
+        """
+        digest = self.digest(image_path)
+        if digest is None:
+            return
+
+        rgb = image if image.mode == "RGB" else image.convert("RGB")
+        long_side = max(rgb.size)
+        written = []
+        for tier in sorted(self.sizes, reverse=True):
+            if long_side < tier and not complete:
+                continue
+            path = self._file_path(digest, tier)
+            if os.path.exists(path):
+                continue
+            if long_side > tier:
+                rgb = rgb.copy()
+                rgb.thumbnail((tier, tier), Image.BICUBIC)
+                long_side = max(rgb.size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            rgb.save(tmp_path, "JPEG", quality=self.quality)
+            os.replace(tmp_path, path)
+            written.append((digest, tier, os.path.getsize(path), time.time()))
+
+        if not written:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (digest, tier, bytes, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                written,
+            )
+            self._conn.commit()
+            self._total_bytes += sum(entry[2] for entry in written)
+            if self._total_bytes > self.budget_bytes:
+                self.evict()
+
+    def _touch(self, digest: str, tier: int):
+        """记录访问时间（先保存在内存中，攒够一批再写入，不长时间占用数据库写锁）"""
+        with self._lock:
+            self._pending_touches[(digest, tier)] = time.time()
+            if len(self._pending_touches) >= 256:
+                self._flush_touches()
+
+    def _flush_touches(self):
+        """写入内存中的访问记录"""
+        with self._lock:
+            if not self._pending_touches:
+                return
+            self._conn.executemany(
+                "UPDATE entries SET last_access = ? WHERE digest = ? AND tier = ?",
+                [
+                    (accessed, digest, tier)
+                    for (digest, tier), accessed in self._pending_touches.items()
+                ],
+            )
+            self._conn.commit()
+            self._pending_touches = {}
+
+    def evict(self, target_ratio: float = 0.9):
+        """
+        按最近访问时间淘汰缩略图，直到磁盘占用不超过预算的 target_ratio
+
+        Args:
+            target_ratio: 淘汰后的目标占用比例
+        """
+        with self._lock:
+            self._flush_touches()
+            total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+            target = self.budget_bytes * target_ratio
+            removed = []
+            if total > target:
+                for digest, tier, size in self._conn.execute(
+                        "SELECT digest, tier, bytes FROM entries ORDER BY last_access"):
+                    if total <= target:
+                        break
+                    removed.append((digest, tier))
+                    total -= size
+
+            for digest, tier in removed:
+                try:
+                    os.remove(self._file_path(digest, tier))
+                except OSError:
+                    pass
+            self._conn.executemany("DELETE FROM entries WHERE digest = ? AND tier = ?", removed)
+            self._conn.commit()
+            self._total_bytes = total
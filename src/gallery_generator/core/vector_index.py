@@ -0,0 +1,450 @@
+"""
+向量索引模块
+基于已提取的图像特征构建可持久化、可增量更新的相似度检索索引（仅 CPU）
+"""
+
+import functools
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+INDEX_KINDS = ("flat", "ivf", "hnsw")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _locked(method):
+    """公开方法在实例锁内执行，多个线程（例如服务模式的多个任务）可以共用一个索引"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class VectorIndex:
+    """
+    图像特征向量索引
+
+    - flat: 精确检索，分块扫描全部向量
+    - ivf: 倒排文件索引，先用 KMeans 将向量划分到若干列表，查询时只扫描最近的 nprobe 个列表
+    - hnsw: 基于 hnswlib 的图索引（可选依赖）
+
+    向量以 float16 追加写入磁盘并通过内存映射读取，同一路径重复加入时旧向量会被标记删除。
+    """
+
+    def __init__(self, index_dir: str, kind: str = "ivf", nprobe: int = 16,
+                 min_train_size: int = 10000, chunk_size: int = 65536,
+                 embedding_key: Optional[str] = None):
+        """
+        初始化索引（目录中已有索引时自动加载）
+
+        Args:
+            index_dir: 索引目录
+            kind: 索引类型 flat / ivf / hnsw
+            nprobe: IVF 查询时扫描的列表数
+            min_train_size: 向量数达到该值后才训练 IVF，之前退化为精确检索
+            chunk_size: 精确检索时每块的向量数
+            embedding_key: 特征来源（后端、模型和精度），与已有索引不一致时重新构建，
+                避免不同模型的向量混在同一个索引中
+        """
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"未知的索引类型: {kind}，可选: {', '.join(INDEX_KINDS)}")
+
+        self.index_dir = index_dir
+        self.kind = kind
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.chunk_size = chunk_size
+        self.embedding_key = embedding_key
+
+        self.meta_path = os.path.join(index_dir, "meta.json")
+        self.vectors_path = os.path.join(index_dir, "vectors.f16")
+        self.paths_path = os.path.join(index_dir, "paths.txt")
+        self.deleted_path = os.path.join(index_dir, "deleted.npy")
+        self.centroids_path = os.path.join(index_dir, "ivf_centroids.npy")
+        self.assign_path = os.path.join(index_dir, "ivf_assign.i32")
+        self.hnsw_path = os.path.join(index_dir, "hnsw.bin")
+
+        self.dim: Optional[int] = None
+        self.paths: List[str] = []
+        self.path_to_id: Dict[str, int] = {}
+        self.deleted = np.zeros(0, dtype=bool)
+        self.trained_count = 0
+
+        self._vectors: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: Dict[int, np.ndarray] = {}
+        self._hnsw = None
+        self._lock = threading.RLock()
+
+        os.makedirs(index_dir, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.paths) - int(self.deleted.sum())
+
+    # ---- 持久化 ----
+
+    def _load(self):
+        """从索引目录加载"""
+        if not os.path.exists(self.meta_path):
+            return
+
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("kind") != self.kind:
+            print(f"索引类型由 {meta.get('kind')} 变为 {self.kind}，需要重新构建")
+            self.clear()
+            return
+        if self.embedding_key is not None and meta.get("embedding_key") != self.embedding_key:
+            print(
+                f"特征模型由 {meta.get('embedding_key')} 变为 {self.embedding_key}，"
+                "需要重新构建索引"
+            )
+            self.clear()
+            return
+
+        self.dim = meta["dim"]
+        self.trained_count = meta.get("trained_count", 0)
+        if not self._truncate(meta["count"]):
+            print("索引文件不完整，需要重新构建")
+            self.clear()
+            return
+
+        with open(self.paths_path, 'r', encoding='utf-8') as f:
+            self.paths = f.read().splitlines()
+        self.path_to_id = {path: i for i, path in enumerate(self.paths)}
+
+        self.deleted = np.zeros(len(self.paths), dtype=bool)
+        if os.path.exists(self.deleted_path):
+            saved = np.load(self.deleted_path)
+            self.deleted[:len(saved)] = saved[:len(self.paths)]
+        for i in np.flatnonzero(self.deleted):
+            if self.path_to_id.get(self.paths[i]) == i:
+                del self.path_to_id[self.paths[i]]
+
+        self._map_vectors()
+
+        if self.kind == "ivf" and self.trained_count and os.path.exists(self.centroids_path):
+            self._centroids = np.load(self.centroids_path)
+            assign = np.fromfile(self.assign_path, dtype=np.int32)[:len(self.paths)]
+            self._build_lists(assign)
+        elif self.kind == "hnsw" and os.path.exists(self.hnsw_path):
+            self._hnsw = self._new_hnsw(max(len(self.paths), 1024))
+            self._hnsw.load_index(self.hnsw_path, max_elements=max(len(self.paths), 1024))
+            if self._hnsw.get_current_count() != len(self.paths):
+                # 图索引在元数据之前保存，中断后可能包含未提交的向量
+                self._rebuild_hnsw()
+
+    def _truncate(self, count: int) -> bool:
+        """
+        将追加写入的文件截断到元数据记录的数量
+
+        加入向量时依次写入 vectors.f16、paths.txt（以及 IVF 划分），最后写 meta.json，
+        中途中断会在文件末尾留下未提交的记录，之后的追加会与路径错位。
+
+        Returns:
+            文件是否至少包含 count 条记录
+        """
+        if count == 0:
+            for path in (self.vectors_path, self.paths_path, self.assign_path):
+                if os.path.exists(path):
+                    os.truncate(path, 0)
+            return True
+
+        vector_bytes = count * self.dim * np.dtype(np.float16).itemsize
+        if (
+            not os.path.exists(self.vectors_path)
+            or os.path.getsize(self.vectors_path) < vector_bytes
+        ):
+            return False
+        if os.path.getsize(self.vectors_path) > vector_bytes:
+            os.truncate(self.vectors_path, vector_bytes)
+
+        if not os.path.exists(self.paths_path):
+            return False
+        with open(self.paths_path, 'rb') as f:
+            data = f.read()
+        end = 0
+        for _ in range(count):
+            end = data.find(b"\n", end) + 1
+            if end == 0:
+                return False
+        if end < len(data):
+            os.truncate(self.paths_path, end)
+
+        assign_bytes = count * np.dtype(np.int32).itemsize
+        if os.path.exists(self.assign_path) and os.path.getsize(self.assign_path) > assign_bytes:
+            os.truncate(self.assign_path, assign_bytes)
+        return True
+
+    def _map_vectors(self):
+        if self.dim and self.paths:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r',
+                                      shape=(len(self.paths), self.dim))
+        else:
+            self._vectors = None
+
+    def _save_meta(self):
+        meta = {
+            "kind": self.kind,
+            "dim": self.dim,
+            "count": len(self.paths),
+            "trained_count": self.trained_count,
+            "embedding_key": self.embedding_key,
+        }
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    @_locked
+    def clear(self):
+        """清空索引"""
+        for path in (self.meta_path, self.vectors_path, self.paths_path, self.deleted_path,
+                     self.centroids_path, self.assign_path, self.hnsw_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.dim = None
+        self.paths = []
+        self.path_to_id = {}
+        self.deleted = np.zeros(0, dtype=bool)
+        self.trained_count = 0
+        self._vectors = None
+        self._centroids = None
+        self._lists = {}
+        self._hnsw = None
+
+    # ---- 写入 ----
+
+    @_locked
+    def add(self, features: np.ndarray, image_paths: List[str]):
+        """
+        增量加入向量；已存在的路径会替换旧向量
+
+        Args:
+            features: 特征向量数组 (N, D)
+            image_paths: 对应的图片路径
+        """
+        if len(image_paths) == 0:
+            return
+
+        vectors = _normalize(features)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"特征维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致")
+
+        start_id = len(self.paths)
+        new_ids = np.arange(start_id, start_id + len(image_paths))
+
+        # 标记被替换的旧向量
+        replaced = [self.path_to_id[path] for path in image_paths if path in self.path_to_id]
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(image_paths), dtype=bool)])
+        if replaced:
+            self.deleted[replaced] = True
+
+        with open(self.vectors_path, 'ab') as f:
+            vectors.astype(np.float16).tofile(f)
+        with open(self.paths_path, 'a', encoding='utf-8') as f:
+            f.writelines(path + "\n" for path in image_paths)
+
+        self.paths.extend(image_paths)
+        for path, i in zip(image_paths, new_ids):
+            self.path_to_id[path] = int(i)
+        self._map_vectors()
+
+        if self.kind == "ivf":
+            if self._centroids is None or len(self.paths) >= self.trained_count * 4:
+                # 尚未训练或数据量已增长数倍时重新训练
+                self._train_ivf()
+            else:
+                assign = self._assign(vectors)
+                with open(self.assign_path, 'ab') as f:
+                    assign.astype(np.int32).tofile(f)
+                self._extend_lists(assign, new_ids)
+        elif self.kind == "hnsw":
+            self._add_hnsw(vectors, new_ids, replaced)
+
+        np.save(self.deleted_path, self.deleted)
+        self._save_meta()
+
+    @_locked
+    def remove(self, image_paths: List[str]):
+        """从索引中删除图片"""
+        ids = [self.path_to_id.pop(path) for path in image_paths if path in self.path_to_id]
+        if not ids:
+            return
+        self.deleted[ids] = True
+        if self._hnsw is not None:
+            for i in ids:
+                self._hnsw.mark_deleted(i)
+            self._hnsw.save_index(self.hnsw_path)
+        np.save(self.deleted_path, self.deleted)
+
+    # ---- IVF ----
+
+    def _train_ivf(self):
+        """训练 IVF 粗量化器并重新划分所有向量"""
+        live = np.flatnonzero(~self.deleted)
+        if len(live) < self.min_train_size:
+            self._centroids = None
+            self._lists = {}
+            self.trained_count = 0
+            return
+
+        nlist = int(min(4096, max(16, np.sqrt(len(live)))))
+        rng = np.random.default_rng(42)
+        sample = np.sort(rng.choice(live, min(len(live), nlist * 64), replace=False))
+        self._centroids = self._spherical_kmeans(
+            np.asarray(self._vectors[sample], dtype=np.float32), nlist, rng
+        )
+        np.save(self.centroids_path, self._centroids)
+
+        assign = np.empty(len(self.paths), dtype=np.int32)
+        for start in range(0, len(self.paths), self.chunk_size):
+            chunk = np.asarray(self._vectors[start:start + self.chunk_size], dtype=np.float32)
+            assign[start:start + len(chunk)] = self._assign(chunk)
+        assign.tofile(self.assign_path)
+
+        self._build_lists(assign)
+        self.trained_count = len(self.paths)
+
+    @staticmethod
+    def _spherical_kmeans(vectors: np.ndarray, n_clusters: int, rng,
+                          n_iter: int = 10) -> np.ndarray:
+        """单位球面上的 KMeans（余弦距离），固定迭代次数以控制训练耗时"""
+        centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            empty = ~np.any(sums, axis=1)
+            # 空列表重新随机选取中心
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+        return centroids
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _build_lists(self, assign: np.ndarray):
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self._centroids) + 1))
+        self._lists = {
+            list_id: order[bounds[list_id]:bounds[list_id + 1]]
+            for list_id in range(len(self._centroids))
+            if bounds[list_id + 1] > bounds[list_id]
+        }
+
+    def _extend_lists(self, assign: np.ndarray, ids: np.ndarray):
+        for list_id in np.unique(assign):
+            added = ids[assign == list_id]
+            existing = self._lists.get(int(list_id))
+            self._lists[int(list_id)] = (
+                added if existing is None else np.concatenate([existing, added])
+            )
+
+    # ---- HNSW ----
+
+    def _new_hnsw(self, max_elements: int):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("hnsw 索引需要安装 hnswlib: pip install hnswlib")
+
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=max_elements, ef_construction=200, M=16)
+        return index
+
+    def _add_hnsw(self, vectors: np.ndarray, ids: np.ndarray, replaced: List[int]):
+        if self._hnsw is None:
+            self._hnsw = self._new_hnsw(max(len(self.paths) * 2, 1024))
+        elif self._hnsw.get_max_elements() < len(self.paths):
+            self._hnsw.resize_index(len(self.paths) * 2)
+        self._hnsw.add_items(vectors, ids)
+        for i in replaced:
+            self._hnsw.mark_deleted(i)
+        self._hnsw.save_index(self.hnsw_path)
+
+    def _rebuild_hnsw(self):
+        """根据已提交的向量重新构建图索引"""
+        self._hnsw = self._new_hnsw(max(len(self.paths) * 2, 1024))
+        for start in range(0, len(self.paths), self.chunk_size):
+            chunk = np.asarray(self._vectors[start:start + self.chunk_size], dtype=np.float32)
+            self._hnsw.add_items(chunk, np.arange(start, start + len(chunk)))
+        for i in np.flatnonzero(self.deleted):
+            self._hnsw.mark_deleted(int(i))
+        self._hnsw.save_index(self.hnsw_path)
+
+    # ---- 查询 ----
+
+    @_locked
+    def search(self, query: np.ndarray, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        查询与给定向量最相似的图片
+
+        Args:
+            query: 查询向量 (D,)
+            k: 返回数量
+
+        Returns:
+            [(图片路径, 余弦相似度)]，按相似度降序
+        """
+        if self._vectors is None or len(self) == 0:
+            return []
+
+        query = _normalize(query)[0]
+
+        if self.kind == "hnsw" and self._hnsw is not None:
+            self._hnsw.set_ef(max(k * 2, 50))
+            labels, distances = self._hnsw.knn_query(query, k=min(k, len(self)))
+            return [(self.paths[i], float(1 - d)) for i, d in zip(labels[0], distances[0])]
+
+        if self.kind == "ivf" and self._centroids is not None:
+            probe = np.argsort(-(self._centroids @ query))[:self.nprobe]
+            candidates = [self._lists[int(p)] for p in probe if int(p) in self._lists]
+            ids = np.sort(np.concatenate(candidates)) if candidates else np.zeros(0, dtype=np.int64)
+            ids = ids[~self.deleted[ids]]
+            scores = np.asarray(self._vectors[ids], dtype=np.float32) @ query
+            return self._top_k(ids, scores, k)
+
+        # 精确检索
+        best_ids = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self.paths), self.chunk_size):
+            chunk = np.asarray(self._vectors[start:start + self.chunk_size], dtype=np.float32)
+            scores = chunk @ query
+            scores[self.deleted[start:start + len(chunk)]] = -np.inf
+            ids = np.arange(start, start + len(chunk))
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+                ids, scores = ids[top], scores[top]
+            best_ids = np.concatenate([best_ids, ids])
+            best_scores = np.concatenate([best_scores, scores])
+        keep = np.isfinite(best_scores)
+        return self._top_k(best_ids[keep], best_scores[keep], k)
+
+    def _top_k(self, ids: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        if len(ids) > k:
+            top = np.argpartition(-scores, k)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores)
+        return [(self.paths[int(ids[i])], float(scores[i])) for i in order]
+
+    @_locked
+    def get_vector(self, image_path: str) -> Optional[np.ndarray]:
+        """获取已索引图片的向量，不存在时返回 None"""
+        i = self.path_to_id.get(image_path)
+        if i is None:
+            return None
+        return np.asarray(self._vectors[i], dtype=np.float32)
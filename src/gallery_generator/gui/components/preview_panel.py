@@ -2,16 +2,25 @@
 预览面板组件
 """
 
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QTextEdit, QPushButton
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QTextEdit, QPushButton, QSplitter
 from PyQt5.QtCore import Qt
 import os
 
+from gallery_generator.gui.components.thumbnail_grid import ThumbnailGrid
+
 
 class PreviewPanel(QWidget):
     """预览面板"""
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, thumbnail_config: dict = None):
+        """
+        初始化预览面板
+        
+        Args:
+            thumbnail_config: 缩略图网格配置（size/workers/cache_items）
+        """
         super().__init__(parent)
+        self.thumbnail_config = thumbnail_config or {}
         self.init_ui()
     
     def init_ui(self):
@@ -24,17 +33,39 @@ class PreviewPanel(QWidget):
         self.preview_text = QTextEdit()
         self.preview_text.setReadOnly(True)
         
+        # 各类别的缩略图（虚拟化列表，只加载可见项）
+        self.thumbnail_grid = ThumbnailGrid(
+            size=self.thumbnail_config.get("size", 128),
+            workers=self.thumbnail_config.get("workers", 4),
+            cache_items=self.thumbnail_config.get("cache_items", 2000)
+        )
+        
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.preview_text)
+        splitter.addWidget(self.thumbnail_grid)
+        splitter.setStretchFactor(0, 1)
+        splitter.setStretchFactor(1, 3)
+        
         self.open_folder_btn = QPushButton("打开输出文件夹")
         self.open_folder_btn.setEnabled(False)
         self.open_folder_btn.clicked.connect(self.open_output_folder)
         
         layout.addWidget(title)
-        layout.addWidget(self.preview_text)
+        layout.addWidget(splitter)
         layout.addWidget(self.open_folder_btn)
         
         self.setLayout(layout)
         self.output_dir = None
     
+    def set_thumbnail_source(self, load_func):
+        """
+        设置读取缩略图的函数
+        
+        Args:
+            load_func: (路径, 尺寸) -> PIL 图片，例如 ImageAnalyzer.get_thumbnail
+        """
+        self.thumbnail_grid.set_load_func(load_func)
+    
     def show_results(self, results: dict):
         """
         显示处理结果
@@ -56,8 +87,11 @@ class PreviewPanel(QWidget):
             for cluster_id, info in cluster_info.items():
                 text += f"  • {info.get('name', '未知')}: {info.get('count', 0)} 张图片\n"
             
-            text += "\n生成的作品集:\n"
             gallery_paths = results.get("gallery_paths", {})
+            if not gallery_paths:
+                text += "\n尚未生成作品集（点击“生成作品集”按当前类别生成）\n"
+            else:
+                text += "\n生成的作品集:\n"
             if "html" in gallery_paths:
                 text += f"  • HTML: {gallery_paths['html']}\n"
             if "pdf" in gallery_paths:
@@ -66,10 +100,12 @@ class PreviewPanel(QWidget):
                 text += f"  • 文件夹: {gallery_paths['folder']}\n"
             
             self.output_dir = results.get("output_dir")
-            self.open_folder_btn.setEnabled(True)
+            self.open_folder_btn.setEnabled(bool(self.output_dir))
+            self.thumbnail_grid.set_cluster_results(cluster_results)
         else:
             text = f"✗ 处理失败: {results.get('message', '未知错误')}"
             self.open_folder_btn.setEnabled(False)
+            self.thumbnail_grid.clear()
         
         self.preview_text.setPlainText(text)
     
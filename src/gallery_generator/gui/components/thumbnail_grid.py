@@ -0,0 +1,338 @@
+"""
+缩略图网格组件
+按类别显示图片缩略图：列表视图只为可见项请求缩略图，缩略图在后台线程池中读取，
+界面线程只做内存查找，图片数量很多时滚动也不会卡顿
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QListView
+from PyQt5.QtCore import (Qt, QObject, QRunnable, QThreadPool, QAbstractListModel, QModelIndex,
+                          QSize, QTimer, QUrl, pyqtSignal)
+from PyQt5.QtGui import QColor, QDesktopServices, QImage, QPixmap
+
+
+class _LoadTask(QRunnable):
+    """线程池任务：读取一张待加载的缩略图"""
+
+    def __init__(self, loader: "ThumbnailLoader"):
+        super().__init__()
+        self.loader = loader
+
+    def run(self):
+        self.loader._load_next()
+
+
+class ThumbnailLoader(QObject):
+    """
+    异步缩略图加载器
+
+    待加载的请求按后进先出处理（最近滚动到的图片优先），已滚出视图的请求可以用 retain 丢弃。
+    加载好的缩略图以 QPixmap 保存在容量有限的 LRU 内存缓存中。
+    """
+
+    # 工作线程读取完成（内部使用，排队到界面线程处理）
+    _image_loaded = pyqtSignal(str, QImage)
+    # 缩略图可用（界面线程）
+    pixmap_ready = pyqtSignal(str)
+
+    def __init__(self, load_func: Callable = None, size: int = 128, workers: int = 4,
+                 cache_items: int = 2000, parent=None):
+        """
+        初始化加载器
+
+        Args:
+            load_func: 读取缩略图的函数 (路径, 尺寸) -> PIL 图片或 None，
+                例如 ImageAnalyzer.get_thumbnail
+            size: 缩略图最长边
+            workers: 后台读取线程数
+            cache_items: 内存中保留的缩略图数量
+        """
+        super().__init__(parent)
+        self.load_func = load_func
+        self.size = size
+        self.cache_items = cache_items
+
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max(1, workers))
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()    # 路径 -> None，最新的请求在末尾
+        self._in_flight = set()
+        self._cache = OrderedDict()      # 路径 -> QPixmap（仅在界面线程访问）
+        self._failed = set()
+        self._image_loaded.connect(self._on_image_loaded)
+
+    def pixmap(self, path: str) -> Optional[QPixmap]:
+        """内存中的缩略图，没有时返回 None"""
+        pixmap = self._cache.get(path)
+        if pixmap is not None:
+            self._cache.move_to_end(path)
+        return pixmap
+
+    def is_failed(self, path: str) -> bool:
+        """该图片的缩略图是否读取失败"""
+        return path in self._failed
+
+    def request(self, path: str):
+        """请求加载缩略图（已在内存、正在加载或已失败时忽略）"""
+        if self.load_func is None or path in self._cache or path in self._failed:
+            return
+        with self._lock:
+            if path in self._in_flight:
+                return
+            if path in self._pending:
+                self._pending.move_to_end(path)
+                return
+            self._pending[path] = None
+        self._pool.start(_LoadTask(self))
+
+    def retain(self, paths: Iterable[str]):
+        """丢弃不在 paths 中的待加载请求（例如已滚出视图的图片）"""
+        keep = set(paths)
+        with self._lock:
+            for path in [path for path in self._pending if path not in keep]:
+                del self._pending[path]
+
+    def clear_pending(self):
+        """丢弃所有待加载请求"""
+        with self._lock:
+            self._pending.clear()
+
+    def shutdown(self):
+        """丢弃待加载请求并等待正在读取的任务结束"""
+        self.clear_pending()
+        self._pool.waitForDone()
+
+    def _load_next(self):
+        """在工作线程中读取最新的一个请求"""
+        with self._lock:
+            if not self._pending:
+                return
+            path, _ = self._pending.popitem(last=True)
+            self._in_flight.add(path)
+
+        image = QImage()
+        try:
+            thumbnail = self.load_func(path, self.size)
+            if thumbnail is not None:
+                rgba = thumbnail.convert("RGBA")
+                data = rgba.tobytes("raw", "RGBA")
+                # copy 使 QImage 拥有自己的数据，不依赖 data 的生命周期
+                image = QImage(
+                    data, rgba.width, rgba.height, rgba.width * 4, QImage.Format_RGBA8888
+                ).copy()
+        except Exception as e:
+            print(f"读取缩略图失败 {path}: {e}")
+        self._image_loaded.emit(path, image)
+
+    def _on_image_loaded(self, path: str, image: QImage):
+        """界面线程：转换为 QPixmap 并放入内存缓存"""
+        with self._lock:
+            self._in_flight.discard(path)
+        if image.isNull():
+            self._failed.add(path)
+        else:
+            self._cache[path] = QPixmap.fromImage(image)
+            while len(self._cache) > self.cache_items:
+                self._cache.popitem(last=False)
+        self.pixmap_ready.emit(path)
+
+
+class ClusterImageModel(QAbstractListModel):
+    """
+    一个类别的图片列表模型
+
+    只保存路径，视图请求某一项的图标时才向加载器请求缩略图，
+    缩略图到达前显示占位图。
+    """
+
+    PathRole = Qt.UserRole + 1
+
+    def __init__(self, loader: ThumbnailLoader, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        self._paths: List[str] = []
+        self._rows: Optional[Dict[str, int]] = None
+        self._placeholder = self._solid_pixmap(QColor("#e0e0e0"))
+        self._broken = self._solid_pixmap(QColor("#f3c1c1"))
+        loader.pixmap_ready.connect(self._on_pixmap_ready)
+
+    def _solid_pixmap(self, color: QColor) -> QPixmap:
+        pixmap = QPixmap(self.loader.size, self.loader.size)
+        pixmap.fill(color)
+        return pixmap
+
+    def set_paths(self, paths: List[str]):
+        """替换显示的图片"""
+        self.beginResetModel()
+        self._paths = list(paths)
+        self._rows = None
+        self.endResetModel()
+
+    def path(self, row: int) -> str:
+        return self._paths[row]
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._paths)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self._paths[index.row()]
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        if role == Qt.ToolTipRole:
+            return path
+        if role == self.PathRole:
+            return path
+        if role == Qt.DecorationRole:
+            pixmap = self.loader.pixmap(path)
+            if pixmap is not None:
+                return pixmap
+            if self.loader.is_failed(path):
+                return self._broken
+            self.loader.request(path)
+            return self._placeholder
+        return None
+
+    def _on_pixmap_ready(self, path: str):
+        # 路径到行号的映射在第一次需要时建立
+        if self._rows is None:
+            self._rows = {item: row for row, item in enumerate(self._paths)}
+        row = self._rows.get(path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class ThumbnailGrid(QWidget):
+    """按类别浏览缩略图的网格"""
+
+    def __init__(self, parent=None, size: int = 128, workers: int = 4, cache_items: int = 2000):
+        """
+        初始化缩略图网格
+
+        Args:
+            size: 缩略图最长边
+            workers: 后台读取线程数
+            cache_items: 内存中保留的缩略图数量
+        """
+        super().__init__(parent)
+        self.loader = ThumbnailLoader(
+            size=size, workers=workers, cache_items=cache_items, parent=self
+        )
+        self.model = ClusterImageModel(self.loader, self)
+        self.cluster_results = None
+        self.cluster_ids = []
+        self.init_ui()
+
+    def init_ui(self):
+        """初始化UI"""
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        header = QHBoxLayout()
+        header.addWidget(QLabel("类别:"))
+        self.cluster_combo = QComboBox()
+        self.cluster_combo.currentIndexChanged.connect(self.show_cluster)
+        header.addWidget(self.cluster_combo, 1)
+
+        size = self.loader.size
+        self.view = QListView()
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setMovement(QListView.Static)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setFlow(QListView.LeftToRight)
+        self.view.setWrapping(True)
+        self.view.setSpacing(6)
+        self.view.setIconSize(QSize(size, size))
+        self.view.setGridSize(QSize(size + 16, size + 32))
+        # 所有项尺寸相同，视图无需逐项计算布局，只查询可见项的数据
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(500)
+        self.view.setModel(self.model)
+        self.view.doubleClicked.connect(self.open_image)
+
+        # 停止滚动后丢弃已滚出视图的加载请求
+        self._scroll_timer = QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(80)
+        self._scroll_timer.timeout.connect(self._retain_visible)
+        self.view.verticalScrollBar().valueChanged.connect(self._scroll_timer.start)
+
+        layout.addLayout(header)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+    def set_load_func(self, load_func: Callable):
+        """设置读取缩略图的函数 (路径, 尺寸) -> PIL 图片"""
+        self.loader.load_func = load_func
+
+    def set_cluster_results(self, cluster_results):
+        """
+        显示聚类结果（聚类结果字典或流式模式的句柄）
+
+        Args:
+            cluster_results: 聚类结果
+        """
+        self.cluster_results = cluster_results
+        cluster_info = cluster_results.get("cluster_info", {}) if cluster_results else {}
+        self.cluster_ids = list(cluster_info.keys())
+
+        self.cluster_combo.blockSignals(True)
+        self.cluster_combo.clear()
+        for cluster_id in self.cluster_ids:
+            info = cluster_info[cluster_id]
+            self.cluster_combo.addItem(
+                f"{info.get('name', f'类别 {cluster_id}')} ({info.get('count', 0)} 张)"
+            )
+        self.cluster_combo.blockSignals(False)
+
+        self.show_cluster(0)
+
+    def clear(self):
+        """清空网格"""
+        self.cluster_results = None
+        self.cluster_ids = []
+        self.cluster_combo.clear()
+        self.loader.clear_pending()
+        self.model.set_paths([])
+
+    def show_cluster(self, position: int):
+        """显示第 position 个类别的图片"""
+        self.loader.clear_pending()
+        if not self.cluster_results or not 0 <= position < len(self.cluster_ids):
+            self.model.set_paths([])
+            return
+
+        cluster_id = self.cluster_ids[position]
+        if hasattr(self.cluster_results, "cluster_paths"):
+            # 流式模式的句柄按类别读取路径
+            paths = self.cluster_results.cluster_paths(cluster_id)
+        else:
+            paths = self.cluster_results.get("clusters", {}).get(cluster_id, [])
+        self.model.set_paths(paths)
+        self.view.scrollToTop()
+
+    def _retain_visible(self):
+        """只保留当前可见范围内（前后各多保留一屏）的加载请求"""
+        rect = self.view.viewport().rect()
+        first = self.view.indexAt(rect.topLeft())
+        last = self.view.indexAt(rect.bottomRight())
+        if not first.isValid():
+            return
+        last_row = last.row() if last.isValid() else self.model.rowCount() - 1
+        margin = last_row - first.row() + 1
+        start = max(first.row() - margin, 0)
+        end = min(last_row + margin, self.model.rowCount() - 1)
+        self.loader.retain(self.model.path(row) for row in range(start, end + 1))
+
+    def open_image(self, index: QModelIndex):
+        """双击用系统默认程序打开原图"""
+        path = index.data(ClusterImageModel.PathRole)
+        if path and os.path.exists(path):
+            QDesktopServices.openUrl(QUrl.fromLocalFile(os.path.abspath(path)))
@@ -2,12 +2,13 @@
 主窗口GUI
 """
 
-import sys
 import os
+import json
+import time
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QLabel, QSpinBox, QCheckBox, QGroupBox,
-                             QMessageBox, QFileDialog, QLineEdit)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+                             QMessageBox, QFileDialog, QLineEdit, QInputDialog, QComboBox)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont
 
 from gallery_generator.gui.components.folder_selector import FolderSelector
@@ -16,19 +17,42 @@ from gallery_generator.gui.components.preview_panel import PreviewPanel
 from gallery_generator.core.image_analyzer import ImageAnalyzer
 
 
+class ModelLoaderThread(QThread):
+    """后台加载模型并预热，窗口在加载期间保持可操作"""
+    
+    status_changed = pyqtSignal(str)
+    loaded = pyqtSignal(object, float)
+    failed = pyqtSignal(str)
+    
+    def run(self):
+        """创建分析器（加载模型）并推理一批空白图片"""
+        try:
+            start = time.perf_counter()
+            self.status_changed.emit("正在加载模型...")
+            analyzer = ImageAnalyzer()
+            self.status_changed.emit("正在预热模型...")
+            analyzer.warm_up()
+            self.loaded.emit(analyzer, time.perf_counter() - start)
+        except Exception as e:
+            import traceback
+            print(f"模型加载错误详情:\n{traceback.format_exc()}")
+            self.failed.emit(str(e))
+
+
 class ProcessingThread(QThread):
     """处理线程"""
     
     progress_updated = pyqtSignal(int, int, str)
     finished = pyqtSignal(dict)
     
-    def __init__(self, analyzer, folder_path, output_dir, formats, n_clusters):
+    def __init__(self, analyzer, folder_path, output_dir, formats, n_clusters, algorithm=None):
         super().__init__()
         self.analyzer = analyzer
         self.folder_path = folder_path
         self.output_dir = output_dir
         self.formats = formats
         self.n_clusters = n_clusters
+        self.algorithm = algorithm
         self._stop_flag = False
     
     def stop(self):
@@ -39,8 +63,10 @@ class ProcessingThread(QThread):
         """运行处理"""
         try:
             # 直接设置分类器的聚类数量，不修改配置文件（修复线程安全问题）
-            if self.n_clusters and self.n_clusters > 0:
+            if self.n_clusters:
                 self.analyzer.classifier.n_clusters = self.n_clusters
+            if self.algorithm:
+                self.analyzer.classifier.algorithm = self.algorithm
             
             def progress_callback(current, total, message):
                 if self._stop_flag:
@@ -70,6 +96,29 @@ class ProcessingThread(QThread):
             })
 
 
+class TaskThread(QThread):
+    """在后台执行一个返回结果字典的任务（重新聚类、生成作品集）"""
+    
+    finished = pyqtSignal(dict)
+    
+    def __init__(self, task, error_prefix: str = "处理出错"):
+        super().__init__()
+        self.task = task
+        self.error_prefix = error_prefix
+    
+    def run(self):
+        """运行任务"""
+        try:
+            self.finished.emit(self.task())
+        except Exception as e:
+            import traceback
+            print(f"{self.error_prefix}详情:\n{traceback.format_exc()}")
+            self.finished.emit({
+                "success": False,
+                "message": f"{self.error_prefix}: {str(e)}"
+            })
+
+
 class MainWindow(QMainWindow):
     """主窗口"""
     
@@ -77,16 +126,23 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.setWindowTitle("Gallery Generate Agent - 图片自动识别归类工具")
         self.setMinimumSize(800, 600)
+        self.analyzer = None
         self.init_ui()
         
-        # 初始化分析器
-        try:
-            self.analyzer = ImageAnalyzer()
-        except Exception as e:
-            QMessageBox.critical(self, "初始化错误", f"无法初始化分析器: {str(e)}")
-            sys.exit(1)
+        # 在后台线程中加载并预热模型，加载完成前只禁用依赖分析器的按钮
+        self.start_btn.setEnabled(False)
+        self.history_btn.setEnabled(False)
+        self.model_thread = ModelLoaderThread()
+        self.model_thread.status_changed.connect(self.model_status.setText)
+        self.model_thread.loaded.connect(self.on_model_loaded)
+        self.model_thread.failed.connect(self.on_model_failed)
+        self.model_thread.start()
         
         self.processing_thread = None
+        self.task_thread = None
+        # 当前显示的结果（重新聚类后更新，生成作品集时使用）
+        self.current_results = None
+        self._recluster_pending = False
     
     def init_ui(self):
         """初始化UI"""
@@ -119,14 +175,27 @@ class MainWindow(QMainWindow):
         cluster_layout = QHBoxLayout()
         cluster_layout.addWidget(QLabel("聚类数量:"))
         self.n_clusters_spin = QSpinBox()
-        self.n_clusters_spin.setMinimum(1)
+        self.n_clusters_spin.setMinimum(0)
         self.n_clusters_spin.setMaximum(50)
         self.n_clusters_spin.setValue(5)
-        self.n_clusters_spin.setToolTip("设置为0将自动确定聚类数量")
+        self.n_clusters_spin.setSpecialValueText("自动")
+        self.n_clusters_spin.setToolTip("设置为0将自动确定聚类数量；处理完成后修改会立即重新聚类")
         cluster_layout.addWidget(self.n_clusters_spin)
+        cluster_layout.addWidget(QLabel("聚类算法:"))
+        self.algorithm_combo = QComboBox()
+        self.algorithm_combo.addItems(["kmeans", "dbscan"])
+        cluster_layout.addWidget(self.algorithm_combo)
         cluster_layout.addStretch()
         config_layout.addLayout(cluster_layout)
         
+        # 调整参数后稍等片刻再重新聚类，连续调整时只执行最后一次
+        self._recluster_timer = QTimer(self)
+        self._recluster_timer.setSingleShot(True)
+        self._recluster_timer.setInterval(300)
+        self._recluster_timer.timeout.connect(self.recluster)
+        self.n_clusters_spin.valueChanged.connect(self.schedule_recluster)
+        self.algorithm_combo.currentIndexChanged.connect(self.schedule_recluster)
+        
         # 输出格式选择
         format_layout = QVBoxLayout()
         format_layout.addWidget(QLabel("输出格式:"))
@@ -176,18 +245,59 @@ class MainWindow(QMainWindow):
             }
         """)
         self.start_btn.clicked.connect(self.start_processing)
+        self.history_btn = QPushButton("打开历史结果")
+        self.history_btn.setToolTip("直接打开之前的处理结果，无需重新处理")
+        self.history_btn.clicked.connect(self.open_history)
+        self.generate_btn = QPushButton("生成作品集")
+        self.generate_btn.setToolTip("按当前的聚类结果生成作品集")
+        self.generate_btn.setEnabled(False)
+        self.generate_btn.clicked.connect(self.generate_gallery)
         button_layout.addStretch()
         button_layout.addWidget(self.start_btn)
+        button_layout.addWidget(self.history_btn)
+        button_layout.addWidget(self.generate_btn)
         button_layout.addStretch()
         main_layout.addLayout(button_layout)
         
         # 预览面板
-        self.preview_panel = PreviewPanel()
+        self.preview_panel = PreviewPanel(
+            thumbnail_config=self._load_gui_config().get("thumbnails", {})
+        )
         main_layout.addWidget(self.preview_panel)
         
-        # 状态栏
+        # 状态栏（右侧常驻显示模型状态）
+        self.model_status = QLabel("正在加载模型...")
+        self.statusBar().addPermanentWidget(self.model_status)
         self.statusBar().showMessage("就绪")
     
+    def on_model_loaded(self, analyzer, elapsed: float):
+        """模型加载和预热完成"""
+        self.analyzer = analyzer
+        self.model_thread.wait()
+        self.model_thread = None
+        
+        # 预览缩略图从缩略图缓存读取
+        self.preview_panel.set_thumbnail_source(self.analyzer.get_thumbnail)
+        self.start_btn.setEnabled(True)
+        self.history_btn.setEnabled(True)
+        self.model_status.setText(f"模型已就绪（{elapsed:.1f} 秒）")
+    
+    def on_model_failed(self, message: str):
+        """模型加载失败：提示后关闭窗口"""
+        self.model_thread.wait()
+        self.model_thread = None
+        self.model_status.setText("模型加载失败")
+        QMessageBox.critical(self, "初始化错误", f"无法初始化分析器: {message}")
+        self.close()
+    
+    def _load_gui_config(self) -> dict:
+        """读取配置文件中的界面设置（分析器创建前使用）"""
+        try:
+            with open("config.json", 'r', encoding='utf-8') as f:
+                return json.load(f).get("gui", {})
+        except (OSError, ValueError):
+            return {}
+    
     def browse_output_folder(self):
         """浏览输出文件夹"""
         folder = QFileDialog.getExistingDirectory(
@@ -225,7 +335,6 @@ class MainWindow(QMainWindow):
         
         output_dir = self.get_output_dir()
         formats = self.get_output_formats()
-        n_clusters = self.n_clusters_spin.value()
         
         if not formats:
             QMessageBox.warning(self, "警告", "请至少选择一种输出格式！")
@@ -238,6 +347,8 @@ class MainWindow(QMainWindow):
         
         # 禁用开始按钮
         self.start_btn.setEnabled(False)
+        self.history_btn.setEnabled(False)
+        self.generate_btn.setEnabled(False)
         self.statusBar().showMessage("正在处理...")
         
         # 创建处理线程
@@ -246,12 +357,139 @@ class MainWindow(QMainWindow):
             folder_path,
             output_dir,
             formats,
-            n_clusters if n_clusters > 0 else None
+            self.get_n_clusters(),
+            self.algorithm_combo.currentText()
         )
         self.processing_thread.progress_updated.connect(self.update_progress)
         self.processing_thread.finished.connect(self.on_processing_finished)
         self.processing_thread.start()
     
+    def open_history(self):
+        """从图库目录打开历史结果"""
+        runs = self.analyzer.list_runs()
+        if not runs:
+            QMessageBox.information(self, "提示", "还没有可打开的历史结果")
+            return
+        
+        items = [
+            f"#{run['id']}  {(run['finished'] or run['started'])[:19].replace('T', ' ')}  "
+            f"{run['folder']}  ({run['image_count']} 张图片, {run['cluster_count']} 个类别)"
+            for run in runs
+        ]
+        item, ok = QInputDialog.getItem(self, "打开历史结果", "选择一次处理记录:", items, 0, False)
+        if not ok:
+            return
+        
+        results = self.analyzer.open_run(runs[items.index(item)]["id"])
+        self.preview_panel.show_results(results)
+        self.set_current_results(results)
+        if results.get("success"):
+            self.folder_selector.set_path(results.get("folder", ""))
+            self.statusBar().showMessage("已打开历史结果")
+        else:
+            QMessageBox.warning(self, "警告", results.get("message", "无法打开历史结果"))
+    
+    def get_n_clusters(self):
+        """获取聚类数量（0 表示自动确定）"""
+        n_clusters = self.n_clusters_spin.value()
+        return n_clusters if n_clusters > 0 else "auto"
+    
+    def set_current_results(self, results: dict):
+        """记录当前显示的结果，有结果时可以重新聚类和生成作品集"""
+        self.current_results = results if results.get("success") else None
+        self.generate_btn.setEnabled(self.current_results is not None)
+    
+    def schedule_recluster(self):
+        """聚类参数变化：已有结果时稍后重新聚类"""
+        if self.current_results is not None and self.processing_thread is None:
+            self._recluster_timer.start()
+    
+    def recluster(self):
+        """用已提取的特征重新聚类（在后台线程中执行，不重新生成作品集）"""
+        if self.task_thread is not None:
+            # 上一个任务完成后再按最新参数执行
+            self._recluster_pending = True
+            return
+        
+        n_clusters = self.get_n_clusters()
+        algorithm = self.algorithm_combo.currentText()
+        self.generate_btn.setEnabled(False)
+        self.start_btn.setEnabled(False)
+        self.statusBar().showMessage("正在重新聚类...")
+        self._start_task(lambda: self.analyzer.recluster(n_clusters, algorithm),
+                         self.on_recluster_finished, "重新聚类出错")
+    
+    def on_recluster_finished(self, results: dict):
+        """重新聚类完成：更新预览，作品集需要时再生成"""
+        self.start_btn.setEnabled(True)
+        if results.get("success"):
+            previous = self.current_results or {}
+            results["output_dir"] = previous.get("output_dir")
+            self.preview_panel.show_results(results)
+            self.set_current_results(results)
+            self.statusBar().showMessage(
+                f"重新聚类完成：{results.get('cluster_count', 0)} 个类别，"
+                f"用时 {results.get('elapsed', 0):.2f} 秒"
+            )
+        else:
+            self.generate_btn.setEnabled(self.current_results is not None)
+            self.statusBar().showMessage(results.get("message", "重新聚类失败"))
+        
+        if self._recluster_pending:
+            self._recluster_pending = False
+            self.recluster()
+    
+    def generate_gallery(self):
+        """按当前的聚类结果生成作品集"""
+        if self.current_results is None or self.task_thread is not None:
+            return
+        
+        results = self.current_results
+        output_dir = self.get_output_dir() or self.analyzer.gallery_generator.default_output_dir
+        formats = self.get_output_formats()
+        
+        def task():
+            gallery_paths = self.analyzer.generate_gallery(
+                results["cluster_results"], output_dir, formats
+            )
+            return dict(results, gallery_paths=gallery_paths, output_dir=output_dir)
+        
+        self.generate_btn.setEnabled(False)
+        self.start_btn.setEnabled(False)
+        self.statusBar().showMessage("正在生成作品集...")
+        self._start_task(task, self.on_generate_finished, "生成作品集出错")
+    
+    def on_generate_finished(self, results: dict):
+        """作品集生成完成"""
+        self.start_btn.setEnabled(True)
+        if results.get("success"):
+            self.preview_panel.show_results(results)
+            self.set_current_results(results)
+            self.statusBar().showMessage("作品集已生成")
+        else:
+            self.generate_btn.setEnabled(self.current_results is not None)
+            self.statusBar().showMessage("生成作品集失败")
+            QMessageBox.critical(self, "错误", results.get("message", "生成作品集失败"))
+    
+    def _start_task(self, task, on_finished, error_prefix: str):
+        """在后台线程中执行任务，完成后在界面线程调用 on_finished"""
+        self.task_thread = TaskThread(task, error_prefix)
+        
+        def finished(results: dict):
+            self.task_thread.wait()
+            self.task_thread = None
+            on_finished(results)
+        
+        self.task_thread.finished.connect(finished)
+        self.task_thread.start()
+    
+    def closeEvent(self, event):
+        """关闭窗口时停止后台的缩略图加载，并等待模型加载线程结束"""
+        self.preview_panel.thumbnail_grid.loader.shutdown()
+        if self.model_thread is not None:
+            self.model_thread.wait()
+        super().closeEvent(event)
+    
     def on_cancel_processing(self):
         """取消处理"""
         if self.processing_thread and self.processing_thread.isRunning():
@@ -266,7 +504,9 @@ class MainWindow(QMainWindow):
         """处理完成"""
         self.progress_dialog.close()
         self.start_btn.setEnabled(True)
+        self.history_btn.setEnabled(True)
         
+        self.set_current_results(results)
         if results.get("success"):
             self.statusBar().showMessage("处理完成！")
             self.preview_panel.show_results(results)
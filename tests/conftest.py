@@ -0,0 +1,56 @@
+"""
+测试共用的夹具
+"""
+
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def make_image_folder():
+    """
+    创建包含纯色图片（00.png、01.png ...）的文件夹，返回文件夹路径
+
+    提供 groups 时按顺序循环使用这些基准颜色并加上少量随机偏移，否则每张图片随机取色
+    """
+    def make(folder, count, seed=0, groups=None):
+        folder.mkdir(parents=True)
+        rng = np.random.default_rng(seed)
+        for i in range(count):
+            if groups:
+                base = groups[i % len(groups)]
+                color = tuple(int(c + d) for c, d in zip(base, rng.integers(0, 20, 3)))
+            else:
+                color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            Image.new("RGB", (64, 48), color).save(folder / f"{i:02d}.png")
+        return str(folder)
+
+    return make
+
+
+@pytest.fixture
+def stub_config(tmp_path):
+    """
+    在 tmp_path 下写入使用桩后端的 config.json，返回配置文件路径
+
+    关键字参数按配置段覆盖默认值，例如 stub_config(model={"batch_size": 2})
+    """
+    def write(**sections):
+        config = {
+            "model": {"backend": "stub", "stub": {"embedding_dim": 16}, "batch_size": 4,
+                      "adaptive_batch_size": False},
+            "clustering": {"n_clusters": 2, "hierarchical": False},
+            "cache": {"dir": str(tmp_path / "cache")},
+            "decoding": {"isolated": False},
+            "thumbnails": {"enabled": False},
+        }
+        for section, values in sections.items():
+            config.setdefault(section, {}).update(values)
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps(config))
+        return str(config_path)
+
+    return write
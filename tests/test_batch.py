@@ -0,0 +1,90 @@
+"""
+多文件夹批量处理测试
+"""
+
+import os
+
+import pytest
+
+from gallery_generator.core.image_analyzer import ImageAnalyzer
+
+
+def test_process_batch_shares_extraction(tmp_path, stub_config, make_image_folder):
+    """测试多个文件夹合并为满批次提取特征，再分别输出到各自的目录"""
+    config_path = stub_config(model={"stub": {"embedding_dim": 32}})
+    folders = [
+        make_image_folder(tmp_path / "in" / name, 3, seed)
+        for seed, name in enumerate(["a", "b", "c"])
+    ]
+    empty = tmp_path / "in" / "empty"
+    empty.mkdir()
+    # 不同位置的同名文件夹
+    folders.append(make_image_folder(tmp_path / "in" / "more" / "a", 3, 9))
+
+    analyzer = ImageAnalyzer(config_path)
+    batches = []
+    embed_images = analyzer.feature_extractor.backend.embed_images
+    analyzer.feature_extractor.backend.embed_images = lambda images: batches.append(
+        len(images)
+    ) or embed_images(images)
+    copy_workers = []
+    create_copy_engine = analyzer.gallery_generator._create_copy_engine
+
+    def record_copy_engine():
+        engine = create_copy_engine()
+        copy_workers.append(engine.workers)
+        return engine
+
+    analyzer.gallery_generator._create_copy_engine = record_copy_engine
+
+    output_root = str(tmp_path / "out")
+    results = analyzer.process_batch(folders + [str(empty)], output_root, ["folder"], workers=2)
+
+    assert batches == [4, 4, 4]
+    # 两个文件夹同时生成时各自使用一半的复制线程（默认 16）
+    assert copy_workers == [8] * len(folders)
+    assert analyzer.gallery_generator.concurrent_outputs == 1
+    assert not results[str(empty)]["success"]
+    assert [results[folder]["output_dir"] for folder in folders] == [
+        os.path.join(output_root, name) for name in ("a", "b", "c", "a_2")
+    ]
+    for folder in folders:
+        result = results[folder]
+        assert result["success"] and result["cluster_count"] == 2
+        clustered = sorted(
+            path for paths in result["cluster_results"]["clusters"].values() for path in paths
+        )
+        assert clustered == sorted(os.path.join(folder, name) for name in os.listdir(folder))
+        assert os.path.isdir(result["gallery_paths"]["folder"])
+
+
+def test_process_batch_progress_and_cancel(tmp_path, stub_config, make_image_folder):
+    """测试批量处理的进度单调递增，回调抛出 InterruptedError 时取消任务并向上抛出"""
+    config_path = stub_config(model={"stub": {"embedding_dim": 32}, "batch_size": 2})
+    folders = [
+        make_image_folder(tmp_path / "in" / name, 3, seed)
+        for seed, name in enumerate(["a", "b", "c"])
+    ]
+    analyzer = ImageAnalyzer(config_path)
+
+    progress = []
+    analyzer.process_batch(
+        folders,
+        str(tmp_path / "out"),
+        ["folder"],
+        lambda current, total, message: progress.append((current, total)),
+        workers=2,
+    )
+    assert {total for _, total in progress} == {100}
+    assert [current for current, _ in progress] == sorted(current for current, _ in progress)
+    assert progress[-1] == (100, 100)
+
+    def cancel_on_folders(current, total, message):
+        if message.startswith("正在处理文件夹"):
+            raise InterruptedError("任务已取消")
+
+    with pytest.raises(InterruptedError):
+        analyzer.process_batch(
+            folders, str(tmp_path / "out2"), ["folder"], cancel_on_folders, workers=1
+        )
+    assert not os.path.exists(tmp_path / "out2" / "b")
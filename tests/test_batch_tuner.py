@@ -0,0 +1,92 @@
+"""
+自适应批大小测试
+"""
+
+import json
+
+import numpy as np
+from PIL import Image
+
+from gallery_generator.core.batch_tuner import AdaptiveBatchSizer
+from gallery_generator.core.feature_extractor import ImageFeatureExtractor
+
+
+def test_ramp_up_and_plateau():
+    """测试吞吐量提升时批大小翻倍，不再提升时固定在最佳值，不满的批次不参与调整"""
+    sizer = AdaptiveBatchSizer(initial_size=4, max_size=64, min_free_memory_mb=0)
+
+    def run(size):
+        # 每批固定开销 1 秒，每张图片 0.01 秒，批大小超过 16 后每张图片变慢
+        per_image = 0.01 if size <= 16 else 0.2
+        sizer.record(size, 1.0 + size * per_image)
+
+    sizes = []
+    for _ in range(6):
+        sizes.append(sizer.batch_size)
+        run(sizer.batch_size)
+    assert sizes == [4, 8, 16, 32, 16, 16]
+
+    sizer.record(3, 0.001)
+    assert sizer.batch_size == 16
+
+
+def test_memory_error_backoff_and_persistence(tmp_path, stub_config):
+    """测试桩后端注入显存不足时批大小回退并完成提取，上限持久化后下次直接使用"""
+    config_path = stub_config(
+        model={
+            "stub": {"embedding_dim": 8},
+            "batch_size": 16,
+            "max_batch_size": 64,
+            "adaptive_batch_size": True,
+        }
+    )
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(40):
+        path = tmp_path / f"{i}.png"
+        Image.fromarray(rng.integers(0, 255, (24, 32, 3), dtype=np.uint8)).save(path)
+        paths.append(str(path))
+
+    extractor = ImageFeatureExtractor(config_path)
+    embed_images = extractor.backend.embed_images
+    calls = []
+
+    def limited(images):
+        calls.append(len(images))
+        if len(images) > 6:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return embed_images(images)
+
+    extractor.backend.embed_images = limited
+    features, valid_paths, _ = extractor.extract_image_features(paths)
+    assert valid_paths == paths and features.shape == (40, 8)
+    assert max(size for size in calls if size <= 6) == 4
+
+    with open(tmp_path / "cache" / "batch_sizes.json", encoding="utf-8") as f:
+        saved = json.load(f)[extractor.batch_size_cache_key]
+    assert saved["batch_size"] <= 4 and saved["ceiling"] <= 7
+
+    # 新的提取器沿用持久化的结果，不再触发显存不足
+    calls.clear()
+    extractor = ImageFeatureExtractor(config_path)
+    extractor.backend.embed_images = limited
+    extractor.extract_image_features(paths)
+    assert max(calls) <= 7
+
+
+def test_records_embedded_count(tmp_path, monkeypatch, stub_config):
+    """测试吞吐量按实际计算嵌入的图片数统计，读取失败的图片不计入"""
+    config_path = stub_config(model={"stub": {"embedding_dim": 8}})
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.png"
+        Image.new("RGB", (16, 16), (i * 40, 0, 0)).save(path)
+        paths.append(str(path))
+    paths.append(str(tmp_path / "missing.png"))
+
+    recorded = []
+    monkeypatch.setattr(
+        AdaptiveBatchSizer, "record", lambda self, batch_len, elapsed: recorded.append(batch_len)
+    )
+    ImageFeatureExtractor(config_path).extract_image_features(paths)
+    assert recorded == [3]
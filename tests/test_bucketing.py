@@ -0,0 +1,42 @@
+"""
+预分桶测试
+"""
+
+import numpy as np
+
+from gallery_generator.core.bucketing import compute_buckets
+from gallery_generator.core.metadata_store import MetadataStore
+
+
+def _records(folder, model, day, count, hour=8):
+    return [
+        {"path": f"/photos/{folder}/{day}_{i}.jpg",
+         "exif": {"model": model, "datetime": f"2023:05:{day:02d} {hour:02d}:{i % 60:02d}:00"}}
+        for i in range(count)
+    ]
+
+
+def test_split_by_session_camera_and_folder():
+    """测试按场次、相机和文件夹分桶"""
+    records = (_records("trip", "X100", 1, 30) + _records("trip", "X100", 3, 30)
+               + _records("trip", "A7", 1, 30) + _records("home", "X100", 1, 30))
+    buckets = compute_buckets(MetadataStore.from_records(records), min_bucket_size=10)
+
+    assert len(set(buckets.tolist())) == 4
+    for start in range(0, 120, 30):
+        assert len(set(buckets[start:start + 30].tolist())) == 1
+
+
+def test_small_sessions_are_merged():
+    """测试过小的场次并入相邻场次，整组过小的放入公共桶"""
+    records = (_records("trip", "X100", 1, 30) + _records("trip", "X100", 2, 3)
+               + _records("a", "X100", 1, 2) + _records("b", "X100", 1, 2))
+    buckets = compute_buckets(MetadataStore.from_records(records), min_bucket_size=10)
+
+    assert len(set(buckets[:33].tolist())) == 1
+    assert len(set(buckets[33:].tolist())) == 1
+    assert buckets[0] != buckets[33]
+
+    # 只按文件夹分桶
+    buckets = compute_buckets(MetadataStore.from_records(records), by=["folder"], min_bucket_size=1)
+    assert np.unique(buckets).size == 3
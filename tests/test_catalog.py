@@ -0,0 +1,77 @@
+"""
+图库目录测试
+"""
+
+import os
+
+import numpy as np
+
+from gallery_generator.core.catalog import LibraryCatalog
+from gallery_generator.core.metadata_store import MetadataStore
+
+
+def _make_images(folder, count):
+    paths = []
+    for i in range(count):
+        path = folder / f"{i}.jpg"
+        path.write_bytes(b"x" * (10 + i))
+        paths.append(str(path))
+    return paths
+
+
+def test_reuse_unchanged_features(tmp_path):
+    """测试未变化的图片复用特征，修改过的图片和其他模型需要重新提取"""
+    paths = _make_images(tmp_path, 5)
+    features = np.random.rand(5, 8).astype(np.float32)
+    metadata = MetadataStore.from_records(
+        [{"path": path, "size": 10 + i} for i, path in enumerate(paths)]
+    )
+
+    catalog = LibraryCatalog(str(tmp_path / "catalog"))
+    catalog.record_features(paths, features, metadata, "stub|fp32")
+
+    # 修改一张图片
+    with open(paths[2], 'ab') as f:
+        f.write(b"changed")
+
+    positions, cached, cached_metadata = catalog.lookup_features(paths, "stub|fp32")
+    assert sorted(positions) == sorted(paths[:2] + paths[3:])
+    for path, row in positions.items():
+        np.testing.assert_array_equal(cached[row], features[paths.index(path)])
+        assert cached_metadata.path(row) == path
+
+    assert catalog.lookup_features(paths, "clip|fp16")[0] == {}
+    catalog.close()
+
+
+def test_run_history(tmp_path):
+    """测试记录运行并直接打开历史结果"""
+    paths = _make_images(tmp_path, 4)
+    catalog = LibraryCatalog(str(tmp_path / "catalog"))
+    catalog.record_features(paths, np.zeros((4, 2), dtype=np.float32),
+                            MetadataStore.from_records([{"path": path} for path in paths]), "stub")
+
+    run_id = catalog.start_run(str(tmp_path), "out", ["html"])
+    assert catalog.list_runs() == []
+
+    cluster_results = {
+        "clusters": {0: paths[:3], 1: paths[3:]},
+        "cluster_info": {0: {"name": "A", "count": 3}, 1: {"name": "B", "count": 1}},
+        "n_clusters": 2,
+    }
+    catalog.finish_run(run_id, cluster_results, 4, {"html": "out/index.html"})
+    catalog.close()
+
+    # 重新打开数据库读取
+    catalog = LibraryCatalog(str(tmp_path / "catalog"))
+    runs = catalog.list_runs(str(tmp_path))
+    assert [run["id"] for run in runs] == [run_id]
+
+    results = catalog.load_run(run_id)
+    assert results["cluster_results"]["clusters"] == cluster_results["clusters"]
+    assert results["cluster_results"]["cluster_info"][0]["name"] == "A"
+    assert results["cluster_results"]["labels"].tolist() == [0, 0, 0, 1]
+    assert len(results["cluster_results"]["metadata"]) == 4
+    assert results["gallery_paths"] == {"html": "out/index.html"}
+    assert os.path.exists(os.path.join(str(tmp_path / "catalog"), "catalog.db"))
+    catalog.close()
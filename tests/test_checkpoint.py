@@ -0,0 +1,74 @@
+"""
+运行检查点测试
+"""
+
+import pytest
+
+from gallery_generator.core.checkpoint import RunCheckpoint, default_run_dir
+from gallery_generator.core.image_analyzer import ImageAnalyzer
+
+
+def test_resume_after_crash(tmp_path, stub_config, make_image_folder):
+    """
+    测试中途崩溃后续跑：恢复已完成的批次，期间图库目录发生变化也不会错位，
+    只重新计算剩余图片的嵌入
+    """
+    config_path = stub_config()
+    folder = make_image_folder(tmp_path / "images", 12)
+    output_dir = str(tmp_path / "out")
+
+    analyzer = ImageAnalyzer(config_path)
+    backend = analyzer.feature_extractor.backend
+    embed_images = backend.embed_images
+    embedded = []
+
+    def crash_on_second_batch(images):
+        if len(embedded) == 1:
+            raise RuntimeError("模拟崩溃")
+        embedded.append(len(images))
+        return embed_images(images)
+
+    backend.embed_images = crash_on_second_batch
+    with pytest.raises(RuntimeError):
+        analyzer.process_folder(folder, output_dir, ["folder"])
+    checkpoint = RunCheckpoint(default_run_dir(str(tmp_path / "cache"), folder))
+    assert checkpoint.count_batches() == (1, 4)
+
+    # 中断期间另一次运行把已完成批次中的 2 张图片写入了图库目录，待处理的图片随之变化
+    image_paths = analyzer.scan_images(folder)
+    backend.embed_images = embed_images
+    features, valid_paths, metadata = analyzer.feature_extractor.extract_image_features(
+        image_paths[:2]
+    )
+    analyzer.catalog.record_features(
+        valid_paths, features, metadata, analyzer.feature_extractor.embedding_key
+    )
+
+    embedded.clear()
+    backend.embed_images = lambda images: embedded.append(len(images)) or embed_images(images)
+    results = analyzer.process_folder(folder, output_dir, ["folder"], resume=True)
+    assert results["success"]
+    assert sum(embedded) == 8
+    clustered = sorted(
+        path for paths in results["cluster_results"]["clusters"].values() for path in paths
+    )
+    assert clustered == sorted(image_paths)
+
+
+def test_generated_output_tracks_cluster_digest(tmp_path):
+    """测试聚类结果变化后不再认为输出已生成"""
+    checkpoint = RunCheckpoint(str(tmp_path / "run"))
+    result_path = tmp_path / "index.html"
+    result_path.write_text("")
+    first = {
+        "clusters": {0: ["a", "b"], 1: ["c"]},
+        "cluster_info": {0: {"name": "海"}, 1: {"name": "山"}},
+    }
+    checkpoint.mark_format_done("html", str(tmp_path), str(result_path), first)
+
+    assert checkpoint.get_generated("html", str(tmp_path), first) == str(result_path)
+    moved = {"clusters": {0: ["a"], 1: ["b", "c"]}, "cluster_info": first["cluster_info"]}
+    assert checkpoint.get_generated("html", str(tmp_path), moved) is None
+    assert RunCheckpoint(str(tmp_path / "run")).get_generated("html", str(tmp_path), first) == str(
+        result_path
+    )
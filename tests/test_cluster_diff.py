@@ -0,0 +1,117 @@
+"""
+聚类结果差异测试
+"""
+
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from gallery_generator.core.cluster_diff import align_cluster_ids, compute_cluster_diff
+from gallery_generator.core.gallery_generator import GalleryGenerator
+
+
+def _results(clusters, names):
+    return {
+        "clusters": clusters,
+        "cluster_info": {
+            cid: {"name": names[cid], "count": len(paths)} for cid, paths in clusters.items()
+        },
+        "labels": np.array([cid for cid, paths in clusters.items() for _ in paths]),
+    }
+
+
+def test_align_keeps_previous_ids():
+    """测试类别编号交换后仍对齐到上一次的ID"""
+    previous = _results({0: ["a", "b", "c"], 1: ["d", "e"]}, {0: "海", 1: "山"})
+    current = _results({0: ["d", "e"], 1: ["a", "b", "c"]}, {0: "山", 1: "海"})
+
+    aligned = align_cluster_ids(previous, current)
+    assert aligned["clusters"] == previous["clusters"]
+    assert aligned["cluster_info"][0]["name"] == "海"
+    assert compute_cluster_diff(previous, aligned)["unchanged"]
+
+
+def test_diff_reports_changes():
+    """测试新增、删除、移动和改名"""
+    previous = _results(
+        {0: ["a", "b", "c"], 1: ["d", "e"], 2: ["f"]}, {0: "海", 1: "山", 2: "城市"}
+    )
+    current = _results({0: ["a", "b"], 1: ["c", "d", "e", "g"]}, {0: "海", 1: "山峰"})
+
+    aligned = align_cluster_ids(previous, current)
+    diff = compute_cluster_diff(previous, aligned)
+
+    assert diff["added"] == ["g"]
+    assert diff["removed"] == ["f"]
+    assert diff["moved"] == [("c", 0, 1)]
+    assert diff["renamed"] == {1: ("山", "山峰")}
+    assert sorted(diff["changed_clusters"]) == [0, 1]
+    assert diff["removed_clusters"] == [2]
+    assert not diff["unchanged"]
+
+
+def test_align_renumbers_centroids_and_is_idempotent():
+    """测试类别中心随类别一起重新编号，输入不被修改，对齐后的结果再次对齐保持不变"""
+    previous = _results({0: ["a", "b"], 1: ["c", "d"]}, {0: "海", 1: "山"})
+    current = _results({0: ["c", "d"], 1: ["a", "b"], 2: ["e"]}, {0: "山", 1: "海", 2: "城市"})
+    current["centroids"] = {
+        0: np.array([0.0, 1.0]),
+        1: np.array([1.0, 0.0]),
+        2: np.array([1.0, 1.0]),
+    }
+    original_clusters = dict(current["clusters"])
+
+    aligned = align_cluster_ids(previous, current)
+    assert current["clusters"] == original_clusters
+    assert aligned["clusters"] == {0: ["a", "b"], 1: ["c", "d"], 2: ["e"]}
+    np.testing.assert_array_equal(aligned["centroids"][0], [1.0, 0.0])
+    np.testing.assert_array_equal(aligned["centroids"][1], [0.0, 1.0])
+    assert aligned["labels"].tolist() == [1, 1, 0, 0, 2]
+
+    again = align_cluster_ids(previous, aligned)
+    assert again["clusters"] == aligned["clusters"]
+    assert sorted(again["centroids"]) == [0, 1, 2]
+
+
+def test_incremental_output_recopies_edited_images(tmp_path, capsys):
+    """测试增量生成时就地修改过的图片重新复制、所在的PDF章节重新渲染，调用方的聚类结果不被修改"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"thumbnails": {"enabled": False}}))
+    images = []
+    for i, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255)]):
+        path = tmp_path / f"{i}.png"
+        Image.new("RGB", (32, 32), color).save(path)
+        images.append(str(path))
+
+    generator = GalleryGenerator(str(config_path))
+    output_dir = str(tmp_path / "out")
+    generator.generate_all(_results({0: images[:2], 1: images[2:]}, {0: "A", 1: "B"}), output_dir,
+                           ["html", "pdf", "folder"])
+    pdf_path = os.path.join(output_dir, "gallery.pdf")
+    first_pdf = os.stat(pdf_path).st_mtime_ns
+    capsys.readouterr()
+
+    # 就地修改一张图片（大小不变，修改时间变化），类别编号与上次相反
+    Image.new("RGB", (32, 32), (255, 255, 0)).save(images[0])
+    os.utime(images[0], (time.time() + 10, time.time() + 10))
+    current = _results({0: images[2:], 1: images[:2]}, {0: "B", 1: "A"})
+    generator.generate_all(current, output_dir, ["html", "pdf", "folder"])
+    assert current["clusters"] == {0: images[2:], 1: images[:2]}
+    assert "PDF 分段: 重新渲染 1/2 个类别" in capsys.readouterr().out
+    assert os.stat(pdf_path).st_mtime_ns != first_pdf
+
+    # 没有任何变化时不重新生成PDF
+    second_pdf = os.stat(pdf_path).st_mtime_ns
+    generator.generate_all(current, output_dir, ["pdf"])
+    assert os.stat(pdf_path).st_mtime_ns == second_pdf
+
+    html_copy = os.path.join(output_dir, "images", generator._html_image_name(images[0]))
+    folder_copies = glob.glob(os.path.join(output_dir, "folders", "*", "0.png"))
+    assert len(folder_copies) == 1
+    for copy_path in folder_copies + [html_copy]:
+        with open(copy_path, 'rb') as copied, open(images[0], 'rb') as source:
+            assert copied.read() == source.read()
@@ -0,0 +1,60 @@
+"""
+构图分析测试
+"""
+
+import numpy as np
+from PIL import Image
+
+from gallery_generator.core.composition import (
+    COMPOSITION_FEATURES, analyze_composition_batch, composition_features, composition_to_dict
+)
+
+
+def test_symmetric_centered_image():
+    """测试对称、中心明亮的图片"""
+    gray = np.zeros((90, 120), dtype=np.uint8)
+    gray[36:54, 48:72] = 255
+    values = dict(zip(COMPOSITION_FEATURES, composition_features(gray).tolist()))
+
+    assert abs(values["aspect_ratio"] - 120 / 90) < 1e-6
+    assert values["symmetry"] > 0.99
+    assert values["center_ratio"] > 1.2
+
+    composition = composition_to_dict(composition_features(gray))
+    assert composition["symmetry"] and composition["center_composition"]
+
+
+def test_thirds_line_detected():
+    """测试三分线上的主体"""
+    gray = np.full((90, 120), 40, dtype=np.uint8)
+    gray[:, 38:42] = 220
+    values = dict(zip(COMPOSITION_FEATURES, composition_features(gray).tolist()))
+    assert values["thirds_strength"] > 1.2
+    assert values["symmetry"] < 1.0
+
+
+def test_batch_with_cache_and_bad_file(tmp_path):
+    """测试批量分析（含缓存和无法读取的文件）"""
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.png"
+        Image.new("RGB", (400, 300), (i * 80, 0, 0)).save(path)
+        paths.append(str(path))
+    bad = tmp_path / "bad.jpg"
+    bad.write_bytes(b"not an image")
+    paths.append(str(bad))
+
+    thumbnails = {
+        "dir": str(tmp_path / "thumbs"),
+        "sizes": [64, 256],
+        "budget_mb": 10,
+        "quality": 85,
+    }
+    features = analyze_composition_batch(paths, size=64, thumbnails=thumbnails, workers=1)
+    assert features.shape == (4, len(COMPOSITION_FEATURES))
+    assert features.dtype == np.float32
+    assert np.isnan(features[3]).all()
+    assert not np.isnan(features[:3]).any()
+
+    again = analyze_composition_batch(paths[:3], size=64, thumbnails=thumbnails, workers=1)
+    np.testing.assert_array_equal(again, features[:3])
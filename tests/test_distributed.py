@@ -0,0 +1,100 @@
+"""
+分布式特征提取测试
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from gallery_generator.core.distributed import ShardQueue, run_workers
+from gallery_generator.core.image_analyzer import ImageAnalyzer
+from gallery_generator.core.metadata_store import MetadataStore
+
+
+def test_workers_merge_in_scan_order(tmp_path, stub_config, make_image_folder):
+    """测试多个本地工作进程处理全部分片（包括接管超时的租约），合并结果与单机提取一致"""
+    config_path = stub_config(
+        model={"batch_size": 2},
+        distributed={"shard_size": 3, "lease_timeout": 30, "max_attempts": 2, "poll_interval": 0.1},
+    )
+    folder = make_image_folder(tmp_path / "images", 10)
+    job_dir = str(tmp_path / "job")
+
+    analyzer = ImageAnalyzer(config_path)
+    shard_queue = analyzer.shard_folder(folder, job_dir)
+    assert shard_queue.status()["shards"] == 4
+
+    # 模拟崩溃的工作进程留下的租约
+    lease_path = os.path.join(job_dir, "leases", "000001.json")
+    with open(lease_path, "w") as f:
+        json.dump({"worker": "dead-host"}, f)
+    old = time.time() - 3600
+    os.utime(lease_path, (old, old))
+
+    assert run_workers(job_dir, config_path, processes=2)
+    status = shard_queue.status()
+    assert status["finished"] and status["done"] == 4
+    assert not os.listdir(os.path.join(job_dir, "leases"))
+
+    features, valid_paths, metadata = shard_queue.merge()
+    image_paths = analyzer.scan_images(folder)
+    expected, expected_paths, _ = analyzer.feature_extractor.extract_image_features(image_paths)
+    assert valid_paths == expected_paths == image_paths
+    assert len(metadata) == 10
+    np.testing.assert_allclose(features, expected, atol=1e-5)
+
+    results = analyzer.process_shards(job_dir, str(tmp_path / "out"), ["folder"])
+    assert results["success"] and results["cluster_count"] == 2
+    # 合并结果写入图库目录，本机再次处理时直接复用
+    cached = analyzer.catalog.lookup_features(image_paths, analyzer.feature_extractor.embedding_key)
+    assert len(cached[0]) == 10
+
+
+def test_failed_shard_retry_and_partial_merge(tmp_path):
+    """测试出错的分片释放后可重试，达到最大次数后标记失败，合并时跳过"""
+    paths = [f"/missing/{i}.jpg" for i in range(5)]
+    shard_queue = ShardQueue.create(str(tmp_path / "job"), paths, 3, "stub", max_attempts=2)
+
+    first = shard_queue.claim("w1")
+    assert shard_queue.claim("w2") == 1 - first
+    assert shard_queue.claim("w3") is None
+
+    assert shard_queue.fail(first, "w1", "boom")
+    assert shard_queue.claim("w3") == first
+    assert not shard_queue.fail(first, "w3", "boom again")
+    assert shard_queue.failures() == {first: "boom again"}
+
+    other = 1 - first
+    shard_queue.complete(other, "w2", np.ones((1, 4), dtype=np.float32), [paths[other * 3]],
+                         MetadataStore.from_records([{"path": paths[other * 3]}]))
+    status = shard_queue.status()
+    assert status["finished"] and status["done"] == 1 and status["failed"] == 1
+    features, valid_paths, _ = shard_queue.merge()
+    assert features.shape == (1, 4) and valid_paths == [paths[other * 3]]
+
+
+def test_takeover_counts_as_attempt(tmp_path):
+    """
+    测试接管超时租约计为一次尝试，反复崩溃的分片最终标记为失败；
+    原进程不能刷新或删除已被接管的租约
+    """
+    shard_queue = ShardQueue.create(str(tmp_path / "job"), ["/missing/0.jpg"], 1, "stub",
+                                    lease_timeout=0.05, max_attempts=2)
+    assert shard_queue.claim("w1") == 0
+    time.sleep(0.1)
+
+    # w1 卡死后被 w2 接管，w1 恢复后既不能刷新也不能删除 w2 的租约
+    assert shard_queue.claim("w2") == 0
+    assert not shard_queue.heartbeat(0, "w1")
+    shard_queue.release(0, "w1")
+    assert shard_queue.fail(0, "w1", "late error")
+    assert shard_queue.heartbeat(0, "w2")
+
+    # w2 同样崩溃，第二次接管达到最大尝试次数
+    time.sleep(0.1)
+    assert shard_queue.claim("w3") is None
+    assert shard_queue.is_failed(0)
+    assert "w2" in shard_queue.failures()[0]
+    assert shard_queue.status()["finished"]
@@ -0,0 +1,66 @@
+"""
+嵌入后端测试
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from gallery_generator.core.embedding_backends import StubBackend, create_backend
+from gallery_generator.core.image_analyzer import ImageAnalyzer
+
+
+def _make_image(path, color):
+    Image.new("RGB", (64, 48), color).save(path)
+    return str(path)
+
+
+def test_create_stub_backend():
+    """测试通过配置创建桩后端"""
+    backend = create_backend({"backend": "stub", "stub": {"embedding_dim": 64}})
+    assert isinstance(backend, StubBackend)
+    assert backend.get_text_features(["海", "山"]).shape == (2, 64)
+
+
+def test_unknown_backend():
+    """测试未知后端名称"""
+    with pytest.raises(ValueError):
+        create_backend({"backend": "unknown"})
+
+
+def test_stub_extract_features_from_paths(tmp_path):
+    """测试桩后端提取特征并跳过损坏文件"""
+    red = _make_image(tmp_path / "red.png", (255, 0, 0))
+    red2 = _make_image(tmp_path / "red2.png", (250, 5, 5))
+    blue = _make_image(tmp_path / "blue.png", (0, 0, 255))
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+
+    backend = StubBackend(embedding_dim=32)
+    features, valid_paths = backend.extract_features_from_paths(
+        [red, str(broken), red2, blue], batch_size=2
+    )
+
+    assert valid_paths == [red, red2, blue]
+    assert features.shape == (3, 32)
+    np.testing.assert_allclose(np.linalg.norm(features, axis=1), 1.0, rtol=1e-5)
+    # 颜色相近的图片特征更相似
+    assert features[0] @ features[1] > features[0] @ features[2]
+
+
+def test_analyzer_shares_backend_and_warms_up(stub_config):
+    """测试分类器与特征提取器共用后端，预热时按批大小推理一次并缓存关键词特征"""
+    analyzer = ImageAnalyzer(stub_config(model={"stub": {"embedding_dim": 32}}))
+    assert analyzer.classifier.backend is analyzer.feature_extractor.backend
+
+    batches = []
+    embed_images = analyzer.feature_extractor.backend.embed_images
+    analyzer.feature_extractor.backend.embed_images = lambda images: batches.append(
+        len(images)
+    ) or embed_images(images)
+    assert analyzer.warm_up() >= 0
+    assert batches == [4]
+    assert analyzer.classifier.keyword_features().shape == (
+        len(analyzer.classifier.CATEGORY_KEYWORDS),
+        32,
+    )
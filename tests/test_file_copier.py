@@ -0,0 +1,33 @@
+"""
+并发复制测试
+"""
+
+import os
+
+from gallery_generator.core.file_copier import CopyEngine, is_identical
+
+
+def test_copy_and_skip_identical(tmp_path):
+    """测试并发复制内容一致，再次复制时跳过相同文件"""
+    src_dir = tmp_path / "src"
+    dest_dir = tmp_path / "dest"
+    src_dir.mkdir()
+    dest_dir.mkdir()
+    for i in range(20):
+        (src_dir / f"{i}.jpg").write_bytes(os.urandom(1000 + i))
+
+    engine = CopyEngine(workers=4)
+    for i in range(20):
+        engine.submit(str(src_dir / f"{i}.jpg"), str(dest_dir / f"{i}.jpg"))
+    stats = engine.wait()
+
+    assert stats["copied"] == 20
+    assert stats["bytes"] == sum(1000 + i for i in range(20))
+    for i in range(20):
+        assert (dest_dir / f"{i}.jpg").read_bytes() == (src_dir / f"{i}.jpg").read_bytes()
+        assert is_identical(str(src_dir / f"{i}.jpg"), str(dest_dir / f"{i}.jpg"))
+
+    engine = CopyEngine(workers=4)
+    for i in range(20):
+        engine.submit(str(src_dir / f"{i}.jpg"), str(dest_dir / f"{i}.jpg"))
+    assert engine.wait()["skipped"] == 20
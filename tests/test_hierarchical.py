@@ -0,0 +1,82 @@
+"""
+两级分层聚类测试
+"""
+
+import numpy as np
+
+from gallery_generator.core.classifier import ImageClassifier
+
+
+def _nested_blobs(n_parents=3, n_children=3, per_child=40, dim=16, seed=0):
+    """每个大类中心周围再分布若干子类中心"""
+    rng = np.random.default_rng(seed)
+    features, groups = [], []
+    for parent in range(n_parents):
+        parent_center = rng.normal(0, 1, dim) * 20
+        for _ in range(n_children):
+            child_center = parent_center + rng.normal(0, 1, dim) * 3
+            features.append(child_center + rng.normal(0, 0.2, (per_child, dim)))
+            groups += [parent] * per_child
+    return np.concatenate(features).astype(np.float32), np.array(groups)
+
+
+def _classifier(stub_config, **clustering):
+    return ImageClassifier(
+        stub_config(
+            clustering={
+                "algorithm": "kmeans",
+                "n_clusters": 3,
+                "hierarchical": "auto",
+                "hierarchical_threshold": 300,
+                "min_sub_cluster_size": 20,
+                "parallel_workers": 2,
+                **clustering,
+            }
+        )
+    )
+
+
+def test_hierarchical_cluster_structure(stub_config):
+    """测试子类完整覆盖所有图片且不跨越大类，标签、大类和子类名称一致"""
+    features, groups = _nested_blobs()
+    paths = [f"{i}.jpg" for i in range(len(features))]
+    classifier = _classifier(stub_config)
+    result = classifier._hierarchical_cluster(features, paths)
+
+    assert result["n_parents"] == 3
+    children = sorted(
+        child for parent in result["parents"].values() for child in parent["children"]
+    )
+    assert children == sorted(result["clusters"]) == list(range(result["n_clusters"]))
+    assert result["n_clusters"] > result["n_parents"]
+
+    labels = np.array(result["labels"])
+    for cluster_id, items in result["clusters"].items():
+        assert items == [paths[i] for i in np.flatnonzero(labels == cluster_id)]
+    assert sorted(result["centroids"]) == children
+
+    for parent_id, parent in result["parents"].items():
+        indices = np.flatnonzero(np.isin(labels, parent["children"]))
+        # 每个大类恰好对应一组生成数据
+        assert len(set(groups[indices].tolist())) == 1
+        assert parent["count"] == len(indices)
+        names = [result["cluster_info"][child]["name"] for child in parent["children"]]
+        assert len(set(names)) == len(names)
+        assert all(
+            result["cluster_info"][child]["parent"] == parent_id for child in parent["children"]
+        )
+
+
+def test_hierarchical_auto_threshold(stub_config):
+    """测试 auto 模式按图片数量切换分层输出，设为 false 时保持平铺"""
+    features, _ = _nested_blobs()
+    paths = [f"{i}.jpg" for i in range(len(features))]
+
+    assert "parents" in _classifier(stub_config).cluster_images(features, paths)
+    flat = _classifier(stub_config, hierarchical_threshold=len(paths) + 1).cluster_images(
+        features, paths
+    )
+    assert "parents" not in flat and flat["n_clusters"] == 3
+    assert "parents" not in _classifier(stub_config, hierarchical=False).cluster_images(
+        features, paths
+    )
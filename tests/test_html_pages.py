@@ -0,0 +1,68 @@
+"""
+HTML 分页和清单测试
+"""
+
+import json
+import os
+
+from PIL import Image
+
+from gallery_generator.core.gallery_generator import GalleryGenerator
+
+
+def _results(clusters):
+    return {
+        "clusters": clusters,
+        "cluster_info": {
+            cid: {"name": f"类别{cid}", "count": len(paths)} for cid, paths in clusters.items()
+        },
+    }
+
+
+def _read_manifest(output_dir):
+    with open(os.path.join(output_dir, "manifest.json"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_pages_manifest_and_incremental_render(tmp_path, capsys):
+    """测试分页数量、清单内容，以及增量运行时只重新渲染变化的分页"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps({"output": {"html_page_size": 2}, "thumbnails": {"enabled": False}})
+    )
+    images = []
+    for i in range(7):
+        path = tmp_path / f"{i}.png"
+        Image.new("RGB", (16, 16), (i * 30, 0, 0)).save(path)
+        images.append(str(path))
+
+    generator = GalleryGenerator(str(config_path))
+    output_dir = str(tmp_path / "out")
+    generator.generate_html(_results({0: images[:5], 1: images[5:6]}), output_dir)
+
+    manifest = _read_manifest(output_dir)
+    assert manifest["page_size"] == 2
+    assert [cluster["id"] for cluster in manifest["clusters"]] == [0, 1]
+    first, second = manifest["clusters"]
+    assert first["pages"] == [f"pages/cluster_0_{n}.html" for n in (1, 2, 3)]
+    assert second["pages"] == ["pages/cluster_1_1.html"]
+    assert (first["name"], first["count"], second["count"]) == ("类别0", 5, 1)
+    assert first["cover"] == "images/" + generator._html_image_name(images[0])
+    assert sorted(os.listdir(os.path.join(output_dir, "pages"))) == sorted(manifest["page_hashes"])
+    assert len(manifest["page_hashes"]) == 4
+    with open(os.path.join(output_dir, "pages", "cluster_0_3.html"), 'r', encoding='utf-8') as f:
+        assert "3 / 3" in f.read()
+    assert "重新渲染 4/4 页" in capsys.readouterr().out
+
+    # 内容不变时不重新渲染任何分页
+    generator.generate_html(_results({0: images[:5], 1: images[5:6]}), output_dir)
+    assert "重新渲染 0/4 页" in capsys.readouterr().out
+    assert _read_manifest(output_dir)["page_hashes"] == manifest["page_hashes"]
+
+    # 类别 0 减少为两张（多余分页被删除），类别 1 增加一张（只重新渲染该类别的分页）
+    generator.generate_html(_results({0: images[:2], 1: images[5:]}), output_dir)
+    assert "重新渲染 2/2 页" in capsys.readouterr().out
+    updated = _read_manifest(output_dir)
+    assert sorted(updated["page_hashes"]) == ["cluster_0_1.html", "cluster_1_1.html"]
+    assert updated["page_hashes"]["cluster_0_1.html"] != manifest["page_hashes"]["cluster_0_1.html"]
+    assert sorted(os.listdir(os.path.join(output_dir, "pages"))) == sorted(updated["page_hashes"])
@@ -0,0 +1,79 @@
+"""
+列式元数据存储测试
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+from gallery_generator.core.metadata_store import MetadataStore
+
+
+def _record(path, size, model=None, taken=None, fmt="JPEG"):
+    record = {
+        "path": path,
+        "filename": path.rsplit("/", 1)[-1],
+        "size": size,
+        "format": fmt,
+        "width": 640,
+        "height": 480,
+        "modification_time": "2024-01-01T12:00:00",
+    }
+    exif = {}
+    if model:
+        exif["model"] = model
+    if taken:
+        exif["datetime"] = taken
+    if exif:
+        record["exif"] = exif
+    return record
+
+
+def test_round_trip_records():
+    """测试字典与列式存储之间的往返转换"""
+    records = [
+        _record("/a/1.jpg", 100, model="X100", taken="2023:05:01 08:00:00"),
+        _record("/a/图片.png", 200, fmt="PNG"),
+    ]
+    store = MetadataStore.from_records(records)
+
+    assert len(store) == 2
+    assert store.paths() == ["/a/1.jpg", "/a/图片.png"]
+    assert store[0]["exif"] == {"model": "X100", "datetime": "2023:05:01 08:00:00"}
+    assert store[1]["format"] == "PNG"
+    assert "exif" not in store[1]
+    assert [item["size"] for item in store] == [100, 200]
+
+
+def test_concat_remaps_categories(tmp_path):
+    """测试拼接时重新映射类别编号，并能保存和读取"""
+    first = MetadataStore.from_records([_record("/1.jpg", 1, model="B")])
+    second = MetadataStore.from_records([_record("/2.jpg", 2, model="A"), _record("/3.jpg", 3)])
+    store = MetadataStore.concat([first, second])
+
+    assert [store.category("model", i) for i in range(3)] == ["B", "A", None]
+    assert store.paths() == ["/1.jpg", "/2.jpg", "/3.jpg"]
+
+    path = str(tmp_path / "meta.npz")
+    store.save(path)
+    loaded = MetadataStore.load(path)
+    assert list(loaded) == list(store)
+
+
+def test_filter_and_sort():
+    """测试向量化筛选和排序"""
+    store = MetadataStore.from_records([
+        _record("/1.jpg", 300, model="X100", taken="2023:05:01 08:00:00"),
+        _record("/2.jpg", 100, model="A7", taken="2021:01:01 08:00:00"),
+        _record("/3.png", 200, fmt="PNG"),
+    ])
+
+    mask = store.filter_mask(date_from=datetime(2022, 1, 1), date_to=datetime(2023, 12, 31))
+    assert mask.tolist() == [True, False, False]
+    assert store.filter_mask(camera="A7").tolist() == [False, True, False]
+    assert store.filter_mask(formats=["PNG"], min_size=150).tolist() == [False, False, True]
+
+    assert store.argsort("size").tolist() == [1, 2, 0]
+    assert store.argsort("model").tolist() == [1, 0, 2]
+    assert store.argsort("model", descending=True).tolist() == [0, 1, 2]
+    assert store.subset(np.array([2, 0])).paths() == ["/3.png", "/1.jpg"]
@@ -0,0 +1,163 @@
+"""
+在线 API 标签测试（使用本地模拟服务）
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from gallery_generator.core.classifier import ImageClassifier
+from gallery_generator.core.feature_extractor import ImageFeatureExtractor
+from gallery_generator.core.online_api import (
+    GoogleVisionProvider,
+    OnlineTagger,
+    OpenAIProvider,
+    ResponseCache,
+)
+
+class _MockVision:
+    """模拟 Google Vision：第一个请求返回 429，之后按上传内容的长度返回不同的标签"""
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock.lock:
+                    mock.requests.append(len(body["requests"]))
+                    first = len(mock.requests) == 1
+                    mock.in_flight += 1
+                    mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+                time.sleep(0.05)
+                with mock.lock:
+                    mock.in_flight -= 1
+
+                if first:
+                    self._send(429, {"error": {"message": "rate limited"}}, {"Retry-After": "0"})
+                    return
+                responses = [
+                    {
+                        "labelAnnotations": [
+                            {
+                                "description": (
+                                    "bright" if len(item["image"]["content"]) % 2 else "dark"
+                                ),
+                                "score": 0.9,
+                            },
+                            {"description": "photo", "score": 0.8},
+                            {"description": "noise", "score": 0.1},
+                        ]
+                    }
+                    for item in body["requests"]
+                ]
+                self._send(200, {"responses": responses})
+
+            def _send(self, status, data, headers=None):
+                payload = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+@pytest.fixture
+def mock_server():
+    mock = _MockVision()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), mock.handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield mock, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _make_images(folder, count):
+    folder.mkdir()
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        pixels = rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(folder / f"{i}.png")
+        paths.append(str(folder / f"{i}.png"))
+    return paths
+
+
+def test_tagger_batches_retries_and_caches(tmp_path, mock_server):
+    """测试合并请求、并发上限、限流重试，以及重复运行时直接读取缓存"""
+    mock, url = mock_server
+    paths = _make_images(tmp_path / "images", 7)
+
+    def make_tagger():
+        return OnlineTagger(GoogleVisionProvider("key"), ResponseCache(str(tmp_path / "api.db")),
+                            base_url=url, max_concurrency=2, batch_size=3, backoff_base=0.01)
+
+    tagger = make_tagger()
+    tags = tagger.tag_images(paths + [paths[0]])
+    assert all(row[1:] == ["photo"] and row[0] in ("bright", "dark") for row in tags)
+    assert tags[-1] == tags[0]
+    # 7 张图片分 3 批，第一个请求被限流后重试一次
+    assert sorted(mock.requests[1:]) == [1, 3, 3]
+    assert tagger.stats["retries"] == 1 and tagger.stats["tagged"] == 7
+    assert mock.max_in_flight <= 2
+
+    mock.requests.clear()
+    again = make_tagger()
+    assert again.tag_images(paths) == tags[:-1]
+    assert mock.requests == [] and again.stats["cached"] == 7
+
+
+def test_extractor_adds_tags_to_metadata(tmp_path, mock_server, stub_config):
+    """测试启用在线 API 后标签写入元数据并汇总到类别描述"""
+    _, url = mock_server
+    paths = _make_images(tmp_path / "images", 4)
+    config_path = stub_config(
+        api={
+            "use_online_api": True,
+            "google_vision_api_key": "key",
+            "base_url": url,
+            "backoff_base": 0.01,
+        }
+    )
+
+    extractor = ImageFeatureExtractor(config_path)
+    _, valid_paths, metadata = extractor.extract_image_features(paths)
+    assert valid_paths == paths
+    assert all("photo" in metadata[i]["tags"] for i in range(len(paths)))
+    assert metadata.subset([2, 0]).tags(1) == metadata.tags(0)
+
+    classifier = ImageClassifier(config_path, backend=extractor.backend)
+    results = classifier.cluster_images(np.eye(4, 16, dtype=np.float32), valid_paths, metadata)
+    assert all("photo" in info["tags"] for info in results["cluster_info"].values())
+
+
+def test_openai_tags_are_not_filtered_by_score():
+    """测试对话接口返回的标签（没有置信度）不被 min_score 过滤"""
+    labels = [f"tag{i}" for i in range(12)]
+    data = {"choices": [{"message": {"content": json.dumps({"tags": [labels, "bad"]})}}]}
+    parsed = OpenAIProvider("key").parse(data, 3)
+
+    assert [item["label"] for item in parsed[0]] == labels[:10]
+    assert all(item["score"] >= 0.5 for item in parsed[0])
+    assert parsed[1] is None and parsed[2] is None
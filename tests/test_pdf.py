@@ -0,0 +1,82 @@
+"""
+PDF 并行生成测试
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from PIL import Image
+from pypdf import PdfReader
+
+from gallery_generator.core.gallery_generator import GalleryGenerator
+
+
+def test_parallel_pdf_keeps_section_order(tmp_path):
+    """测试进程池渲染的分段按类别顺序合并，书签和目录页码指向各自的章节"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps({"output": {"pdf_workers": 2}, "thumbnails": {"enabled": False}})
+    )
+    names = ["Alpha", "Beta", "Gamma", "Delta"]
+    clusters = {}
+    for cid in range(len(names)):
+        paths = []
+        for i in range(cid + 1):
+            path = tmp_path / f"{cid}_{i}.png"
+            Image.new("RGB", (40, 30), (cid * 60, i * 40, 0)).save(path)
+            paths.append(str(path))
+        clusters[cid] = paths
+    results = {
+        "clusters": clusters,
+        "cluster_info": {
+            cid: {"name": names[cid], "description": f"section {cid}"} for cid in clusters
+        },
+    }
+
+    pdf_path = GalleryGenerator(str(config_path)).generate_pdf(results, str(tmp_path / "out"))
+    reader = PdfReader(pdf_path)
+
+    bookmarks = [(item.title, reader.get_destination_page_number(item)) for item in reader.outline]
+    assert [title for title, _ in bookmarks] == names
+    pages = [page for _, page in bookmarks]
+    assert pages == sorted(pages) and pages[0] >= 1
+    for title, page in bookmarks:
+        assert f"section {names.index(title)}" in reader.pages[page].extract_text()
+
+    cover = reader.pages[0].extract_text()
+    assert [cover.index(name) for name in names] == sorted(cover.index(name) for name in names)
+
+
+def test_corrupt_pdf_part_state_is_reported_and_rebuilt(tmp_path, capsys):
+    """测试 PDF 分段状态损坏时按 PDF 分段状态报错，并重新渲染全部分段"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"thumbnails": {"enabled": False}}))
+    path = tmp_path / "a.png"
+    Image.new("RGB", (40, 30), (200, 0, 0)).save(path)
+    results = {"clusters": {0: [str(path)]}, "cluster_info": {0: {"name": "Alpha"}}}
+    output_dir = tmp_path / "out"
+    parts_dir = output_dir / ".pdf_parts"
+    parts_dir.mkdir(parents=True)
+    (parts_dir / "parts.json").write_text("{broken")
+
+    pdf_path = GalleryGenerator(str(config_path)).generate_pdf(results, str(output_dir))
+    out = capsys.readouterr().out
+    assert "读取PDF分段状态失败" in out and "HTML清单" not in out
+    assert os.path.exists(pdf_path)
+    assert len(json.loads((parts_dir / "parts.json").read_text())) == 1
+
+
+def test_pdf_worker_imports_are_light():
+    """测试工作进程入口模块不加载聚类和作品集生成模块"""
+    heavy = ("sklearn", "torch", "pypdf", "gallery_generator.core.gallery_generator")
+    code = (
+        "import sys, gallery_generator.core.pdf_worker; "
+        f"print(sorted(m for m in {heavy!r} if m in sys.modules))"
+    )
+    # 与 spawn 启动的工作进程一样沿用当前进程的模块搜索路径
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True, env=env).stdout
+    assert output.strip() == "[]"
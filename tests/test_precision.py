@@ -0,0 +1,72 @@
+"""
+推理精度测试
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from gallery_generator.core import embedding_backends
+from gallery_generator.core.embedding_backends import StubBackend
+from gallery_generator.core.precision import check_precision_accuracy, resolve_precision
+
+
+class _NoisyBackend(StubBackend):
+    """模拟低精度推理：在桩后端的特征上叠加噪声"""
+
+    def __init__(self, noise, **kwargs):
+        super().__init__(**kwargs)
+        self.noise = noise
+        self._rng = np.random.default_rng(0)
+
+    def embed_images(self, images):
+        features = super().embed_images(images)
+        return features + self._rng.normal(0, self.noise, features.shape).astype(np.float32)
+
+
+def _make_images(folder, count):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        base = rng.integers(0, 255, 3)
+        pixels = np.clip(base + rng.normal(0, 20, (32, 32, 3)), 0, 255).astype(np.uint8)
+        Image.fromarray(pixels).save(folder / f"{i}.png")
+        paths.append(str(folder / f"{i}.png"))
+    return paths
+
+
+def test_resolve_precision_fallback():
+    """测试设备不支持的精度回退，未知精度报错"""
+    assert resolve_precision("int8", "cuda:0") == "fp32"
+    assert resolve_precision("int8", "cpu") == "int8"
+    assert resolve_precision("fp16", "cpu") == "bf16"
+    assert resolve_precision("fp16", "cuda") == "fp16"
+    with pytest.raises(ValueError):
+        resolve_precision("fp8", "cpu")
+
+
+def test_check_precision_accuracy(tmp_path, monkeypatch):
+    """测试与 fp32 比较余弦相似度、近邻召回率和聚类一致性"""
+    paths = _make_images(tmp_path, 30)
+    model_config = {"backend": "stub", "stub": {"embedding_dim": 32}, "batch_size": 8}
+
+    # 桩后端忽略精度设置，结果与 fp32 完全一致
+    same = check_precision_accuracy(paths, model_config, "int8", sample_size=20, n_clusters=3)
+    assert same["sample_size"] == 20
+    assert same["mean_cosine_similarity"] == pytest.approx(1.0, abs=1e-5)
+    assert same["neighbor_recall"] == pytest.approx(1.0)
+    assert same["adjusted_rand_index"] == pytest.approx(1.0)
+
+    created = []
+
+    def fake_create_backend(config):
+        created.append(config["precision"])
+        noise = 0.0 if config["precision"] == "fp32" else 0.3
+        return _NoisyBackend(noise, embedding_dim=32)
+
+    monkeypatch.setattr(embedding_backends, "create_backend", fake_create_backend)
+    noisy = check_precision_accuracy(paths, model_config, "bf16", n_clusters=3)
+    assert created == ["fp32", "bf16"]
+    assert noisy["sample_size"] == 30
+    assert noisy["min_cosine_similarity"] <= noisy["mean_cosine_similarity"] < 0.99
+    assert noisy["neighbor_recall"] < 1.0
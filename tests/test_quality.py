@@ -0,0 +1,79 @@
+"""
+图片质量评分测试
+"""
+
+import json
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from gallery_generator.core.gallery_generator import GalleryGenerator
+from gallery_generator.core.metadata_store import MetadataStore
+from gallery_generator.core.quality import image_quality, is_blurry
+
+
+def _texture(seed=0):
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(30, 220, (32, 32, 3), dtype=np.uint8)
+    return np.asarray(Image.fromarray(blocks).resize((256, 256), Image.NEAREST))
+
+
+def test_sharp_blurry_and_noisy():
+    """测试清晰度、噪声和曝光指标"""
+    sharp = _texture()
+    blurry = np.asarray(Image.fromarray(sharp).filter(ImageFilter.GaussianBlur(6)))
+    noisy = np.clip(sharp + np.random.default_rng(1).normal(0, 20, sharp.shape), 0, 255).astype(
+        np.uint8
+    )
+    dark = (sharp // 10).astype(np.uint8)
+
+    sharp_q = image_quality(sharp, 4000, 3000)
+    blurry_q = image_quality(blurry, 4000, 3000)
+    assert sharp_q["sharpness"] > 10 * blurry_q["sharpness"]
+    assert sharp_q["score"] > blurry_q["score"]
+    assert is_blurry(blurry_q, 30) and not is_blurry(sharp_q, 30)
+
+    assert image_quality(noisy)["noise"] > 2 * sharp_q["noise"]
+    assert image_quality(dark)["exposure"] < sharp_q["exposure"]
+    assert abs(sharp_q["resolution"] - 12.0) < 1e-6
+
+
+def test_quality_columns_round_trip(tmp_path):
+    """测试质量指标保存在列式元数据中"""
+    store = MetadataStore.from_records([
+        {"path": "a.jpg", "quality": {"sharpness": 50.0, "score": 0.4}},
+        {"path": "b.jpg", "quality": {"sharpness": 500.0, "score": 0.9}},
+        {"path": "c.jpg"},
+    ])
+    path = str(tmp_path / "meta.npz")
+    store.save(path)
+    loaded = MetadataStore.load(path)
+
+    assert loaded[1]["quality"]["score"] == np.float32(0.9)
+    assert "quality" not in loaded[2]
+    assert loaded.argsort("quality_score", descending=True).tolist() == [1, 0, 2]
+
+
+def test_gallery_ranks_and_limits(tmp_path):
+    """测试作品集按质量排序并只输出每类得分最高的图片"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({
+        "quality": {"max_images_per_cluster": 2},
+        "thumbnails": {"enabled": False},
+    }))
+    generator = GalleryGenerator(str(config_path))
+
+    paths = ["a.jpg", "b.jpg", "c.jpg"]
+    cluster_results = {
+        "clusters": {0: list(paths)},
+        "cluster_info": {0: {"name": "类别", "count": 3}},
+        "metadata": MetadataStore.from_records(
+            {"path": path, "quality": {"score": score}}
+            for path, score in zip(paths, [0.2, 0.9, 0.5])
+        ),
+    }
+    selected = generator._select_by_quality(cluster_results)
+
+    assert selected["clusters"][0] == ["b.jpg", "c.jpg"]
+    assert selected["cluster_info"][0]["count"] == 2
+    assert cluster_results["clusters"][0] == paths
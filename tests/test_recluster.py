@@ -0,0 +1,83 @@
+"""
+重新聚类测试
+"""
+
+import numpy as np
+
+from gallery_generator.core.classifier import ImageClassifier, cluster_centroids
+
+
+def _blobs(n_clusters=6, per_cluster=50, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 1, (n_clusters, dim)) * 10
+    features = np.concatenate(
+        [center + rng.normal(0, 0.5, (per_cluster, dim)) for center in centers]
+    )
+    features /= np.linalg.norm(features, axis=1, keepdims=True)
+    return features.astype(np.float32)
+
+
+def test_cluster_centroids():
+    """测试类别中心为各类特征的平均值，且不包含噪声类别"""
+    features = np.arange(12, dtype=np.float32).reshape(6, 2)
+    centroids = cluster_centroids(features, [0, 0, 1, 1, 1, -1])
+
+    assert sorted(centroids) == [0, 1]
+    assert np.allclose(centroids[0], features[:2].mean(axis=0))
+    assert np.allclose(centroids[1], features[2:5].mean(axis=0))
+
+
+def test_warm_start_changes_cluster_count(stub_config):
+    """测试以上一次的类别中心热启动，聚类数量增加或减少都得到正确的类别数"""
+    features = _blobs()
+    paths = [f"{i}.jpg" for i in range(len(features))]
+    classifier = ImageClassifier(stub_config(clustering={"algorithm": "kmeans", "n_clusters": 6}))
+
+    first = classifier.cluster_images(features, paths)
+    assert len(first["centroids"]) == 6
+
+    for n_clusters in (3, 9):
+        classifier.n_clusters = n_clusters
+        result = classifier.cluster_images(features, paths, init_centroids=first["centroids"])
+        assert result["n_clusters"] == n_clusters
+        assert len(result["centroids"]) == n_clusters
+        assert sum(len(items) for items in result["clusters"].values()) == len(paths)
+
+    # 类别数不变时热启动得到相同的划分
+    classifier.n_clusters = 6
+    again = classifier.cluster_images(features, paths, init_centroids=first["centroids"])
+    assert sorted(map(sorted, again["clusters"].values())) == sorted(
+        map(sorted, first["clusters"].values())
+    )
+
+
+def test_warm_start_keeps_hierarchy_and_samples_k(monkeypatch, stub_config):
+    """测试分层聚类热启动后仍保留大类结构，自动确定聚类数时只使用抽样"""
+    features = _blobs(per_cluster=100)
+    paths = [f"{i}.jpg" for i in range(len(features))]
+    classifier = ImageClassifier(stub_config(clustering={
+        "algorithm": "kmeans", "n_clusters": 3, "hierarchical": True,
+        "min_sub_cluster_size": 20, "k_selection_sample": 150,
+    }))
+    first = classifier.cluster_images(features, paths)
+    assert first["n_parents"] == 3
+
+    classifier.n_clusters = 2
+    result = classifier.cluster_images(features, paths, init_centroids=first["centroids"])
+    assert result["n_parents"] == 2
+    children = sorted(
+        child for parent in result["parents"].values() for child in parent["children"]
+    )
+    assert children == sorted(result["clusters"])
+
+    sizes = []
+    determine = classifier._determine_clusters
+    monkeypatch.setattr(
+        classifier,
+        "_determine_clusters",
+        lambda sample: sizes.append(len(sample)) or determine(sample),
+    )
+    classifier.hierarchical = False
+    classifier.n_clusters = "auto"
+    classifier.cluster_images(features, paths, init_centroids=first["centroids"])
+    assert sizes == [150]
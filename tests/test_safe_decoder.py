@@ -0,0 +1,81 @@
+"""
+隔离解码测试
+"""
+
+import errno
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from gallery_generator.core.image_decoder import SafeDecoder, decode_image
+
+
+def _fake_decode(image_path, max_pixels, max_side, thumbnails=None):
+    """按文件名模拟卡死、崩溃和网络存储的 I/O 错误"""
+    name = os.path.basename(image_path)
+    if name.startswith("hang"):
+        time.sleep(60)
+    if name.startswith("crash"):
+        os._exit(1)
+    if name.startswith("eio"):
+        raise OSError(errno.EIO, "Input/output error", image_path)
+    return decode_image(image_path, max_pixels, max_side, thumbnails)
+
+
+def _make_image(path, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+    return str(path)
+
+
+def test_timeout_crash_and_quarantine(tmp_path):
+    """测试卡死和崩溃的文件被隔离（持久化，修改后重新尝试），I/O 错误和缺失的文件不被隔离"""
+    good = [_make_image(tmp_path / f"good{i}.png", i) for i in range(3)]
+    hang = _make_image(tmp_path / "hang.png")
+    crash = _make_image(tmp_path / "crash.png")
+    eio = _make_image(tmp_path / "eio.png")
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    missing = str(tmp_path / "missing.png")
+    quarantine_path = str(tmp_path / "quarantine.json")
+
+    decoder = SafeDecoder(
+        workers=2, timeout=2, quarantine_path=quarantine_path, decode_func=_fake_decode
+    )
+    paths = [good[0], hang, good[1], crash, eio, str(broken), missing, good[2]]
+    results = decoder.decode_batch(paths)
+
+    assert [item["path"] for item in results] == good
+    assert set(decoder.quarantine.entries) == {hang, crash, str(broken)}
+    # 被终止的进程已在后台替换，进程池在多次调用之间保持运行
+    assert decoder.decode_batch([good[0]])[0]["path"] == good[0]
+    assert len(decoder._pool) == 2 and all(worker.process.is_alive() for worker in decoder._pool)
+    decoder.close()
+
+    reopened = SafeDecoder(workers=1, quarantine_path=quarantine_path, decode_func=_fake_decode)
+    assert reopened.quarantine.contains(hang) and not reopened.quarantine.contains(eio)
+    _make_image(tmp_path / "crash.png", seed=5)
+    os.utime(crash, (time.time() + 10, time.time() + 10))
+    assert not reopened.quarantine.contains(crash)
+    reopened.close()
+
+
+def test_fallback_skips_quarantined_files(tmp_path):
+    """测试替换进程无法启动时退回进程内解码，但不再解码刚刚导致进程崩溃的文件"""
+    good = _make_image(tmp_path / "good.png")
+    crash = _make_image(tmp_path / "crash.png")
+    decoder = SafeDecoder(workers=1, timeout=5, quarantine_path=str(tmp_path / "q.json"),
+                          decode_func=_fake_decode)
+    assert len(decoder.decode_batch([good])) == 1
+
+    def fail_to_start():
+        raise RuntimeError("无法启动解码工作进程")
+
+    decoder._start_worker = fail_to_start
+    # crash 在当前进程中解码会直接结束测试进程
+    results = decoder.decode_batch([crash, good])
+    assert not decoder.isolated
+    assert decoder.quarantine.contains(crash)
+    assert [item["path"] for item in results] == [good]
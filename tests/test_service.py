@@ -0,0 +1,87 @@
+"""
+分析服务测试
+"""
+
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from gallery_generator.core.embedding_backends import BatchingBackend, StubBackend
+from gallery_generator.core.service import (
+    AnalysisService,
+    ServiceClient,
+    ServiceError,
+    create_server,
+)
+
+def test_batching_backend_merges_concurrent_requests():
+    """测试多个线程同时请求的图片合并为一次推理，结果按请求拆分"""
+    inner = StubBackend(embedding_dim=16)
+    batches = []
+    embed_images = inner.embed_images
+    inner.embed_images = lambda images: batches.append(len(images)) or embed_images(images)
+    backend = BatchingBackend(inner, max_batch_size=64, max_wait=0.5)
+
+    requests = [[Image.new("RGB", (32, 32), (i * 40, 0, 0))] * 3 for i in range(4)]
+    results = [None] * len(requests)
+
+    def embed(i):
+        results[i] = backend.embed_images(requests[i])
+
+    threads = [threading.Thread(target=embed, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    backend.close()
+
+    assert sum(batches) == 12 and len(batches) < len(requests)
+    for images, features in zip(requests, results):
+        np.testing.assert_allclose(features, embed_images(images), rtol=1e-5)
+
+
+def test_service_runs_jobs_over_http(tmp_path, stub_config, make_image_folder):
+    """测试通过 HTTP 提交多个任务，共用模型并返回结果"""
+    config_path = stub_config(model={"stub": {"embedding_dim": 32}}, service={"batch_wait_ms": 50})
+    folders = [make_image_folder(tmp_path / name, 6, seed) for seed, name in enumerate(["a", "b"])]
+
+    service = AnalysisService(config_path, workers=2)
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = ServiceClient(f"http://127.0.0.1:{server.server_address[1]}")
+        jobs = [client.submit(folder, str(tmp_path / f"out_{i}"), formats=["html"])
+                for i, folder in enumerate(folders)]
+        finished = [client.wait(job["id"], poll_interval=0.05) for job in jobs]
+
+        for job in finished:
+            assert job["status"] == "done", job
+            assert job["result"]["image_count"] == 6
+            assert job["result"]["cluster_count"] == 2
+        assert len(client.jobs()) == 2
+
+        batch = client.wait(
+            client.submit_batch(folders, str(tmp_path / "batch"), formats=["html"])["id"],
+            poll_interval=0.05,
+        )
+        assert batch["status"] == "done"
+        assert [item["image_count"] for item in batch["result"]["folders"].values()] == [6, 6]
+        assert client.health()["batching"]["images"] >= 12
+
+        with pytest.raises(ServiceError):
+            client.submit(str(tmp_path / "missing"))
+        with pytest.raises(ServiceError):
+            client.job(999)
+        # 聚类数量只接受正整数或 "auto"
+        for n_clusters in ("5", 2.5, 0, True):
+            with pytest.raises(ServiceError, match="聚类数量"):
+                client.submit(folders[0], n_clusters=n_clusters)
+        with pytest.raises(ServiceError, match="聚类数量"):
+            client.submit_batch(folders, n_clusters="5")
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
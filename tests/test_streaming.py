@@ -0,0 +1,51 @@
+"""
+流式处理测试
+"""
+
+import os
+
+from PIL import Image
+
+from gallery_generator.core.image_analyzer import ImageAnalyzer
+
+
+def _groups(cluster_results):
+    return {frozenset(paths) for paths in cluster_results.get("clusters", {}).values()}
+
+
+def test_streaming_reuses_catalog(tmp_path, stub_config, make_image_folder):
+    """测试流式与非流式模式的聚类结果一致，重复运行时复用图库目录中的特征而不追加重复的行"""
+    config_path = stub_config(model={"stub": {"embedding_dim": 32}})
+    # 两组明显不同的颜色
+    folder = make_image_folder(tmp_path / "images", 10, groups=[(40, 40, 200), (200, 40, 40)])
+
+    analyzer = ImageAnalyzer(config_path)
+    embedded = []
+    embed_images = analyzer.feature_extractor.backend.embed_images
+    analyzer.feature_extractor.backend.embed_images = lambda images: embedded.append(
+        len(images)
+    ) or embed_images(images)
+
+    batch = analyzer.process_folder(
+        folder, str(tmp_path / "out_batch"), ["folder"], streaming=False
+    )
+    embeddings_dir = os.path.join(analyzer.catalog.catalog_dir, "embeddings")
+    catalog_size = sum(entry.stat().st_size for entry in os.scandir(embeddings_dir))
+    assert sum(embedded) == 10
+
+    streamed = analyzer.process_folder(
+        folder, str(tmp_path / "out_stream"), ["folder"], streaming=True
+    )
+    assert streamed["success"] and streamed["image_count"] == 10
+    assert _groups(streamed["cluster_results"]) == _groups(batch["cluster_results"])
+    # 第二次运行全部复用已有特征
+    assert sum(embedded) == 10
+    assert sum(entry.stat().st_size for entry in os.scandir(embeddings_dir)) == catalog_size
+    assert len(analyzer.vector_index) == 10
+
+    # 修改一张图片后只重新提取这一张
+    Image.new("RGB", (64, 48), (40, 200, 40)).save(os.path.join(folder, "03.png"))
+    os.utime(os.path.join(folder, "03.png"), (1, 1))
+    analyzer.process_folder(folder, str(tmp_path / "out_stream"), ["folder"], streaming=True)
+    assert sum(embedded) == 11
+    assert len(analyzer.vector_index) == 10
@@ -0,0 +1,71 @@
+"""
+缩略图缓存测试
+"""
+
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from gallery_generator.core.image_decoder import decode_image
+from gallery_generator.core.thumbnail_cache import ThumbnailCache
+
+
+def _make_image(path, size=(800, 600), seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+    return str(path)
+
+
+def test_tiers_and_content_sharing(tmp_path):
+    """测试各尺寸档位，以及内容相同的副本共用缩略图"""
+    original = _make_image(tmp_path / "a.jpg")
+    os.makedirs(tmp_path / "copy")
+    duplicate = str(tmp_path / "copy" / "a.jpg")
+    shutil.copy(original, duplicate)
+
+    cache = ThumbnailCache(str(tmp_path / "cache"), sizes=[128, 512, 1024], budget_mb=100)
+    assert cache.get(original, 128) is None
+
+    small = cache.get_or_create(original, 100)
+    assert max(small.size) == 128
+    medium = cache.get_or_create(original, 300)
+    assert max(medium.size) == 512
+    # 原图小于最大档位时保存原图大小
+    assert max(cache.get_or_create(original, 1024).size) == 800
+
+    assert cache.get_path(duplicate, 128) == cache.get_path(original, 128)
+
+
+def test_decode_fills_cache(tmp_path):
+    """测试解码时写入缓存，再次解码直接读取缓存"""
+    path = _make_image(tmp_path / "b.jpg", size=(1600, 1200), seed=1)
+    spec = {"dir": str(tmp_path / "cache"), "sizes": [128, 512], "budget_mb": 100, "quality": 85}
+
+    first = decode_image(path, max_side=512, thumbnails=spec)
+    cache = ThumbnailCache.from_spec(spec)
+    assert cache.get_path(path, 128) is not None
+    assert cache.get_path(path, 512) is not None
+
+    second = decode_image(path, max_side=512, thumbnails=spec)
+    assert second["image"].shape == first["image"].shape
+    assert second["metadata"]["width"] == 1600
+
+
+def test_lru_eviction(tmp_path):
+    """测试超出磁盘预算时淘汰最久未使用的缩略图"""
+    paths = [_make_image(tmp_path / f"{i}.jpg", size=(400, 300), seed=i) for i in range(6)]
+    cache = ThumbnailCache(str(tmp_path / "cache"), sizes=[256], budget_mb=0.06)
+
+    cache.get_or_create(paths[0], 256)
+    for path in paths[1:]:
+        cache.get_or_create(path, 256)
+        # 保持第一张最近被访问
+        cache.get_path(paths[0], 256)
+
+    assert cache.get_path(paths[0], 256) is not None
+    assert cache.get_path(paths[1], 256) is None
+    total = sum(os.path.getsize(os.path.join(root, name))
+                for root, _, names in os.walk(tmp_path / "cache" / "256") for name in names)
+    assert total <= 0.06 * 1024 * 1024
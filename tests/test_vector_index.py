@@ -0,0 +1,77 @@
+"""
+向量索引测试
+"""
+
+import numpy as np
+import pytest
+
+from gallery_generator.core.vector_index import VectorIndex
+
+
+def _random_vectors(n, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("kind", ["flat", "ivf"])
+def test_search_finds_exact_match(tmp_path, kind):
+    """测试查询已索引向量时返回其自身"""
+    vectors = _random_vectors(500)
+    paths = [f"img_{i}.jpg" for i in range(500)]
+
+    index = VectorIndex(str(tmp_path), kind=kind, min_train_size=100)
+    index.add(vectors, paths)
+
+    results = index.search(vectors[123], k=5)
+    assert len(results) == 5
+    assert results[0][0] == "img_123.jpg"
+    assert results[0][1] == pytest.approx(1.0, abs=1e-2)
+    assert [score for _, score in results] == sorted((s for _, s in results), reverse=True)
+
+
+def test_incremental_add_and_reload(tmp_path):
+    """测试增量加入、替换同一路径以及重新加载"""
+    vectors = _random_vectors(200)
+    index = VectorIndex(str(tmp_path), kind="ivf", min_train_size=50)
+    index.add(vectors[:150], [f"a_{i}" for i in range(150)])
+    index.add(vectors[150:], [f"a_{i}" for i in range(150, 200)])
+
+    # 替换已有路径的向量
+    index.add(vectors[199:200], ["a_0"])
+    assert len(index) == 200
+
+    reloaded = VectorIndex(str(tmp_path), kind="ivf", min_train_size=50)
+    assert len(reloaded) == 200
+    np.testing.assert_allclose(reloaded.get_vector("a_0"), vectors[199], atol=1e-2)
+
+    top_paths = [path for path, _ in reloaded.search(vectors[199], k=2)]
+    assert set(top_paths) == {"a_0", "a_199"}
+
+    reloaded.remove(["a_199"])
+    assert "a_199" not in [path for path, _ in reloaded.search(vectors[199], k=3)]
+
+
+def test_model_change_and_interrupted_append(tmp_path):
+    """测试特征模型变化时重新构建，以及中断的追加写入在加载时被截断"""
+    vectors = _random_vectors(20)
+    index = VectorIndex(str(tmp_path), kind="flat", embedding_key="clip|a|fp32")
+    index.add(vectors[:10], [f"a_{i}" for i in range(10)])
+
+    # 模拟写入向量和路径之后、写入元数据之前中断
+    with open(index.vectors_path, 'ab') as f:
+        vectors[10:12].astype(np.float16).tofile(f)
+    with open(index.paths_path, 'a', encoding='utf-8') as f:
+        f.write("partial_0\n")
+
+    reloaded = VectorIndex(str(tmp_path), kind="flat", embedding_key="clip|a|fp32")
+    assert len(reloaded) == 10 and "partial_0" not in reloaded.path_to_id
+    reloaded.add(vectors[12:14], ["b_0", "b_1"])
+    again = VectorIndex(str(tmp_path), kind="flat", embedding_key="clip|a|fp32")
+    np.testing.assert_allclose(again.get_vector("b_1"), vectors[13], atol=1e-2)
+    np.testing.assert_allclose(again.get_vector("a_9"), vectors[9], atol=1e-2)
+
+    # 同维度的其他模型不能与旧向量混用
+    other = VectorIndex(str(tmp_path), kind="flat", embedding_key="clip|b|fp32")
+    assert len(other) == 0
+    other.add(_random_vectors(3, dim=16), ["c_0", "c_1", "c_2"])
+    assert other.dim == 16